@@ -0,0 +1,123 @@
+"""
+Central server hot paths. Run through benchmarks/run.py, which puts
+central-server/src on the path and runs this file in a scratch directory
+(the server modules create log and dump files in the working directory).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+
+from harness import BenchmarkSuite
+
+from utils.app_logger import logger
+from aioquic.h3.connection import H3Connection
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.connection import QuicConnection
+
+from loadtest.wire import create_video_packets, stream_packet
+from managers.client_manager import ClientManager
+from quic_server import QUICRelayProtocol
+from utils.video_datagram_assembler import VideoDatagramAssembler
+
+TRAIN_ID = "8c5a5fc8-8a43-4a47-9f50-2a4f7a4a4a4a"
+FRAME_SIZE = 25_000  # a P-frame at 6 Mbit/s and 30 fps
+FAN_OUT = (1, 4, 16)
+
+
+def make_stream_reassembler() -> QUICRelayProtocol:
+    # only the stream reassembly state is needed, no QUIC connection
+    protocol = object.__new__(QUICRelayProtocol)
+    protocol.client_type = None
+    protocol.stream_data_to_process = None
+    protocol.header_data = None
+    protocol.stream_data_size_remaining = 0
+    protocol.process_stream_packet = lambda packet, stream_id: None
+    return protocol
+
+
+class BenchViewer:
+    """A WebTransport viewer with a real H3 connection whose datagrams are dropped on transmit."""
+
+    def __init__(self):
+        quic = QuicConnection(configuration=QuicConfiguration(is_client=True, max_datagram_frame_size=65536))
+        self.h3_connection = H3Connection(quic, enable_webtransport=True)
+        self.session_id = 0
+
+    def transmit(self):
+        self.h3_connection._quic._datagrams_pending.clear()
+
+
+def bench_construct_stream_packet(suite: BenchmarkSuite):
+    keepalive = stream_packet("keepalive", {
+        "type": "keepalive", "protocol": "quic", "train_id": TRAIN_ID,
+        "timestamp": 1234567.891, "sequence": 42,
+    })
+    protocol = make_stream_reassembler()
+    suite.measure("construct_stream_packet/single", lambda: protocol.construct_stream_packet(keepalive, 0))
+
+    coalesced = keepalive * 4
+    suite.measure("construct_stream_packet/coalesced_x4",
+                  lambda: protocol.construct_stream_packet(coalesced, 0), ops_per_call=4)
+
+    telemetry = stream_packet("telemetry", {"train_id": TRAIN_ID, "payload": "x" * 1400})
+    chunks = [telemetry[:600], telemetry[600:1200], telemetry[1200:]]
+
+    def split():
+        for chunk in chunks:
+            protocol.construct_stream_packet(chunk, 0)
+    suite.measure("construct_stream_packet/split_x3", split)
+
+
+def bench_video_assembler(suite: BenchmarkSuite):
+    assembler = VideoDatagramAssembler(TRAIN_ID)
+    train_id_bytes = TRAIN_ID.encode('utf-8').ljust(36)[:36]
+    frame = os.urandom(FRAME_SIZE)
+    # alternate two frame ids, the assembler starts a new frame whenever the id changes
+    frames = itertools.cycle([create_video_packets(train_id_bytes, frame_id, 1_700_000_000_000, frame)
+                              for frame_id in (1, 2)])
+    packets_per_frame = len(create_video_packets(train_id_bytes, 0, 0, frame))
+
+    def assemble():
+        for packet in next(frames):
+            assembler.process_packet(packet)
+    suite.measure("video_datagram_assembler/packet", assemble, ops_per_call=packets_per_frame)
+
+
+def bench_relay_fan_out(suite: BenchmarkSuite):
+    train_id_bytes = TRAIN_ID.encode('utf-8').ljust(36)[:36]
+    packet = create_video_packets(train_id_bytes, 1, 1_700_000_000_000, os.urandom(FRAME_SIZE))[0]
+    for subscribers in FAN_OUT:
+        client_manager = ClientManager()
+        viewers = {f"viewer-{index}": BenchViewer() for index in range(subscribers)}
+        client_manager.remote_control_clients.update(viewers)
+        client_manager.train_to_remote_controls_map[TRAIN_ID] = set(viewers)
+        suite.measure(f"relay_datagram/fan_out_{subscribers}",
+                      lambda: client_manager.relay_datagram(TRAIN_ID, packet))
+
+
+async def run(suite: BenchmarkSuite):
+    bench_construct_stream_packet(suite)
+    bench_video_assembler(suite)
+    bench_relay_fan_out(suite)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Central server micro-benchmarks")
+    parser.add_argument("--output", required=True, help="write the results as JSON to this file")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds spent per benchmark")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this text")
+    args = parser.parse_args()
+
+    # measure the code paths, not the terminal and log files
+    logger.remove()
+
+    suite = BenchmarkSuite("central-server", min_time=args.min_time, name_filter=args.filter)
+    asyncio.run(run(suite))
+    with open(args.output, "w") as f:
+        json.dump(suite.to_dict(), f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Train client hot paths. Run through benchmarks/run.py, which puts
+train-client/src on the path and runs this file in a scratch directory.
+No camera, serial port or network connection is opened.
+"""
+import argparse
+import asyncio
+import json
+import os
+import struct
+
+from harness import BenchmarkSuite
+
+from utils.app_logger import logger
+from PyQt5.QtCore import QCoreApplication, Qt
+
+from globals import PACKET_TYPE
+from network_worker_quic import NetworkWorkerQUIC
+from sensor.telemetry import Telemetry
+
+TRAIN_ID = "8c5a5fc8-8a43-4a47-9f50-2a4f7a4a4a4a"
+FRAME_SIZES = {"p_frame": 25_000, "keyframe": 120_000, "keyframe_1080p": 400_000}
+STATUS_MESSAGES_PER_CALL = 200
+
+
+def bench_create_packets(suite: BenchmarkSuite):
+    worker = NetworkWorkerQUIC(TRAIN_ID)
+    for name, size in FRAME_SIZES.items():
+        frame = os.urandom(size)
+        suite.measure(f"create_packets/{name}", lambda: worker.create_packets(1, 1_700_000_000_000, frame))
+        suite.measure(f"fec_parity/{name}",
+                      lambda: worker.fec.create_parity_packets(1, 1_700_000_000_000, frame, worker.max_packet_size))
+
+
+def bench_telemetry(suite: BenchmarkSuite):
+    telemetry = Telemetry(TRAIN_ID)
+    encoded = []
+
+    def on_telemetry_data(data):
+        # same encoding as BaseClient.on_telemetry_data
+        packet_data = json.dumps(data).encode('utf-8')
+        encoded.append(struct.pack("B", PACKET_TYPE["telemetry"]) + packet_data)
+        if len(encoded) > 1000:
+            encoded.clear()
+
+    telemetry.telemetry_ready.connect(on_telemetry_data, Qt.DirectConnection)
+    suite.measure("telemetry/poll_and_encode", telemetry._poll_telemetry)
+
+    sample = {}
+    telemetry.telemetry_ready.disconnect()
+    telemetry.telemetry_ready.connect(sample.update, Qt.DirectConnection)
+    telemetry._poll_telemetry()
+    suite.measure("telemetry/json_encode", lambda: json.dumps(sample).encode('utf-8'))
+
+
+class ReplaySerial:
+    """Serves the same encoded status message until `count` messages were consumed."""
+
+    def __init__(self, status_data: bytes, count: int):
+        self.status_data = status_data
+        self.count = count
+        self.remaining = count
+
+    async def consume(self, num_bytes: int) -> bytes:
+        if self.remaining == 0:
+            self.remaining = self.count
+            # ends MessageHandler._decoder_loop the same way a shutdown does
+            raise asyncio.CancelledError()
+        self.remaining -= 1
+        return self.status_data[:num_bytes]
+
+
+def bench_message_handler(suite: BenchmarkSuite):
+    name = "message_handler/decode_status"
+    try:
+        from connector.connector.message_handler import MessageHandler
+        from connector.connector.generated.communication_bp import StatusMessage, Mode
+    except (ImportError, SyntaxError) as e:
+        # the connector needs Python >= 3.13, bitproto and pyserial-asyncio
+        suite.skip(name, f"connector not importable: {e!r}")
+        return
+
+    status_msg = StatusMessage(remote_control=True, time=123456, mode=Mode.DRIVE_MODE_FORWARD,
+                               motor_rpm=1800, target_rpm=2000, control_rpm=1900)
+    serial = ReplaySerial(bytes(status_msg.encode()), STATUS_MESSAGES_PER_CALL)
+    received = []
+    handler = MessageHandler(serial, lambda status: received.append(status))
+    loop = asyncio.new_event_loop()
+
+    def decode():
+        received.clear()
+        loop.run_until_complete(handler._decoder_loop(loop.create_future()))
+    suite.measure(name, decode, ops_per_call=STATUS_MESSAGES_PER_CALL)
+    loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train client micro-benchmarks")
+    parser.add_argument("--output", required=True, help="write the results as JSON to this file")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds spent per benchmark")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this text")
+    args = parser.parse_args()
+
+    # measure the code paths, not the terminal and log files
+    logger.remove()
+    # the workers and the telemetry timer are QObjects, the application must stay alive while they run
+    app = QCoreApplication([])
+
+    suite = BenchmarkSuite("train-client", min_time=args.min_time, name_filter=args.filter)
+    bench_create_packets(suite)
+    bench_telemetry(suite)
+    bench_message_handler(suite)
+    del app
+    with open(args.output, "w") as f:
+        json.dump(suite.to_dict(), f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Video over one lossy uplink against the same video bonded over two.
+
+Sends synthetic 30 fps video (a large keyframe every second, small P-frames
+in between) through the send loop of train-client's NetworkWorkerQUIC to a
+minimal QUIC receiver on loopback. Every link goes through its own instance
+of the central server's loss proxy, with --loss bursty loss and a drop-tail
+bottleneck of --rate-kbps, so the links fail independently like two modems
+in different cells. The receiver keeps the first copy of every packet, like
+the server does for a bonded train. FEC is off.
+
+Modes: the primary connection alone, bonded with P-frames split over both
+links and keyframes sent over both, bonded with every P-frame on the best
+link, and bonded without the keyframe copies.
+Needs aioquic, PyQt5 and the central-server dependencies of
+loadtest.loss_proxy.
+
+    python benchmarks/bonding_loss.py
+    python benchmarks/bonding_loss.py --loss 0.1 --rate-kbps 3000 --seconds 20
+"""
+import argparse
+import asyncio
+import datetime
+import importlib.util
+import os
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SRC = os.path.join(REPO_DIR, "central-server", "src")
+sys.path.insert(0, os.path.join(REPO_DIR, "train-client", "src"))
+
+from aioquic.asyncio import serve
+from aioquic.asyncio.protocol import QuicConnectionProtocol
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.events import DatagramFrameReceived
+
+from utils.app_logger import logger
+from utils.link_scheduler import LinkScheduler
+from network_worker_quic import NetworkWorkerQUIC
+from quic_link import QuicLink
+from globals import PACKET_TYPE
+
+TRAIN_ID = "8c5a5fc8-8a43-4a47-9f50-2a4f7a4a4a4a"
+VIDEO_HEADER = struct.Struct(">BIHH36sQ")
+
+
+def load_certificate_module():
+    # central-server/src has its own globals and utils, so only this file is loaded from there
+    spec = importlib.util.spec_from_file_location("loadtest_certificate",
+                                                  os.path.join(SERVER_SRC, "loadtest", "certificate.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Receiver(QuicConnectionProtocol):
+    """Collects the video datagrams of all connections, the first copy of a packet counts."""
+
+    frames = defaultdict(set)  # frame_id -> packet ids received
+    sizes = {}  # frame_id -> number of packets
+    latencies = []  # ms from the frame timestamp to its last packet
+    datagrams = 0
+
+    def quic_event_received(self, event):
+        if not isinstance(event, DatagramFrameReceived) or event.data[0] != PACKET_TYPE["video"]:
+            return
+        Receiver.datagrams += 1
+        _, frame_id, number_of_packets, packet_id, _, timestamp = VIDEO_HEADER.unpack_from(event.data)
+        received = self.frames[frame_id]
+        if packet_id in received:
+            return
+        received.add(packet_id)
+        self.sizes[frame_id] = number_of_packets
+        if len(received) == number_of_packets:
+            self.latencies.append(datetime.datetime.now().timestamp() * 1000 - timestamp)
+
+
+def make_frame(frame_id: int, args) -> bytes:
+    if frame_id % args.gop == 1:
+        return b"\x00\x00\x00\x01\x65" + os.urandom(args.keyframe_bytes - 5)
+    return b"\x00\x00\x00\x01\x41" + os.urandom(args.frame_bytes - 5)
+
+
+async def run_mode(mode: str, args, certificate, proxy_ports: list) -> dict:
+    Receiver.frames = defaultdict(set)
+    Receiver.sizes = {}
+    Receiver.latencies = []
+    Receiver.datagrams = 0
+    configuration = QuicConfiguration(is_client=False, alpn_protocols=["quic"], max_datagram_frame_size=65536)
+    configuration.load_cert_chain(*certificate)
+    server = await serve("127.0.0.1", args.server_port, configuration=configuration, create_protocol=Receiver)
+
+    worker = NetworkWorkerQUIC(TRAIN_ID)
+    worker.server_host = "127.0.0.1"
+    worker.server_port = proxy_ports[0]
+    worker.configuration.verify_mode = ssl.CERT_NONE
+    worker.fec = None
+    if mode == "single":
+        worker.links = []
+    else:
+        worker.links = [QuicLink(1, "link1", server_port=proxy_ports[1])]
+        worker.link_scheduler = LinkScheduler(keyframe_redundancy=1 if mode == "bonded-no-copies" else 2,
+                                              split_frames=mode != "bonded-best-link")
+    # what NetworkWorkerQUIC.run does before it runs the client on its thread
+    worker._running = True
+    worker._loop = asyncio.get_running_loop()
+    worker.control_plane.bind(worker._loop)
+    worker.frame_queue.bind(worker._loop)
+    worker._pmtu_acked = asyncio.Event()
+    client = asyncio.create_task(worker.run_client())
+    while worker._client is None:
+        if client.done():
+            raise RuntimeError("could not connect through the loss proxy")
+        await asyncio.sleep(0.05)
+    # the receiver sends no connect response, which is what starts the links
+    worker.start_links()
+    deadline = time.monotonic() + 5
+    while not all(link.connected for link in worker.links) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+
+    frame_count = int(args.seconds * args.fps)
+    next_due = time.monotonic()
+    for frame_id in range(1, frame_count + 1):
+        timestamp = int(datetime.datetime.now().timestamp() * 1000)
+        worker.enqueue_frame(frame_id, timestamp, make_frame(frame_id, args))
+        next_due += 1 / args.fps
+        await asyncio.sleep(max(0.0, next_due - time.monotonic()))
+    await asyncio.sleep(1.0)
+
+    links = [link.stats() for link in [worker.primary_link] + worker.links]
+    worker._running = False
+    worker.frame_queue.close()
+    client.cancel()
+    server.close()
+    await asyncio.sleep(0.5)  # the sockets are closed by the loop
+
+    unique_packets = sum(Receiver.sizes.values())  # every frame had at least one packet arrive
+    keyframes = [frame_id for frame_id in range(1, frame_count + 1) if frame_id % args.gop == 1]
+    received = sum(len(packets) for packets in Receiver.frames.values())
+    complete = [frame_id for frame_id, packets in Receiver.frames.items() if len(packets) == Receiver.sizes[frame_id]]
+    latencies = sorted(Receiver.latencies)
+    return {
+        "mode": mode,
+        "packet_loss": 1 - received / unique_packets if unique_packets else 0.0,
+        "frames_complete": len(complete) / frame_count,
+        "keyframes_complete": len(set(complete) & set(keyframes)) / len(keyframes),
+        "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+        "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+        "overhead": Receiver.datagrams / received - 1 if received else 0.0,
+        "links": links,
+    }
+
+
+async def run(args):
+    certificate = load_certificate_module().generate_self_signed_certificate(tempfile.mkdtemp())
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as trace:
+        trace.write(f"0,{args.rate_kbps}\n3600,{args.rate_kbps}\n")
+    proxy_ports = [args.server_port + 1, args.server_port + 2]
+    proxies = [
+        subprocess.Popen(
+            [sys.executable, "-m", "loadtest.loss_proxy", "--listen-port", str(port),
+             "--server-port", str(args.server_port), "--loss", str(args.loss), "--burst", str(args.burst),
+             "--trace", trace.name, "--queue-delay", str(args.queue_delay),
+             "--report-interval", "3600"],
+            cwd=SERVER_SRC, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for port in proxy_ports
+    ]
+    try:
+        await asyncio.sleep(1.0)
+        average = (args.keyframe_bytes + (args.gop - 1) * args.frame_bytes) * 8 * args.fps / args.gop
+        print(f"2 links of {args.rate_kbps / 1000:.1f} Mbps, {args.loss:.0%} loss in bursts of {args.burst:g}, "
+              f"video {average / 1e6:.2f} Mbps ({args.keyframe_bytes // 1000} kB keyframes), {args.seconds:g} s")
+        for mode in ("single", "bonded", "bonded-best-link", "bonded-no-copies"):
+            result = await run_mode(mode, args, certificate, proxy_ports)
+            print(f"  {result['mode']:<17} packet loss {result['packet_loss']:6.2%}  "
+                  f"frames complete {result['frames_complete']:6.1%}  "
+                  f"keyframes complete {result['keyframes_complete']:6.1%}  "
+                  f"latency p50={result['latency_p50']:.0f}ms p95={result['latency_p95']:.0f}ms  "
+                  f"duplicates {result['overhead']:.0%}")
+            if len(result["links"]) > 1:
+                print("  " + " " * 17 + ", ".join(
+                    f"{link['name']}: {link['sent_datagrams']} datagrams, loss {link['loss']:.1%}"
+                    for link in result["links"]))
+    finally:
+        for proxy in proxies:
+            proxy.terminate()
+            proxy.wait()
+        os.unlink(trace.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate-kbps", type=int, default=4000)
+    parser.add_argument("--loss", type=float, default=0.05, help="loss on each link")
+    parser.add_argument("--burst", type=float, default=3.0, help="mean number of consecutive dropped packets")
+    parser.add_argument("--queue-delay", type=float, default=0.1, help="bottleneck buffer in seconds")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--gop", type=int, default=30)
+    parser.add_argument("--keyframe-bytes", type=int, default=50_000)
+    parser.add_argument("--frame-bytes", type=int, default=8_000)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--server-port", type=int, default=14433)
+    args = parser.parse_args()
+    logger.remove()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
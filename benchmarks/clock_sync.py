@@ -0,0 +1,101 @@
+"""
+Accuracy of the train's clock offset to a remote control, the old 5-probe average against ClockSync.
+
+Simulates --minutes of rtt_train probes every CLOCK_SYNC_PROBE_INTERVAL
+between the train and a remote control whose clock is --offset ms ahead
+and drifts by --skew-ppm. Each direction takes --delay ms plus an
+exponential queueing delay with a mean of --jitter ms, the uplink --asymmetry
+ms longer than the downlink. With --step the remote clock jumps by that
+many ms halfway through.
+
+average: the offset of the first 5 probes, averaged, what BaseClient used
+for the whole session before.
+clock_sync: ClockSync over all probes, read 500 ms after every probe.
+
+Prints the mean, p95 and max error of the offset, i.e. of every latency
+computed with it, and for ClockSync the mean uncertainty bound and the
+share of the errors within it.
+
+    python benchmarks/clock_sync.py
+    python benchmarks/clock_sync.py --skew-ppm -100 --jitter 40 --step 300
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "train-client", "src"))
+
+from utils.clock_sync import ClockSync
+from globals import CLOCK_SYNC_PROBE_INTERVAL, CLOCK_SYNC_BURST
+
+START_MS = 1.7e12
+
+
+def simulate(args):
+    rng = random.Random(args.seed)
+    sync = ClockSync("benchmark")
+    first = []
+    errors = {"average": [], "clock_sync": []}
+    bounds = []
+    # the burst after map_connect, then the periodic probes
+    sends = [index * 200.0 for index in range(CLOCK_SYNC_BURST)]
+    sends += [sends[-1] + CLOCK_SYNC_PROBE_INTERVAL * 1000 * index
+              for index in range(1, int(args.minutes * 60 / CLOCK_SYNC_PROBE_INTERVAL))]
+
+    def true_offset(local_ms):
+        step = args.step if args.step and local_ms - START_MS > args.minutes * 30_000 else 0
+        return args.offset + args.skew_ppm * 1e-6 * (local_ms - START_MS) + step
+
+    for index, sent in enumerate(sends):
+        sent += START_MS
+        up = args.delay + args.asymmetry + rng.expovariate(1 / args.jitter)
+        down = args.delay + rng.expovariate(1 / args.jitter)
+        # the web client stamps with Date.now(), whole milliseconds
+        remote = int(sent + up + true_offset(sent + up))
+        received = sent + up + down
+        sync.add_sample(sent, remote, received)
+        if len(first) < CLOCK_SYNC_BURST:
+            first.append(remote - (sent + received) / 2)
+        if index < CLOCK_SYNC_BURST:
+            continue
+        at = received + 500
+        errors["average"].append(abs(sum(first) / len(first) - true_offset(at)))
+        errors["clock_sync"].append(abs(sync.offset(at) - true_offset(at)))
+        bounds.append(sync.uncertainty(at))
+    return errors, bounds, sync
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--offset", type=float, default=120, help="ms the remote clock is ahead")
+    parser.add_argument("--skew-ppm", type=float, default=40, help="drift of the remote clock")
+    parser.add_argument("--delay", type=float, default=10, help="ms one way without queueing")
+    parser.add_argument("--jitter", type=float, default=15, help="ms mean queueing delay per direction")
+    parser.add_argument("--asymmetry", type=float, default=2, help="ms the uplink is longer than the downlink")
+    parser.add_argument("--step", type=float, default=0, help="ms the remote clock jumps halfway through")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    errors, bounds, sync = simulate(args)
+    print(f"{args.minutes:g} min, probes every {CLOCK_SYNC_PROBE_INTERVAL:g} s, skew {args.skew_ppm:g} ppm, "
+          f"{args.delay:g} ms + {args.jitter:g} ms jitter each way, asymmetry {args.asymmetry:g} ms")
+    for mode, values in errors.items():
+        line = (f"  {mode:<11} error mean {sum(values) / len(values):6.2f} ms  p95 {percentile(values, 0.95):6.2f} ms  "
+                f"max {max(values):6.2f} ms")
+        if mode == "clock_sync":
+            covered = sum(error <= bound for error, bound in zip(values, bounds)) / len(values)
+            stats = sync.stats()
+            line += (f"  bound mean {sum(bounds) / len(bounds):5.2f} ms, {covered * 100:.1f}% within  "
+                     f"skew {stats['skew_ppm']:+.1f} ppm  {stats['points']} points  {stats['resets']} resets")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Per-frame encode time of every train encoder backend, and the one the probe picks.
+
+Runs the startup probe of train-client's Encoder on synthetic frames: every
+backend in encoder_backends.ENCODER_BACKENDS that this FFmpeg build and
+machine can open encodes --frames frames, then the backends are ranked
+against the latency budget like Encoder.select_backend does. Software
+backends run on any Linux box, v4l2m2m only where the kernel exposes a
+V4L2 memory-to-memory encoder. Needs PyAV and numpy.
+
+    python benchmarks/encoder_probe.py
+    python benchmarks/encoder_probe.py --sizes 1920x1080 --budget-ms 20
+"""
+import argparse
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "train-client", "src"))
+
+from utils.app_logger import logger
+from encoder_backends import ENCODER_BACKENDS, measure_backend, probe_backends
+from globals import ENCODER_BACKEND_CANDIDATES, ENCODER_GOP_SIZE, VIDEO_BITRATE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["1280x720", "1920x1080"], help="WIDTHxHEIGHT")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--budget-ms", type=float, default=None, help="default: one frame interval")
+    args = parser.parse_args()
+    logger.remove()
+    budget_ms = args.budget_ms or 1000 / args.fps
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        print(f"{width}x{height}, {args.frames} frames, budget {budget_ms:.1f} ms")
+        for name, backend in ENCODER_BACKENDS.items():
+            result = measure_backend(backend, width, height, args.fps, ENCODER_GOP_SIZE, VIDEO_BITRATE, args.frames)
+            if result is None:
+                print(f"  {name:<16} not usable here")
+            else:
+                print(f"  {name:<16} mean={result['mean_ms']:6.1f} ms  p95={result['p95_ms']:6.1f} ms")
+        ranked = probe_backends(ENCODER_BACKEND_CANDIDATES, width, height, args.fps, ENCODER_GOP_SIZE,
+                                VIDEO_BITRATE, budget_ms, args.frames)
+        print(f"  selected: {', '.join(backend.name for backend in ranked) or 'none'} (in fallback order)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Worst frame interval of the train encoder across bitrate switches.
+
+Feeds synthetic frames in real time to train-client's Encoder, changes the
+bitrate every --switch-every frames and reports the gaps between two
+encoded frames. No camera or network is needed, only PyAV and PyQt5.
+
+    python benchmarks/encoder_switch.py
+    python benchmarks/encoder_switch.py --mode standby --size 1280x720
+
+Modes:
+  live     libx264 rate control follows the new bitrate from the next frame
+  standby  the encoder acts like a codec without live rate control, every
+           switch goes through a standby encoder opened in the background
+  reinit   the old behaviour, close and reopen the encoder on every switch
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "train-client", "src"))
+
+import numpy as np
+
+from utils.app_logger import logger
+from encoder import Encoder
+from encoder_backends import X264Backend
+
+BITRATES = [1_000_000, 5_000_000, 2_000_000, 4_000_000, 1_500_000, 3_000_000]
+
+
+def make_frames(width: int, height: int, count: int = 16):
+    """A noisy gradient that moves, so that P-frames are not empty."""
+    rng = np.random.default_rng(1)
+    base = np.add.outer(np.arange(height), np.arange(width)).astype(np.uint8)
+    frames = []
+    for i in range(count):
+        frame = np.stack([np.roll(base, 8 * i, axis=1)] * 3, axis=-1)
+        noise = rng.integers(0, 24, size=frame.shape, dtype=np.uint8)
+        frames.append(frame + noise)
+    return frames
+
+
+def run(args):
+    width, height = (int(v) for v in args.size.split("x"))
+    frames = make_frames(width, height)
+    encoder = Encoder()
+    encoder.frame_rate = args.fps
+    if args.mode == "standby":
+        encoder.backend = X264Backend("fast")
+        encoder.backend.live_rate_control = False
+
+    emitted = []  # (frame_id, perf_counter) of every encoded frame
+    encoder.encode_ready.connect(lambda frame_id, timestamp, data: emitted.append((frame_id, time.perf_counter())))
+
+    switch_frames = []
+    call_ms = {}  # frame_id -> time spent in the switch and encode_frame
+    frame_time = 1.0 / args.fps
+    next_due = time.perf_counter()
+    for frame_id in range(args.frames):
+        start = time.perf_counter()
+        if frame_id and frame_id % args.switch_every == 0:
+            bitrate = BITRATES[len(switch_frames) % len(BITRATES)]
+            switch_frames.append(frame_id)
+            if args.mode == "reinit":
+                encoder.current_bitrate = bitrate
+                encoder.init_encoder(width, height)
+            else:
+                encoder.set_bitrate(bitrate)
+        encoder.encode_frame(frame_id, frames[frame_id % len(frames)], width, height)
+        call_ms[frame_id] = (time.perf_counter() - start) * 1000
+        next_due += frame_time
+        delay = next_due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    encoder.close()
+
+    intervals = {frame_id: (t - prev_t) * 1000
+                 for (_, prev_t), (frame_id, t) in zip(emitted, emitted[1:])}
+    # a switch may take effect up to one GOP later
+    window = set()
+    for frame_id in switch_frames:
+        window.update(range(frame_id, frame_id + encoder.gop_size + 1))
+    around = [ms for frame_id, ms in intervals.items() if frame_id in window]
+    steady = [ms for frame_id, ms in intervals.items() if frame_id not in window]
+    calls = [ms for frame_id, ms in call_ms.items() if frame_id in window]
+
+    print(f"mode={args.mode} {width}x{height}@{args.fps} frames={args.frames} "
+          f"emitted={len(emitted)} switches={len(switch_frames)} standby_switches={encoder.standby_switches}")
+    print(f"  frame interval target      {frame_time * 1000:7.1f} ms")
+    if steady:
+        print(f"  steady median / worst      {statistics.median(steady):7.1f} / {max(steady):7.1f} ms")
+    if around:
+        print(f"  around switches med/worst  {statistics.median(around):7.1f} / {max(around):7.1f} ms")
+        print(f"  slowest call near switch   {max(calls):7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["live", "standby", "reinit"], default="live")
+    parser.add_argument("--size", default="640x360", help="WIDTHxHEIGHT")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--switch-every", type=int, default=45, help="frames between two bitrate changes")
+    args = parser.parse_args()
+    logger.remove()
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Frames per second and allocations per frame of the train encoder.
+
+Encodes synthetic BGR frames as fast as possible, once through
+train-client's Encoder and once through the previous pipeline
+(an mp4 container on pipe:, VideoFrame.from_ndarray and bytes(packet)).
+Needs PyAV, PyQt5, numpy and OpenCV.
+
+    python benchmarks/encoder_throughput.py
+    python benchmarks/encoder_throughput.py --sizes 1280x720 --frames 300
+
+Allocations are the peak of the Python heap while one frame is encoded,
+measured with tracemalloc in a separate pass from the frame rate. They
+cover frame objects, numpy arrays and packet copies, but not buffers
+FFmpeg allocates with av_malloc.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from fractions import Fraction
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "train-client", "src"))
+
+import av
+
+from utils.app_logger import logger
+from encoder import Encoder
+from encoder_switch import make_frames
+
+
+class ContainerEncoder:
+    """The encoder before it was built on a bare CodecContext, kept here for comparison."""
+
+    def __init__(self, width: int, height: int, bitrate: int, fps: int = 30):
+        self.output_container = av.open('pipe:', mode='w', format='mp4')
+        self.stream = self.output_container.add_stream('h264', rate=Fraction(fps))
+        self.stream.pix_fmt = 'yuv420p'
+        self.stream.width = width
+        self.stream.height = height
+        self.stream.bit_rate = bitrate
+        self.stream.options = {'g': '30', 'preset': 'fast', 'tune': 'zerolatency', 'sc_threshold': '0'}
+        self.sink = []
+
+    def encode_frame(self, frame_id, frame, width, height):
+        for packet in self.stream.encode(av.VideoFrame.from_ndarray(frame, format='bgr24')):
+            self.sink.append(bytes(packet))
+
+
+def measure(encode, frames, count: int):
+    # warm up, the first frames open the encoder
+    for frame_id in range(10):
+        encode(frame_id, frames[frame_id % len(frames)])
+
+    tracemalloc.start()
+    allocated = 0
+    for frame_id in range(10, 10 + count):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        encode(frame_id, frames[frame_id % len(frames)])
+        allocated += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    timed = time.perf_counter()
+    for frame_id in range(10 + count, 10 + 2 * count):
+        encode(frame_id, frames[frame_id % len(frames)])
+    fps = count / (time.perf_counter() - timed)
+    return fps, allocated / count
+
+
+def run(args):
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        frames = make_frames(width, height)
+
+        encoder = Encoder()
+        kept = []  # hold on to the output like the network queue does
+        encoder.encode_ready.connect(lambda frame_id, timestamp, data: kept.append(data) if len(kept) < 60 else kept.clear())
+        results = {"codec_context": measure(lambda i, f: encoder.encode_frame(i, f, width, height), frames, args.frames)}
+        encoder.close()
+
+        legacy = ContainerEncoder(width, height, encoder.current_bitrate)
+
+        def encode_legacy(frame_id, frame):
+            legacy.encode_frame(frame_id, frame, width, height)
+            if len(legacy.sink) >= 60:
+                legacy.sink.clear()
+        results["container"] = measure(encode_legacy, frames, args.frames)
+
+        print(f"{width}x{height}, {args.frames} frames")
+        for name, (fps, allocated) in results.items():
+            print(f"  {name:<14} {fps:7.1f} fps  {allocated / 1024:9.1f} KiB allocated/frame")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["1280x720", "1920x1080"], help="WIDTHxHEIGHT")
+    parser.add_argument("--frames", type=int, default=150)
+    args = parser.parse_args()
+    logger.remove()
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+What an uplink stall does to the encode thread and to the latency of the video.
+
+A producer thread puts synthetic 30 fps frames (a keyframe every --gop
+frames) into the frame queue of train-client's NetworkWorkerQUIC, a
+consumer on an asyncio loop takes them at --send-ms per frame. After
+--stall-at seconds the consumer stops for --stall seconds, like an uplink
+that loses coverage. Runs once with the old bounded LoopQueue, which blocks
+the producer while it is full, and once with VideoFrameQueue, which sheds.
+Prints how long the producer was blocked, the capture-to-send age of the
+frames that were sent and the frames that were dropped. Needs PyQt5.
+
+    python benchmarks/frame_queue_stall.py
+    python benchmarks/frame_queue_stall.py --stall 3 --send-ms 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "train-client", "src"))
+
+from utils.app_logger import logger
+from utils.loop_queue import LoopQueue
+from utils.video_frame_queue import VideoFrameQueue
+from sensor.video_source import monotonic_to_epoch_ms
+from globals import FRAME_QUEUE_SIZE
+
+KEYFRAME = b"\x00\x00\x00\x01\x65" + bytes(20_000)
+P_FRAME = b"\x00\x00\x00\x01\x41" + bytes(3_000)
+
+
+def produce(frame_queue, args, blocked: list, keyframe_requests: list, done: threading.Event):
+    next_due = time.monotonic()
+    next_keyframe = 0
+    for frame_id in range(int(args.seconds * args.fps)):
+        keyframe = frame_id >= next_keyframe or bool(keyframe_requests)
+        if keyframe:
+            keyframe_requests.clear()
+            next_keyframe = frame_id + args.gop
+        start = time.monotonic()
+        frame_queue.put((frame_id, monotonic_to_epoch_ms(start), KEYFRAME if keyframe else P_FRAME))
+        blocked.append(time.monotonic() - start)
+        next_due += 1 / args.fps
+        time.sleep(max(0.0, next_due - time.monotonic()))
+    done.set()
+
+
+async def consume(frame_queue, args, done: threading.Event) -> list:
+    frame_queue.bind(asyncio.get_running_loop())
+    start = time.monotonic()
+    stalled = False
+    ages = []
+    while not done.is_set() or frame_queue.qsize():
+        if not stalled and time.monotonic() - start >= args.stall_at:
+            stalled = True
+            await asyncio.sleep(args.stall)
+        handoff = await frame_queue.get(timeout=0.1)
+        if handoff is None:
+            continue
+        (_, timestamp, _), _ = handoff
+        await asyncio.sleep(args.send_ms / 1000)
+        ages.append(monotonic_to_epoch_ms(time.monotonic()) - timestamp)
+    return ages
+
+
+def run_mode(name: str, frame_queue, args, keyframe_requests: list) -> None:
+    blocked = []
+    done = threading.Event()
+    producer = threading.Thread(target=produce, args=(frame_queue, args, blocked, keyframe_requests, done))
+    producer.start()
+    ages = sorted(asyncio.run(consume(frame_queue, args, done)))
+    producer.join()
+    frames = len(blocked)
+    line = (f"  {name:<16} producer blocked max {max(blocked) * 1000:6.0f} ms, total {sum(blocked):5.2f} s  "
+            f"sent {len(ages)}/{frames} frames, age p50={ages[len(ages) // 2]:.0f}ms "
+            f"p95={ages[int(len(ages) * 0.95)]:.0f}ms max={ages[-1]:.0f}ms")
+    if isinstance(frame_queue, VideoFrameQueue):
+        stats = frame_queue.stats()
+        line += (f"\n  {'':<16} dropped {stats['dropped_full']} full, {stats['dropped_expired']} expired, "
+                 f"{stats['dropped_until_keyframe']} waiting for a keyframe, "
+                 f"{stats['keyframe_requests']} keyframes requested")
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--gop", type=int, default=60)
+    parser.add_argument("--seconds", type=float, default=8)
+    parser.add_argument("--stall-at", type=float, default=2)
+    parser.add_argument("--stall", type=float, default=2, help="seconds the consumer stops")
+    parser.add_argument("--send-ms", type=float, default=10, help="time to send one frame")
+    args = parser.parse_args()
+    logger.remove()
+    print(f"{args.fps} fps, {args.stall:g} s stall after {args.stall_at:g} s, {args.send_ms:g} ms per frame")
+    run_mode("blocking queue", LoopQueue("bench", maxsize=FRAME_QUEUE_SIZE), args, [])
+    keyframe_requests = []
+    run_mode("shedding queue", VideoFrameQueue("bench", on_keyframe_request=lambda: keyframe_requests.append(1)),
+             args, keyframe_requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Small timing harness shared by the benchmark suites.
+
+Every benchmark is a zero-argument callable. The harness calibrates how often
+it has to be called to run for `min_time` seconds, repeats that measurement
+and reports the time per operation in nanoseconds.
+"""
+import gc
+import statistics
+import time
+from typing import Callable, Dict
+
+
+class BenchmarkSuite:
+    def __init__(self, name: str, min_time: float = 0.2, repeat: int = 7, name_filter: str = ""):
+        self.name = name
+        self.min_time = min_time
+        self.repeat = repeat
+        self.name_filter = name_filter
+        self.results: Dict[str, dict] = {}
+        self.skipped: Dict[str, str] = {}
+
+    def skip(self, name: str, reason: str):
+        self.skipped[name] = reason
+        print(f"  {name:<48} skipped: {reason}", flush=True)
+
+    def measure(self, name: str, func: Callable[[], object], ops_per_call: int = 1):
+        """
+        Time `func`. `ops_per_call` is the number of logical operations one call
+        performs (e.g. packets in a frame) so that results are reported per operation.
+        """
+        if self.name_filter not in name:
+            return
+        number = self._calibrate(func)
+        samples = []
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for _ in range(self.repeat):
+                start = time.perf_counter_ns()
+                for _ in range(number):
+                    func()
+                samples.append((time.perf_counter_ns() - start) / (number * ops_per_call))
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        median = statistics.median(samples)
+        self.results[name] = {
+            "ns_per_op": round(median, 1),
+            "ns_per_op_min": round(min(samples), 1),
+            "ns_per_op_stdev": round(statistics.stdev(samples), 1) if len(samples) > 1 else 0.0,
+            "ops_per_sec": round(1e9 / median, 1) if median else None,
+            "number": number,
+            "repeat": self.repeat,
+            "ops_per_call": ops_per_call,
+        }
+        print(f"  {name:<48} {_format_ns(median):>10}/op  ({number} x {self.repeat} runs)", flush=True)
+
+    def _calibrate(self, func: Callable[[], object]) -> int:
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.min_time / self.repeat or number >= 1_000_000:
+                return number
+            # aim slightly above the target so the loop converges in a few steps
+            number = max(number * 2, int(number * (self.min_time / self.repeat) / max(elapsed, 1e-9) * 1.2))
+
+    def to_dict(self) -> dict:
+        return {"results": self.results, "skipped": self.skipped}
+
+
+def _format_ns(value: float) -> str:
+    if value >= 1e6:
+        return f"{value / 1e6:.2f} ms"
+    if value >= 1e3:
+        return f"{value / 1e3:.2f} us"
+    return f"{value:.0f} ns"
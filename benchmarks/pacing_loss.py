@@ -0,0 +1,185 @@
+"""
+Video datagram loss behind a shallow bottleneck, with and without pacing.
+
+Sends synthetic 30 fps video (a large keyframe every second, small P-frames
+in between) through the send loop of train-client's NetworkWorkerQUIC to a
+minimal QUIC receiver on loopback. The central server's loss proxy sits in
+between as a drop-tail bottleneck of --rate-kbps with a buffer of
+--queue-delay seconds, like the uplink buffer of a cellular modem. FEC is
+off, so the loss is what the bottleneck drops. Needs aioquic, PyQt5 and the
+central-server dependencies of loadtest.loss_proxy.
+
+    python benchmarks/pacing_loss.py
+    python benchmarks/pacing_loss.py --rate-kbps 4000 --queue-delay 0.02 --seconds 20
+"""
+import argparse
+import asyncio
+import datetime
+import importlib.util
+import os
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SRC = os.path.join(REPO_DIR, "central-server", "src")
+sys.path.insert(0, os.path.join(REPO_DIR, "train-client", "src"))
+
+from aioquic.asyncio import serve
+from aioquic.asyncio.protocol import QuicConnectionProtocol
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.events import DatagramFrameReceived
+
+from utils.app_logger import logger
+from utils.datagram_pacer import DatagramPacer
+from network_worker_quic import NetworkWorkerQUIC
+from globals import PACKET_TYPE
+
+TRAIN_ID = "8c5a5fc8-8a43-4a47-9f50-2a4f7a4a4a4a"
+VIDEO_HEADER = struct.Struct(">BIHH36sQ")
+
+
+def load_certificate_module():
+    # central-server/src has its own globals and utils, so only this file is loaded from there
+    spec = importlib.util.spec_from_file_location("loadtest_certificate",
+                                                  os.path.join(SERVER_SRC, "loadtest", "certificate.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Receiver(QuicConnectionProtocol):
+    """Counts the video datagrams of every frame and when each frame was complete."""
+
+    frames = defaultdict(set)  # frame_id -> packet ids received
+    sizes = {}  # frame_id -> number of packets
+    latencies = []  # ms from the frame timestamp to its last packet
+
+    def quic_event_received(self, event):
+        if not isinstance(event, DatagramFrameReceived) or event.data[0] != PACKET_TYPE["video"]:
+            return
+        _, frame_id, number_of_packets, packet_id, _, timestamp = VIDEO_HEADER.unpack_from(event.data)
+        received = self.frames[frame_id]
+        received.add(packet_id)
+        self.sizes[frame_id] = number_of_packets
+        if len(received) == number_of_packets:
+            self.latencies.append(datetime.datetime.now().timestamp() * 1000 - timestamp)
+
+
+def make_frame(frame_id: int, args) -> bytes:
+    if frame_id % args.gop == 1:
+        return b"\x00\x00\x00\x01\x65" + os.urandom(args.keyframe_bytes - 5)
+    return b"\x00\x00\x00\x01\x41" + os.urandom(args.frame_bytes - 5)
+
+
+async def run_mode(paced: bool, args, certificate, proxy_port: int) -> dict:
+    Receiver.frames = defaultdict(set)
+    Receiver.sizes = {}
+    Receiver.latencies = []
+    configuration = QuicConfiguration(is_client=False, alpn_protocols=["quic"], max_datagram_frame_size=65536)
+    configuration.load_cert_chain(*certificate)
+    server = await serve("127.0.0.1", args.server_port, configuration=configuration, create_protocol=Receiver)
+
+    worker = NetworkWorkerQUIC(TRAIN_ID)
+    worker.server_host = "127.0.0.1"
+    worker.server_port = proxy_port
+    worker.configuration.verify_mode = ssl.CERT_NONE
+    worker.fec = None
+    worker.pacer = DatagramPacer(TRAIN_ID, args.fps) if paced else None
+    # what NetworkWorkerQUIC.run does before it runs the client on its thread
+    worker._running = True
+    worker._loop = asyncio.get_running_loop()
+    worker.control_plane.bind(worker._loop)
+    worker.frame_queue.bind(worker._loop)
+    worker._pmtu_acked = asyncio.Event()
+    client = asyncio.create_task(worker.run_client())
+    while worker._client is None:
+        if client.done():
+            raise RuntimeError("could not connect through the loss proxy")
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+
+    frame_count = int(args.seconds * args.fps)
+    next_due = time.monotonic()
+    for frame_id in range(1, frame_count + 1):
+        timestamp = int(datetime.datetime.now().timestamp() * 1000)
+        worker.enqueue_frame(frame_id, timestamp, make_frame(frame_id, args))
+        next_due += 1 / args.fps
+        await asyncio.sleep(max(0.0, next_due - time.monotonic()))
+    await asyncio.sleep(1.0)
+
+    worker._running = False
+    worker.frame_queue.close()
+    client.cancel()
+    server.close()
+    await asyncio.sleep(0.5)  # the socket is closed by the loop
+
+    sent_packets = sum(Receiver.sizes.values())  # every frame had at least one packet arrive
+    keyframes = [frame_id for frame_id in range(1, frame_count + 1) if frame_id % args.gop == 1]
+    received = sum(len(packets) for packets in Receiver.frames.values())
+    complete = [frame_id for frame_id, packets in Receiver.frames.items() if len(packets) == Receiver.sizes[frame_id]]
+    latencies = sorted(Receiver.latencies)
+    return {
+        "mode": "paced" if paced else "burst",
+        "packet_loss": 1 - received / sent_packets if sent_packets else 0.0,
+        "frames_complete": len(complete) / frame_count,
+        "keyframes_complete": len(set(complete) & set(keyframes)) / len(keyframes),
+        "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+        "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+        "pacer": worker.pacer.stats() if worker.pacer is not None else None,
+    }
+
+
+async def run(args):
+    certificate = load_certificate_module().generate_self_signed_certificate(tempfile.mkdtemp())
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as trace:
+        trace.write(f"0,{args.rate_kbps}\n3600,{args.rate_kbps}\n")
+    proxy_port = args.server_port + 1
+    proxy = subprocess.Popen(
+        [sys.executable, "-m", "loadtest.loss_proxy", "--listen-port", str(proxy_port),
+         "--server-port", str(args.server_port), "--loss", "0", "--trace", trace.name,
+         "--queue-delay", str(args.queue_delay), "--report-interval", "3600"],
+        cwd=SERVER_SRC, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await asyncio.sleep(1.0)
+        average = (args.keyframe_bytes + (args.gop - 1) * args.frame_bytes) * 8 * args.fps / args.gop
+        print(f"bottleneck {args.rate_kbps / 1000:.1f} Mbps, buffer {args.queue_delay * 1000:.0f} ms, "
+              f"video {average / 1e6:.2f} Mbps ({args.keyframe_bytes // 1000} kB keyframes), {args.seconds:g} s")
+        for paced in (False, True):
+            result = await run_mode(paced, args, certificate, proxy_port)
+            print(f"  {result['mode']:<6} packet loss {result['packet_loss']:6.2%}  "
+                  f"frames complete {result['frames_complete']:6.1%}  "
+                  f"keyframes complete {result['keyframes_complete']:6.1%}  "
+                  f"latency p50={result['latency_p50']:.0f}ms p95={result['latency_p95']:.0f}ms")
+            if result["pacer"]:
+                pacer = result["pacer"]
+                print(f"         bandwidth estimate {(pacer['bandwidth'] or 0) / 1e6:.2f} Mbps, "
+                      f"frame spread p95 {pacer['frame_spread_p95_ms']:.0f} ms max {pacer['frame_spread_max_ms']:.0f} ms, "
+                      f"{pacer['late_frames']} of {pacer['frames']} frames late")
+    finally:
+        proxy.terminate()
+        proxy.wait()
+        os.unlink(trace.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate-kbps", type=int, default=8000)
+    parser.add_argument("--queue-delay", type=float, default=0.02, help="bottleneck buffer in seconds")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--gop", type=int, default=30)
+    parser.add_argument("--keyframe-bytes", type=int, default=50_000)
+    parser.add_argument("--frame-bytes", type=int, default=8_000)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--server-port", type=int, default=14433)
+    args = parser.parse_args()
+    logger.remove()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
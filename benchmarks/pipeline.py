@@ -0,0 +1,129 @@
+"""
+Achieved frame rate and per-stage timing of the train video pipeline.
+
+Runs a synthetic 30 fps source with the same kind of text overlay as the
+video sources, once with capture and encode on one thread (how the Qt main
+thread used to do it) and once pipelined: capture thread, EncodeWorker
+behind a latest-frame-wins mailbox, and a network thread that takes the
+encoded frames from a queue. Needs PyAV, PyQt5, numpy and OpenCV.
+
+    python benchmarks/pipeline.py
+    python benchmarks/pipeline.py --sizes 1920x1080 --seconds 20
+"""
+import argparse
+import datetime
+import os
+import queue
+import sys
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "train-client", "src"))
+
+import cv2
+from PyQt5.QtCore import Qt
+
+from utils.app_logger import logger
+from utils.pipeline_stats import PIPELINE_STAGES, PipelineStats
+from encoder import Encoder
+from encode_worker import EncodeWorker
+from sensor.video_source import CapturedFrame
+from encoder_switch import make_frames
+
+
+def capture(frames, frame_id):
+    """A copy of the source frame with an overlay, like the video sources draw."""
+    frame = frames[frame_id % len(frames)].copy()
+    now = datetime.datetime.now().strftime("Time: %H:%M:%S:%f")[:-3]
+    for y, text in ((30, f"Frame ID: {frame_id}"), (60, now)):
+        cv2.putText(frame, text, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (229, 230, 216), 1, cv2.LINE_AA)
+    return frame
+
+
+def run_source(seconds, fps, on_frame, frames, stats):
+    frame_id = 0
+    next_due = start = time.monotonic()
+    while time.monotonic() - start < seconds:
+        frame_id += 1
+        capture_time = time.monotonic()
+        frame = capture(frames, frame_id)
+        stats.record("capture", (time.monotonic() - capture_time) * 1000)
+        on_frame(CapturedFrame(frame_id, frame, frame.shape[1], frame.shape[0], "bgr24", frame.strides[0], capture_time))
+        next_due += 1.0 / fps
+        delay = next_due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_due = time.monotonic()
+
+
+def run_network(frame_queue, stats, stop):
+    while not stop.is_set():
+        try:
+            frame_id, timestamp, data, enqueued_at = frame_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        bytes(data)  # stands in for packetizing
+        stats.record("send", (time.monotonic() - enqueued_at) * 1000)
+        stats.record("total", datetime.datetime.now().timestamp() * 1000 - timestamp)
+
+
+def run_mode(mode, width, height, args):
+    frames = make_frames(width, height)
+    stats = PipelineStats()
+    encoder = Encoder()
+    frame_queue = queue.Queue(maxsize=30)
+    encoder.encode_ready.connect(lambda frame_id, timestamp, data: frame_queue.put((frame_id, timestamp, data, time.monotonic())),
+                                 Qt.DirectConnection)
+    stop = threading.Event()
+    network = threading.Thread(target=run_network, args=(frame_queue, stats, stop), daemon=True)
+    network.start()
+
+    worker = None
+    if mode == "serial":
+        def on_frame(captured):
+            start = time.monotonic()
+            encoder.encode_frame(captured.frame_id, captured.data, width, height, capture_time=captured.capture_time)
+            stats.record("encode", (time.monotonic() - start) * 1000)
+    else:
+        # same backend as the serial run
+        worker = EncodeWorker(encoder, stats, select_backend=False)
+        worker.start()
+        on_frame = worker.submit
+
+    start = time.monotonic()
+    run_source(args.seconds, args.fps, on_frame, frames, stats)
+    elapsed = time.monotonic() - start
+    if worker is not None:
+        worker.stop()
+    stop.set()
+    network.join()
+    encoder.close()
+
+    print(f"  {mode:<10}", end="")
+    for stage in PIPELINE_STAGES:
+        snapshot = stats.histograms[stage].snapshot()
+        if snapshot["count"]:
+            print(f" {stage} {snapshot['count'] / elapsed:5.1f}fps p50={snapshot['p50_ms']:.1f}ms "
+                  f"p95={snapshot['p95_ms']:.1f}ms |", end="")
+    dropped = worker.mailbox.dropped if worker is not None else 0
+    print(f" dropped={dropped}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["1280x720", "1920x1080"], help="WIDTHxHEIGHT")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    logger.remove()
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        print(f"{width}x{height} source at {args.fps} fps for {args.seconds:g} s")
+        for mode in ("serial", "pipelined"):
+            run_mode(mode, width, height, args)
+
+
+if __name__ == "__main__":
+    main()
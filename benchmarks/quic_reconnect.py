@@ -0,0 +1,247 @@
+"""
+How long the video is gone after a server restart or a network blip.
+
+Runs train-client's NetworkWorkerQUIC, supervisor included, against a
+minimal QUIC server on loopback that answers the connect message like the
+central server. Everything goes through a relay that delays every packet by
+half of --rtt in each direction. The worker keeps 30 fps synthetic video
+coming, like a train that is sending.
+
+restart: the server closes, is down for --downtime seconds and comes back.
+blip: the relay drops every packet for --blip seconds, the server stays up,
+longer than the worker's liveness timeout so that it has to reconnect.
+
+Measured from the moment the server or the path is back until the train is
+registered again (its connect response) and until the server has its first
+video datagram. Both include the wait for the next attempt of the worker.
+The handshake column is the cost of the successful attempt alone: from its
+first packet until the connect response is back at the worker. Once with a full
+handshake on every connection, once with session tickets that survive the
+restart (the server's QUIC_SESSION_TICKET_FILE), which let the connect
+message and the first video go out as 0-RTT data. Needs aioquic, PyQt5 and
+the certificate helper of the central server's load test.
+
+    python benchmarks/quic_reconnect.py
+    python benchmarks/quic_reconnect.py --rtt 0.2 --downtime 3 --runs 5
+"""
+import argparse
+import asyncio
+import datetime
+import importlib.util
+import json
+import os
+import ssl
+import statistics
+import struct
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SRC = os.path.join(REPO_DIR, "central-server", "src")
+sys.path.insert(0, os.path.join(REPO_DIR, "train-client", "src"))
+
+from aioquic.asyncio import serve
+from aioquic.asyncio.protocol import QuicConnectionProtocol
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.events import DatagramFrameReceived, StreamDataReceived
+
+from utils.app_logger import logger
+from network_worker_quic import NetworkWorkerQUIC
+from globals import PACKET_TYPE
+
+TRAIN_ID = "8c5a5fc8-8a43-4a47-9f50-2a4f7a4a4a4a"
+
+
+def load_certificate_module():
+    # central-server/src has its own globals and utils, so only this file is loaded from there
+    spec = importlib.util.spec_from_file_location("loadtest_certificate",
+                                                  os.path.join(SERVER_SRC, "loadtest", "certificate.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Server(QuicConnectionProtocol):
+    """Registers the train on its connect message and notes when video arrives."""
+
+    registered_at = None
+    registered_after = None  # seconds from the first packet of the registered connection to its connect message
+    first_video_at = None
+
+    def datagram_received(self, data, addr):
+        if not hasattr(self, "first_packet_at"):
+            self.first_packet_at = asyncio.get_running_loop().time()
+        super().datagram_received(data, addr)
+
+    def quic_event_received(self, event):
+        loop = asyncio.get_running_loop()
+        if isinstance(event, StreamDataReceived) and len(event.data) > 2 and event.data[2] == PACKET_TYPE["connect"]:
+            response = json.dumps({"type": "connect_response", "train_id": TRAIN_ID, "status": "admitted"})
+            packet = struct.pack("B", PACKET_TYPE["connect_response"]) + response.encode()
+            self._quic.send_stream_data(event.stream_id, struct.pack(">H", len(packet)) + packet)
+            self.transmit()
+            if Server.registered_at is None:
+                Server.registered_at = loop.time()
+                Server.registered_after = Server.registered_at - self.first_packet_at
+        elif isinstance(event, DatagramFrameReceived) and event.data[0] == PACKET_TYPE["video"]:
+            if Server.first_video_at is None:
+                Server.first_video_at = loop.time()
+
+
+class Relay:
+    """UDP relay between the worker and the server, delays and optionally drops every packet."""
+
+    class Side(asyncio.DatagramProtocol):
+        def __init__(self, forward):
+            self.forward = forward
+
+        def datagram_received(self, data, addr):
+            self.forward(data, addr)
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.blocked = False
+        self.client_address = None
+        self.front = self.back = None
+
+    async def start(self, listen_port: int, server_port: int):
+        loop = asyncio.get_running_loop()
+        self.front, _ = await loop.create_datagram_endpoint(
+            lambda: Relay.Side(self.from_client), local_addr=("127.0.0.1", listen_port))
+        self.back, _ = await loop.create_datagram_endpoint(
+            lambda: Relay.Side(self.from_server), remote_addr=("127.0.0.1", server_port))
+
+    def from_client(self, data, addr):
+        # a reconnect comes from a new socket, answers go to the latest one
+        self.client_address = addr
+        if not self.blocked:
+            asyncio.get_running_loop().call_later(self.delay, self.send, self.back, data, None)
+
+    def from_server(self, data, addr):
+        if not self.blocked and self.client_address is not None:
+            asyncio.get_running_loop().call_later(self.delay, self.send, self.front, data, self.client_address)
+
+    @staticmethod
+    def send(transport, data, address):
+        if not transport.is_closing():
+            transport.sendto(data, address)
+
+    def close(self):
+        self.front.close()
+        self.back.close()
+
+
+async def produce(worker: NetworkWorkerQUIC):
+    frame_id = 0
+    while True:
+        frame_id += 1
+        header = b"\x00\x00\x00\x01\x65" if frame_id % 30 == 1 else b"\x00\x00\x00\x01\x41"
+        frame = header + os.urandom(20_000 if frame_id % 30 == 1 else 4_000)
+        if worker._running:
+            worker.enqueue_frame(frame_id, int(datetime.datetime.now().timestamp() * 1000), frame)
+        await asyncio.sleep(1 / 30)
+
+
+async def start_server(args, certificate, tickets):
+    configuration = QuicConfiguration(is_client=False, alpn_protocols=["quic"], max_datagram_frame_size=65536)
+    configuration.load_cert_chain(*certificate)
+    ticket_handlers = {}
+    if tickets is not None:
+        ticket_handlers = {"session_ticket_handler": lambda ticket: tickets.__setitem__(ticket.ticket, ticket),
+                           "session_ticket_fetcher": lambda label: tickets.pop(label, None)}
+    return await serve("127.0.0.1", args.server_port, configuration=configuration, create_protocol=Server,
+                       **ticket_handlers)
+
+
+async def wait_registered(timeout: float):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while (Server.registered_at is None or Server.first_video_at is None) and loop.time() < deadline:
+        await asyncio.sleep(0.005)
+
+
+async def run_scenario(scenario: str, resume: bool, args, certificate) -> dict:
+    loop = asyncio.get_running_loop()
+    tickets = {} if resume else None
+    Server.registered_at = Server.first_video_at = None
+    server = await start_server(args, certificate, tickets)
+    relay = Relay(args.rtt / 2)
+    await relay.start(args.server_port + 1, args.server_port)
+
+    worker = NetworkWorkerQUIC(TRAIN_ID)
+    worker.server_host = "127.0.0.1"
+    worker.server_port = args.server_port + 1
+    worker.configuration.verify_mode = ssl.CERT_NONE
+    worker.fec = None
+    # what NetworkWorkerQUIC.run does before it runs the supervisor on its thread
+    worker._loop = loop
+    worker.control_plane.bind(loop)
+    worker.frame_queue.bind(loop)
+    worker._pmtu_acked = asyncio.Event()
+    worker._stopped = asyncio.Event()
+    supervisor = asyncio.create_task(worker.supervise())
+    producer = asyncio.create_task(produce(worker))
+    await wait_registered(10)
+    await asyncio.sleep(1.0)  # the session ticket comes after the handshake
+
+    if scenario == "restart":
+        server.close()
+        await asyncio.sleep(args.downtime)
+        Server.registered_at = Server.first_video_at = None
+        server = await start_server(args, certificate, tickets)
+    else:
+        relay.blocked = True
+        await asyncio.sleep(args.blip)
+        Server.registered_at = Server.first_video_at = None
+        relay.blocked = False
+    back_at = loop.time()
+    await wait_registered(30)
+    await asyncio.sleep(args.rtt)  # the server's handshake flight reaches the worker
+
+    result = {
+        "registered": Server.registered_at - back_at if Server.registered_at else None,
+        "video": Server.first_video_at - back_at if Server.first_video_at else None,
+        "handshake": Server.registered_after + args.rtt if Server.registered_at else None,
+        "resumed": worker._client is not None and worker._client._quic.tls.session_resumed,
+    }
+    worker.stop()
+    producer.cancel()
+    await asyncio.gather(supervisor, producer, return_exceptions=True)
+    server.close()
+    relay.close()
+    await asyncio.sleep(0.2)  # the sockets are closed by the loop
+    return result
+
+
+async def run(args):
+    certificate = load_certificate_module().generate_self_signed_certificate(tempfile.mkdtemp())
+    print(f"RTT {args.rtt * 1000:.0f} ms, server down for {args.downtime:g} s, path down for {args.blip:g} s, "
+          f"median of {args.runs} runs, ms after the server or path is back")
+    for scenario in ("restart", "blip"):
+        for resume in (False, True):
+            results = [await run_scenario(scenario, resume, args, certificate) for _ in range(args.runs)]
+
+            def median(key):
+                values = [result[key] * 1000 for result in results if result[key] is not None]
+                return f"{statistics.median(values):6.0f}" if values else "     -"
+
+            name = f"{scenario}, {'session tickets' if resume else 'full handshake'}"
+            print(f"  {name:<26} registered {median('registered')}  first video {median('video')}  "
+                  f"handshake {median('handshake')}  "
+                  f"resumed {sum(result['resumed'] for result in results)}/{len(results)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt", type=float, default=0.1, help="seconds, added by the relay")
+    parser.add_argument("--downtime", type=float, default=2.0, help="seconds the server is down")
+    parser.add_argument("--blip", type=float, default=3.0, help="seconds the path is down")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--server-port", type=int, default=14533)
+    args = parser.parse_args()
+    logger.remove()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Micro-benchmarks for the protocol hot paths of the train client and the central server.
+
+    python benchmarks/run.py run --output benchmarks/baseline.json
+    python benchmarks/run.py run --output current.json --compare benchmarks/baseline.json
+    python benchmarks/run.py compare benchmarks/baseline.json current.json --threshold 0.2
+
+Both trees have top-level modules with the same names (globals, utils), so every
+suite runs in its own interpreter with only its tree on the path.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+SUITES = {
+    "central-server": ("bench_central_server.py", os.path.join(REPO_DIR, "central-server", "src")),
+    "train-client": ("bench_train_client.py", os.path.join(REPO_DIR, "train-client", "src")),
+}
+
+DEFAULT_THRESHOLD = 0.20  # 20 % slower than the baseline counts as a regression
+
+
+def run_suite(name: str, min_time: float, name_filter: str) -> dict:
+    script, source_dir = SUITES[name]
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([source_dir, BENCHMARK_DIR])
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    print(f"{name}:", flush=True)
+    # the modules under test create log and dump files in the working directory
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as workdir:
+        output = os.path.join(workdir, "results.json")
+        command = [sys.executable, os.path.join(BENCHMARK_DIR, script),
+                   "--output", output, "--min-time", str(min_time), "--filter", name_filter]
+        process = subprocess.run(command, cwd=workdir, env=env)
+        if process.returncode != 0 or not os.path.exists(output):
+            print(f"  suite failed with exit code {process.returncode}", flush=True)
+            return {"results": {}, "skipped": {}, "error": f"exit code {process.returncode}"}
+        with open(output) as f:
+            return json.load(f)
+
+
+def run(args) -> int:
+    report = {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "processor": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "suites": {},
+    }
+    for name in args.suite or SUITES:
+        report["suites"][name] = run_suite(name, args.min_time, args.filter)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+
+    failed = any("error" in suite for suite in report["suites"].values())
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        return compare_reports(baseline, report, args.threshold) or int(failed)
+    return int(failed)
+
+
+def flatten(report: dict) -> dict:
+    return {
+        f"{suite_name}/{benchmark}": result["ns_per_op"]
+        for suite_name, suite in report.get("suites", {}).items()
+        for benchmark, result in suite.get("results", {}).items()
+    }
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float) -> int:
+    """Print a comparison table and return 1 if any benchmark regressed beyond `threshold`."""
+    baseline_results = flatten(baseline)
+    current_results = flatten(current)
+    if baseline.get("machine") != current.get("machine"):
+        print("warning: baseline was recorded on a different machine or interpreter, "
+              "differences may not be caused by the code")
+
+    regressions = []
+    print(f"{'benchmark':<64} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name in sorted(set(baseline_results) | set(current_results)):
+        before = baseline_results.get(name)
+        after = current_results.get(name)
+        if before is None or after is None:
+            status = "new" if before is None else "missing"
+            print(f"{name:<64} {_format(before):>12} {_format(after):>12} {status:>9}")
+            continue
+        change = (after - before) / before
+        marker = ""
+        if change > threshold:
+            marker = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            marker = "  improved"
+        print(f"{name:<64} {_format(before):>12} {_format(after):>12} {change:>+8.1%}{marker}")
+
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {threshold:.0%}:")
+        for name in regressions:
+            print(f"  {name}")
+        return 1
+    print(f"\nno regressions beyond {threshold:.0%}")
+    return 0
+
+
+def compare(args) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    return compare_reports(baseline, current, args.threshold)
+
+
+def _format(ns) -> str:
+    if ns is None:
+        return "-"
+    if ns >= 1e6:
+        return f"{ns / 1e6:.2f} ms"
+    if ns >= 1e3:
+        return f"{ns / 1e3:.2f} us"
+    return f"{ns:.0f} ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Protocol hot path micro-benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write a JSON report")
+    run_parser.add_argument("--output", default=os.path.join(BENCHMARK_DIR, "baseline.json"))
+    run_parser.add_argument("--suite", action="append", choices=sorted(SUITES),
+                            help="only run this suite, can be given more than once")
+    run_parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this text")
+    run_parser.add_argument("--min-time", type=float, default=0.5, help="seconds spent per benchmark")
+    run_parser.add_argument("--compare", help="compare the new report against this baseline")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="relative slowdown that counts as a regression, e.g. 0.2")
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
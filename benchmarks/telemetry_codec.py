@@ -0,0 +1,162 @@
+"""
+Size and rate of the train's telemetry over MQTT, JSON against the compact encoding.
+
+Runs train-client's Telemetry for --hours of simulated time at its 5 Hz
+poll rate, with a station change every 10 s like a train that is sending
+video, and encodes every sample:
+
+json: one JSON document per sample, what BaseClient published before.
+compact: one message per sample, a snapshot every TELEMETRY_SNAPSHOT_INTERVAL
+and the changed fields in between.
+batched: the same records, --batch of them per message.
+
+The compact messages are decoded again with the central server's decoder
+and compared with the samples. Prints the payload and the estimated wire
+bytes per train-hour (MQTT PUBLISH with QoS 1 and its PUBACK, each in its
+own TCP segment of --tcp-overhead bytes), the publishes per second of one
+train and the messages per second the broker handles for --trains trains
+with --subscribers subscribers each, and the encode and decode time per
+sample. Needs PyQt5.
+
+    python benchmarks/telemetry_codec.py
+    python benchmarks/telemetry_codec.py --batch 10 --trains 200 --subscribers 3
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SRC = os.path.join(REPO_DIR, "central-server", "src")
+sys.path.insert(0, os.path.join(REPO_DIR, "train-client", "src"))
+
+from sensor.telemetry import Telemetry
+from utils import telemetry_codec
+from utils.telemetry_codec import TelemetryEncoder
+
+TRAIN_ID = "8c5a5fc8-8a43-4a47-9f50-2a4f7a4a4a4a"
+TOPIC = f"train/{TRAIN_ID}/telemetry"
+PUBACK_BYTES = 4
+
+
+def load_server_codec():
+    # central-server/src has its own globals and utils, so only this file is loaded from there
+    spec = importlib.util.spec_from_file_location("server_telemetry_codec",
+                                                  os.path.join(SERVER_SRC, "utils", "telemetry_codec.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def publish_bytes(payload_size: int) -> int:
+    """PUBLISH with QoS 1: fixed header, remaining length, topic, packet id and payload."""
+    remaining = 2 + len(TOPIC) + 2 + payload_size
+    length_bytes = 1 if remaining < 128 else 2 if remaining < 16384 else 3
+    return 1 + length_bytes + remaining
+
+
+def simulate(hours: float, interval: float) -> list:
+    telemetry = Telemetry(TRAIN_ID)
+    samples = []
+    telemetry.telemetry_ready.connect(samples.append)
+    start_ms = int(time.time() * 1000)
+    for index in range(int(hours * 3600 / interval)):
+        telemetry._poll_telemetry()
+        samples[-1]["timestamp"] = start_ms + int(index * interval * 1000)
+        for _ in range(int(30 * interval)):
+            # 30 fps of video, every 300 frames the train reaches the next station
+            telemetry.notify_new_frame_processed()
+    return samples
+
+
+def run_mode(mode: str, samples: list, args, decoder_class) -> dict:
+    clock = [0.0]
+    # the encoder's snapshot interval runs on the simulated time
+    telemetry_codec.time = types.SimpleNamespace(monotonic=lambda: clock[0])
+    encoder = None if mode == "json" else TelemetryEncoder(batch_size=args.batch if mode == "batched" else 1)
+    messages = []
+    started = time.perf_counter()
+    for index, sample in enumerate(samples):
+        clock[0] = index * args.interval
+        if encoder is None:
+            messages.append(json.dumps(sample).encode("utf-8"))
+        else:
+            message = encoder.encode(sample)
+            if message is not None:
+                messages.append(message)
+    encode_time = time.perf_counter() - started
+
+    decode_time = 0.0
+    mismatches = 0
+    if encoder is not None:
+        decoder = decoder_class(TRAIN_ID)
+        started = time.perf_counter()
+        decoded = [sample for message in messages for sample in decoder.decode(message)]
+        decode_time = time.perf_counter() - started
+        mismatches = sum(1 for original, sample in zip(samples, decoded) if not matches(original, sample))
+        mismatches += abs(len(samples) - len(decoded))
+
+    seconds = len(samples) * args.interval
+    payload = sum(len(message) for message in messages)
+    wire = sum(publish_bytes(len(message)) + PUBACK_BYTES + 2 * args.tcp_overhead for message in messages)
+    publish_rate = len(messages) / seconds
+    return {
+        "payload_per_hour": payload * 3600 / seconds,
+        "wire_per_hour": wire * 3600 / seconds,
+        "bytes_per_message": payload / len(messages),
+        "publish_rate": publish_rate,
+        # every publish comes in once and goes out to each subscriber
+        "broker_rate": publish_rate * args.trains * (1 + args.subscribers),
+        "encode_us": encode_time / len(samples) * 1e6,
+        "decode_us": decode_time / len(samples) * 1e6,
+        "snapshots": encoder.snapshots if encoder is not None else len(samples),
+        "mismatches": mismatches,
+    }
+
+
+def matches(original: dict, decoded: dict) -> bool:
+    """Equal up to the resolution of the schema's scales."""
+    for key, value in original.items():
+        other = decoded.get(key)
+        if isinstance(value, dict):
+            if not isinstance(other, dict) or not matches(value, other):
+                return False
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            if other is None or abs(value - other) > 0.01:
+                return False
+        elif value != other:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=1.0, help="simulated time")
+    parser.add_argument("--interval", type=float, default=0.2, help="seconds between samples, the poll interval of Telemetry")
+    parser.add_argument("--batch", type=int, default=5, help="samples per message in the batched mode")
+    parser.add_argument("--trains", type=int, default=100)
+    parser.add_argument("--subscribers", type=int, default=2, help="per train, the server's bridge and a viewer")
+    parser.add_argument("--tcp-overhead", type=int, default=52, help="bytes of IPv4 and TCP headers per segment")
+    args = parser.parse_args()
+
+    decoder_class = load_server_codec().TelemetryDecoder
+    samples = simulate(args.hours, args.interval)
+    print(f"{len(samples)} samples, {args.hours:g} h at {1 / args.interval:g} Hz, broker rate for {args.trains} trains "
+          f"with {args.subscribers} subscribers each")
+    for mode in ("json", "compact", "batched"):
+        result = run_mode(mode, samples, args, decoder_class)
+        name = f"batched/{args.batch}" if mode == "batched" else mode
+        print(f"  {name:<10} {result['bytes_per_message']:6.0f} B/message  "
+              f"payload {result['payload_per_hour'] / 1e6:6.2f} MB/train-hour  "
+              f"wire {result['wire_per_hour'] / 1e6:6.2f} MB/train-hour  "
+              f"{result['publish_rate']:4.1f} publishes/s per train  "
+              f"broker {result['broker_rate']:6.0f} messages/s  "
+              f"encode {result['encode_us']:5.1f} us  decode {result['decode_us']:5.1f} us  "
+              f"{result['snapshots']} snapshots, {result['mismatches']} mismatches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""
+How long the video is gone when the QUIC path of the train dies, with and without the transport manager.
+
+Runs train-client's NetworkWorkerQUIC and NetworkWorkerWS side by side
+against minimal QUIC and WebSocket servers on loopback, both count the
+frames that arrive complete. The QUIC packets go through a relay that
+delays them by half of --rtt in each direction and, after --before
+seconds, drops all of them for --outage seconds, like a modem that loses
+its cell. The WebSocket keeps working. The producer sends synthetic
+30 fps video, a keyframe every --gop frames and on every keyframe request.
+
+Meanwhile an operator sends a CHANGE_TARGET_SPEED command every
+--command-interval seconds, the train's workers count those that arrive.
+
+quic: what BaseClient and the server did before, every frame to the QUIC
+worker, every command over the QUIC stream.
+manager: every frame through the TransportManager, which moves the video
+to the WebSocket when QUIC stops answering and back once it is healthy
+again. The commands go over the WebSocket while the train's QUIC
+connection has been silent for TRAIN_QUIC_SILENCE_TIMEOUT, those sent
+over QUIC since its last packet again first, like the server's
+ClientManager.send_to_train.
+
+Prints the share of frames that arrived, the longest gap between two
+frames at the receiver, how long after the outage began the first frame
+came over the WebSocket, and the switches of the manager. For the commands
+sent during the outage, the share that reached the train before it ended
+and the longest delay of those that arrived at all. Needs aioquic,
+websockets, PyQt5, the central server's globals and the certificate helper
+of its load test.
+
+    python benchmarks/transport_failover.py
+    python benchmarks/transport_failover.py --rtt 0.1 --outage 5
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import ssl
+import struct
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SRC = os.path.join(REPO_DIR, "central-server", "src")
+sys.path.insert(0, os.path.join(REPO_DIR, "train-client", "src"))
+
+import websockets
+from aioquic.asyncio import serve
+from aioquic.asyncio.protocol import QuicConnectionProtocol
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.events import DatagramFrameReceived, StreamDataReceived
+
+from utils.app_logger import logger
+from sensor.video_source import monotonic_to_epoch_ms
+from network_worker_quic import NetworkWorkerQUIC
+from network_worker_ws import NetworkWorkerWS
+from transport_manager import TransportManager
+from globals import PACKET_TYPE, TRANSPORT_HEALTH_INTERVAL
+
+TRAIN_ID = "8c5a5fc8-8a43-4a47-9f50-2a4f7a4a4a4a"
+VIDEO_HEADER = struct.Struct(">BIHH36sQ")
+
+
+def load_server_module(name: str, *path: str):
+    # central-server/src has its own globals and utils, so only single files are loaded from there
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SERVER_SRC, *path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+SERVER_GLOBALS = load_server_module("server_globals", "globals.py")
+
+
+def command_packet(command_id: int) -> bytes:
+    message = {"type": "command", "instruction": "CHANGE_TARGET_SPEED", "target_speed": command_id % 100,
+               "command_id": command_id}
+    return struct.pack("B", PACKET_TYPE["command"]) + json.dumps(message).encode()
+
+
+class Receiver:
+    """Both servers report here, a frame counts once when its last packet arrives over either transport."""
+
+    def __init__(self):
+        self.packets = {}  # frame_id -> packets received over QUIC
+        self.arrivals = {}  # frame_id -> (monotonic arrival time, transport)
+        self.commands = {}  # command_id -> [monotonic send time, arrival time or None]
+
+    def on_datagram(self, data: bytes):
+        _, frame_id, number_of_packets, _, _, _ = VIDEO_HEADER.unpack_from(data, 0)
+        received = self.packets.get(frame_id, 0) + 1
+        self.packets[frame_id] = received
+        if received == number_of_packets:
+            self.arrivals.setdefault(frame_id, (time.monotonic(), "QUIC"))
+
+    def on_message(self, message: bytes):
+        if message[0] == PACKET_TYPE["video_frame"]:
+            _, frame_id, _, _, _, _ = VIDEO_HEADER.unpack_from(message, 1)
+            self.arrivals.setdefault(frame_id, (time.monotonic(), "WEBSOCKET"))
+
+    def on_command(self, payload: bytes):
+        # the process_command signal of either worker of the train
+        command = self.commands.get(json.loads(payload.decode("utf-8"))["command_id"])
+        if command is not None and command[1] is None:
+            command[1] = time.monotonic()
+
+
+class QuicServer(QuicConnectionProtocol):
+    """Registers the train on its connect message and hands the video datagrams to the receiver."""
+
+    receiver = None
+    train = None  # the latest connection of the train, commands go to its stream
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stream_id = None
+        self.last_received = time.monotonic()
+        self.unanswered = []  # (monotonic time, packet) sent since the train's last packet
+
+    def datagram_received(self, data, addr):
+        self.last_received = time.monotonic()
+        super().datagram_received(data, addr)
+
+    def send_stream_packet(self, packet: bytes):
+        now = time.monotonic()
+        self.unanswered = [(sent_at, sent) for sent_at, sent in self.unanswered if sent_at >= self.last_received]
+        self.unanswered.append((now, packet))
+        self._quic.send_stream_data(self.stream_id, struct.pack(">H", len(packet)) + packet)
+        self.transmit()
+
+    def quic_event_received(self, event):
+        if isinstance(event, StreamDataReceived) and len(event.data) > 2 and event.data[2] == PACKET_TYPE["connect"]:
+            self.stream_id = event.stream_id
+            QuicServer.train = self
+            response = json.dumps({"type": "connect_response", "train_id": TRAIN_ID, "status": "admitted"})
+            self.send_stream_packet(struct.pack("B", PACKET_TYPE["connect_response"]) + response.encode())
+        elif isinstance(event, DatagramFrameReceived) and event.data[0] == PACKET_TYPE["video"]:
+            QuicServer.receiver.on_datagram(event.data)
+
+
+class Relay:
+    """UDP relay between the QUIC worker and the server, delays and optionally drops every packet."""
+
+    class Side(asyncio.DatagramProtocol):
+        def __init__(self, forward):
+            self.forward = forward
+
+        def datagram_received(self, data, addr):
+            self.forward(data, addr)
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.blocked = False
+        self.client_address = None
+        self.front = self.back = None
+
+    async def start(self, listen_port: int, server_port: int):
+        loop = asyncio.get_running_loop()
+        self.front, _ = await loop.create_datagram_endpoint(
+            lambda: Relay.Side(self.from_client), local_addr=("127.0.0.1", listen_port))
+        self.back, _ = await loop.create_datagram_endpoint(
+            lambda: Relay.Side(self.from_server), remote_addr=("127.0.0.1", server_port))
+
+    def from_client(self, data, addr):
+        # a reconnect comes from a new socket, answers go to the latest one
+        self.client_address = addr
+        if not self.blocked:
+            asyncio.get_running_loop().call_later(self.delay, self.send, self.back, data, None)
+
+    def from_server(self, data, addr):
+        if not self.blocked and self.client_address is not None:
+            asyncio.get_running_loop().call_later(self.delay, self.send, self.front, data, self.client_address)
+
+    @staticmethod
+    def send(transport, data, address):
+        if not transport.is_closing():
+            transport.sendto(data, address)
+
+    def close(self):
+        self.front.close()
+        self.back.close()
+
+
+def start_quic_worker(loop, port: int) -> NetworkWorkerQUIC:
+    worker = NetworkWorkerQUIC(TRAIN_ID)
+    worker.server_host = "127.0.0.1"
+    worker.server_port = port
+    worker.configuration.verify_mode = ssl.CERT_NONE
+    worker.fec = None
+    # what NetworkWorkerQUIC.run does before it runs the supervisor on its thread
+    worker._loop = loop
+    worker.control_plane.bind(loop)
+    worker.frame_queue.bind(loop)
+    worker._pmtu_acked = asyncio.Event()
+    worker._stopped = asyncio.Event()
+    return worker
+
+
+def start_ws_worker(loop, port: int) -> NetworkWorkerWS:
+    worker = NetworkWorkerWS(TRAIN_ID)
+    worker.server_url = f"wss://127.0.0.1:{port}/ws/train/{TRAIN_ID}"
+    # what NetworkWorkerWS.run does before it runs the supervisor on its thread
+    worker.loop = loop
+    worker.packet_queue.bind(loop)
+    worker.frame_queue.bind(loop)
+    worker._stopped = asyncio.Event()
+    return worker
+
+
+async def produce(send, args, keyframe_requests: list):
+    loop = asyncio.get_running_loop()
+    next_due = loop.time()
+    for frame_id in range(1, int(args.duration * args.fps) + 1):
+        timestamp = monotonic_to_epoch_ms(time.monotonic())
+        if frame_id % args.gop == 1 or keyframe_requests:
+            keyframe_requests.clear()
+            frame = b"\x00\x00\x00\x01\x65" + os.urandom(args.keyframe_bytes - 5)
+        else:
+            frame = b"\x00\x00\x00\x01\x41" + os.urandom(args.frame_bytes - 5)
+        send(frame_id, timestamp, frame)
+        next_due += 1 / args.fps
+        await asyncio.sleep(max(0.0, next_due - loop.time()))
+
+
+async def operate(args, receiver: Receiver, websockets_open: list, fallback: bool):
+    command_id = 0
+    while True:
+        command_id += 1
+        packet = command_packet(command_id)
+        receiver.commands[command_id] = [time.monotonic(), None]
+        train = QuicServer.train
+        silent = train is None or time.monotonic() - train.last_received > SERVER_GLOBALS.TRAIN_QUIC_SILENCE_TIMEOUT
+        if fallback and silent and websockets_open:
+            if train is not None:
+                for sent_at, sent in train.unanswered:
+                    if sent_at >= train.last_received:
+                        await websockets_open[-1].send(sent)
+                train.unanswered = []
+            await websockets_open[-1].send(packet)
+        elif train is not None:
+            train.send_stream_packet(packet)
+        await asyncio.sleep(args.command_interval)
+
+
+async def check_health(manager: TransportManager):
+    # the QTimer of the manager needs a Qt event loop
+    while True:
+        manager.update()
+        await asyncio.sleep(TRANSPORT_HEALTH_INTERVAL)
+
+
+async def run_mode(mode: str, args, certificate) -> dict:
+    loop = asyncio.get_running_loop()
+    receiver = Receiver()
+    QuicServer.receiver = receiver
+    QuicServer.train = None
+    configuration = QuicConfiguration(is_client=False, alpn_protocols=["quic"], max_datagram_frame_size=65536)
+    configuration.load_cert_chain(*certificate)
+    quic_server = await serve("127.0.0.1", args.server_port, configuration=configuration, create_protocol=QuicServer)
+    relay = Relay(args.rtt / 2)
+    await relay.start(args.server_port + 1, args.server_port)
+
+    websockets_open = []
+
+    async def handle(websocket):
+        websockets_open.append(websocket)
+        try:
+            async for message in websocket:
+                receiver.on_message(message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            websockets_open.remove(websocket)
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(*certificate)
+    ws_server = await websockets.serve(handle, "127.0.0.1", args.server_port + 2, ssl=context, max_size=None)
+
+    quic = start_quic_worker(loop, args.server_port + 1)
+    ws = start_ws_worker(loop, args.server_port + 2)
+    keyframe_requests = []
+    tasks = [asyncio.create_task(quic.supervise()), asyncio.create_task(ws.supervise())]
+    for worker in (quic, ws):
+        worker.keyframe_requested.connect(lambda: keyframe_requests.append(True))
+        worker.process_command.connect(receiver.on_command)
+    while not quic._accepted or ws._websocket is None:
+        await asyncio.sleep(0.01)
+
+    manager = None
+    if mode == "manager":
+        manager = TransportManager({"QUIC": quic, "WEBSOCKET": ws})
+        manager.keyframe_requested.connect(lambda: keyframe_requests.append(True))
+        tasks.append(asyncio.create_task(check_health(manager)))
+        send = manager.send_frame
+    else:
+        send = quic.enqueue_frame
+
+    async def outage():
+        await asyncio.sleep(args.before)
+        relay.blocked = True
+        outage_at = time.monotonic()
+        await asyncio.sleep(args.outage)
+        relay.blocked = False
+        return outage_at
+
+    outage_task = asyncio.create_task(outage())
+    tasks.append(asyncio.create_task(operate(args, receiver, websockets_open, fallback=mode == "manager")))
+    args.duration = args.before + args.outage + args.after
+    await produce(send, args, keyframe_requests)
+    await asyncio.sleep(0.5)
+    outage_at = await outage_task
+
+    route = manager.routes["video"] if manager is not None else "QUIC"
+    stats = manager.stats() if manager is not None else None
+    quic.stop()
+    ws._stopping = True
+    ws.frame_queue.close()
+    ws.packet_queue.close()
+    ws._stopped.set()
+    for task in tasks[2:]:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    quic_server.close()
+    ws_server.close()
+    await ws_server.wait_closed()
+    relay.close()
+    await asyncio.sleep(0.2)  # the sockets are closed by the loop
+
+    sent = int(args.duration * args.fps)
+    times = sorted(arrival for arrival, _ in receiver.arrivals.values())
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    over_ws = [arrival for arrival, transport in receiver.arrivals.values()
+               if transport == "WEBSOCKET" and arrival >= outage_at]
+    outage_end = outage_at + args.outage
+    in_outage = [command for command in receiver.commands.values() if outage_at <= command[0] < outage_end]
+    delays = [arrived - sent_at for sent_at, arrived in in_outage if arrived is not None]
+    return {
+        "commands": sum(arrived is not None and arrived < outage_end for _, arrived in in_outage) / len(in_outage),
+        "command_delay": max(delays) if delays else None,
+        "complete": len(receiver.arrivals) / sent,
+        "max_gap": max(gaps) if gaps else None,
+        "first_ws": min(over_ws) - outage_at if over_ws else None,
+        "route": route,
+        "switches": stats["switches"]["video"] if stats else 0,
+    }
+
+
+async def run(args):
+    certificate = load_server_module("loadtest_certificate", "loadtest", "certificate.py").generate_self_signed_certificate(
+        tempfile.mkdtemp())
+    print(f"RTT {args.rtt * 1000:.0f} ms, QUIC path down for {args.outage:g} s after {args.before:g} s, "
+          f"{args.after:g} s after it is back")
+    for mode in ("quic", "manager"):
+        result = await run_mode(mode, args, certificate)
+        first_ws = f"{result['first_ws'] * 1000:5.0f} ms" if result["first_ws"] is not None else "      -"
+        command_delay = f"{result['command_delay'] * 1000:5.0f} ms" if result["command_delay"] is not None else "      -"
+        print(f"  {mode:<8} frames complete {result['complete']:6.1%}  "
+              f"longest gap {result['max_gap'] * 1000:5.0f} ms  first frame over WebSocket {first_ws}  "
+              f"video ends on {result['route']}, {result['switches']} video switches")
+        print(f"  {'':<8} commands in the outage delivered in it {result['commands']:6.1%}  "
+              f"longest delay {command_delay}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt", type=float, default=0.05, help="seconds, added by the QUIC relay")
+    parser.add_argument("--before", type=float, default=3.0, help="seconds of video before the outage")
+    parser.add_argument("--outage", type=float, default=4.0, help="seconds the QUIC path is down")
+    parser.add_argument("--after", type=float, default=8.0, help="seconds of video after the path is back")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--gop", type=int, default=30)
+    parser.add_argument("--keyframe-bytes", type=int, default=20_000)
+    parser.add_argument("--frame-bytes", type=int, default=4_000)
+    parser.add_argument("--command-interval", type=float, default=0.25, help="seconds between two commands")
+    parser.add_argument("--server-port", type=int, default=14733)
+    args = parser.parse_args()
+    logger.remove()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
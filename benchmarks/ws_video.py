@@ -0,0 +1,266 @@
+"""
+Video and telemetry over the train's WebSocket through a bottleneck slower than the video.
+
+Runs train-client's NetworkWorkerWS against a minimal WebSocket server on
+loopback. A TCP relay in between forwards the train's bytes at --rate-kbps
+and reads them through a small receive buffer, so the train's TCP sees the
+bottleneck like an uplink that is too slow. The producer sends synthetic
+30 fps video (a keyframe every --gop frames and on every keyframe request
+of the worker) and telemetry at 5 Hz.
+
+frames: the worker as it is, one message per frame, write-buffer
+high-water mark and the frame queue that sheds.
+packets: the old path, frames split into 1000-byte packets with a second
+type byte, a queue that never drops and the default buffers of websockets
+and the kernel.
+
+Prints the share of frames that arrived complete, their capture-to-arrival
+latency, the latency of the telemetry messages that share the socket, and
+what the worker dropped. Needs websockets, PyQt5 and the certificate helper
+of the central server's load test.
+
+    python benchmarks/ws_video.py
+    python benchmarks/ws_video.py --rate-kbps 800 --seconds 30
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import socket
+import ssl
+import struct
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SRC = os.path.join(REPO_DIR, "central-server", "src")
+sys.path.insert(0, os.path.join(REPO_DIR, "train-client", "src"))
+
+import websockets
+
+from utils.app_logger import logger
+from utils.video_frame_queue import VideoFrameQueue
+from utils.video_packetizer import VideoPacketizer
+from sensor.video_source import monotonic_to_epoch_ms
+import network_worker_ws
+from network_worker_ws import NetworkWorkerWS
+from globals import MAX_PACKET_SIZE, PACKET_TYPE
+
+TRAIN_ID = "8c5a5fc8-8a43-4a47-9f50-2a4f7a4a4a4a"
+VIDEO_HEADER = struct.Struct(">BIHH36sQ")
+
+
+def load_certificate_module():
+    # central-server/src has its own globals and utils, so only this file is loaded from there
+    spec = importlib.util.spec_from_file_location("loadtest_certificate",
+                                                  os.path.join(SERVER_SRC, "loadtest", "certificate.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class PacketWorker(NetworkWorkerWS):
+    """The WebSocket worker before frame messages: 1000-byte packets, nothing dropped, default buffers."""
+
+    def __init__(self, train_client_id):
+        super().__init__(train_client_id)
+        self.frame_queue = VideoFrameQueue(f"{train_client_id}:ws_frames", maxsize=0, max_age=float("inf"))
+        self.packetizer = VideoPacketizer(self.train_client_id_bytes, prefix=struct.pack("B", PACKET_TYPE["video"]))
+
+    @staticmethod
+    def limit_unsent_bytes(websocket):
+        pass
+
+    async def send_frames(self, websocket):
+        while True:
+            handoff = await self.frame_queue.get()
+            if handoff is None:
+                return
+            (frame_id, timestamp, frame), _ = handoff
+            for packet in self.packetizer.packetize(frame_id, timestamp, frame, MAX_PACKET_SIZE):
+                await websocket.send(packet)
+
+
+class Receiver:
+    """The server side: reassembles the frames and measures the latency of video and telemetry."""
+
+    def __init__(self):
+        self.frames = {}  # frame_id -> packets received
+        self.frame_latencies = []
+        self.telemetry_latencies = []
+
+    async def handle(self, websocket):
+        try:
+            async for message in websocket:
+                self.on_message(message, monotonic_to_epoch_ms(time.monotonic()))
+        except websockets.ConnectionClosed:
+            # the relay goes away without a close frame at the end of a run
+            pass
+
+    def on_message(self, message: bytes, now: float):
+        if message[0] == PACKET_TYPE["telemetry"]:
+            self.telemetry_latencies.append(now - json.loads(message[1:])["timestamp"])
+        elif message[0] in (PACKET_TYPE["video"], PACKET_TYPE["video_frame"]):
+            _, frame_id, number_of_packets, _, _, timestamp = VIDEO_HEADER.unpack_from(message, 1)
+            received = self.frames.get(frame_id, 0) + 1
+            self.frames[frame_id] = received
+            if received == number_of_packets:
+                self.frame_latencies.append(now - timestamp)
+
+
+class Bottleneck:
+    """TCP relay that forwards the train's bytes at a fixed rate, the way back is not limited."""
+
+    def __init__(self, rate_kbps: int, receive_buffer: int):
+        self.rate = rate_kbps * 1000 / 8
+        self.receive_buffer = receive_buffer
+        self.server = None
+
+    async def start(self, listen_port: int, server_port: int):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # set before listen, so that the window of every accepted connection stays small
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+        sock.bind(("127.0.0.1", listen_port))
+        # the stream reader buffers up to twice its limit before it stops reading the socket
+        self.server = await asyncio.start_server(lambda r, w: self.relay(r, w, server_port), sock=sock,
+                                                 limit=4096)
+
+    async def relay(self, client_reader, client_writer, server_port: int):
+        server_reader, server_writer = await asyncio.open_connection("127.0.0.1", server_port)
+        tasks = [asyncio.create_task(self.forward(client_reader, server_writer, self.rate)),
+                 asyncio.create_task(self.forward(server_reader, client_writer, None))]
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in tasks:
+            task.cancel()
+        client_writer.close()
+        server_writer.close()
+
+    @staticmethod
+    async def forward(reader, writer, rate):
+        loop = asyncio.get_running_loop()
+        next_send = loop.time()
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                return
+            if rate is not None:
+                next_send = max(next_send, loop.time()) + len(data) / rate
+                await asyncio.sleep(next_send - loop.time())
+            writer.write(data)
+            await writer.drain()
+
+    def close(self):
+        self.server.close()
+
+
+async def produce(worker: NetworkWorkerWS, args, keyframe_requests: list):
+    loop = asyncio.get_running_loop()
+    next_due = loop.time()
+    for frame_id in range(1, int(args.seconds * args.fps) + 1):
+        timestamp = monotonic_to_epoch_ms(time.monotonic())
+        if frame_id % args.gop == 1 or keyframe_requests:
+            keyframe_requests.clear()
+            frame = b"\x00\x00\x00\x01\x65" + os.urandom(args.keyframe_bytes - 5)
+        else:
+            frame = b"\x00\x00\x00\x01\x41" + os.urandom(args.frame_bytes - 5)
+        worker.enqueue_frame(frame_id, timestamp, frame)
+        if frame_id % (args.fps // 5) == 0:
+            telemetry = {"type": "telemetry", "train_id": TRAIN_ID, "timestamp": timestamp}
+            worker.enqueue_packet(struct.pack("B", PACKET_TYPE["telemetry"]) + json.dumps(telemetry).encode('utf-8'))
+        next_due += 1 / args.fps
+        await asyncio.sleep(max(0.0, next_due - loop.time()))
+
+
+def percentile(values: list, share: float) -> str:
+    if not values:
+        return "    -"
+    values = sorted(values)
+    return f"{values[min(len(values) - 1, int(len(values) * share))]:5.0f}"
+
+
+async def run_mode(mode: str, args, certificate) -> dict:
+    receiver = Receiver()
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(*certificate)
+    server = await websockets.serve(receiver.handle, "127.0.0.1", args.server_port, ssl=context, max_size=None)
+    bottleneck = Bottleneck(args.rate_kbps, args.receive_buffer)
+    await bottleneck.start(args.server_port + 1, args.server_port)
+
+    saved_write_limits = network_worker_ws.WS_WRITE_HIGH_WATER, network_worker_ws.WS_WRITE_LOW_WATER
+    if mode == "packets":
+        # the defaults of websockets that the old worker ran with
+        network_worker_ws.WS_WRITE_HIGH_WATER, network_worker_ws.WS_WRITE_LOW_WATER = 2 ** 15, None
+        worker = PacketWorker(TRAIN_ID)
+    else:
+        worker = NetworkWorkerWS(TRAIN_ID)
+    worker.server_url = f"wss://127.0.0.1:{args.server_port + 1}/ws/train/{TRAIN_ID}"
+    keyframe_requests = []
+    worker.keyframe_requested.connect(lambda: keyframe_requests.append(True))
+    # what NetworkWorkerWS.run does before it runs the supervisor on its thread
+    loop = asyncio.get_running_loop()
+    worker.loop = loop
+    worker.packet_queue.bind(loop)
+    worker.frame_queue.bind(loop)
+    worker._stopped = asyncio.Event()
+    supervisor = asyncio.create_task(worker.supervise())
+    while worker._websocket is None:
+        await asyncio.sleep(0.01)
+
+    await produce(worker, args, keyframe_requests)
+    await asyncio.sleep(1.0)
+    sent = int(args.seconds * args.fps)
+    stats = worker.frame_queue.stats()
+    worker._stopping = True
+    worker.frame_queue.close()
+    worker.packet_queue.close()
+    worker._stopped.set()
+    await asyncio.wait_for(supervisor, 10)
+    network_worker_ws.WS_WRITE_HIGH_WATER, network_worker_ws.WS_WRITE_LOW_WATER = saved_write_limits
+    bottleneck.close()
+    server.close()
+    await server.wait_closed()
+    return {
+        "complete": len(receiver.frame_latencies) / sent,
+        "frame_p50": percentile(receiver.frame_latencies, 0.5),
+        "frame_p95": percentile(receiver.frame_latencies, 0.95),
+        "frame_max": percentile(receiver.frame_latencies, 1.0),
+        "telemetry_p50": percentile(receiver.telemetry_latencies, 0.5),
+        "telemetry_p95": percentile(receiver.telemetry_latencies, 0.95),
+        "dropped": stats["dropped"],
+        "keyframe_requests": stats["keyframe_requests"],
+    }
+
+
+async def run(args):
+    certificate = load_certificate_module().generate_self_signed_certificate(tempfile.mkdtemp())
+    average = (args.keyframe_bytes + (args.gop - 1) * args.frame_bytes) * 8 * args.fps / args.gop
+    print(f"bottleneck {args.rate_kbps / 1000:.1f} Mbps, video {average / 1e6:.2f} Mbps "
+          f"({args.keyframe_bytes // 1000} kB keyframes), {args.seconds:g} s, latencies in ms")
+    for mode in ("packets", "frames"):
+        result = await run_mode(mode, args, certificate)
+        print(f"  {mode:<8} frames complete {result['complete']:6.1%}  "
+              f"frame latency p50={result['frame_p50']} p95={result['frame_p95']} max={result['frame_max']}  "
+              f"telemetry p50={result['telemetry_p50']} p95={result['telemetry_p95']}  "
+              f"dropped {result['dropped']}, {result['keyframe_requests']} keyframes requested")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate-kbps", type=int, default=1500)
+    parser.add_argument("--receive-buffer", type=int, default=16 * 1024, help="bytes, of the relay's socket, the kernel doubles it")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--gop", type=int, default=30)
+    parser.add_argument("--keyframe-bytes", type=int, default=40_000)
+    parser.add_argument("--frame-bytes", type=int, default=8_000)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--server-port", type=int, default=14633)
+    args = parser.parse_args()
+    logger.remove()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ import time, os
 
 from server_controller import ServerController
 from utils.app_logger import logger
-from globals import PACKET_TYPE
+from globals import PACKET_TYPE, WS_CLOSE_TRY_AGAIN_LATER
 
 
 s_controller = ServerController()
@@ -32,6 +32,13 @@ class WebRTCIceCandidate(BaseModel):
 async def remote_control_interface(websocket: WebSocket, remote_control_id: str):
     logger.debug(f"WebSocket: connection established for web client:  {remote_control_id}")
     await websocket.accept()
+    decision = s_controller.admission_manager.admit_viewer(remote_control_id, "websocket")
+    if not decision.admitted:
+        # tell the web client why before closing, close reasons are limited to 123 bytes
+        await websocket.send_bytes(decision.to_packet(remote_control_id=remote_control_id))
+        await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER, reason=decision.reason[:123])
+        return
+
     await s_controller.add_remote_controller(websocket, remote_control_id)
     try:
         while True:
@@ -40,6 +47,8 @@ async def remote_control_interface(websocket: WebSocket, remote_control_id: str)
     except WebSocketDisconnect:
         await s_controller.remove_remote_controller(remote_control_id)
         s_controller.unmap_client_from_train(remote_control_id)
+    finally:
+        s_controller.admission_manager.release_viewer(remote_control_id, "websocket")
 
 @router.get("/api/trains")
 async def get_trains():
@@ -56,21 +65,35 @@ async def get_stream(train_id: str):
 @router.post("/api/remote_control/{remote_control_id}/train/{train_id}")
 async def map_client_to_train(remote_control_id: str, train_id: str):
     logger.debug(f"HTTP: Mapping remote control {remote_control_id} to train {train_id}")
+    decision = s_controller.admission_manager.admit_mapping(remote_control_id, train_id)
+    if not decision.admitted:
+        return JSONResponse(status_code=503, content={
+            "status": "rejected",
+            "message": decision.reason,
+            "admission": decision.to_dict(),
+        })
+
     s_controller.map_client_to_train(remote_control_id, train_id)
     return {
         "status": "success",
-        "message": f"Mapped {remote_control_id} to {train_id}"
+        "message": f"Mapped {remote_control_id} to {train_id}",
+        "admission": decision.to_dict(),
     }
 
 @router.delete("/api/remote_control/{remote_control_id}/train")
 async def unmap_client_from_train(remote_control_id: str):
     logger.debug(f"HTTP: Unmapping remote control {remote_control_id} from train")
     s_controller.unmap_client_from_train(remote_control_id)
+    s_controller.admission_manager.release_mapping(remote_control_id)
     return {
         "status": "success",
         "message": f"Unmapped {remote_control_id}"
     }
 
+@router.get("/api/admission")
+async def get_admission_stats():
+    return s_controller.admission_manager.get_stats()
+
 @router.get("/api/speedtest/download")
 async def speedtest_download():
     return Response(content=test_data, media_type="application/octet-stream")
@@ -91,6 +114,15 @@ async def webrtc_offer(offer_request: WebRTCOffer):
     Server acts as the offerer, creating data channels for video streaming.
     """
     try:
+        decision = s_controller.admission_manager.admit_viewer(offer_request.remote_control_id, "webrtc")
+        if not decision.admitted:
+            return {
+                "status": "error",
+                "message": f"Admission rejected: {decision.reason}",
+                "admission": decision.to_dict(),
+                "offer": None
+            }
+
         logger.info(f"WebRTC: Creating offer for {offer_request.remote_control_id}")
         offer = await s_controller.get_webrtc_offer(offer_request.remote_control_id)
         
@@ -7,7 +7,7 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from server_controller import ServerController
 from utils.app_logger import logger
 from utils.packet_builder import PacketBuilder
-from globals import PACKET_TYPE
+from globals import PACKET_TYPE, WS_CLOSE_TRY_AGAIN_LATER
 
 s_controller = ServerController()
 packet_builder = PacketBuilder()
@@ -16,6 +16,15 @@ router = APIRouter()
 @router.websocket("/ws/train/{train_id}")
 async def train_interface(websocket: WebSocket, train_id: str):
     await websocket.accept()
+    loop = asyncio.get_running_loop()
+    decision = s_controller.admission_manager.admit_train(
+        train_id, "websocket",
+        send_command=lambda packet: asyncio.run_coroutine_threadsafe(websocket.send_bytes(packet), loop)
+    )
+    if not decision.admitted:
+        await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER, reason=decision.reason[:123])
+        return
+
     await s_controller.add_train(train_id, websocket)
     logger.debug(f"WebSocket: connection established for Train {train_id}")
 
@@ -55,7 +64,12 @@ async def train_interface(websocket: WebSocket, train_id: str):
             packet_type = data[0]
             payload = data[1:]
 
-            if packet_type == PACKET_TYPE["video"] or packet_type == PACKET_TYPE["telemetry"]:
+            is_video = packet_type == PACKET_TYPE["video"] or packet_type == PACKET_TYPE["video_frame"]
+            if is_video:
+                s_controller.admission_manager.record_ingress(train_id, len(data))
+
+            # a video_frame carries a whole frame, the viewers' assembler takes it like a single datagram
+            if is_video or packet_type == PACKET_TYPE["telemetry"]:
                 await s_controller.send_data_to_clients(train_id, data)
             elif packet_type == PACKET_TYPE["keepalive"]:
                 message = json.loads(payload.decode('utf-8'))
@@ -64,7 +78,7 @@ async def train_interface(websocket: WebSocket, train_id: str):
                 logger.debug(f"WebSocket: Received unknown packet type {packet_type} from train {train_id}")
 
             # calculate number of frames per seconds for video packets
-            if packet_type == PACKET_TYPE["video"]:
+            if is_video:
                 frame_counter += 1
                 # difference of current frame_counter and frame_counter received 1 second ago
                 if time.time() - last_time > 1:
@@ -89,3 +103,4 @@ async def train_interface(websocket: WebSocket, train_id: str):
             pass
 
         await s_controller.remove_train(train_id)
+        s_controller.admission_manager.release_train(train_id, "websocket")
@@ -1,3 +1,4 @@
+import os
 import sys
 from dataclasses import dataclass
 
@@ -24,6 +25,13 @@ PACKET_TYPE = {
     "map_disconnect": 31,
     "connect": 32,
     "connect_response": 33,
+    "admission": 34,
+    "pmtu_probe": 35,
+    "pmtu_ack": 36,
+    "video_fec": 37,
+    "receiver_report": 38,
+    "nack": 39,
+    "video_frame": 40,
 }
 
 HOST = "0.0.0.0"
@@ -32,9 +40,50 @@ QUIC_PORT = 4437
 
 CLIENT_TYPE_TRAIN = "TRAIN"
 CLIENT_TYPE_REMOTE_CONTROL = "REMOTE_CONTROL"
+CLIENT_TYPE_TRAIN_LINK = "TRAIN_LINK"  # extra uplink of a bonded train, carries video datagrams only
 
 STREAM_MESSAGE_SIZE_LIMIT = 300  # bytes, will adjust if needed after testing
 
+# UDP payload size of the QUIC packets the server sends. Every relayed video datagram has to
+# fit into one packet to the viewer, so this also bounds the datagrams a train may send.
+# 1200 is safe on every path, raise it (e.g. 1452) when the viewers are on Ethernet/WiFi paths.
+QUIC_MAX_DATAGRAM_SIZE = int(os.environ.get("QUIC_MAX_DATAGRAM_SIZE", 1200))
+# worst case QUIC short header (20 byte connection id, 2 byte packet number), AEAD tag,
+# DATAGRAM frame type and length, and the WebTransport quarter stream id
+RELAY_DATAGRAM_OVERHEAD = 1 + 20 + 2 + 16 + 1 + 2 + 2
+
+# Video datagrams and their FEC parity packets, see "Video Datagrams and FEC" in the README
+VIDEO_HEADER_SIZE = 53
+FEC_HEADER_SIZE = 6
+FEC_REORDER_WINDOW = 16         # frames a frame may stay incomplete before it counts as lost
+RECEIVER_REPORT_INTERVAL = 1.0  # seconds between receiver reports to a train
+
+# Selective retransmission of lost keyframe packets
+NACK_ENABLED = True
+NACK_CHECK_INTERVAL = 0.01      # seconds between scans for incomplete keyframes
+NACK_RETRY_INTERVAL = 0.05      # seconds before the same keyframe is NACKed again
+NACK_MAX_ATTEMPTS = 3           # NACKs per keyframe
+
+# Trains with several uplinks send video over one QUIC connection per link, see "Bonded uplinks" in the README
+BONDING_REORDER_DELAY = 0.1     # seconds a missing packet may still arrive over a slower link before it is NACKed
+
+# Reconnecting trains, see "Reconnects" in the README
+TRAIN_RECONNECT_GRACE = 60.0    # seconds the viewers of a disconnected train are kept for its reconnect
+SESSION_TICKET_STORE_SIZE = 1024  # TLS session tickets kept for resumption, the oldest are evicted
+SESSION_TICKET_FILE = os.environ.get("QUIC_SESSION_TICKET_FILE")  # keeps the tickets across restarts, unset: memory only
+
+# Admission control, a limit of 0 disables the check
+ADMISSION_MAX_TRAINS = 32
+ADMISSION_MAX_VIEWERS = 128                 # remote controls per server process, over all transports
+ADMISSION_MAX_VIEWERS_PER_TRAIN = 8
+ADMISSION_MAX_EGRESS_MBPS = 500.0           # relayed video for all trains
+ADMISSION_MAX_EGRESS_MBPS_PER_TRAIN = 100.0
+ADMISSION_DEFAULT_TRAIN_MBPS = 3.5          # assumed ingress of a train before it is measured (medium quality)
+ADMISSION_LOW_QUALITY_MBPS = 1.2            # expected ingress of a train after a downgrade to low quality
+ADMISSION_RESTORE_QUALITY = "medium"
+ADMISSION_RATE_WINDOW = 1.0                 # seconds per ingress rate sample
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
 
 @dataclass
 class ServerConfig:
@@ -43,6 +92,12 @@ class ServerConfig:
 
 def get_client_config() -> ServerConfig:
     """Get platform-specific client configuration"""
+    # explicit certificate, e.g. a self-signed one for loopback load tests
+    if os.environ.get("QUIC_CERT_FILE") and os.environ.get("QUIC_KEY_FILE"):
+        return ServerConfig(
+            cert_file=os.environ["QUIC_CERT_FILE"],
+            key_file=os.environ["QUIC_KEY_FILE"]
+        )
     if sys.platform.startswith("win"):
         return ServerConfig(
             cert_file="C:\\quic_conf\\certificate.pem",
@@ -55,3 +110,18 @@ def get_client_config() -> ServerConfig:
         )
     else:
         raise RuntimeError(f"Unsupported platform: {sys.platform}")
+
+# Control-plane lanes for stream messages, a lower value is always served first
+STREAM_LANE = {
+    "urgent": 0,
+    "control": 1,
+    "probe": 2,
+    "bulk": 3,
+}
+
+# Unacknowledged bytes on a train's main stream before non-urgent messages are held back
+STREAM_BACKLOG_LIMIT = 4096
+# seconds without a packet from a train's QUIC connection before its stream packets go over its WebSocket,
+# an idle train still sends a PING every 0.5 s (QUIC_PING_INTERVAL of the train)
+TRAIN_QUIC_SILENCE_TIMEOUT = 1.0
+CONTROL_PLANE_STATS_INTERVAL = 60  # seconds
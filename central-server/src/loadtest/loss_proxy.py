@@ -0,0 +1,237 @@
+"""
+UDP proxy that drops packets between a QUIC client and the central server.
+
+Used to check FEC, NACK recovery and the adaptive bitrate of the train on
+loopback, where nothing is lost on its own. Losses follow a two-state
+(Gilbert) model, so `--burst` > 1 drops runs of consecutive packets like a
+fading radio link does. With `--trace` the proxy is also a drop-tail
+bottleneck whose rate follows a bandwidth trace, e.g. loadtest/traces/.
+
+Run from central-server/src:
+
+    # 3 % loss on the way to the server, in bursts of 2 packets on average
+    python -m loadtest.loss_proxy --listen-port 4438 --loss 0.03 --burst 2
+
+    # no random loss, the uplink follows a recorded cellular drive
+    python -m loadtest.loss_proxy --listen-port 4438 --loss 0 --trace loadtest/traces/cellular_drive.csv
+
+    # then point the train client (server_port) or the swarm (--port) at 4438
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.app_logger import logger
+from globals import QUIC_PORT
+
+Address = Tuple[str, int]
+
+
+class LossModel:
+    """Gilbert loss model: every packet is lost in the bad state, none in the good state."""
+
+    def __init__(self, loss: float, burst: float):
+        self.loss = loss
+        # mean stay in the bad state is `burst` packets, the stationary share of the bad state is `loss`
+        self.p_leave_bad = 1.0 / max(burst, 1.0)
+        self.p_enter_bad = loss * self.p_leave_bad / (1.0 - loss) if loss < 1.0 else 1.0
+        self.bad = False
+
+    def drop(self) -> bool:
+        if self.loss <= 0.0:
+            return False
+        if self.bad:
+            self.bad = random.random() >= self.p_leave_bad
+        else:
+            self.bad = random.random() < self.p_enter_bad
+        return self.bad
+
+
+def load_trace(path: str) -> List[Tuple[float, float]]:
+    """Read a bandwidth trace of `seconds,kbps` lines, the rate holds until the next line."""
+    trace = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                seconds, kbps = line.split(",")
+                trace.append((float(seconds), float(kbps) * 1000))
+    if len(trace) < 2 or trace[0][0] != 0:
+        raise ValueError(f"{path}: a trace starts at 0 seconds and needs an end line")
+    return trace
+
+
+class TraceShaper:
+    """Drop-tail bottleneck whose rate follows a bandwidth trace, looped from the first packet on."""
+
+    def __init__(self, trace: List[Tuple[float, float]], queue_delay: float):
+        self.trace = trace
+        self.period = trace[-1][0]
+        self.queue_delay = queue_delay
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.start: Optional[float] = None
+        self.next_send = 0.0
+        self.draining = False
+
+    def rate(self, now: float) -> float:
+        offset = (now - self.start) % self.period
+        rate = self.trace[0][1]
+        for seconds, bits_per_second in self.trace:
+            if seconds > offset:
+                break
+            rate = bits_per_second
+        return max(rate, 1000.0)
+
+    def enqueue(self, data: bytes, send: Callable[[], None]) -> bool:
+        """Queue a packet, False if the queue is full and the packet is dropped."""
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        if self.queued_bytes + len(data) > self.rate(now) * self.queue_delay / 8:
+            return False
+        self.queue.append((len(data), send))
+        self.queued_bytes += len(data)
+        if not self.draining:
+            self.draining = True
+            self.next_send = max(self.next_send, now)
+            self._drain()
+        return True
+
+    def _drain(self):
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        while self.queue and self.next_send <= now:
+            size, send = self.queue.popleft()
+            self.queued_bytes -= size
+            send()
+            self.next_send += size * 8 / self.rate(now)
+        if self.queue:
+            loop.call_later(self.next_send - now, self._drain)
+        else:
+            self.draining = False
+
+
+class UpstreamProtocol(asyncio.DatagramProtocol):
+    """Socket towards the server for one client, so the server sees one address per client."""
+
+    def __init__(self, proxy: "LossProxy", client_address: Address):
+        self.proxy = proxy
+        self.client_address = client_address
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Address):
+        self.proxy.forward("down", data, self.proxy.transport, self.client_address)
+
+
+class LossProxy(asyncio.DatagramProtocol):
+    def __init__(self, args):
+        self.args = args
+        self.server_address = (args.server_host, args.server_port)
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.upstreams: Dict[Address, UpstreamProtocol] = {}
+        self.models = {
+            "up": LossModel(args.loss if args.direction in ("up", "both") else 0.0, args.burst),
+            "down": LossModel(args.loss if args.direction in ("down", "both") else 0.0, args.burst),
+        }
+        self.shapers: Dict[str, TraceShaper] = {}
+        if args.trace:
+            trace = load_trace(args.trace)
+            for direction in ("up", "down"):
+                if args.direction in (direction, "both"):
+                    self.shapers[direction] = TraceShaper(trace, args.queue_delay)
+        self.stats = Counter()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Address):
+        upstream = self.upstreams.get(addr)
+        if upstream is None:
+            logger.info(f"Loss proxy: new client {addr[0]}:{addr[1]}")
+            asyncio.ensure_future(self._open_upstream(addr, data))
+            return
+        if upstream.transport is not None:
+            self.forward("up", data, upstream.transport, None)
+
+    async def _open_upstream(self, addr: Address, first_packet: bytes):
+        loop = asyncio.get_running_loop()
+        self.upstreams[addr] = upstream = UpstreamProtocol(self, addr)
+        await loop.create_datagram_endpoint(lambda: upstream, remote_addr=self.server_address)
+        # the handshake packet is never dropped, QUIC would retry it only after a second
+        upstream.transport.sendto(first_packet)
+        self.stats["up_forwarded"] += 1
+
+    def forward(self, direction: str, data: bytes, transport: asyncio.DatagramTransport, addr: Optional[Address]):
+        if len(data) >= self.args.min_size and self.models[direction].drop():
+            self.stats[f"{direction}_dropped"] += 1
+            return
+        shaper = self.shapers.get(direction)
+        if shaper is not None:
+            if not shaper.enqueue(data, lambda: transport.sendto(data, addr)):
+                self.stats[f"{direction}_queue_dropped"] += 1
+                return
+        else:
+            transport.sendto(data, addr)
+        self.stats[f"{direction}_forwarded"] += 1
+
+    def report(self):
+        parts = []
+        for direction in ("up", "down"):
+            forwarded = self.stats[f"{direction}_forwarded"]
+            dropped = self.stats[f"{direction}_dropped"]
+            queue_dropped = self.stats[f"{direction}_queue_dropped"]
+            total = forwarded + dropped + queue_dropped
+            part = f"{direction}: {total} packets, {dropped} dropped ({dropped / total if total else 0.0:.2%})"
+            shaper = self.shapers.get(direction)
+            if shaper is not None and shaper.start is not None:
+                part += (f", {queue_dropped} queue drops, rate {shaper.rate(time.monotonic()) / 1e6:.2f} Mbps, "
+                         f"queue {shaper.queued_bytes} bytes")
+            parts.append(part)
+        logger.info("Loss proxy: " + ", ".join(parts))
+
+
+async def run_proxy(args):
+    loop = asyncio.get_running_loop()
+    proxy = LossProxy(args)
+    await loop.create_datagram_endpoint(lambda: proxy, local_addr=(args.listen_host, args.listen_port))
+    logger.info(f"Loss proxy: {args.listen_host}:{args.listen_port} -> {args.server_host}:{args.server_port}, "
+                f"{args.loss:.1%} loss ({args.direction}), mean burst {args.burst} packets"
+                + (f", bandwidth trace {args.trace}" if args.trace else ""))
+    while True:
+        await asyncio.sleep(args.report_interval)
+        proxy.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP loss injection proxy for the central server")
+    parser.add_argument("--listen-host", default="127.0.0.1")
+    parser.add_argument("--listen-port", type=int, default=QUIC_PORT + 1)
+    parser.add_argument("--server-host", default="127.0.0.1")
+    parser.add_argument("--server-port", type=int, default=QUIC_PORT)
+    parser.add_argument("--loss", type=float, default=0.03, help="share of dropped packets, e.g. 0.03")
+    parser.add_argument("--burst", type=float, default=1.0, help="mean number of consecutive dropped packets")
+    parser.add_argument("--direction", choices=["up", "down", "both"], default="up",
+                        help="up is client to server, i.e. the video of a train")
+    parser.add_argument("--min-size", type=int, default=0,
+                        help="only drop packets of at least this size, e.g. 1000 to spare ACKs and control messages")
+    parser.add_argument("--trace", help="bandwidth trace (seconds,kbps per line) the proxy rate follows")
+    parser.add_argument("--queue-delay", type=float, default=0.2,
+                        help="bottleneck buffer of the trace shaper in seconds at the current rate")
+    parser.add_argument("--report-interval", type=float, default=5.0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run_proxy(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
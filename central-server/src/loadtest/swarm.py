@@ -0,0 +1,572 @@
+"""
+Headless swarm load generator for the central server.
+
+Opens N synthetic trains and M synthetic viewers against a running server and
+reports ingress/egress throughput, relay latency percentiles, drops and the
+CPU usage of the server process. Trains replay pre-encoded H.264 (or random
+payloads with a realistic frame size pattern) in the same datagram format as
+the train client, viewers subscribe with map_connect like the web client.
+
+Run from central-server/src:
+
+    # once: create a self-signed certificate and start the server with it
+    python -m loadtest.swarm --generate-cert /tmp/loadtest-cert
+    QUIC_CERT_FILE=/tmp/loadtest-cert/certificate.pem QUIC_KEY_FILE=/tmp/loadtest-cert/certificate.key python main.py
+
+    # then
+    python -m loadtest.swarm --trains 4 --viewers 16 --duration 60 --server-pid <pid>
+"""
+import argparse
+import asyncio
+import json
+import os
+import ssl
+import time
+import urllib.request
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+import websockets
+from aioquic.asyncio import connect
+from aioquic.asyncio.protocol import QuicConnectionProtocol
+from aioquic.h3.connection import H3Connection
+from aioquic.h3.events import DatagramReceived, HeadersReceived, WebTransportStreamDataReceived
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.events import ConnectionTerminated, QuicEvent, StreamDataReceived
+
+from utils.app_logger import logger
+from loadtest.certificate import generate_self_signed_certificate
+from loadtest.wire import (create_video_packets, load_h264_frames, parse_video_header, split_stream_packets,
+                           stream_packet, synthetic_frames, TRAIN_MAX_PACKET_SIZE)
+from globals import PACKET_TYPE, QUIC_PORT, FAST_API_PORT, RELAY_DATAGRAM_OVERHEAD, VIDEO_HEADER_SIZE
+
+# frames older than this (in frame ids) are considered final when counting drops
+FRAME_REORDER_WINDOW = 30
+MAX_LATENCY_SAMPLES = 500_000
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def insecure_ssl_context() -> ssl.SSLContext:
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class SwarmStats:
+    def __init__(self):
+        self.sent_bytes = 0
+        self.sent_packets = 0
+        self.sent_frames = 0
+        self.received_bytes = 0
+        self.received_packets = 0
+        self.expected_packets = 0
+        self.complete_frames = 0
+        self.incomplete_frames = 0
+        self.missing_frames = 0
+        self.packet_latencies_ms: List[float] = []
+        self.frame_latencies_ms: List[float] = []
+        self.connected_trains = 0
+        self.connected_viewers = 0
+        self.admission: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    def record_latency(self, samples: List[float], value: float):
+        if len(samples) < MAX_LATENCY_SAMPLES:
+            samples.append(value)
+
+
+class FrameTracker:
+    """Per viewer reassembly bookkeeping, only counts packets, the payload is discarded."""
+
+    def __init__(self, stats: SwarmStats):
+        self.stats = stats
+        self.frames: Dict[tuple, list] = {}   # (train_id, frame_id) -> [expected, received]
+        self.latest_frame_id: Dict[str, int] = {}
+
+    def on_packet(self, packet: bytes, received_at_ms: float):
+        if len(packet) < VIDEO_HEADER_SIZE:
+            self.stats.errors["short_video_packet"] += 1
+            return
+        header = parse_video_header(packet)
+        self.stats.received_packets += 1
+        self.stats.received_bytes += len(packet)
+        latency = received_at_ms - header.timestamp
+        self.stats.record_latency(self.stats.packet_latencies_ms, latency)
+
+        key = (header.train_id, header.frame_id)
+        entry = self.frames.get(key)
+        if entry is None:
+            latest = self.latest_frame_id.get(header.train_id)
+            if latest is not None and header.frame_id <= latest - FRAME_REORDER_WINDOW:
+                self.stats.errors["late_packet"] += 1
+                return
+            if latest is not None and header.frame_id > latest + 1:
+                self.stats.missing_frames += header.frame_id - latest - 1
+            if latest is None or header.frame_id > latest:
+                self.latest_frame_id[header.train_id] = header.frame_id
+            entry = self.frames[key] = [header.number_of_packets, 0]
+            self.stats.expected_packets += header.number_of_packets
+            self._expire(header.train_id)
+
+        entry[1] += 1
+        if entry[1] == entry[0]:
+            self.stats.complete_frames += 1
+            self.stats.record_latency(self.stats.frame_latencies_ms, latency)
+            del self.frames[key]
+
+    def _expire(self, train_id: str):
+        latest = self.latest_frame_id[train_id]
+        for key in [k for k in self.frames if k[0] == train_id and k[1] <= latest - FRAME_REORDER_WINDOW]:
+            del self.frames[key]
+            self.stats.incomplete_frames += 1
+
+
+class ProcessCpuSampler:
+    """CPU usage of another process in percent of one core, from /proc or psutil."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.samples: List[float] = []
+        self._last = None
+        try:
+            import psutil
+            self._process = psutil.Process(pid)
+        except ImportError:
+            self._process = None
+
+    def _cpu_seconds(self) -> float:
+        if self._process is not None:
+            times = self._process.cpu_times()
+            return times.user + times.system
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime are fields 14 and 15 of the stat line
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def sample(self) -> Optional[float]:
+        try:
+            now = (time.monotonic(), self._cpu_seconds())
+        except Exception as e:
+            logger.warning(f"Loadtest: cannot read CPU usage of pid {self.pid}: {e}")
+            return None
+        value = None
+        if self._last is not None:
+            value = 100 * (now[1] - self._last[1]) / (now[0] - self._last[0])
+            self.samples.append(value)
+        self._last = now
+        return value
+
+
+class SyntheticTrainProtocol(QuicConnectionProtocol):
+    def __init__(self, *args, train: "SyntheticTrain", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.train = train
+        self.stream_buffers: Dict[int, bytearray] = {}
+
+    def quic_event_received(self, event: QuicEvent):
+        if isinstance(event, StreamDataReceived) and event.data:
+            # the server length-prefixes its messages to trains, like the train does towards it
+            buffer = self.stream_buffers.setdefault(event.stream_id, bytearray())
+            buffer += event.data
+            for packet in split_stream_packets(buffer):
+                self.train.on_stream_data(packet)
+        elif isinstance(event, ConnectionTerminated):
+            self.train.closed = True
+
+
+class SyntheticTrain:
+    def __init__(self, args, frames: List[bytes], stats: SwarmStats):
+        self.args = args
+        self.frames = frames
+        self.stats = stats
+        self.train_id = str(uuid.uuid4())
+        self.train_id_bytes = self.train_id.encode('utf-8').ljust(36)[:36]
+        # real trains wait for START_SENDING_DATA, websocket trains are never told to start
+        self.sending = args.always_send or args.train_transport == "websocket"
+        self.closed = False
+
+    def on_stream_data(self, data: bytes):
+        packet_type, payload = data[0], data[1:]
+        try:
+            if packet_type == PACKET_TYPE["command"]:
+                instruction = json.loads(payload.decode('utf-8')).get("instruction")
+                if instruction == "START_SENDING_DATA":
+                    self.sending = True
+                elif instruction == "STOP_SENDING_DATA" and not self.args.always_send:
+                    self.sending = False
+            elif packet_type == PACKET_TYPE["connect_response"]:
+                response = json.loads(payload.decode('utf-8'))
+                self.stats.admission[f"train_{response.get('status', 'admitted')}"] += 1
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            self.stats.errors["train_bad_stream_data"] += 1
+
+    async def run(self, deadline: float):
+        try:
+            if self.args.train_transport == "websocket":
+                await self._run_websocket(deadline)
+            else:
+                await self._run_quic(deadline)
+        except Exception as e:
+            logger.error(f"Loadtest: train {self.train_id} failed: {e!r}")
+            self.stats.errors["train_connect"] += 1
+
+    async def _run_quic(self, deadline: float):
+        # large enough that one video datagram always fits into a packet
+        max_datagram_size = max(1200, self.args.max_packet_size + VIDEO_HEADER_SIZE + RELAY_DATAGRAM_OVERHEAD)
+        configuration = QuicConfiguration(is_client=True, alpn_protocols=["quic"], max_datagram_size=max_datagram_size,
+                                          max_datagram_frame_size=65536, idle_timeout=30.0)
+        configuration.verify_mode = ssl.CERT_NONE
+        async with connect(self.args.host, self.args.port, configuration=configuration,
+                           create_protocol=lambda *a, **kw: SyntheticTrainProtocol(*a, train=self, **kw)) as client:
+            stream_id = client._quic.get_next_available_stream_id(is_unidirectional=False)
+            client._quic.send_stream_data(stream_id, stream_packet("connect", {"type": "connect", "train_id": self.train_id}))
+            client.transmit()
+            self.stats.connected_trains += 1
+
+            async def send_frame(packets: List[bytes]):
+                for packet in packets:
+                    client._quic.send_datagram_frame(packet)
+                client.transmit()
+
+            async def send_keepalive(sequence: int):
+                client._quic.send_stream_data(stream_id, stream_packet("keepalive", {
+                    "type": "keepalive", "protocol": "quic", "train_id": self.train_id,
+                    "timestamp": time.time(), "sequence": sequence}))
+                client.transmit()
+
+            await self._stream_video(deadline, send_frame, send_keepalive)
+
+    async def _run_websocket(self, deadline: float):
+        url = f"wss://{self.args.host}:{self.args.ws_port}/ws/train/{self.train_id}"
+        async with websockets.connect(url, ssl=insecure_ssl_context(), max_size=None) as websocket:
+            self.stats.connected_trains += 1
+
+            async def receive():
+                async for message in websocket:
+                    if isinstance(message, bytes) and message:
+                        self.on_stream_data(message)
+
+            receive_task = asyncio.create_task(receive())
+
+            async def send_frame(packets: List[bytes]):
+                # like the websocket worker of the train, one message per frame
+                for packet in packets:
+                    await websocket.send(bytes([PACKET_TYPE["video_frame"]]) + packet)
+
+            async def send_keepalive(sequence: int):
+                message = {"type": "keepalive", "protocol": "websocket", "train_id": self.train_id,
+                           "timestamp": time.time(), "sequence": sequence}
+                await websocket.send(bytes([PACKET_TYPE["keepalive"]]) + json.dumps(message).encode('utf-8'))
+
+            try:
+                await self._stream_video(deadline, send_frame, send_keepalive, whole_frames=True)
+            finally:
+                receive_task.cancel()
+
+    async def _stream_video(self, deadline: float, send_frame, send_keepalive, whole_frames: bool = False):
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.args.fps
+        next_frame_time = loop.time()
+        next_keepalive_time = loop.time()
+        frame_id = 0
+        keepalive_sequence = 0
+        while loop.time() < deadline and not self.closed:
+            if loop.time() >= next_keepalive_time:
+                keepalive_sequence += 1
+                await send_keepalive(keepalive_sequence)
+                next_keepalive_time += 10
+
+            if self.sending:
+                frame = self.frames[frame_id % len(self.frames)]
+                timestamp = int(time.time() * 1000)
+                max_packet_size = max(1, len(frame)) if whole_frames else self.args.max_packet_size
+                packets = create_video_packets(self.train_id_bytes, frame_id, timestamp, frame, max_packet_size)
+                await send_frame(packets)
+                frame_id += 1
+                self.stats.sent_frames += 1
+                self.stats.sent_packets += len(packets)
+                self.stats.sent_bytes += sum(len(packet) for packet in packets)
+
+            next_frame_time += interval
+            delay = next_frame_time - loop.time()
+            if delay < -interval:
+                # we are more than a frame late, the generator itself is overloaded
+                self.stats.errors["train_frame_late"] += 1
+                next_frame_time = loop.time()
+            await asyncio.sleep(max(0.0, delay))
+
+
+class SyntheticViewerProtocol(QuicConnectionProtocol):
+    def __init__(self, *args, viewer: "SyntheticViewer", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.viewer = viewer
+        self.h3_connection = H3Connection(self._quic, enable_webtransport=True)
+
+    def quic_event_received(self, event: QuicEvent):
+        if isinstance(event, ConnectionTerminated):
+            self.viewer.closed = True
+        if isinstance(event, StreamDataReceived) and event.stream_id == self.viewer.stream_id:
+            # the server answers on our own WebTransport stream without H3 framing
+            self.viewer.on_stream_data(event.data)
+            return
+        for h3_event in self.h3_connection.handle_event(event):
+            self.viewer.on_h3_event(h3_event)
+
+
+class SyntheticViewer:
+    def __init__(self, args, train: SyntheticTrain, stats: SwarmStats):
+        self.args = args
+        self.train = train
+        self.stats = stats
+        self.remote_control_id = str(uuid.uuid4())
+        self.tracker = FrameTracker(stats)
+        self.stream_id: Optional[int] = None
+        self.session_ready = asyncio.Event()
+        self.connected = asyncio.Event()
+        self.closed = False
+
+    def on_h3_event(self, event):
+        if isinstance(event, HeadersReceived):
+            headers = dict(event.headers)
+            if headers.get(b":status") == b"200":
+                self.session_ready.set()
+            else:
+                logger.error(f"Loadtest: WebTransport session refused: {headers}")
+                self.closed = True
+        elif isinstance(event, DatagramReceived):
+            if event.data and event.data[0] == PACKET_TYPE["video"]:
+                self.tracker.on_packet(event.data, time.time() * 1000)
+        elif isinstance(event, WebTransportStreamDataReceived):
+            self.on_stream_data(event.data)
+
+    def on_stream_data(self, data: bytes):
+        if not data:
+            return
+        packet_type, payload = data[0], data[1:]
+        try:
+            if packet_type == PACKET_TYPE["connect_response"]:
+                response = json.loads(payload.decode('utf-8'))
+                self.stats.admission[f"viewer_{response.get('status', 'admitted')}"] += 1
+                if response.get("status") == "rejected":
+                    self.closed = True
+                self.connected.set()
+            elif packet_type == PACKET_TYPE["admission"]:
+                decision = json.loads(payload.decode('utf-8'))
+                self.stats.admission[f"mapping_{decision['status']}"] += 1
+        except (UnicodeDecodeError, json.JSONDecodeError, KeyError):
+            self.stats.errors["viewer_bad_stream_data"] += 1
+
+    async def run(self, deadline: float):
+        try:
+            if self.args.viewer_transport == "websocket":
+                await self._run_websocket(deadline)
+            else:
+                await self._run_webtransport(deadline)
+        except Exception as e:
+            logger.error(f"Loadtest: viewer {self.remote_control_id} failed: {e!r}")
+            self.stats.errors["viewer_connect"] += 1
+
+    async def _run_webtransport(self, deadline: float):
+        configuration = QuicConfiguration(is_client=True, alpn_protocols=["h3"],
+                                          max_datagram_frame_size=65536, idle_timeout=30.0)
+        configuration.verify_mode = ssl.CERT_NONE
+        async with connect(self.args.host, self.args.port, configuration=configuration,
+                           create_protocol=lambda *a, **kw: SyntheticViewerProtocol(*a, viewer=self, **kw)) as client:
+            quic = client._quic
+            session_id = quic.get_next_available_stream_id()
+            client.h3_connection.send_headers(session_id, [
+                (b":method", b"CONNECT"),
+                (b":protocol", b"webtransport"),
+                (b":scheme", b"https"),
+                (b":authority", f"{self.args.host}:{self.args.port}".encode()),
+                (b":path", b"/"),
+            ])
+            client.transmit()
+            await asyncio.wait_for(self.session_ready.wait(), timeout=10)
+
+            # like the browser, the stream header goes out before the first message
+            stream_id = self.stream_id = client.h3_connection.create_webtransport_stream(session_id)
+            client.transmit()
+            await asyncio.sleep(0.05)
+
+            quic.send_stream_data(stream_id, stream_packet("connect", {"type": "connect", "remote_control_id": self.remote_control_id}))
+            client.transmit()
+            await asyncio.wait_for(self.connected.wait(), timeout=10)
+            if self.closed:
+                return
+            self.stats.connected_viewers += 1
+
+            quic.send_stream_data(stream_id, stream_packet("map_connect", {
+                "type": "map_connect", "remote_control_id": self.remote_control_id, "train_id": self.train.train_id}))
+            client.transmit()
+
+            loop = asyncio.get_running_loop()
+            sequence = 0
+            while loop.time() < deadline and not self.closed:
+                sequence += 1
+                quic.send_stream_data(stream_id, stream_packet("keepalive", {
+                    "type": "keepalive", "remote_control_id": self.remote_control_id,
+                    "remote_control_timestamp": int(time.time() * 1000), "sequence": sequence}))
+                client.transmit()
+                await asyncio.sleep(min(1.0, max(0.0, deadline - loop.time())))
+
+    async def _run_websocket(self, deadline: float):
+        url = f"wss://{self.args.host}:{self.args.ws_port}/ws/remote_control/{self.remote_control_id}"
+        async with websockets.connect(url, ssl=insecure_ssl_context(), max_size=None) as websocket:
+            self.stats.connected_viewers += 1
+            await asyncio.to_thread(self._map_over_rest)
+
+            loop = asyncio.get_running_loop()
+            while loop.time() < deadline:
+                try:
+                    message = await asyncio.wait_for(websocket.recv(), timeout=max(0.1, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                if not isinstance(message, bytes) or not message:
+                    continue
+                if message[0] == PACKET_TYPE["video"] or message[0] == PACKET_TYPE["video_frame"]:
+                    # websocket trains send type byte + datagram, a whole frame in one, the server forwards it unchanged
+                    self.tracker.on_packet(message[1:], time.time() * 1000)
+                elif message[0] == PACKET_TYPE["admission"]:
+                    self.on_stream_data(message)
+
+    def _map_over_rest(self):
+        url = f"https://{self.args.host}:{self.args.ws_port}/api/remote_control/{self.remote_control_id}/train/{self.train.train_id}"
+        request = urllib.request.Request(url, method="POST")
+        try:
+            with urllib.request.urlopen(request, context=insecure_ssl_context(), timeout=10) as response:
+                decision = json.loads(response.read()).get("admission", {})
+        except urllib.error.HTTPError as e:
+            decision = json.loads(e.read()).get("admission", {"status": f"http_{e.code}"})
+        self.stats.admission[f"mapping_{decision.get('status', 'admitted')}"] += 1
+
+
+class SwarmReporter:
+    def __init__(self, stats: SwarmStats, cpu_sampler: Optional[ProcessCpuSampler]):
+        self.stats = stats
+        self.cpu_sampler = cpu_sampler
+        self.start = time.monotonic()
+        self._last = (self.start, 0, 0)
+
+    def interval_report(self):
+        now = time.monotonic()
+        last_time, last_sent, last_received = self._last
+        elapsed = max(now - last_time, 1e-6)
+        ingress = (self.stats.sent_bytes - last_sent) * 8 / elapsed / 1e6
+        egress = (self.stats.received_bytes - last_received) * 8 / elapsed / 1e6
+        self._last = (now, self.stats.sent_bytes, self.stats.received_bytes)
+        cpu = self.cpu_sampler.sample() if self.cpu_sampler else None
+        cpu_text = f", server CPU {cpu:.0f}%" if cpu is not None else ""
+        logger.info(f"Loadtest: ingress {ingress:.1f} Mbit/s, egress {egress:.1f} Mbit/s, "
+                    f"trains {self.stats.connected_trains}, viewers {self.stats.connected_viewers}{cpu_text}")
+
+    def summary(self) -> dict:
+        duration = time.monotonic() - self.start
+        packet_latencies = sorted(self.stats.packet_latencies_ms)
+        frame_latencies = sorted(self.stats.frame_latencies_ms)
+        lost_packets = max(0, self.stats.expected_packets - self.stats.received_packets)
+        cpu_samples = self.cpu_sampler.samples if self.cpu_sampler else []
+        return {
+            "duration_s": round(duration, 1),
+            "trains": self.stats.connected_trains,
+            "viewers": self.stats.connected_viewers,
+            "ingress_mbps": round(self.stats.sent_bytes * 8 / duration / 1e6, 2),
+            "egress_mbps": round(self.stats.received_bytes * 8 / duration / 1e6, 2),
+            "sent_frames": self.stats.sent_frames,
+            "sent_packets": self.stats.sent_packets,
+            "received_packets": self.stats.received_packets,
+            "packet_loss_ratio": round(lost_packets / self.stats.expected_packets, 4) if self.stats.expected_packets else 0.0,
+            "complete_frames": self.stats.complete_frames,
+            "incomplete_frames": self.stats.incomplete_frames,
+            "missing_frames": self.stats.missing_frames,
+            "packet_latency_ms": {p: round(percentile(packet_latencies, p), 1) for p in (50, 95, 99)},
+            "frame_latency_ms": {p: round(percentile(frame_latencies, p), 1) for p in (50, 95, 99)},
+            "server_cpu_percent": {
+                "mean": round(sum(cpu_samples) / len(cpu_samples), 1) if cpu_samples else None,
+                "max": round(max(cpu_samples), 1) if cpu_samples else None,
+            },
+            "admission": dict(self.stats.admission),
+            "errors": dict(self.stats.errors),
+        }
+
+
+async def run_swarm(args) -> dict:
+    if args.video:
+        frames = load_h264_frames(args.video)
+        logger.info(f"Loadtest: replaying {len(frames)} frames from {args.video}")
+    else:
+        frames = synthetic_frames(args.fps * 10, args.fps, args.bitrate, args.keyframe_interval)
+        logger.info(f"Loadtest: using {len(frames)} synthetic frames at {args.bitrate / 1e6:.1f} Mbit/s")
+
+    stats = SwarmStats()
+    cpu_sampler = ProcessCpuSampler(args.server_pid) if args.server_pid else None
+    reporter = SwarmReporter(stats, cpu_sampler)
+    if cpu_sampler:
+        cpu_sampler.sample()
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.duration
+    trains = [SyntheticTrain(args, frames, stats) for _ in range(args.trains)]
+    tasks = [asyncio.create_task(train.run(deadline)) for train in trains]
+    # trains have to be registered before viewers can map to them
+    await asyncio.sleep(1.0)
+
+    viewers = [SyntheticViewer(args, trains[i % len(trains)], stats) for i in range(args.viewers)] if trains else []
+    for viewer in viewers:
+        tasks.append(asyncio.create_task(viewer.run(deadline)))
+        await asyncio.sleep(args.ramp_up / max(1, len(viewers)))
+
+    while loop.time() < deadline:
+        await asyncio.sleep(min(args.report_interval, max(0.0, deadline - loop.time())))
+        reporter.interval_report()
+
+    await asyncio.wait(tasks, timeout=5)
+    return reporter.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Swarm load generator for the central server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=QUIC_PORT, help="QUIC / WebTransport port")
+    parser.add_argument("--ws-port", type=int, default=FAST_API_PORT, help="FastAPI (WebSocket and REST) port")
+    parser.add_argument("--trains", type=int, default=1)
+    parser.add_argument("--viewers", type=int, default=1)
+    parser.add_argument("--train-transport", choices=["quic", "websocket"], default="quic")
+    parser.add_argument("--viewer-transport", choices=["webtransport", "websocket"], default="webtransport")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="seconds to connect all viewers")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--video", help="Annex-B H.264 file to replay, e.g. a train client dump")
+    parser.add_argument("--bitrate", type=int, default=3_000_000, help="bit/s of synthetic frames")
+    parser.add_argument("--keyframe-interval", type=int, default=30)
+    parser.add_argument("--max-packet-size", type=int, default=TRAIN_MAX_PACKET_SIZE,
+                        help="video payload bytes per datagram of the synthetic trains")
+    parser.add_argument("--always-send", action="store_true", help="stream without waiting for START_SENDING_DATA")
+    parser.add_argument("--server-pid", type=int, help="pid of the server process to sample CPU usage")
+    parser.add_argument("--report-interval", type=float, default=5.0)
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    parser.add_argument("--generate-cert", metavar="DIR", help="write a self-signed loopback certificate and exit")
+    args = parser.parse_args()
+
+    if args.generate_cert:
+        cert_file, key_file = generate_self_signed_certificate(args.generate_cert, args.host)
+        print(f"QUIC_CERT_FILE={cert_file} QUIC_KEY_FILE={key_file} python main.py")
+        return
+
+    summary = asyncio.run(run_swarm(args))
+    logger.info(f"Loadtest summary:\n{json.dumps(summary, indent=2)}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
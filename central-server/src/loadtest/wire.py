@@ -0,0 +1,113 @@
+"""
+Wire format helpers for the synthetic clients of the load generator.
+
+They mirror what the train client and the web client put on the wire, so the
+server under test cannot tell synthetic clients from real ones.
+"""
+import json
+import os
+import random
+import struct
+from typing import List, NamedTuple
+
+from globals import PACKET_TYPE
+
+TRAIN_MAX_PACKET_SIZE = 1000  # payload bytes per datagram, same as the train client
+
+
+class VideoHeader(NamedTuple):
+    frame_id: int
+    number_of_packets: int
+    packet_id: int
+    train_id: str
+    timestamp: int
+
+
+def stream_packet(packet_type: str, message: dict) -> bytes:
+    """Type byte + JSON with the 2-byte length prefix expected by the server on QUIC streams."""
+    packet = struct.pack("B", PACKET_TYPE[packet_type]) + json.dumps(message).encode('utf-8')
+    return struct.pack(">H", len(packet)) + packet
+
+
+def split_stream_packets(buffer: bytearray) -> List[bytes]:
+    """Take the complete length-prefixed packets off the front of what a stream delivered so far."""
+    packets = []
+    offset = 0
+    while len(buffer) - offset >= 2:
+        end = offset + 2 + ((buffer[offset] << 8) | buffer[offset + 1])
+        if end > len(buffer):
+            break
+        packets.append(bytes(buffer[offset + 2:end]))
+        offset = end
+    del buffer[:offset]
+    return packets
+
+
+def create_video_packets(train_id_bytes: bytes, frame_id: int, timestamp: int, frame: bytes,
+                         max_packet_size: int = TRAIN_MAX_PACKET_SIZE) -> List[bytes]:
+    # same layout as the VideoPacketizer of the train client, an empty frame still gets one packet
+    number_of_packets = max(1, -(-len(frame) // max_packet_size))
+    packets = []
+    for packet_id in range(1, number_of_packets + 1):
+        offset = (packet_id - 1) * max_packet_size
+        header = struct.pack(">BIHH36sQ", PACKET_TYPE["video"], frame_id, number_of_packets, packet_id,
+                             train_id_bytes, timestamp)
+        packets.append(header + frame[offset:offset + max_packet_size])
+    return packets
+
+
+def parse_video_header(packet: bytes) -> VideoHeader:
+    _, frame_id, number_of_packets, packet_id, train_id, timestamp = struct.unpack_from(">BIHH36sQ", packet)
+    return VideoHeader(frame_id, number_of_packets, packet_id, train_id.decode('utf-8').strip(), timestamp)
+
+
+def load_h264_frames(path: str) -> List[bytes]:
+    """
+    Split an Annex-B H.264 file (e.g. a train client dump) into access units.
+
+    A new frame starts at every slice whose first_mb_in_slice is 0, parameter
+    sets and SEI are attached to the frame that follows them.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    starts = []
+    index = data.find(b"\x00\x00\x01")
+    while index != -1:
+        # include the leading zero of a 4-byte start code
+        starts.append(index - 1 if index > 0 and data[index - 1] == 0 else index)
+        index = data.find(b"\x00\x00\x01", index + 3)
+    starts.append(len(data))
+
+    frames = []
+    current = bytearray()
+    current_has_slice = False
+    for begin, end in zip(starts, starts[1:]):
+        nal = data[begin:end]
+        header_offset = nal.find(b"\x00\x00\x01") + 3
+        nal_type = nal[header_offset] & 0x1F
+        is_slice = nal_type in (1, 5)
+        # first_mb_in_slice is ue(v), a value of 0 is encoded as a single 1 bit
+        starts_frame = is_slice and len(nal) > header_offset + 1 and nal[header_offset + 1] & 0x80
+        if current_has_slice and (starts_frame or not is_slice):
+            frames.append(bytes(current))
+            current = bytearray()
+            current_has_slice = False
+        current += nal
+        current_has_slice = current_has_slice or is_slice
+    if current_has_slice:
+        frames.append(bytes(current))
+    return frames
+
+
+def synthetic_frames(count: int, fps: int, bitrate: int, keyframe_interval: int) -> List[bytes]:
+    """Random payloads with a keyframe/P-frame size pattern close to the x264 zerolatency output."""
+    average = bitrate / 8 / fps
+    # keyframes are roughly 5x the size of a P-frame at the same average rate
+    p_frame_size = average * keyframe_interval / (keyframe_interval + 4)
+    frames = []
+    for index in range(count):
+        size = p_frame_size * 5 if index % keyframe_interval == 0 else p_frame_size
+        size = max(64, int(random.gauss(size, size * 0.1)))
+        frames.append(os.urandom(size))
+    return frames
@@ -0,0 +1,264 @@
+import json
+import struct
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Optional, Set
+
+from utils.app_logger import logger
+from globals import *
+
+
+@dataclass
+class AdmissionDecision:
+    admitted: bool
+    reason: str = ""
+    degraded: bool = False  # admitted, but the train is asked to stream at low quality
+
+    @property
+    def status(self) -> str:
+        if not self.admitted:
+            return "rejected"
+        return "degraded" if self.degraded else "admitted"
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["status"] = self.status
+        return data
+
+    def to_packet(self, **extra) -> bytes:
+        message = {"type": "admission", **self.to_dict(), **extra}
+        return struct.pack("B", PACKET_TYPE["admission"]) + json.dumps(message).encode('utf-8')
+
+
+class IngressMeter:
+    """Bytes per second of video received from one train, averaged over a short window."""
+
+    def __init__(self):
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.rate_mbps = 0.0
+
+    def add(self, nbytes: int):
+        now = time.monotonic()
+        self.window_bytes += nbytes
+        elapsed = now - self.window_start
+        if elapsed >= ADMISSION_RATE_WINDOW:
+            sample = self.window_bytes * 8 / elapsed / 1_000_000
+            # smooth the estimate, keyframes make single windows very bursty
+            self.rate_mbps = sample if self.rate_mbps == 0 else 0.7 * self.rate_mbps + 0.3 * sample
+            self.window_start = now
+            self.window_bytes = 0
+
+    def current(self) -> float:
+        # a train that stopped sending decays to zero after a few windows
+        if time.monotonic() - self.window_start > 5 * ADMISSION_RATE_WINDOW:
+            return 0.0
+        return self.rate_mbps
+
+
+class AdmissionManager:
+    """
+    Decides whether a new train, viewer session or viewer-to-train mapping is accepted.
+
+    Sessions are counted per client id, independent of how many transports
+    (WebTransport, WebSocket, WebRTC) a client opens. Egress is estimated from
+    the measured ingress of each train multiplied by its number of viewers.
+    Shared between the FastAPI and the QUIC thread, so all state is guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.trains: Dict[str, Set[str]] = {}                      # train_id -> transports
+        self.train_command_senders: Dict[str, Callable[[bytes], None]] = {}
+        self.viewers: Dict[str, Set[str]] = {}                     # remote_control_id -> transports
+        self.viewer_to_train: Dict[str, str] = {}
+        self.ingress: Dict[str, IngressMeter] = {}
+        self.degraded_trains: Set[str] = set()
+        self.rejections: Dict[str, int] = {}
+
+    # ---- metrics ----
+
+    def record_ingress(self, train_id: str, nbytes: int):
+        with self._lock:
+            meter = self.ingress.get(train_id)
+            if meter is None:
+                meter = self.ingress[train_id] = IngressMeter()
+            meter.add(nbytes)
+
+    def _train_rate_mbps(self, train_id: str) -> float:
+        meter = self.ingress.get(train_id)
+        measured = meter.current() if meter else 0.0
+        if measured > 0:
+            return measured
+        # a train only streams while it has viewers, assume the default quality until measured
+        return ADMISSION_LOW_QUALITY_MBPS if train_id in self.degraded_trains else ADMISSION_DEFAULT_TRAIN_MBPS
+
+    def _viewer_count(self, train_id: str) -> int:
+        return sum(1 for mapped_train in self.viewer_to_train.values() if mapped_train == train_id)
+
+    def _train_egress_mbps(self, train_id: str) -> float:
+        return self._train_rate_mbps(train_id) * self._viewer_count(train_id)
+
+    def _total_egress_mbps(self) -> float:
+        return sum(self._train_egress_mbps(train_id) for train_id in set(self.viewer_to_train.values()))
+
+    def _reject(self, reason: str) -> AdmissionDecision:
+        self.rejections[reason.split(":")[0]] = self.rejections.get(reason.split(":")[0], 0) + 1
+        logger.warning(f"Admission: rejected, {reason}")
+        return AdmissionDecision(admitted=False, reason=reason)
+
+    # ---- trains ----
+
+    def admit_train(self, train_id: str, transport: str, send_command: Optional[Callable[[bytes], None]] = None) -> AdmissionDecision:
+        with self._lock:
+            if train_id not in self.trains and ADMISSION_MAX_TRAINS and len(self.trains) >= ADMISSION_MAX_TRAINS:
+                return self._reject(f"train capacity reached: {len(self.trains)} of {ADMISSION_MAX_TRAINS} trains connected")
+
+            self.trains.setdefault(train_id, set()).add(transport)
+            if send_command is not None:
+                self.train_command_senders[train_id] = send_command
+            logger.info(f"Admission: train {train_id} admitted via {transport}, trains: {len(self.trains)}")
+            return AdmissionDecision(admitted=True)
+
+    def release_train(self, train_id: str, transport: str):
+        with self._lock:
+            transports = self.trains.get(train_id)
+            if transports is None:
+                return
+            transports.discard(transport)
+            if not transports:
+                del self.trains[train_id]
+                self.train_command_senders.pop(train_id, None)
+                self.ingress.pop(train_id, None)
+                self.degraded_trains.discard(train_id)
+
+    # ---- viewers ----
+
+    def admit_viewer(self, remote_control_id: str, transport: str) -> AdmissionDecision:
+        with self._lock:
+            if remote_control_id not in self.viewers:
+                if ADMISSION_MAX_VIEWERS and len(self.viewers) >= ADMISSION_MAX_VIEWERS:
+                    return self._reject(f"viewer capacity reached: {len(self.viewers)} of {ADMISSION_MAX_VIEWERS} viewers connected")
+                total_egress = self._total_egress_mbps()
+                if ADMISSION_MAX_EGRESS_MBPS and total_egress >= ADMISSION_MAX_EGRESS_MBPS:
+                    return self._reject(f"server egress over budget: {total_egress:.1f} of {ADMISSION_MAX_EGRESS_MBPS:.1f} Mbit/s in use")
+
+            self.viewers.setdefault(remote_control_id, set()).add(transport)
+            return AdmissionDecision(admitted=True)
+
+    def release_viewer(self, remote_control_id: str, transport: str):
+        with self._lock:
+            transports = self.viewers.get(remote_control_id)
+            if transports is None:
+                return
+            transports.discard(transport)
+            if transports:
+                return
+            del self.viewers[remote_control_id]
+            train_id = self.viewer_to_train.pop(remote_control_id, None)
+        if train_id:
+            self._restore_quality_if_possible(train_id)
+
+    # ---- viewer to train mappings ----
+
+    def admit_mapping(self, remote_control_id: str, train_id: str) -> AdmissionDecision:
+        send_downgrade = None
+        with self._lock:
+            if self.viewer_to_train.get(remote_control_id) == train_id:
+                # the same mapping is requested over several transports
+                return AdmissionDecision(admitted=True, degraded=train_id in self.degraded_trains)
+
+            viewers = self._viewer_count(train_id)
+            if ADMISSION_MAX_VIEWERS_PER_TRAIN and viewers >= ADMISSION_MAX_VIEWERS_PER_TRAIN:
+                return self._reject(f"train viewer limit reached: train {train_id} already has {viewers} of {ADMISSION_MAX_VIEWERS_PER_TRAIN} viewers")
+
+            previous_train = self.viewer_to_train.get(remote_control_id)
+            other_egress = self._total_egress_mbps() - self._train_egress_mbps(train_id)
+            if previous_train is not None:
+                other_egress -= self._train_rate_mbps(previous_train)
+
+            if self._fits(other_egress, self._train_rate_mbps(train_id) * (viewers + 1)):
+                degraded = train_id in self.degraded_trains
+            elif self._fits(other_egress, ADMISSION_LOW_QUALITY_MBPS * (viewers + 1)):
+                degraded = True
+                if train_id not in self.degraded_trains:
+                    self.degraded_trains.add(train_id)
+                    send_downgrade = self.train_command_senders.get(train_id)
+            else:
+                projected = other_egress + ADMISSION_LOW_QUALITY_MBPS * (viewers + 1)
+                return self._reject(f"egress budget exhausted: {projected:.1f} Mbit/s projected even at low quality, "
+                                    f"limits are {ADMISSION_MAX_EGRESS_MBPS_PER_TRAIN:.1f} per train and {ADMISSION_MAX_EGRESS_MBPS:.1f} per server")
+
+            self.viewer_to_train[remote_control_id] = train_id
+
+        if send_downgrade is not None:
+            logger.warning(f"Admission: egress over budget, downgrading train {train_id} to low quality")
+            self._send_quality(send_downgrade, "low")
+        if previous_train is not None:
+            self._restore_quality_if_possible(previous_train)
+
+        reason = "egress over budget, video is limited to low quality" if degraded else ""
+        return AdmissionDecision(admitted=True, reason=reason, degraded=degraded)
+
+    def release_mapping(self, remote_control_id: str):
+        with self._lock:
+            train_id = self.viewer_to_train.pop(remote_control_id, None)
+        if train_id:
+            self._restore_quality_if_possible(train_id)
+
+    def _fits(self, other_egress: float, train_egress: float) -> bool:
+        if ADMISSION_MAX_EGRESS_MBPS_PER_TRAIN and train_egress > ADMISSION_MAX_EGRESS_MBPS_PER_TRAIN:
+            return False
+        if ADMISSION_MAX_EGRESS_MBPS and other_egress + train_egress > ADMISSION_MAX_EGRESS_MBPS:
+            return False
+        return True
+
+    def _restore_quality_if_possible(self, train_id: str):
+        with self._lock:
+            if train_id not in self.degraded_trains:
+                return
+            other_egress = self._total_egress_mbps() - self._train_egress_mbps(train_id)
+            if not self._fits(other_egress, ADMISSION_DEFAULT_TRAIN_MBPS * self._viewer_count(train_id)):
+                return
+            self.degraded_trains.discard(train_id)
+            send_command = self.train_command_senders.get(train_id)
+        logger.info(f"Admission: egress back within budget, restoring {ADMISSION_RESTORE_QUALITY} quality for train {train_id}")
+        if send_command is not None:
+            self._send_quality(send_command, ADMISSION_RESTORE_QUALITY)
+
+    def _send_quality(self, send_command: Callable[[bytes], None], quality: str):
+        instruction_packet = {
+            "type": "command",
+            "instruction": "CHANGE_VIDEO_QUALITY",
+            "quality": quality,
+        }
+        packet = struct.pack("B", PACKET_TYPE["command"]) + json.dumps(instruction_packet).encode('utf-8')
+        try:
+            send_command(packet)
+        except Exception as e:
+            logger.error(f"Admission: failed to send quality change to train: {e}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "trains": len(self.trains),
+                "viewers": len(self.viewers),
+                "egress_mbps": round(self._total_egress_mbps(), 2),
+                "per_train": {
+                    train_id: {
+                        "ingress_mbps": round(self._train_rate_mbps(train_id), 2),
+                        "viewers": self._viewer_count(train_id),
+                        "degraded": train_id in self.degraded_trains,
+                    }
+                    for train_id in self.trains
+                },
+                "limits": {
+                    "max_trains": ADMISSION_MAX_TRAINS,
+                    "max_viewers": ADMISSION_MAX_VIEWERS,
+                    "max_viewers_per_train": ADMISSION_MAX_VIEWERS_PER_TRAIN,
+                    "max_egress_mbps": ADMISSION_MAX_EGRESS_MBPS,
+                    "max_egress_mbps_per_train": ADMISSION_MAX_EGRESS_MBPS_PER_TRAIN,
+                },
+                "rejections": dict(self.rejections),
+            }
@@ -1,11 +1,14 @@
 from utils.app_logger import logger
 import asyncio
-from typing import Dict, Set
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
 from aioquic.asyncio.protocol import QuicConnectionProtocol
 import json
 import struct
-from globals import PACKET_TYPE
+from globals import (PACKET_TYPE, STREAM_LANE, STREAM_BACKLOG_LIMIT, CONTROL_PLANE_STATS_INTERVAL, TRAIN_RECONNECT_GRACE,
+                     TRAIN_QUIC_SILENCE_TIMEOUT)
 from server_controller import ServerController
+from utils.control_plane import ControlPlaneQueue, classify_stream_packet, frame_stream_packet
 
 s_controller = ServerController()
 
@@ -17,6 +20,9 @@ class ClientManager:
 
         self.train_to_remote_controls_map: Dict[str, Set[str]] = {}
         self.remote_control_to_train_map: Dict[str, str] = {}
+        # viewers of trains that disconnected lately, restored when the train reconnects within TRAIN_RECONNECT_GRACE
+        self.recent_train_viewers: Dict[str, Tuple[float, Set[str]]] = {}
+        self.train_control_planes: Dict[str, ControlPlaneQueue] = {}
         self.packet_queue: asyncio.Queue = asyncio.Queue()
         asyncio.create_task(self.relay_datagram_to_remote_controls())
         self.lock = asyncio.Lock()
@@ -26,22 +32,83 @@ class ClientManager:
 
     async def add_train_client(self, train_id: str, protocol: QuicConnectionProtocol):
         async with self.lock:
+            previous = self.train_clients.get(train_id)
             self.train_clients[train_id] = protocol
+            control_plane = ControlPlaneQueue(train_id)
+            self.train_control_planes[train_id] = control_plane
+            asyncio.create_task(self.drain_control_plane(train_id, protocol, control_plane))
             logger.info(f"QUIC: Train client connected: {train_id}, Trains: {self.train_clients.keys()}")
 
-    async def remove_train_client(self, train_id: str):
+            if previous is not None and previous is not protocol:
+                # the train reconnected before the old connection timed out, its viewers stay mapped
+                logger.info(f"QUIC: Train {train_id} reconnected, closing its previous connection")
+                previous._close_connection()
+                remote_control_ids = set(self.train_to_remote_controls_map.get(train_id, ()))
+            else:
+                remote_control_ids = self.take_recent_viewers(train_id)
+            self.restore_viewers(train_id, remote_control_ids)
+
+    def take_recent_viewers(self, train_id: str) -> Set[str]:
+        now = time.monotonic()
+        for expired in [tid for tid, (at, _) in self.recent_train_viewers.items() if now - at > TRAIN_RECONNECT_GRACE]:
+            del self.recent_train_viewers[expired]
+        _, remote_control_ids = self.recent_train_viewers.pop(train_id, (now, set()))
+        return remote_control_ids
+
+    def restore_viewers(self, train_id: str, remote_control_ids: Iterable[str]):
+        """Map the viewers of a reconnected train again and tell the train, called with the lock held."""
+        restored = []
+        for remote_control_id in remote_control_ids:
+            if remote_control_id not in self.remote_control_clients:
+                continue
+            if self.remote_control_to_train_map.get(remote_control_id, train_id) != train_id:
+                # the viewer moved to another train in the meantime
+                continue
+            self.remote_control_to_train_map[remote_control_id] = train_id
+            self.train_to_remote_controls_map.setdefault(train_id, set()).add(remote_control_id)
+            map_connect_packet = {
+                "type": "map_connect",
+                "remote_control_id": remote_control_id,
+                "train_id": train_id,
+            }
+            self.send_to_train(train_id, struct.pack("B", PACKET_TYPE["map_connect"]) + json.dumps(map_connect_packet).encode('utf-8'))
+            restored.append(remote_control_id)
+        if not restored:
+            return
+
+        instruction_packet = {
+            "type": "command",
+            "instruction": "START_SENDING_DATA",
+        }
+        packet = struct.pack("B", PACKET_TYPE["command"]) + json.dumps(instruction_packet).encode('utf-8')
+        self.send_to_train(train_id, packet)
+        logger.info(f"QUIC: Restored the viewers {restored} of reconnected train {train_id}")
+
+    async def remove_train_client(self, train_id: str, protocol: Optional[QuicConnectionProtocol] = None) -> bool:
+        """Forget the train, False if `protocol` is a connection that a newer one of the train replaced."""
         async with self.lock:
+            current = self.train_clients.get(train_id)
+            if protocol is not None and current is not None and current is not protocol:
+                return False
+
             # first remove mapping from remote controls connected to this train
             if train_id in self.train_to_remote_controls_map:
                 remote_control_ids = self.train_to_remote_controls_map[train_id]
                 for remote_control_id in remote_control_ids:
                     self.remote_control_to_train_map.pop(remote_control_id, None)
                 del self.train_to_remote_controls_map[train_id]
+                self.recent_train_viewers[train_id] = (time.monotonic(), remote_control_ids)
+
+            # stop the control plane of this train
+            control_plane = self.train_control_planes.pop(train_id, None)
+            if control_plane:
+                control_plane.wakeup.set()
 
             # then remove the train client
             if train_id in self.train_clients:
                 del self.train_clients[train_id]
                 logger.info(f"QUIC: Train client disconnected: {train_id}")
+            return True
 
     async def add_remote_control_client(self, remote_control_id: str, protocol: QuicConnectionProtocol):
         async with self.lock:
@@ -79,20 +146,15 @@ class ClientManager:
                             logger.debug(f"QUIC: Removed empty entry for train {existing_train_id} from train_to_remote_controls_map")
 
                             # send instruction to train, stop sending any more data
-                            protocol = self.train_clients.get(existing_train_id)
-                            if protocol:
-                                try:
-                                    instruction_packet = {
-                                        "type": "command",
-                                        "instruction": "STOP_SENDING_DATA",
-                                    }
-                                    packet_data = json.dumps(instruction_packet).encode('utf-8')
-                                    packet = struct.pack("B", PACKET_TYPE["command"]) + packet_data
-                                    protocol._quic.send_stream_data(protocol.stream_id, packet, end_stream=False)
-                                    protocol.transmit()
-                                    logger.info(f"Sent STOP_STREAM to train {existing_train_id} for remote control {remote_control_id}")
-                                except Exception as e:
-                                    logger.error(f"Failed to send STOP_STREAM to train {existing_train_id}: {e}")
+                            if self.is_train_connected(existing_train_id):
+                                instruction_packet = {
+                                    "type": "command",
+                                    "instruction": "STOP_SENDING_DATA",
+                                }
+                                packet_data = json.dumps(instruction_packet).encode('utf-8')
+                                packet = struct.pack("B", PACKET_TYPE["command"]) + packet_data
+                                self.send_to_train(existing_train_id, packet)
+                                logger.info(f"Sent STOP_STREAM to train {existing_train_id} for remote control {remote_control_id}")
 
             logger.debug(f"QUIC: Mapping remote control {remote_control_id} to train {train_id}")
 
@@ -104,57 +166,166 @@ class ClientManager:
             logger.info(f"QUIC: Updated train_to_remote_controls_map: {self.train_to_remote_controls_map}")
 
             # Send instruction to the remote control to start sending data
-            protocol = self.train_clients.get(train_id)
-            if protocol:
-                try:
-                    instruction_packet = {
-                        "type": "command",
-                        "instruction": "START_SENDING_DATA",
-                    }
-                    packet_data = json.dumps(instruction_packet).encode('utf-8')
-                    packet = struct.pack("B", PACKET_TYPE["command"]) + packet_data
-                    protocol._quic.send_stream_data(protocol.stream_id, packet, end_stream=False)
-                    protocol.transmit()
-                    logger.info(f"QUIC: Sending instruction START_SENDING_DATA to train {train_id}")
-                except Exception as e:
-                    logger.error(f"Failed to send START_STREAM to train {train_id}: {e}")
+            if self.is_train_connected(train_id):
+                instruction_packet = {
+                    "type": "command",
+                    "instruction": "START_SENDING_DATA",
+                }
+                packet_data = json.dumps(instruction_packet).encode('utf-8')
+                packet = struct.pack("B", PACKET_TYPE["command"]) + packet_data
+                self.send_to_train(train_id, packet)
+                logger.info(f"QUIC: Sending instruction START_SENDING_DATA to train {train_id}")
 
     async def relay_datagram_to_remote_controls(self):
         while True:
             try:
                 train_id, data = await self.packet_queue.get()
-                remote_controls = self.train_to_remote_controls_map.get(train_id, set())
-                for remote_control_id in remote_controls:
-                    protocol = self.remote_control_clients.get(remote_control_id)
-                    if protocol:
-                        try:
-                            protocol.h3_connection.send_datagram(protocol.session_id, data)
-                            protocol.transmit()
-                        except Exception as e:
-                            logger.error(f"Failed to relay video to remote_control {remote_control_id}: {e}")
-            except self.packet_queue.Empty:
+                self.relay_datagram(train_id, data)
+            except asyncio.QueueEmpty:
                 await asyncio.sleep(0.1)
 
-    async def relay_stream_to_remote_controls(self, train_id: str, data: bytes):
+    def relay_datagram(self, train_id: str, data: bytes):
         remote_controls = self.train_to_remote_controls_map.get(train_id, set())
         for remote_control_id in remote_controls:
             protocol = self.remote_control_clients.get(remote_control_id)
             if protocol:
                 try:
-                    protocol._quic.send_stream_data(protocol.stream_id, data, end_stream=False)
+                    protocol.h3_connection.send_datagram(protocol.session_id, data)
                     protocol.transmit()
                 except Exception as e:
                     logger.error(f"Failed to relay video to remote_control {remote_control_id}: {e}")
 
-    async def relay_stream_to_train(self, remote_control_id: str, data: bytes):
-        train_id = self.remote_control_to_train_map.get(remote_control_id)
-        if train_id:
-            protocol = self.train_clients.get(train_id)
+    async def relay_stream_to_remote_controls(self, train_id: str, data: bytes):
+        remote_controls = self.train_to_remote_controls_map.get(train_id, set())
+        for remote_control_id in remote_controls:
+            protocol = self.remote_control_clients.get(remote_control_id)
             if protocol:
                 try:
                     protocol._quic.send_stream_data(protocol.stream_id, data, end_stream=False)
                     protocol.transmit()
                 except Exception as e:
-                    logger.error(f"Failed to relay stream to train {train_id}: {e}")
+                    logger.error(f"Failed to relay video to remote_control {remote_control_id}: {e}")
+
+    async def relay_stream_to_train(self, remote_control_id: str, data: bytes):
+        train_id = self.remote_control_to_train_map.get(remote_control_id)
+        if train_id:
+            self.send_to_train(train_id, data)
+        else:
+            logger.warning(f"No train found for remote control {remote_control_id}")
+
+    def send_to_train(self, train_id: str, data: bytes):
+        # Queue the packet on the control plane of the train, the drain task sends it by priority
+        control_plane = self.train_control_planes.get(train_id)
+        if control_plane is not None and not self.is_quic_silent(train_id):
+            control_plane.put(classify_stream_packet(data), data)
+            return
+        # a train without QUIC (UDP blocked), or whose QUIC path went silent, takes its commands on the
+        # WebSocket it sends its video over meanwhile
+        if train_id in s_controller.train_manager.active_connections:
+            self.move_to_websocket(train_id)
+            self.send_to_train_websocket(train_id, data)
+        elif control_plane is not None:
+            # no other way to the train, QUIC delivers it if the path comes back before the idle timeout
+            control_plane.put(classify_stream_packet(data), data)
         else:
-            logger.warning(f"No train found for remote control {remote_control_id}")
\ No newline at end of file
+            logger.warning(f"Train {train_id} is connected neither over QUIC nor over WebSocket, dropping stream packet")
+
+    def move_to_websocket(self, train_id: str):
+        """Send what is on its way to a train over QUIC over its WebSocket instead, the QUIC path went silent."""
+        protocol = self.train_clients.get(train_id)
+        if protocol is not None:
+            # sent over QUIC since the train was last heard of, likely lost with the path: again, ahead of the
+            # rest. Should the path come back on the same connection, the train gets these twice.
+            for sent_at, packet in protocol.unanswered_stream_packets:
+                if sent_at >= protocol.last_received:
+                    self.send_to_train_websocket(train_id, packet)
+            protocol.unanswered_stream_packets.clear()
+        control_plane = self.train_control_planes.get(train_id)
+        if control_plane is not None:
+            # then what still waits for QUIC, by lane
+            while control_plane.pending():
+                _, packet = control_plane.pop()
+                self.send_to_train_websocket(train_id, packet)
+
+    def is_quic_silent(self, train_id: str) -> bool:
+        protocol = self.train_clients.get(train_id)
+        return protocol is None or time.monotonic() - protocol.last_received > TRAIN_QUIC_SILENCE_TIMEOUT
+
+    def send_to_train_websocket(self, train_id: str, data: bytes) -> bool:
+        """Send a stream packet as one WebSocket message, False if the train has no WebSocket connection."""
+        websocket = s_controller.train_manager.active_connections.get(train_id)
+        if websocket is None:
+            return False
+
+        def log_failure(task: asyncio.Task):
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(f"WebSocket: Failed to send stream packet to train {train_id}: {task.exception()}")
+
+        asyncio.ensure_future(websocket.send_bytes(data)).add_done_callback(log_failure)
+        return True
+
+    def is_train_connected(self, train_id: str) -> bool:
+        return train_id in self.train_clients or train_id in s_controller.train_manager.active_connections
+
+    async def drain_control_plane(self, train_id: str, protocol: QuicConnectionProtocol, control_plane: ControlPlaneQueue):
+        loop = asyncio.get_event_loop()
+        last_stats_time = loop.time()
+        held_back = False
+        while self.train_control_planes.get(train_id) is control_plane:
+            try:
+                # while messages are held back, poll the stream backlog again shortly
+                await asyncio.wait_for(control_plane.wait(), timeout=0.01 if held_back else 1.0)
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                if self.is_quic_silent(train_id) and train_id in s_controller.train_manager.active_connections:
+                    self.move_to_websocket(train_id)
+                held_back = self.flush_control_plane(train_id, protocol, control_plane)
+            except Exception as e:
+                logger.error(f"Failed to relay stream to train {train_id}: {e}")
+
+            if loop.time() - last_stats_time >= CONTROL_PLANE_STATS_INTERVAL:
+                control_plane.log_stats()
+                last_stats_time = loop.time()
+
+    def flush_control_plane(self, train_id: str, protocol: QuicConnectionProtocol, control_plane: ControlPlaneQueue) -> bool:
+        """Send queued packets by lane priority, returns True if non-urgent packets are held back."""
+        while control_plane.pending():
+            urgent_pending = bool(control_plane.lanes[STREAM_LANE["urgent"]])
+            if not urgent_pending and self.get_stream_backlog(protocol) > STREAM_BACKLOG_LIMIT:
+                # keep the main stream shallow so that later urgent packets are not stuck behind it
+                return True
+
+            lane, packet = control_plane.pop()
+            self.remember_unanswered(protocol, packet)
+            # the train splits its streams into messages by the length prefix, QUIC may coalesce or split them
+            packet = frame_stream_packet(packet)
+            if lane == STREAM_LANE["urgent"]:
+                # commands and mappings get their own stream, never blocked by loss on the main stream,
+                # a single one so that a later command cannot overtake an earlier one
+                if protocol.urgent_stream_id is None:
+                    protocol.urgent_stream_id = protocol._quic.get_next_available_stream_id(is_unidirectional=True)
+                    logger.info(f"QUIC: Opened command stream {protocol.urgent_stream_id} to train {train_id}")
+                protocol._quic.send_stream_data(protocol.urgent_stream_id, packet, end_stream=False)
+            else:
+                protocol._quic.send_stream_data(protocol.stream_id, packet, end_stream=False)
+            protocol.transmit()
+        return False
+
+    @staticmethod
+    def remember_unanswered(protocol: QuicConnectionProtocol, packet: bytes):
+        # kept until the train sends anything after it, send_to_train resends them if that never happens
+        now = time.monotonic()
+        unanswered = protocol.unanswered_stream_packets
+        while unanswered and unanswered[0][0] < protocol.last_received:
+            unanswered.popleft()
+        unanswered.append((now, packet))
+
+    def get_stream_backlog(self, protocol: QuicConnectionProtocol) -> int:
+        # bytes written to the main stream but not yet acknowledged by the train, aioquic has no
+        # public view of its send buffer and no event per acknowledged range, hence the pinned version
+        stream = protocol._quic._streams.get(protocol.stream_id)
+        if stream is None:
+            return 0
+        return stream.sender._buffer_stop - stream.sender._buffer_start
\ No newline at end of file
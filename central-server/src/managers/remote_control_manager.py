@@ -32,6 +32,8 @@ class RemoteControlManager:
             self.active_connections.pop(remote_control_id, None)
         # Close WebRTC peer connection
         await self.webrtc_manager.close_peer_connection(remote_control_id)
+        if self.webrtc_manager.server_controller:
+            self.webrtc_manager.server_controller.admission_manager.release_viewer(remote_control_id, "webrtc")
         logger.info(f"RemoteControl: Removed {remote_control_id}")
 
     async def disconnect_all(self):
@@ -5,6 +5,8 @@ from typing import Dict, Callable, Optional
 import paho.mqtt.client as mqtt
 from loguru import logger
 
+from utils.telemetry_codec import TelemetryDecoder, is_compact
+
 
 class MqttBridge:
     """
@@ -35,6 +37,8 @@ class MqttBridge:
 
         # Callback handlers
         self.telemetry_handlers: Dict[str, Callable] = {}
+        # compact telemetry is made of deltas, decoded against the last sample of each train
+        self.telemetry_decoders: Dict[str, TelemetryDecoder] = {}
 
         # Threading for async integration
         self.loop: Optional[asyncio.AbstractEventLoop] = None
@@ -121,7 +125,7 @@ class MqttBridge:
         """Callback for when a message is received"""
         try:
             topic = msg.topic
-            payload = msg.payload.decode('utf-8')
+            payload = msg.payload
 
             # logger.debug(f"Received MQTT message on topic: {topic}")
 
@@ -155,9 +159,18 @@ class MqttBridge:
             else:
                 logger.error(f"Failed to subscribe to topic: {topic} (Error: {result})")
 
-    def _handle_telemetry_message(self, train_id: str, payload: str):
-        """Handle telemetry data from trains"""
+    def _handle_telemetry_message(self, train_id: str, payload: bytes):
+        """Handle telemetry data from trains, JSON or the compact encoding of utils.telemetry_codec"""
         try:
+            if is_compact(payload):
+                decoder = self.telemetry_decoders.get(train_id)
+                if decoder is None:
+                    decoder = self.telemetry_decoders[train_id] = TelemetryDecoder(train_id)
+                # a batch holds several samples, every one goes to the handlers like a JSON message
+                for telemetry_data in decoder.decode(payload):
+                    self._dispatch_telemetry(train_id, telemetry_data)
+                return
+
             # Parse JSON payload
             telemetry_data = json.loads(payload)
 
@@ -171,26 +184,31 @@ class MqttBridge:
             # battery = telemetry_data.get('battery_level', 'N/A')
             # logger.info(f"Telemetry from train {train_id} - Speed: {speed}, Status: {status}, Location: {location}, Battery: {battery}")
 
-            # Call registered telemetry handlers
-            for handler_name, handler in self.telemetry_handlers.items():
-                try:
-                    if asyncio.iscoroutinefunction(handler):
-                        # Handle async functions
-                        if self.loop and self.loop.is_running():
-                            asyncio.run_coroutine_threadsafe(
-                                handler(train_id, telemetry_data), self.loop
-                            )
-                    else:
-                        # Handle sync functions
-                        handler(train_id, telemetry_data)
-                except Exception as e:
-                    logger.error(f"Error in telemetry handler {handler_name}: {e}")
+            self._dispatch_telemetry(train_id, telemetry_data)
 
         except json.JSONDecodeError as e:
             logger.error(f"Invalid JSON in telemetry message from train {train_id}: {e}")
+        except ValueError as e:
+            logger.error(f"Invalid compact telemetry message from train {train_id}: {e}")
         except Exception as e:
             logger.error(f"Error processing telemetry from train {train_id}: {e}")
 
+    def _dispatch_telemetry(self, train_id: str, telemetry_data: Dict):
+        """Call the registered telemetry handlers with one sample"""
+        for handler_name, handler in self.telemetry_handlers.items():
+            try:
+                if asyncio.iscoroutinefunction(handler):
+                    # Handle async functions
+                    if self.loop and self.loop.is_running():
+                        asyncio.run_coroutine_threadsafe(
+                            handler(train_id, telemetry_data), self.loop
+                        )
+                else:
+                    # Handle sync functions
+                    handler(train_id, telemetry_data)
+            except Exception as e:
+                logger.error(f"Error in telemetry handler {handler_name}: {e}")
+
     def register_telemetry_handler(self, name: str, handler: Callable):
         """Register a callback function for telemetry data"""
         self.telemetry_handlers[name] = handler
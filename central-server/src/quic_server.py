@@ -1,7 +1,9 @@
 import asyncio
 import struct
+from collections import deque
 from typing import Dict, Optional
 import json, os
+import time
 
 from aioquic.asyncio import serve
 from aioquic.asyncio.protocol import QuicConnectionProtocol
@@ -20,8 +22,11 @@ from aioquic.h3.events import H3Event, HeadersReceived, DataReceived
 
 from utils.app_logger import logger
 from utils.video_datagram_assembler import VideoDatagramAssembler
+from utils.session_ticket_store import SessionTicketStore
 from utils.calculator import Calculator
+from utils.control_plane import frame_stream_packet
 from managers.client_manager import ClientManager
+from managers.admission_manager import AdmissionDecision
 from utils.simulation_process import SimulationProcess
 from globals import *
 
@@ -36,17 +41,28 @@ class QUICRelayProtocol(QuicConnectionProtocol):
         self.calculator = calculator
         self.client_type: Optional[str] = None
         self.train_id: Optional[str] = None
+        self.link_id = 0  # > 0 for an extra uplink of a bonded train
+        self.links: Dict[int, "QUICRelayProtocol"] = {}  # extra uplinks attached to this train connection
+        self.link_packets: Dict[int, int] = {}  # video datagrams received per link, 0 is this connection
         self.remote_control_id: Optional[str] = None
         self.h3_connection: Optional[H3Connection] = None
         self.session_id: int = -1  # Default session ID
         self.stream_id: Optional[int] = None
+        self.urgent_stream_id: Optional[int] = None
+        self.unanswered_stream_packets = deque()  # (monotonic time, packet) sent to a train since its last packet
         self.video_datagram_assembler: Optional[VideoDatagramAssembler] = None
+        self.last_receiver_report = time.monotonic()
+        self.last_received = time.monotonic()  # a train's commands leave QUIC while it is silent
         self.is_closed = False
         self.file = open("video_dump.h264", "wb")
         self.stream_data_to_process = None
         self.header_data = None
         self.stream_data_size_remaining = 0
 
+    def datagram_received(self, data, addr) -> None:
+        self.last_received = time.monotonic()
+        super().datagram_received(data, addr)
+
     def connection_idle_timeout(self) -> None:
         logger.warning(f"QUIC: Connection idle timeout for train_id: {self.train_id}, remote_control_id: {self.remote_control_id}")
         self._close_connection()
@@ -89,27 +105,79 @@ class QUICRelayProtocol(QuicConnectionProtocol):
         logger.debug(f"Stream reset: {event.stream_id}")
 
     def _handle_datagram_frame(self, event: DatagramFrameReceived) -> None:
-        if self.client_type == CLIENT_TYPE_TRAIN and event.data and event.data[0] == PACKET_TYPE["video"]:
-            # Relay the video frame to all mapped remote controls
-            asyncio.create_task(
-                self.client_manager.enqueue_video_packet(self.train_id, event.data)
-            )
-
-            asyncio.create_task(
-                s_controller.remote_control_manager.webrtc_manager.enqueue_video_packet(self.train_id, event.data)
-            )
-
-            self.calculator.calculate_bandwidth(len(event.data))
-
-            # if a complete video frame is received, then write to a file to check
-            # frame = self.video_datagram_assembler.process_packet(event.data)
-            # if frame:
-            #     logger.debug(f"QUIC: Received video frame for train {self.train_id}, size: {len(frame)} bytes")
-            #     self.file.write(frame)
-            #     self.file.flush()
+        if self.client_type == CLIENT_TYPE_TRAIN and event.data and event.data[0] == PACKET_TYPE["pmtu_probe"]:
+            self._handle_pmtu_probe(event.data)
+        elif self.client_type == CLIENT_TYPE_TRAIN and event.data and event.data[0] in (PACKET_TYPE["video"], PACKET_TYPE["video_fec"]):
+            self._handle_video_datagram(event.data, self.link_id)
+        elif self.client_type == CLIENT_TYPE_TRAIN_LINK and event.data and event.data[0] in (PACKET_TYPE["video"], PACKET_TYPE["video_fec"]):
+            # one reassembly per train, on the connection that carries its streams
+            primary = self.client_manager.train_clients.get(self.train_id)
+            if primary is not None:
+                primary._handle_video_datagram(event.data, self.link_id)
         else:
             logger.warning(f"QUIC: Received unhandled data : {event.data}")
 
+    def _handle_video_datagram(self, data: bytes, link_id: int) -> None:
+        self.link_packets[link_id] = self.link_packets.get(link_id, 0) + 1
+        if self.video_datagram_assembler.reorder_delay and self.video_datagram_assembler.is_duplicate(data):
+            # the same packet came in over another link of the bonded train, viewers get it once
+            return
+
+        # Relay video and parity packets to all mapped remote controls
+        self._relay_video_packet(data)
+
+        self.calculator.calculate_bandwidth(len(data))
+        s_controller.admission_manager.record_ingress(self.train_id, len(data))
+
+        # recovers lost packets from the parity packets and relays them through _relay_video_packet
+        self.video_datagram_assembler.process_packet(data)
+        if NACK_ENABLED:
+            self._send_nacks()
+        self._send_receiver_report()
+
+    def _relay_video_packet(self, data: bytes) -> None:
+        asyncio.create_task(
+            self.client_manager.enqueue_video_packet(self.train_id, data)
+        )
+
+        asyncio.create_task(
+            s_controller.remote_control_manager.webrtc_manager.enqueue_video_packet(self.train_id, data)
+        )
+
+    def _send_nacks(self) -> None:
+        # ask the train to resend keyframe packets that neither arrived nor could be recovered
+        for frame_id, packet_ids in self.video_datagram_assembler.take_nacks():
+            packet = struct.pack(f">BIH{len(packet_ids)}H", PACKET_TYPE["nack"], frame_id, len(packet_ids), *packet_ids)
+            self.client_manager.send_to_train(self.train_id, packet)
+
+    def _send_receiver_report(self) -> None:
+        # the train adapts its FEC redundancy to the packet loss measured here
+        now = time.monotonic()
+        if now - self.last_receiver_report < RECEIVER_REPORT_INTERVAL:
+            return
+        self.last_receiver_report = now
+        if not self.video_datagram_assembler.expected_packets:
+            return
+        report = self.video_datagram_assembler.take_report()
+        if self.links:
+            report["link_packets"] = self.link_packets
+            self.link_packets = {}
+        packet = struct.pack("B", PACKET_TYPE["receiver_report"]) + json.dumps(report).encode('utf-8')
+        self.client_manager.send_to_train(self.train_id, packet)
+
+    def _handle_pmtu_probe(self, data: bytes) -> None:
+        # the probe reached us, so the path carries its size; also tell the train how large
+        # datagrams can get before they no longer fit into one packet to the viewers
+        _, probe_id, size = struct.unpack_from(">BIH", data)
+        ack = {
+            "probe_id": probe_id,
+            "size": size,
+            "received": len(data),
+            "relay_limit": QUIC_MAX_DATAGRAM_SIZE - RELAY_DATAGRAM_OVERHEAD,
+        }
+        packet = struct.pack("B", PACKET_TYPE["pmtu_ack"]) + json.dumps(ack).encode('utf-8')
+        self.client_manager.send_to_train(self.train_id, packet)
+
     async def _handle_stream_end(self) -> None:
         if self.client_type == CLIENT_TYPE_REMOTE_CONTROL:
             # Send a message to the train client to acknowledge the unmapping
@@ -227,13 +295,7 @@ class QUICRelayProtocol(QuicConnectionProtocol):
             if packet and packet[0] == PACKET_TYPE["map_connect"]:
                 remote_control_id = message.get("remote_control_id")
                 train_id = message.get("train_id")
-                asyncio.create_task(
-                    self.client_manager.connect_remote_control_to_train(remote_control_id, train_id)
-                )
-                # also send a message to the train client to acknowledge the mapping
-                asyncio.create_task(
-                    self.client_manager.relay_stream_to_train(remote_control_id, packet)
-                )
+                asyncio.create_task(self.handle_map_connect(remote_control_id, train_id, packet))
             elif packet and (packet[0] == PACKET_TYPE["command"] or packet[0] == PACKET_TYPE["rtt"] or packet[0] == PACKET_TYPE["rtt_train"] or packet[0] == PACKET_TYPE["keepalive"]):
                 asyncio.create_task(
                     self.client_manager.relay_stream_to_train(self.remote_control_id, packet)
@@ -242,6 +304,20 @@ class QUICRelayProtocol(QuicConnectionProtocol):
                 logger.error(f"QUIC: Unhandled stream packet from remote control {self.remote_control_id}: data = {packet}")
         else:
             logger.error(f"QUIC: Received stream packet but client type is unknown or packet is empty, client type: {self.client_type}, packet: {packet}")
+
+    async def handle_map_connect(self, remote_control_id: str, train_id: str, packet: bytes):
+        decision = s_controller.admission_manager.admit_mapping(remote_control_id, train_id)
+
+        # report the admission decision to the remote control in any case
+        self._quic.send_stream_data(self.stream_id, decision.to_packet(train_id=train_id), end_stream=False)
+        self.transmit()
+        if not decision.admitted:
+            return
+
+        await self.client_manager.connect_remote_control_to_train(remote_control_id, train_id)
+        # also send a message to the train client to acknowledge the mapping
+        await self.client_manager.relay_stream_to_train(remote_control_id, packet)
+
     def _h3_event_received(self, event: H3Event) -> None:
         if isinstance(event, HeadersReceived):
             headers = {}
@@ -273,6 +349,8 @@ class QUICRelayProtocol(QuicConnectionProtocol):
     def connection_lost(self, exc: Optional[Exception]) -> None:
         if self.client_type == CLIENT_TYPE_TRAIN:
             logger.info(f"QUIC: Connection lost for train_id: {self.train_id}")
+        elif self.client_type == CLIENT_TYPE_TRAIN_LINK:
+            logger.info(f"QUIC: Connection lost for link {self.link_id} of train_id: {self.train_id}")
         elif self.client_type == CLIENT_TYPE_REMOTE_CONTROL:
             logger.info(f"QUIC: Connection lost for remote_control_id: {self.remote_control_id}")
         else:
@@ -288,14 +366,23 @@ class QUICRelayProtocol(QuicConnectionProtocol):
             self.is_closed = True
 
     def _cleanup(self) -> None:
+        if self.client_type == CLIENT_TYPE_TRAIN_LINK:
+            # a link is not a client of its own, the train stays connected
+            self._detach_train_link()
+            return
+        if self.client_type == CLIENT_TYPE_TRAIN:
+            for link in list(self.links.values()):
+                link._close_connection()
         asyncio.create_task(self._remove_client_from_manager())
 
     async def _remove_client_from_manager(self) -> None:
         try:
             if self.client_type == CLIENT_TYPE_TRAIN:
-                await self.client_manager.remove_train_client(self.train_id)
+                if await self.client_manager.remove_train_client(self.train_id, self):
+                    s_controller.admission_manager.release_train(self.train_id, "quic")
             elif self.client_type == CLIENT_TYPE_REMOTE_CONTROL:
                 await self.client_manager.remove_remote_control_client(self.remote_control_id)
+                s_controller.admission_manager.release_viewer(self.remote_control_id, "webtransport")
                 if not self.client_manager.remote_control_clients:
                     self.sim_process.destroy_simulation_process()
         except Exception as e:
@@ -355,28 +442,49 @@ class QUICRelayProtocol(QuicConnectionProtocol):
             message = json.loads(json_str)
             # here we need to check of message contains field named "train_id"
 
+            if message.get("train_id") is not None and message.get("link_id"):
+                self.attach_train_link(message["train_id"], int(message["link_id"]), stream_id)
+                return
+
             if message.get("train_id") is not None:
+                train_id = message.get("train_id")
+                loop = asyncio.get_event_loop()
+                decision = s_controller.admission_manager.admit_train(
+                    train_id, "quic",
+                    send_command=lambda packet: loop.call_soon_threadsafe(self.client_manager.send_to_train, train_id, packet)
+                )
+                if not decision.admitted:
+                    self.reject_connection(stream_id, {"train_id": train_id}, decision)
+                    return
+
                 self.client_type = CLIENT_TYPE_TRAIN
                 self.stream_id = stream_id
-                self.train_id = message.get("train_id")
-                self.video_datagram_assembler = VideoDatagramAssembler(self.train_id)
+                self.train_id = train_id
+                self.video_datagram_assembler = VideoDatagramAssembler(self.train_id, on_recovered_packet=self._relay_video_packet)
                 asyncio.create_task(self.client_manager.add_train_client(self.train_id, self))
 
                 # try send Stream hello world message to the train client
                 connect_response_msg = {
                     "type" : "connect_response",
                     "train_id": self.train_id,
+                    "status": decision.status,
                 }
                 connect_response_packet = json.dumps(connect_response_msg).encode('utf-8')
                 connect_response_packet = struct.pack("B", PACKET_TYPE["connect_response"]) + connect_response_packet
-                self._quic.send_stream_data(stream_id, connect_response_packet, end_stream=False)
+                self._quic.send_stream_data(stream_id, frame_stream_packet(connect_response_packet), end_stream=False)
                 self.transmit()
                 return
 
             if message.get("remote_control_id") is not None:
+                remote_control_id = message.get("remote_control_id")
+                decision = s_controller.admission_manager.admit_viewer(remote_control_id, "webtransport")
+                if not decision.admitted:
+                    self.reject_connection(stream_id, {"remote_control_id": remote_control_id}, decision)
+                    return
+
                 self.client_type = CLIENT_TYPE_REMOTE_CONTROL
                 self.stream_id = stream_id
-                self.remote_control_id = message.get("remote_control_id")
+                self.remote_control_id = remote_control_id
                 asyncio.create_task(self.client_manager.add_remote_control_client(self.remote_control_id, self))
 
                 # If no train clients are connected, spawn a subprocess to run a simulated train client
@@ -390,6 +498,7 @@ class QUICRelayProtocol(QuicConnectionProtocol):
                 connect_response_msg = {
                     "type" : "connect_response",
                     "remote_control_id": self.remote_control_id,
+                    "status": decision.status,
                 }
                 connect_response_packet = json.dumps(connect_response_msg).encode('utf-8')
                 connect_response_packet = struct.pack("B", PACKET_TYPE["connect_response"]) + connect_response_packet
@@ -401,6 +510,59 @@ class QUICRelayProtocol(QuicConnectionProtocol):
             logger.warning("Could not decode connect message")
             return
 
+    def attach_train_link(self, train_id: str, link_id: int, stream_id: int) -> None:
+        """Accept an extra uplink of a train, its video goes to the reassembly of the train's connection."""
+        primary = self.client_manager.train_clients.get(train_id)
+        if primary is None or primary.is_closed:
+            # links are opened after the train connection is admitted, and do not outlive it
+            self.reject_connection(stream_id, {"train_id": train_id, "link_id": link_id},
+                                   AdmissionDecision(admitted=False, reason="train is not connected"))
+            return
+
+        self.client_type = CLIENT_TYPE_TRAIN_LINK
+        self.stream_id = stream_id
+        self.train_id = train_id
+        self.link_id = link_id
+        primary.links[link_id] = self
+        primary.video_datagram_assembler.reorder_delay = BONDING_REORDER_DELAY
+        logger.info(f"QUIC: Link {link_id} of train {train_id} connected, links: {sorted(primary.links)}")
+
+        connect_response_msg = {
+            "type": "connect_response",
+            "train_id": train_id,
+            "link_id": link_id,
+            "status": "admitted",
+        }
+        connect_response_packet = json.dumps(connect_response_msg).encode('utf-8')
+        connect_response_packet = struct.pack("B", PACKET_TYPE["connect_response"]) + connect_response_packet
+        self._quic.send_stream_data(stream_id, frame_stream_packet(connect_response_packet), end_stream=False)
+        self.transmit()
+
+    def _detach_train_link(self) -> None:
+        primary = self.client_manager.train_clients.get(self.train_id)
+        if primary is not None and primary.links.get(self.link_id) is self:
+            del primary.links[self.link_id]
+            logger.info(f"QUIC: Link {self.link_id} of train {self.train_id} disconnected, links: {sorted(primary.links)}")
+
+    def reject_connection(self, stream_id: int, client_info: dict, decision) -> None:
+        # client_type stays unset, so closing this connection never touches an admitted client with the same id
+        connect_response_msg = {
+            "type": "connect_response",
+            **client_info,
+            "status": decision.status,
+            "reason": decision.reason,
+        }
+        connect_response_packet = json.dumps(connect_response_msg).encode('utf-8')
+        connect_response_packet = struct.pack("B", PACKET_TYPE["connect_response"]) + connect_response_packet
+        if "train_id" in client_info:
+            # trains and their links read length-prefixed messages, remote controls one message per chunk
+            connect_response_packet = frame_stream_packet(connect_response_packet)
+        self._quic.send_stream_data(stream_id, connect_response_packet, end_stream=False)
+        self.transmit()
+
+        # give the response a moment to be delivered before closing
+        asyncio.get_event_loop().call_later(1.0, self._close_connection)
+
 
 async def run_quic_server():
     try:
@@ -410,6 +572,7 @@ async def run_quic_server():
             is_client=False,
             alpn_protocols=["quic", "h3", "webtransport"],
             max_datagram_frame_size=2000,
+            max_datagram_size=QUIC_MAX_DATAGRAM_SIZE,
             idle_timeout=30.0,  # 30 seconds idle timeout
         )
         quic_config.load_cert_chain(certfile=config.cert_file, keyfile=config.key_file)
@@ -423,17 +586,26 @@ async def run_quic_server():
         # create a shared Calculator instance
         calculator = Calculator()
 
+        # session resumption, a reconnecting train sends its connect message as 0-RTT data
+        session_tickets = SessionTicketStore(path=SESSION_TICKET_FILE)
+
         server = await serve(
             HOST,
             QUIC_PORT,
             configuration=quic_config,
             create_protocol=lambda *args, **kwargs: QUICRelayProtocol(
                 *args, client_manager=client_manager, calculator=calculator, sim_process=sim_process, **kwargs
-            )
+            ),
+            session_ticket_fetcher=session_tickets.pop,
+            session_ticket_handler=session_tickets.add,
         )
 
         logger.info(f"QUIC: server running on {HOST}:{QUIC_PORT}")
-        await asyncio.Future()  # Run forever
+        try:
+            await asyncio.Future()  # Run forever
+        finally:
+            # CONNECTION_CLOSE to every client, so they reconnect at once instead of waiting for a timeout
+            server.close()
 
     except Exception as e:
         logger.critical(f"QUIC: server failed to start: {e}", exc_info=True)
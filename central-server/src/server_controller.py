@@ -3,6 +3,7 @@ from typing import Any
 
 from managers.train_manager import TrainManager
 from managers.remote_control_manager import RemoteControlManager
+from managers.admission_manager import AdmissionManager
 from utils.app_logger import logger
 from utils.connection_tracker import ConnectionTracker
 class ServerController:
@@ -32,6 +33,7 @@ class ServerController:
         self.train_to_clients_map = {}
         self.client_to_train_map = {}
         self.connection_tracker = ConnectionTracker()
+        self.admission_manager = AdmissionManager()
 
     def start_server(self) -> None:
         with self._lock:
@@ -0,0 +1,79 @@
+import asyncio
+import struct
+import time
+from collections import deque
+from typing import Optional, Tuple
+
+from utils.app_logger import logger
+from utils.latency_histogram import LatencyHistogram
+from globals import PACKET_TYPE, STREAM_LANE
+
+# everything that steers the train shares one lane, and so one stream, to reach it in the order it was sent
+LANE_BY_PACKET_TYPE = {
+    PACKET_TYPE["command"]: STREAM_LANE["urgent"],
+    PACKET_TYPE["map_connect"]: STREAM_LANE["urgent"],
+    PACKET_TYPE["map_disconnect"]: STREAM_LANE["urgent"],
+    PACKET_TYPE["nack"]: STREAM_LANE["control"],
+    PACKET_TYPE["rtt"]: STREAM_LANE["probe"],
+    PACKET_TYPE["rtt_train"]: STREAM_LANE["probe"],
+    PACKET_TYPE["pmtu_ack"]: STREAM_LANE["probe"],
+    PACKET_TYPE["receiver_report"]: STREAM_LANE["probe"],
+    PACKET_TYPE["keepalive"]: STREAM_LANE["bulk"],
+    PACKET_TYPE["telemetry"]: STREAM_LANE["bulk"],
+}
+
+
+def frame_stream_packet(packet: bytes) -> bytes:
+    """Prefix a stream packet to a train with its 2-byte big-endian length, the framing the train uses towards us."""
+    return struct.pack(">H", len(packet)) + packet
+
+
+def classify_stream_packet(packet: bytes) -> int:
+    """Map a stream packet (type byte + payload) to its control-plane lane."""
+    if not packet:
+        return STREAM_LANE["bulk"]
+
+    return LANE_BY_PACKET_TYPE.get(packet[0], STREAM_LANE["bulk"])
+
+
+class ControlPlaneQueue:
+    """Per-client priority queue for stream messages.
+
+    Each lane is a FIFO, lanes are served strictly by priority. The time a
+    message spends in the queue is recorded in a histogram per lane.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lanes = {lane: deque() for lane in STREAM_LANE.values()}
+        self.histograms = {
+            lane: LatencyHistogram(f"{name}:{lane_name}") for lane_name, lane in STREAM_LANE.items()
+        }
+        self.wakeup = asyncio.Event()
+
+    def put(self, lane: int, packet: bytes):
+        self.lanes[lane].append((time.monotonic(), packet))
+        self.wakeup.set()
+
+    def pop(self) -> Optional[Tuple[int, bytes]]:
+        for lane in sorted(self.lanes):
+            if self.lanes[lane]:
+                enqueued_at, packet = self.lanes[lane].popleft()
+                self.histograms[lane].record((time.monotonic() - enqueued_at) * 1000)
+                return lane, packet
+        return None
+
+    def pending(self) -> int:
+        return sum(len(lane) for lane in self.lanes.values())
+
+    async def wait(self):
+        await self.wakeup.wait()
+        self.wakeup.clear()
+
+    def log_stats(self):
+        for lane_name, lane in STREAM_LANE.items():
+            snapshot = self.histograms[lane].snapshot()
+            if snapshot["count"]:
+                logger.info(f"Control plane {self.name} [{lane_name}] queue wait: count={snapshot['count']}, "
+                            f"p50={snapshot['p50_ms']}ms, p95={snapshot['p95_ms']}ms, max={snapshot['max_ms']}ms, "
+                            f"pending={len(self.lanes[lane])}")
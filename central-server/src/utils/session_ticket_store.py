@@ -0,0 +1,75 @@
+import os
+import pickle
+from collections import OrderedDict
+from typing import Optional
+
+from aioquic.tls import SessionTicket
+
+from utils.app_logger import logger
+from globals import SESSION_TICKET_STORE_SIZE
+
+
+class SessionTicketStore:
+    """TLS session tickets issued by the QUIC server, for session resumption and 0-RTT.
+
+    aioquic calls add() for every ticket it issues and pop() when a client
+    presents one. A ticket is taken out when it is used, so early data sent
+    with it is accepted once: a replayed 0-RTT connect falls back to a full
+    handshake. The oldest tickets are evicted beyond `maxsize`.
+
+    With a `path` the tickets are written to that file on every change and
+    loaded on start, so that trains resume their sessions across a restart
+    of the server. The file holds resumption secrets, it is only readable by
+    the server's user.
+    """
+
+    def __init__(self, maxsize: int = SESSION_TICKET_STORE_SIZE, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.path = path
+        self.tickets: "OrderedDict[bytes, SessionTicket]" = OrderedDict()
+        self.issued = 0
+        self.resumed = 0
+        if path is not None:
+            self.load()
+
+    def add(self, ticket: SessionTicket) -> None:
+        self.tickets[ticket.ticket] = ticket
+        self.issued += 1
+        while len(self.tickets) > self.maxsize:
+            self.tickets.popitem(last=False)
+        self.save()
+
+    def pop(self, label: bytes) -> Optional[SessionTicket]:
+        # aioquic checks the ticket's lifetime itself
+        ticket = self.tickets.pop(label, None)
+        if ticket is not None:
+            self.resumed += 1
+            self.save()
+        return ticket
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "rb") as f:
+                tickets = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"QUIC: cannot load session tickets from {self.path}: {e}")
+            return
+        self.tickets = OrderedDict((ticket.ticket, ticket) for ticket in tickets if ticket.is_valid)
+        logger.info(f"QUIC: loaded {len(self.tickets)} session tickets from {self.path}")
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        temporary = f"{self.path}.tmp"
+        try:
+            fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(list(self.tickets.values()), f)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logger.warning(f"QUIC: cannot save session tickets to {self.path}: {e}")
+
+    def stats(self) -> dict:
+        return {"stored": len(self.tickets), "issued": self.issued, "resumed": self.resumed}
@@ -0,0 +1,165 @@
+import struct
+from typing import List, Optional
+
+# Fields of a telemetry sample by schema id, the index of a field is its bit in the change mask.
+# Numbers are (key, struct format, scale): sent as round(value * scale), a scale of 1 keeps an int.
+# Strings are (key, "s"): up to 255 bytes of UTF-8 behind a length byte, they come after the numbers.
+# train_id and video_stream_url follow from the train, timestamp and sequence_number are in every record.
+# Keep in sync with train-client/src/utils/telemetry_codec.py and web-client/src/scripts/telemetryCodec.js
+TELEMETRY_SCHEMAS = {
+    1: (
+        ("direction", "b", 1),
+        ("speed", "H", 100),  # km/h
+        ("max_speed", "H", 100),
+        ("passenger_count", "H", 1),
+        ("temperature", "h", 10),  # °C
+        ("battery_level", "H", 100),  # %
+        ("gps.latitude", "i", 10_000_000),
+        ("gps.longitude", "i", 10_000_000),
+        ("engine_temperature", "h", 10),
+        ("fuel_level", "H", 100),
+        ("network_signal_strength", "B", 1),
+        ("download_speed", "I", 1000),  # Mbps
+        ("upload_speed", "I", 1000),
+        ("jitter", "I", 100),  # ms
+        ("ping", "I", 100),
+        ("name", "s"),
+        ("status", "s"),
+        ("brake_status", "s"),
+        ("location", "s"),
+        ("next_station", "s"),
+        ("reaktor_motor_mode", "s"),
+    ),
+}
+
+# A message is the schema id, the number of records and the records.
+# A record is its kind, the sequence number and the timestamp (ms), then
+# a snapshot: every number in one fixed layout, then every string,
+# a delta: the change mask, then the numbers and strings that changed.
+MESSAGE_HEADER = struct.Struct(">BB")
+RECORD_HEADER = struct.Struct(">BIQ")
+CHANGE_MASK = struct.Struct(">I")
+RECORD_SNAPSHOT = 1
+RECORD_DELTA = 2
+
+
+def is_compact(payload: bytes) -> bool:
+    """True for the binary encoding, JSON telemetry starts with "{"."""
+    return bool(payload) and payload[0] in TELEMETRY_SCHEMAS
+
+
+class _Schema:
+    def __init__(self, schema_id: int):
+        self.id = schema_id
+        fields = TELEMETRY_SCHEMAS[schema_id]
+        self.numbers = [(index, field[0].split("."), field[1], field[2])
+                        for index, field in enumerate(fields) if field[1] != "s"]
+        self.strings = [(index, field[0].split(".")) for index, field in enumerate(fields) if field[1] == "s"]
+        self.all_numbers = struct.Struct(">" + "".join(fmt for _, _, fmt, _ in self.numbers))
+        self.size = len(fields)
+        self.all_mask = (1 << self.size) - 1
+        self._layouts = {}  # change mask -> layout of the numbers of a delta, deltas mostly repeat a few masks
+
+    def numbers_struct(self, mask: int) -> struct.Struct:
+        layout = self._layouts.get(mask)
+        if layout is None:
+            layout = struct.Struct(">" + "".join(fmt for index, _, fmt, _ in self.numbers if mask >> index & 1))
+            self._layouts[mask] = layout
+        return layout
+
+
+class TelemetryDecoder:
+    """Turns the messages of one train back into the samples the JSON encoding had.
+
+    A delta applies to the last sample, so deltas before the first snapshot
+    are dropped. A record with a sequence number that was already decoded
+    is a duplicate (QoS 1 delivers at least once) and dropped as well, a
+    gap only leaves the fields of the missing deltas stale until the next
+    snapshot.
+    """
+
+    def __init__(self, train_id: str):
+        self.train_id = train_id
+        self._schema: Optional[_Schema] = None
+        self._values: Optional[list] = None
+        self._sequence: Optional[int] = None
+        self.decoded = 0
+        self.dropped = 0
+        self.gaps = 0
+
+    def decode(self, payload: bytes) -> List[dict]:
+        """The samples of a message, raises ValueError if it is malformed."""
+        try:
+            schema_id, count = MESSAGE_HEADER.unpack_from(payload, 0)
+            if schema_id not in TELEMETRY_SCHEMAS:
+                raise ValueError(f"unknown telemetry schema {schema_id}")
+            if self._schema is None or self._schema.id != schema_id:
+                self._schema = _Schema(schema_id)
+                self._values = None
+            offset = MESSAGE_HEADER.size
+            samples = []
+            for _ in range(count):
+                sample, offset = self._decode_record(payload, offset)
+                if sample is not None:
+                    samples.append(sample)
+            return samples
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise ValueError(f"malformed telemetry message: {e}") from e
+
+    def _decode_record(self, payload: bytes, offset: int):
+        schema = self._schema
+        kind, sequence, timestamp = RECORD_HEADER.unpack_from(payload, offset)
+        offset += RECORD_HEADER.size
+        if kind == RECORD_SNAPSHOT:
+            mask = schema.all_mask
+            layout = schema.all_numbers
+        else:
+            (mask,) = CHANGE_MASK.unpack_from(payload, offset)
+            offset += CHANGE_MASK.size
+            layout = schema.numbers_struct(mask)
+        numbers = layout.unpack_from(payload, offset)
+        offset += layout.size
+        strings = {}
+        for index, _ in schema.strings:
+            if mask >> index & 1:
+                length = payload[offset]
+                strings[index] = payload[offset + 1:offset + 1 + length].decode("utf-8")
+                offset += 1 + length
+
+        if kind != RECORD_SNAPSHOT:
+            if self._values is None or (self._sequence is not None and sequence <= self._sequence):
+                # no base yet, or already decoded
+                self.dropped += 1
+                return None, offset
+            if self._sequence is not None and sequence != self._sequence + 1:
+                self.gaps += 1
+            values = list(self._values)
+        else:
+            values = [None] * schema.size
+        changed = iter(numbers)
+        for index, _, _, scale in schema.numbers:
+            if mask >> index & 1:
+                value = next(changed)
+                values[index] = value / scale if scale != 1 else value
+        for index, value in strings.items():
+            values[index] = value
+        self._values = values
+        self._sequence = sequence
+        self.decoded += 1
+        return self._sample(values, sequence, timestamp), offset
+
+    def _sample(self, values: list, sequence: int, timestamp: int) -> dict:
+        sample = {"train_id": self.train_id, "video_stream_url": "/stream/" + self.train_id}
+        for index, path, _, _ in self._schema.numbers:
+            self._set(sample, path, values[index])
+        for index, path in self._schema.strings:
+            self._set(sample, path, values[index])
+        sample["timestamp"] = timestamp
+        sample["sequence_number"] = sequence
+        return sample
+
+    @staticmethod
+    def _set(sample: dict, path: list, value):
+        for key in path[:-1]:
+            sample = sample.setdefault(key, {})
+        sample[path[-1]] = value
@@ -1,61 +1,311 @@
-import asyncio
-from typing import Optional
+import struct
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
 from utils.app_logger import logger
+from globals import (
+    PACKET_TYPE, VIDEO_HEADER_SIZE, FEC_HEADER_SIZE, FEC_REORDER_WINDOW,
+    NACK_CHECK_INTERVAL, NACK_RETRY_INTERVAL, NACK_MAX_ATTEMPTS,
+)
+
+VIDEO_HEADER = struct.Struct(">BIHH36sQ")
+FEC_HEADER = struct.Struct(">HI")
+_PACKET_IDS = struct.Struct(">BIHH")  # type, frame_id, number_of_packets, packet_id
+
+
+NAL_START_CODE = b"\x00\x00\x01"
+NAL_IDR = 5
+NAL_SPS = 7
+
+
+def is_keyframe_payload(payload, scan_bytes: int = 1024) -> bool:
+    """True if the first packet of a frame has an SPS or IDR slice ahead of any other slice, the same check as
+    the train's utils.h264.is_keyframe. AUD, SEI and PPS units in front of them are skipped."""
+    head = bytes(payload[:scan_bytes])
+    start = head.find(NAL_START_CODE)
+    while start != -1 and start + 3 < len(head):
+        nal_type = head[start + 3] & 0x1F
+        if nal_type in (NAL_IDR, NAL_SPS):
+            return True
+        if 1 <= nal_type < NAL_IDR:
+            # a non-IDR slice, a P frame
+            return False
+        start = head.find(NAL_START_CODE, start + 3)
+    return False
+
+
+class FrameState:
+    __slots__ = ("frame_id", "number_of_packets", "timestamp", "payloads", "received", "parity",
+                 "group_count", "frame_size", "payload_size", "recovered",
+                 "is_keyframe", "nack_attempts", "last_nack_at", "last_packet_at")
+
+    def __init__(self, frame_id: int, number_of_packets: int, timestamp: int):
+        self.frame_id = frame_id
+        self.number_of_packets = number_of_packets
+        self.timestamp = timestamp
+        self.payloads: List[Optional[bytes]] = [None] * number_of_packets
+        self.received = 0
+        self.parity: Dict[int, memoryview] = {}
+        self.group_count = 0
+        self.frame_size = -1
+        self.payload_size = 0
+        self.recovered = 0
+        self.is_keyframe: Optional[bool] = None  # unknown until the first packet arrives
+        self.nack_attempts = 0
+        self.last_nack_at = 0.0
+        self.last_packet_at = 0.0  # only kept while reorder_delay is set
+
 
 class VideoDatagramAssembler:
-    def __init__(self, train_id: str):
+    """
+    Reassembles the video frames of one train from its datagrams.
+
+    Packets may arrive out of order and interleaved between frames. With FEC
+    enabled on the train, a lost data packet is rebuilt from the XOR parity of
+    its group and handed to `on_recovered_packet` as a regular video datagram,
+    so viewers without FEC support get the complete frame as well. Packets of
+    keyframes that are still missing after that are reported by `take_nacks`
+    so that the train can send them again.
+
+    A bonded train sends over several links, so the same packet may arrive
+    twice (`is_duplicate`) and a packet may be overtaken by the packets of
+    newer frames on a faster link. With `reorder_delay` set, a keyframe is
+    only NACKed once none of its packets arrived for that long.
+    """
+
+    def __init__(self, train_id: str, on_recovered_packet: Optional[Callable[[bytes], None]] = None):
         self.train_id = train_id
-        self.current_frame = bytearray()
-        self.current_frame_id = -1
-        self.expected_packets = 0
-        self.received_packets = 0
+        self.train_id_bytes = train_id.encode('utf-8').ljust(36)[:36]
+        self.on_recovered_packet = on_recovered_packet
+        self.reorder_delay = 0.0  # seconds, set while the train is bonded
+        self.frames: "OrderedDict[int, FrameState]" = OrderedDict()
+        self.finished_ids = deque(maxlen=4 * FEC_REORDER_WINDOW)
+        self.newest_frame_id = -1
+
         self.frame_counter = 0
         self.start_time = None
 
+        # totals since the train connected
+        self.complete_frames = 0
+        self.recovered_frames = 0
+        self.unrecoverable_frames = 0
+        self.recovered_packets = 0
+        # packet loss of data packets before recovery, reset by take_report
+        self.expected_packets = 0
+        self.lost_packets = 0
+        self.nacked_packets = 0
+        self.duplicate_packets = 0
+        self.next_nack_check = 0.0
+
     def process_packet(self, data: bytes) -> Optional[bytes]:
+        """Add a video or parity datagram, returns the frame once all of its data packets are present."""
         try:
-            # Ignoring first byte as packet_type = data[0]
-            frame_id = int.from_bytes(data[1:5], byteorder='big')
-            number_of_packets = int.from_bytes(data[5:7], byteorder='big')
-            packet_id = int.from_bytes(data[7:9], byteorder='big')
-            train_id = data[9:45].decode('utf-8').strip()
-            timestamp = int.from_bytes(data[45:53], byteorder='big')
-            payload = data[53:]
-
-            if train_id != self.train_id:
-                logger.warning(f"Packet train ID mismatch: expected {self.train_id}, got {train_id}")
+            packet_type, frame_id, number_of_packets, packet_id, train_id, timestamp = VIDEO_HEADER.unpack_from(data)
+
+            if train_id != self.train_id_bytes:
+                logger.warning(f"Packet train ID mismatch: expected {self.train_id}, got {train_id.decode('utf-8').strip()}")
+                return None
+            if frame_id in self.finished_ids:
+                # straggler or parity of a frame that is already complete
+                return None
+            if packet_type == PACKET_TYPE["video_fec"]:
+                group_count, frame_size = FEC_HEADER.unpack_from(data, VIDEO_HEADER_SIZE)
+                # one parity packet per group, group_count of them for the number_of_packets data packets
+                valid = 0 < packet_id <= group_count <= number_of_packets
+            else:
+                valid = 0 < packet_id <= number_of_packets
+            if not valid:
+                logger.warning(f"Video packet {packet_id} of frame {frame_id} out of range, "
+                               f"number_of_packets: {number_of_packets}")
                 return None
 
-            if frame_id != self.current_frame_id:
-                # New frame
-                self.current_frame = bytearray()
-                self.current_frame_id = frame_id
-                self.expected_packets = number_of_packets
-                self.received_packets = 0
+            state = self._get_frame_state(frame_id, number_of_packets, timestamp)
+            if state is None:
+                return None
+            if number_of_packets != state.number_of_packets or (
+                    packet_type == PACKET_TYPE["video_fec"] and state.group_count and group_count != state.group_count):
+                logger.warning(f"Video packet {packet_id} of frame {frame_id} does not match the frame's earlier packets")
+                return None
+            if self.reorder_delay:
+                state.last_packet_at = time.monotonic()
 
-            self.current_frame.extend(payload)
-            self.received_packets += 1
+            if packet_type == PACKET_TYPE["video_fec"]:
+                group_index = packet_id - 1
+                if group_index in state.parity:
+                    return None
+                state.parity[group_index] = memoryview(data)[VIDEO_HEADER_SIZE + FEC_HEADER_SIZE:]
+                state.group_count = group_count
+                state.frame_size = frame_size
+                state.payload_size = len(state.parity[group_index])
+                self._try_recover(state, group_index)
+            else:
+                index = packet_id - 1
+                if state.payloads[index] is not None:
+                    return None
+                payload = memoryview(data)[VIDEO_HEADER_SIZE:]
+                state.payloads[index] = payload
+                state.received += 1
+                if index < number_of_packets - 1:
+                    state.payload_size = len(payload)
+                if index == 0:
+                    state.is_keyframe = is_keyframe_payload(payload)
+                if state.group_count:
+                    self._try_recover(state, index % state.group_count)
 
-            if packet_id == number_of_packets and self.received_packets == self.expected_packets:
-                # Complete frame received
-                complete_frame = bytes(self.current_frame)
-                self.current_frame = bytearray()
+            if state.received == state.number_of_packets:
+                return self._finish_frame(state)
+            return None
 
-                if self.frame_counter == 0:
-                    self.frame_counter += 1
-                    self.start_time = asyncio.get_event_loop().time()
-                else:
-                    self.frame_counter += 1
+        except Exception as e:
+            logger.error(f"Error processing video packet: {e}")
+            return None
 
-                current_time = asyncio.get_event_loop().time()
-                if current_time - self.start_time >= 1.0:
-                    logger.info(f"Received {self.frame_counter} complete video frames in the last second for train {self.train_id}")
-                    self.frame_counter = 0
+    def is_duplicate(self, data) -> bool:
+        """True if this video or parity datagram was already received, e.g. over another link,
+        or belongs to a frame that is already complete or expired."""
+        packet_type, frame_id, _, packet_id = _PACKET_IDS.unpack_from(data)
+        state = self.frames.get(frame_id)
+        if state is None:
+            duplicate = frame_id in self.finished_ids
+        elif packet_type == PACKET_TYPE["video_fec"]:
+            duplicate = packet_id - 1 in state.parity
+        else:
+            duplicate = 0 < packet_id <= state.number_of_packets and state.payloads[packet_id - 1] is not None
+        if duplicate:
+            self.duplicate_packets += 1
+        return duplicate
 
-                return complete_frame
+    def _get_frame_state(self, frame_id: int, number_of_packets: int, timestamp: int) -> Optional[FrameState]:
+        state = self.frames.get(frame_id)
+        if state is not None:
+            return state
 
+        if frame_id > self.newest_frame_id or frame_id < self.newest_frame_id - 1000:
+            # a much smaller id means the train restarted its frame counter
+            if frame_id < self.newest_frame_id - 1000:
+                self._expire_frames(float("inf"))
+                self.finished_ids.clear()
+            self.newest_frame_id = frame_id
+            self._expire_frames(frame_id - FEC_REORDER_WINDOW)
+        elif frame_id <= self.newest_frame_id - FEC_REORDER_WINDOW:
+            # too late, the frame was already counted as lost
             return None
 
-        except Exception as e:
-            logger.error(f"Error processing video packet: {e}")
-            return None
+        state = FrameState(frame_id, number_of_packets, timestamp)
+        self.frames[frame_id] = state
+        return state
+
+    def take_nacks(self) -> List[Tuple[int, List[int]]]:
+        """
+        Missing packet IDs of incomplete keyframes as (frame_id, packet_ids).
+
+        The train sends the packets of a frame back to back, followed by its
+        parity packets, so once a newer frame arrives whatever is still missing
+        was lost. Frames whose first packet is missing might be keyframes and
+        are reported as well, the train only answers for frames it buffered.
+        """
+        now = time.monotonic()
+        if now < self.next_nack_check:
+            return []
+        self.next_nack_check = now + NACK_CHECK_INTERVAL
+
+        nacks = []
+        for frame_id, state in self.frames.items():
+            if frame_id >= self.newest_frame_id:
+                continue
+            if (state.is_keyframe is False or state.nack_attempts >= NACK_MAX_ATTEMPTS
+                    or now - state.last_nack_at < NACK_RETRY_INTERVAL
+                    or now - state.last_packet_at < self.reorder_delay):
+                continue
+            missing = [index + 1 for index, payload in enumerate(state.payloads) if payload is None]
+            state.nack_attempts += 1
+            state.last_nack_at = now
+            self.nacked_packets += len(missing)
+            nacks.append((frame_id, missing))
+        return nacks
+
+    def _try_recover(self, state: FrameState, group_index: int):
+        parity = state.parity.get(group_index)
+        if parity is None:
+            return
+        members = range(group_index, state.number_of_packets, state.group_count)
+        missing = [index for index in members if state.payloads[index] is None]
+        if len(missing) != 1:
+            return
+
+        index = missing[0]
+        recovered = np.frombuffer(parity, dtype=np.uint8).copy()
+        for member in members:
+            if member != index:
+                payload = np.frombuffer(state.payloads[member], dtype=np.uint8)
+                recovered[:len(payload)] ^= payload
+        if index == state.number_of_packets - 1:
+            length = state.frame_size - index * state.payload_size
+        else:
+            length = state.payload_size
+        payload = recovered[:length].tobytes()
+
+        state.payloads[index] = payload
+        state.received += 1
+        state.recovered += 1
+        self.recovered_packets += 1
+        if self.on_recovered_packet is not None:
+            header = VIDEO_HEADER.pack(PACKET_TYPE["video"], state.frame_id, state.number_of_packets, index + 1,
+                                       self.train_id_bytes, state.timestamp)
+            self.on_recovered_packet(header + payload)
+
+    def _finish_frame(self, state: FrameState) -> bytes:
+        del self.frames[state.frame_id]
+        self.finished_ids.append(state.frame_id)
+        self._count_frame(state)
+        if state.recovered:
+            self.recovered_frames += 1
+        else:
+            self.complete_frames += 1
+
+        self.frame_counter += 1
+        now = time.monotonic()
+        if self.start_time is None:
+            self.start_time = now
+        elif now - self.start_time >= 1.0:
+            logger.debug(f"Received {self.frame_counter} complete video frames in the last second for train {self.train_id}")
+            self.frame_counter = 0
+            self.start_time = now
+
+        return b"".join(state.payloads)
+
+    def _expire_frames(self, oldest_frame_id: float):
+        while self.frames:
+            frame_id, state = next(iter(self.frames.items()))
+            if frame_id >= oldest_frame_id:
+                break
+            del self.frames[frame_id]
+            self.finished_ids.append(frame_id)
+            self._count_frame(state)
+            self.unrecoverable_frames += 1
+
+    def _count_frame(self, state: FrameState):
+        self.expected_packets += state.number_of_packets
+        self.lost_packets += state.number_of_packets - (state.received - state.recovered)
+
+    def take_report(self) -> dict:
+        """Loss since the last report and the FEC totals, sent back to the train."""
+        loss = self.lost_packets / self.expected_packets if self.expected_packets else 0.0
+        report = {
+            "type": "receiver_report",
+            "loss": round(loss, 4),
+            "expected_packets": self.expected_packets,
+            "lost_packets": self.lost_packets,
+            "complete_frames": self.complete_frames,
+            "recovered_frames": self.recovered_frames,
+            "unrecoverable_frames": self.unrecoverable_frames,
+            "recovered_packets": self.recovered_packets,
+            "nacked_packets": self.nacked_packets,
+            "duplicate_packets": self.duplicate_packets,
+        }
+        self.expected_packets = 0
+        self.lost_packets = 0
+        return report
@@ -0,0 +1,42 @@
+import json
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from utils.control_plane import ControlPlaneQueue, classify_stream_packet
+from globals import PACKET_TYPE, STREAM_LANE
+
+REMOTE_CONTROL_ID = "44ffefc5-878e-4558-b846-37a3acdfd8af"
+
+
+def stream_packet(packet_type: str, message: dict) -> bytes:
+    return struct.pack("B", PACKET_TYPE[packet_type]) + json.dumps(message).encode("utf-8")
+
+
+def test_train_control_keeps_its_order():
+    # a speed change must not overtake the POWER_ON or the map_disconnect sent before it
+    sent = [
+        stream_packet("keepalive", {"type": "keepalive"}),
+        stream_packet("command", {"instruction": "POWER_ON"}),
+        stream_packet("nack", {}),
+        stream_packet("command", {"instruction": "CHANGE_TARGET_SPEED", "target_speed": 20}),
+        stream_packet("map_disconnect", {"type": "map_disconnect", "remote_control_id": REMOTE_CONTROL_ID}),
+        stream_packet("command", {"instruction": "CHANGE_DIRECTION", "direction": "BACKWARD"}),
+        stream_packet("map_connect", {"type": "map_connect", "remote_control_id": REMOTE_CONTROL_ID}),
+        stream_packet("command", {"instruction": "START_SENDING_DATA"}),
+    ]
+    control_plane = ControlPlaneQueue("test")
+    for packet in sent:
+        control_plane.put(classify_stream_packet(packet), packet)
+
+    popped = []
+    while control_plane.pending():
+        popped.append(control_plane.pop())
+
+    train_control = [packet for lane, packet in popped if lane == STREAM_LANE["urgent"]]
+    assert train_control == [packet for packet in sent if packet[0] in (
+        PACKET_TYPE["command"], PACKET_TYPE["map_connect"], PACKET_TYPE["map_disconnect"])]
+    assert [lane for lane, _ in popped] == sorted(lane for lane, _ in popped)
+    assert popped[-1] == (STREAM_LANE["bulk"], sent[0])
@@ -0,0 +1,84 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from utils.video_datagram_assembler import FEC_HEADER, VIDEO_HEADER, VideoDatagramAssembler, is_keyframe_payload
+from globals import PACKET_TYPE
+
+TRAIN_ID = "2f0c3f4e-6b1a-4c8e-9d2b-5a7e1f3c9b10"
+MAX_PACKET_SIZE = 100
+
+AUD = b"\x00\x00\x00\x01\x09\xf0"
+SEI = b"\x00\x00\x01\x06\x05\x10" + bytes(16)
+SPS = b"\x00\x00\x00\x01\x67\x42\xc0\x1f"
+PPS = b"\x00\x00\x00\x01\x68\xce\x3c\x80"
+IDR = b"\x00\x00\x01\x65\x88\x84"
+P_SLICE = b"\x00\x00\x01\x41\x9a\x02"
+
+
+def video_packets(frame_id: int, frame: bytes):
+    number_of_packets = max(1, -(-len(frame) // MAX_PACKET_SIZE))
+    train_id = TRAIN_ID.encode("utf-8")
+    return [VIDEO_HEADER.pack(PACKET_TYPE["video"], frame_id, number_of_packets, packet_id, train_id, 0)
+            + frame[(packet_id - 1) * MAX_PACKET_SIZE:packet_id * MAX_PACKET_SIZE]
+            for packet_id in range(1, number_of_packets + 1)]
+
+
+@pytest.mark.parametrize("frame, keyframe", [
+    (IDR, True),
+    (SPS + PPS + IDR, True),
+    (AUD + SPS + PPS + IDR, True),
+    (AUD + SEI + IDR, True),
+    (P_SLICE, False),
+    (AUD + P_SLICE, False),
+    (AUD + SEI + P_SLICE + IDR, False),
+    (b"", False),
+])
+def test_is_keyframe_payload(frame, keyframe):
+    assert is_keyframe_payload(memoryview(frame + bytes(64))) is keyframe
+
+
+def test_aud_prefixed_keyframe_is_nacked():
+    assembler = VideoDatagramAssembler(TRAIN_ID)
+    keyframe = AUD + SPS + PPS + IDR + bytes(3 * MAX_PACKET_SIZE)
+    packets = video_packets(1, keyframe)
+    for index, packet in enumerate(packets):
+        if index != 1:
+            assert assembler.process_packet(packet) is None
+    # a newer frame tells the assembler that the keyframe's second packet was lost
+    assembler.process_packet(video_packets(2, AUD + P_SLICE + bytes(10))[0])
+
+    assert assembler.take_nacks() == [(1, [2])]
+    assert assembler.process_packet(packets[1]) == keyframe
+
+
+@pytest.mark.parametrize("packet_id", [0, 4, 65535])
+def test_packet_id_out_of_range_is_rejected(packet_id):
+    assembler = VideoDatagramAssembler(TRAIN_ID)
+    frame = IDR + bytes(range(250))
+    packets = video_packets(1, frame)
+    assert len(packets) == 3
+    stray = VIDEO_HEADER.pack(PACKET_TYPE["video"], 1, 3, packet_id, TRAIN_ID.encode("utf-8"), 0) + b"x" * 10
+
+    assert assembler.process_packet(stray) is None
+    assert not assembler.is_duplicate(packets[-1])
+    assert assembler.process_packet(packets[0]) is None
+    assert assembler.process_packet(packets[1]) is None
+    assert assembler.process_packet(packets[2]) == frame
+
+
+@pytest.mark.parametrize("packet_id, group_count", [(0, 1), (2, 1), (1, 0), (1, 4)])
+def test_parity_out_of_range_is_rejected(packet_id, group_count):
+    assembler = VideoDatagramAssembler(TRAIN_ID)
+    frame = IDR + bytes(range(256))
+    packets = video_packets(1, frame)
+    parity = (VIDEO_HEADER.pack(PACKET_TYPE["video_fec"], 1, len(packets), packet_id, TRAIN_ID.encode("utf-8"), 0)
+              + FEC_HEADER.pack(group_count, len(frame)) + bytes(MAX_PACKET_SIZE))
+
+    assert assembler.process_packet(parity) is None
+    for packet in packets[:-1]:
+        assert assembler.process_packet(packet) is None
+    assert assembler.process_packet(packets[-1]) == frame
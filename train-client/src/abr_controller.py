@@ -0,0 +1,158 @@
+import time
+from typing import Optional
+
+from PyQt5.QtCore import QObject, QTimer
+from utils.app_logger import logger
+from globals import *
+
+
+class AbrController(QObject):
+    """Closed-loop bitrate control for the QUIC video of the train.
+
+    Every ABR_INTERVAL it compares what the encoder produces with what the
+    connection can carry, in the spirit of GCC: a growing send backlog (frame
+    queue, unsent datagrams, RTT above the minimum) or high receiver loss is
+    overuse and cuts the bitrate below the measured send rate, an empty
+    backlog with low loss lets it grow slowly. The congestion window over the
+    RTT caps it, like the bandwidth estimate of BBR. After a decrease the
+    bitrate is held for a while, and the encoder is only reconfigured for
+    changes of at least ABR_MIN_CHANGE so it does not flap.
+
+    The operator's quality preset (CHANGE_VIDEO_QUALITY) is the upper limit.
+    """
+
+    def __init__(self, network_worker, encoder, parent=None):
+        super().__init__(parent)
+        self.network_worker = network_worker
+        self.encoder = encoder
+        self.encoder.min_bitrate = min(self.encoder.min_bitrate, ABR_MIN_BITRATE)
+        self.min_bitrate = ABR_MIN_BITRATE
+        self.max_bitrate = encoder.current_bitrate
+        self.target_bitrate = float(encoder.current_bitrate)
+        self.state = "hold"
+        self.hold_until = 0.0
+        self.loss = 0.0
+        self.send_rate: Optional[float] = None  # bit/s that left the QUIC connection, smoothed
+        self._last_update: Optional[float] = None
+        self._last_sent_bytes = 0
+        self._last_report_count = 0
+        self._last_frame_drops = 0
+        self._last_increase = 0.0
+        self._reason = ""  # why the target last moved, logged when the encoder follows
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update)
+
+    def start(self):
+        self.timer.start(int(ABR_INTERVAL * 1000))
+
+    def stop(self):
+        self.timer.stop()
+
+    def set_max_bitrate(self, bitrate: int):
+        self.max_bitrate = bitrate
+        self.target_bitrate = min(self.target_bitrate, bitrate)
+        logger.info(f"ABR: maximum bitrate set to {bitrate / 1e6:.2f} Mbps")
+        self._apply(f"maximum bitrate {bitrate / 1e6:.2f} Mbps", force=True)
+
+    def update(self):
+        stats = self.network_worker.transport_stats()
+        now = time.monotonic()
+        if stats is None:
+            # not connected, start measuring from scratch on the next connection
+            self._last_update = None
+            self.send_rate = None
+            return
+
+        sent_bytes = stats["sent_video_bytes"] - stats["pending_datagram_bytes"]
+        if self._last_update is None or sent_bytes < self._last_sent_bytes:
+            self._last_update = now
+            self._last_sent_bytes = sent_bytes
+            return
+        dt = now - self._last_update
+        delta = sent_bytes - self._last_sent_bytes
+        self._last_update = now
+        self._last_sent_bytes = sent_bytes
+        if delta <= 0 and stats["pending_datagram_bytes"] == 0:
+            # not sending video, nothing to learn from
+            return
+
+        rate = delta * 8 / dt
+        self.send_rate = rate if self.send_rate is None else 0.7 * self.send_rate + 0.3 * rate
+        if self.network_worker.receiver_report_count != self._last_report_count:
+            self._last_report_count = self.network_worker.receiver_report_count
+            self.loss = float(self.network_worker.receiver_report.get("loss", 0.0))
+
+        reason = self.decide(stats, dt, now)
+        if reason is not None:
+            self._reason = reason
+        # also retries increases that were held back by ABR_MIN_INCREASE_INTERVAL
+        self._apply(self._reason)
+
+    def decide(self, stats: dict, dt: float, now: float) -> Optional[str]:
+        """Move the target bitrate, returns the reason if it changed."""
+        video_share = 1 / (1 + stats["fec_overhead"])  # the rest of the send rate is parity
+        video_rate = self.send_rate * video_share
+        queue_delay = (stats["pending_datagram_bytes"] * 8 / max(self.send_rate, self.min_bitrate)
+                       + stats["frame_queue_age"])
+        if stats["smoothed_rtt"] is not None:
+            queue_delay += max(0.0, stats["smoothed_rtt"] - stats["min_rtt"])
+        # the frame queue sheds old frames, so its age alone stays below what the uplink is behind
+        frame_drops = stats["frame_queue"]["dropped"] - self._last_frame_drops
+        self._last_frame_drops = stats["frame_queue"]["dropped"]
+        measurements = (f"queue {queue_delay * 1000:.0f} ms, loss {self.loss:.1%}, "
+                        f"send rate {self.send_rate / 1e6:.2f} Mbps")
+        if frame_drops > 0:
+            measurements += f", {frame_drops} frames dropped"
+
+        old_target = self.target_bitrate
+        if self.loss > ABR_LOSS_HIGH:
+            state = "decrease"
+            self.target_bitrate *= 1 - 0.5 * self.loss
+            # count each report once
+            self.loss = 0.0
+        elif queue_delay > ABR_QUEUE_DELAY_HIGH or frame_drops > 0:
+            state = "decrease"
+            self.target_bitrate = min(self.target_bitrate, ABR_DECREASE_FACTOR * video_rate)
+        elif queue_delay < ABR_QUEUE_DELAY_LOW and self.loss < ABR_LOSS_LOW and now >= self.hold_until:
+            state = "increase"
+            increased = self.target_bitrate * (1 + ABR_INCREASE_RATE * dt)
+            # a still scene needs less than the target, do not grow far beyond what is actually sent
+            self.target_bitrate = max(self.target_bitrate, min(increased, 1.5 * video_rate))
+        else:
+            state = "hold"
+
+        if stats["smoothed_rtt"]:
+            # the links of a bonded train add up
+            path_rate = stats.get("link_capacity") or stats["congestion_window"] * 8 / stats["smoothed_rtt"]
+            capacity = path_rate * ABR_CWND_UTILIZATION * video_share
+            if capacity < self.target_bitrate:
+                self.target_bitrate = capacity
+                measurements += f", cwnd limit {capacity / 1e6:.2f} Mbps"
+        self.target_bitrate = max(self.min_bitrate, min(self.max_bitrate, self.target_bitrate))
+
+        if self.target_bitrate < old_target:
+            self.hold_until = now + ABR_HOLD_AFTER_DECREASE
+        if state != self.state:
+            logger.debug(f"ABR: {self.state} -> {state} ({measurements})")
+            self.state = state
+        if self.target_bitrate != old_target:
+            return f"{state}: {measurements}"
+        return None
+
+    def _apply(self, reason: str, force: bool = False):
+        current = self.encoder.current_bitrate
+        target = int(self.target_bitrate)
+        change = abs(target - current) / current
+        at_limit = target in (self.min_bitrate, self.max_bitrate) and target != current
+        if not force and change < ABR_MIN_CHANGE and not at_limit:
+            return
+        if target == current:
+            return
+        now = time.monotonic()
+        if not force and target > current:
+            if now - self._last_increase < ABR_MIN_INCREASE_INTERVAL:
+                return
+            self._last_increase = now
+        logger.info(f"ABR: {current / 1e6:.2f} -> {target / 1e6:.2f} Mbps ({reason})")
+        self.encoder.set_bitrate(target)
@@ -1,10 +1,10 @@
 from abc import ABC, abstractmethod
 import datetime
-import os
+import time
 import uuid
 import json
 import struct
-from PyQt5.QtCore import QThread, QDateTime, QTimer
+from PyQt5.QtCore import QThread, QDateTime, QTimer, Qt
 from utils.app_logger import logger
 from globals import *
 from network_worker_ws import NetworkWorkerWS
@@ -14,8 +14,17 @@ from networkspeed import NetworkSpeed
 from sensor.telemetry import Telemetry
 from sensor.imu import IMU
 from encoder import Encoder
+from encode_worker import EncodeWorker
+from sensor.video_source import CapturedFrame
+from utils.pipeline_stats import PipelineStats
+from abr_controller import AbrController
+from transport_manager import TransportManager
+from utils.telemetry_codec import TelemetryEncoder
 from PyQt5.QtCore import QObject
-from hw_info import HWInfo
+from hw_info import HWSampler
+from utils.dump_writer import DumpWriter
+from utils.h264 import is_keyframe
+from utils.clock_sync import ClockSync
 
 # Fix for metaclass conflict with QObject
 class QABCMeta(type(QObject), type(ABC)):
@@ -33,28 +42,54 @@ class BaseClient(ABC, metaclass=QABCMeta):
         self.target_speed = MAX_SPEED
         self._running = True
         self.connected_remote_control_ids = set()
-        self.clock_offsets = {}  # Clock offset between train and remote controls (ms)
-        self.number_of_rtt_packets = 5
-        self.clock_offset_samples = {}
-        self.latency_output_file =self.create_dump_file_for_latency(LATENCY_DUMP)
-        self.latency_output_file_for_keepalive = self.create_dump_file_for_latency(LATENCY_KEEPALIVE_DUMP)
+        self.clock_syncs = {}  # remote_control_id -> ClockSync, offset and skew of its clock against the train's
+        # every dump goes to disk on the writer thread, the encode and Qt threads only queue their data
+        self.dump_writer = DumpWriter()
+        self.latency_output_file = self.dump_writer.open(LATENCY_DUMP, "log")
+        self.latency_output_file_for_keepalive = self.dump_writer.open(LATENCY_KEEPALIVE_DUMP, "log")
+        self.dump_writer.start()
 
         # Initialize components
         self.telemetry = Telemetry(self.train_client_id)
+        self.telemetry_encoder = TelemetryEncoder() if TELEMETRY_ENCODING == "compact" else None
         self.imu = IMU()
         self.encoder = Encoder()
+        self.pipeline_stats = PipelineStats()
+        self.encode_worker = EncodeWorker(self.encoder, self.pipeline_stats)
         self.init_network()
-        self.create_dump_file()
-        self.hw_info = HWInfo()
-        self.hw_info_generator_timer = QTimer()
-        self.hw_info_generator_timer.timeout.connect(self.generate_hw_info)
-        self.hw_info_generator_timer.start(1000)  # every 1 seconds
+        self.network_worker_quic.pipeline_stats = self.pipeline_stats
+        self.abr_controller = AbrController(self.network_worker_quic, self.encoder) if ABR_ENABLED else None
+        self.transport_manager = TransportManager({
+            "QUIC": self.network_worker_quic,
+            "WEBSOCKET": self.network_worker_ws,
+            "MQTT": self.network_worker_mqtt,
+        })
+        self.output_file = self.dump_writer.open(H264_DUMP, "h264")
+        # one sampler thread feeds the hw_usage dump, consumers take its samples from sample_ready or latest()
+        self.hw_sampler = HWSampler(self.dump_writer)
+        # low-rate rtt_train probes keep the clock offsets to the remote controls up to date
+        self.clock_sync_timer = QTimer()
+        self.clock_sync_timer.timeout.connect(self.send_clock_probes)
+        self.clock_sync_timer.start(int(CLOCK_SYNC_PROBE_INTERVAL * 1000))
+        self.pipeline_stats_timer = QTimer()
+        self.pipeline_stats_timer.timeout.connect(self.log_pipeline_stats)
+        self.pipeline_stats_timer.start(PIPELINE_STATS_INTERVAL * 1000)
+        self.frames_dropped_before_encode = 0
 
         # Connect signals
-        self.video_source.frame_ready.connect(self.on_new_frame)
+        self.connect_video_source()
         self.telemetry.telemetry_ready.connect(self.on_telemetry_data)
         self.imu.imu_ready.connect(self.on_imu_data)
-        self.encoder.encode_ready.connect(self.on_encoded_frame)
+        # encoded frames go to the dump file and the network queue straight from the encode thread
+        self.encoder.encode_ready.connect(self.on_encoded_frame, Qt.DirectConnection)
+        # the frame queue drops frames when the uplink falls behind, a keyframe lets the video recover
+        self.network_worker_quic.keyframe_requested.connect(self.encoder.request_keyframe, Qt.DirectConnection)
+        self.network_worker_ws.keyframe_requested.connect(self.encoder.request_keyframe, Qt.DirectConnection)
+        self.transport_manager.keyframe_requested.connect(self.encoder.request_keyframe, Qt.DirectConnection)
+        self.transport_manager.route_changed.connect(self.on_route_changed)
+        self.transport_manager.start()
+        self.hw_sampler.start()
+        self.encode_worker.start()
         self.video_source.init_capture()
         self.telemetry.start()
         self.imu.start()
@@ -64,8 +99,17 @@ class BaseClient(ABC, metaclass=QABCMeta):
         self.show_capture_frame_log = True
 
 
-    def generate_hw_info(self):
-        self.hw_info.get_hw_info(write_to_file=True)
+    def log_pipeline_stats(self):
+        dropped = self.encode_worker.mailbox.dropped
+        self.pipeline_stats.log_stats(dropped - self.frames_dropped_before_encode)
+        self.frames_dropped_before_encode = dropped
+
+    def connect_video_source(self):
+        # The encode worker takes raw frames on the capture thread, the GUI preview
+        # and FPS counter get them queued on the main thread
+        self.video_source.pipeline_stats = self.pipeline_stats
+        self.video_source.frame_ready.connect(self.encode_worker.submit, Qt.DirectConnection)
+        self.video_source.frame_ready.connect(self.on_new_frame)
 
     def switch_video_source(self, new_source):
         """Switch the active video source at runtime.
@@ -76,10 +120,11 @@ class BaseClient(ABC, metaclass=QABCMeta):
         try:
             # Disconnect and stop old source
             if hasattr(self.video_source, 'frame_ready'):
-                try:
-                    self.video_source.frame_ready.disconnect(self.on_new_frame)
-                except Exception:
-                    pass
+                for slot in (self.on_new_frame, self.encode_worker.submit):
+                    try:
+                        self.video_source.frame_ready.disconnect(slot)
+                    except Exception:
+                        pass
             if hasattr(self.video_source, 'stop'):
                 try:
                     self.video_source.stop()
@@ -88,7 +133,7 @@ class BaseClient(ABC, metaclass=QABCMeta):
 
             # Replace
             self.video_source = new_source
-            self.video_source.frame_ready.connect(self.on_new_frame)
+            self.connect_video_source()
 
             # Apply current direction & speed if methods exist
             if hasattr(new_source, 'set_direction'):
@@ -113,35 +158,11 @@ class BaseClient(ABC, metaclass=QABCMeta):
         logger.info(f"TrainClient ID initialized: {client_id}")
         return client_id
 
-    def create_dump_file(self):
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        dump_dir = os.path.dirname(H264_DUMP)
-        if dump_dir and not os.path.exists(dump_dir):
-            os.makedirs(dump_dir, exist_ok=True)
-        output_filename = f"{H264_DUMP}_{timestamp}.h264"
-        self.output_file = open(output_filename, 'wb')
-
-    def create_dump_file_for_latency(self, file_prefix):
-        dump_dir = os.path.dirname(file_prefix)
-        if dump_dir and not os.path.exists(dump_dir):
-            os.makedirs(dump_dir, exist_ok=True)
-
-        time_suffix = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"{file_prefix}_{time_suffix}.log"
-
-
-        # create a new file only if it doesn't exist
-        output_file = None
-        if not os.path.exists(output_filename):
-            output_file = open(output_filename, 'w')
-        else:
-            output_file = open(output_filename, 'a')
-        return output_file
-
     def init_network(self):
         # WebSocket
         self.network_worker_ws = NetworkWorkerWS(self.train_client_id)
         self.network_worker_ws.process_command.connect(self.on_new_command)
+        self.network_worker_ws.data_received.connect(self.on_data_received)
         self.network_worker_ws.start()
 
         # QUIC
@@ -149,7 +170,7 @@ class BaseClient(ABC, metaclass=QABCMeta):
         self.network_worker_quic.connection_established.connect(self.on_quic_connected)
         self.network_worker_quic.connection_failed.connect(self.on_quic_failed)
         self.network_worker_quic.connection_closed.connect(self.on_quic_closed)
-        self.network_worker_quic.data_received.connect(self.on_data_received_quic)
+        self.network_worker_quic.data_received.connect(self.on_data_received)
         self.network_worker_quic.process_command.connect(self.on_new_command)
         self.network_worker_quic.start()
 
@@ -176,10 +197,12 @@ class BaseClient(ABC, metaclass=QABCMeta):
         logger.error(f"QUIC connection failed: {error}")
 
     def on_quic_closed(self):
-        logger.info("QUIC connection closed")
+        logger.info("QUIC connection closed, reconnecting")
+        # the train stops until an operator is back, the server sends map_connect again for the viewers it restores
+        self.connected_remote_control_ids.clear()
         self.stop_train_operations()
 
-    def on_data_received_quic(self, data):
+    def on_data_received(self, data):
         packet_type = data[0]
         payload = data[1:]
         if packet_type == PACKET_TYPE["map_connect"]:
@@ -188,10 +211,13 @@ class BaseClient(ABC, metaclass=QABCMeta):
                 remote_control_id = json.loads(payload.decode('utf-8')).get('remote_control_id')
                 self.connected_remote_control_ids.add(remote_control_id)
                 logger.info(f"Map CONNECT received from remote control ID: {remote_control_id}")
-                # Reset samples for this remote and start RTT measurement
-                self.clock_offset_samples[remote_control_id] = []
+                # a remote control that comes back keeps its estimate, the burst gives a new one a first offset
+                self.clock_syncs.setdefault(remote_control_id, ClockSync(remote_control_id))
                 self.send_rtt_packets(remote_control_id)
-                self.hw_info.notify_new_remote_control_connected(remote_control_id)
+                if self.telemetry_encoder is not None:
+                    # the new viewer needs every field, not only what changes
+                    self.telemetry_encoder.request_snapshot()
+                self.hw_sampler.notify_new_remote_control_connected(remote_control_id)
             except json.JSONDecodeError as e:
                 logger.error(f"Failed to parse map_connect JSON: {e}")
 
@@ -216,41 +242,27 @@ class BaseClient(ABC, metaclass=QABCMeta):
             # Extract timestamps
             remote_control_timestamp = jsonData.get('remote_control_timestamp', 0)
             train_timestamp_sent = jsonData.get('train_timestamp', 0)
-            current_time = int(datetime.datetime.now().timestamp() * 1000)
+            current_time = time.time() * 1000
             remote_control_id = jsonData.get('remote_control_id')
 
-            # Calculate RTT (Round Trip Time)
-            rtt = current_time - train_timestamp_sent
-
-            # Calculate clock offset
-            # Clock offset = remote_time - local_time (at the midpoint of RTT)
-            # Approximation: remote_control_timestamp was captured at roughly (train_timestamp_sent + rtt/2)
-            clock_offset = remote_control_timestamp - (train_timestamp_sent + rtt / 2)
-
-            # Collect offset samples per remote and compute average after N samples
-            samples = self.clock_offset_samples.setdefault(remote_control_id, [])
-            samples.append(clock_offset)
-
-            logger.info(
+            clock_sync = self.clock_syncs.get(remote_control_id)
+            if clock_sync is None or not remote_control_timestamp:
+                logger.debug(f"RTT packet from {remote_control_id} without a connect or a remote timestamp")
+                return
+            was_ready = clock_sync.ready
+            accepted = clock_sync.add_sample(train_timestamp_sent, remote_control_timestamp, current_time)
+            logger.debug(
                 f"RTT packet received - "
-                f"RTT: {rtt}ms, "
-                f"Clock Offset sample: {clock_offset:.2f}ms, "
-                f"Sample count for {remote_control_id}: {len(samples)}/{self.number_of_rtt_packets}, "
+                f"RTT: {current_time - train_timestamp_sent:.1f}ms, "
                 f"Remote timestamp: {remote_control_timestamp}, "
                 f"Train timestamp sent: {train_timestamp_sent}, "
-                f"Current time: {current_time}"
+                f"Current time: {current_time:.1f}{'' if accepted else ', ignored'}"
             )
-
-            if len(samples) >= self.number_of_rtt_packets:
-                avg_offset = sum(samples[:self.number_of_rtt_packets]) / self.number_of_rtt_packets
-                avg_offset = round(avg_offset)
-                self.clock_offsets[remote_control_id] = avg_offset
+            if clock_sync.ready and not was_ready:
                 logger.info(
-                    f"Clock offset established for {remote_control_id}: {avg_offset:.2f}ms "
-                    f"(averaged over {self.number_of_rtt_packets} RTT samples)"
+                    f"Clock offset established for {remote_control_id}: {clock_sync.offset():.1f}ms "
+                    f"(± {clock_sync.uncertainty():.1f}ms)"
                 )
-                # Reset samples to avoid unbounded growth; new ACK can re-initiate measurement
-                self.clock_offset_samples[remote_control_id] = []
 
         elif packet_type == PACKET_TYPE["keepalive"]:
             try:
@@ -266,57 +278,68 @@ class BaseClient(ABC, metaclass=QABCMeta):
                         "received_at": int(datetime.datetime.now().timestamp() * 1000),
                         "size" : len(payload),
                         "sequence" : message.get('sequence', None),
+                        **self.clock_sync_fields(remote_control_id),
                     }
                     self.latency_output_file_for_keepalive.write(json.dumps(latency_log_entry) + "\n")
-                    self.latency_output_file_for_keepalive.flush()
             except json.JSONDecodeError as e:
                 logger.error(f"Failed to parse keepalive JSON: {e}")
         else:
-            logger.warning(f"Unknown QUIC packet type received: {packet_type}")
+            logger.warning(f"Unknown stream packet type received: {packet_type}")
+
+
+    def send_rtt_packet(self, remote_control_id):
+        # the remote control adds its time and echoes the packet, ClockSync takes the three timestamps
+        rtt_train_Packet = {
+            "type": "rtt_train",
+            "remote_control_timestamp": 0,
+            "remote_control_id": remote_control_id,
+            "train_timestamp": round(time.time() * 1000, 3)
+        }
 
+        rtt_train_data = json.dumps(rtt_train_Packet).encode('utf-8')
+        rtt_train_packet = struct.pack("B", PACKET_TYPE["rtt_train"]) + rtt_train_data
+
+        # Add 2-byte length prefix (big-endian)
+        data_size = len(rtt_train_packet)
+        length_prefixed_packet = bytearray(2 + len(rtt_train_packet))
+        length_prefixed_packet[0] = (data_size >> 8) & 0xFF  # High byte
+        length_prefixed_packet[1] = data_size & 0xFF         # Low byte
+        length_prefixed_packet[2:] = rtt_train_packet
+        self.network_worker_quic.enqueue_stream_packet(length_prefixed_packet)
 
     def send_rtt_packets(self, remote_control_id):
-        """Send RTT packets with delays using QTimer to avoid blocking."""
-        def send_packet(packet_index):
-            rtt_train_Packet = {
-                "type": "rtt_train",
-                "remote_control_timestamp": 0,
-                "remote_control_id": remote_control_id,
-                "train_timestamp": int(datetime.datetime.now().timestamp() * 1000)
-            }
-
-            rtt_train_data = json.dumps(rtt_train_Packet).encode('utf-8')
-            rtt_train_packet = struct.pack("B", PACKET_TYPE["rtt_train"]) + rtt_train_data
-
-            # Add 2-byte length prefix (big-endian)
-            data_size = len(rtt_train_packet)
-            length_prefixed_packet = bytearray(2 + len(rtt_train_packet))
-            length_prefixed_packet[0] = (data_size >> 8) & 0xFF  # High byte
-            length_prefixed_packet[1] = data_size & 0xFF         # Low byte
-            length_prefixed_packet[2:] = rtt_train_packet
-            self.network_worker_quic.enqueue_stream_packet(length_prefixed_packet)
-            logger.debug(f"Sent RTT packet {packet_index + 1}/{self.number_of_rtt_packets} to {remote_control_id}")
-
-        # Send packets with delays using QTimer
-        for i in range(self.number_of_rtt_packets):
+        """A burst of RTT packets after map_connect, with delays using QTimer to avoid blocking."""
+        for i in range(CLOCK_SYNC_BURST):
             after_ms = 2000
-            QTimer.singleShot(after_ms + i * 200, lambda idx=i: send_packet(idx))
+            QTimer.singleShot(after_ms + i * 200, lambda: self.send_rtt_packet(remote_control_id))
 
+    def send_clock_probes(self):
+        for remote_control_id in list(self.connected_remote_control_ids):
+            if remote_control_id in self.clock_syncs:
+                self.send_rtt_packet(remote_control_id)
 
     def calculate_latency(self, remote_control_id, remote_timestamp):
-        current_time = int(datetime.datetime.now().timestamp() * 1000)
+        current_time = time.time() * 1000
 
         # Check if clock offset has been calculated for this remote control
-        if remote_control_id not in self.clock_offsets:
-            logger.warning(f"Clock offset not available for remote_control_id: {remote_control_id}. Cannot calculate accurate latency. Clock offsets: {self.clock_offsets}")
+        clock_sync = self.clock_syncs.get(remote_control_id)
+        if clock_sync is None or not clock_sync.ready:
+            logger.warning(f"Clock offset not available for remote_control_id: {remote_control_id}. Cannot calculate accurate latency.")
             return None
 
-        # Adjust remote timestamp to local time by subtracting clock offset
-        # Clock offset = remote_time - local_time, so local_time = remote_time - clock_offset
-        adjusted_remote_time = remote_timestamp - self.clock_offsets[remote_control_id]
+        # The remote timestamp on the train's clock, with the offset and drift at that time
+        adjusted_remote_time = clock_sync.to_local(remote_timestamp)
         # Latency = current_time - adjusted_remote_time
         latency = current_time - adjusted_remote_time
-        return latency
+        return round(latency, 1)
+
+    def clock_sync_fields(self, remote_control_id):
+        """Offset and its error bound (ms) the latency of a log entry was computed with, for the analysis."""
+        clock_sync = self.clock_syncs[remote_control_id]
+        return {
+            "clock_offset": round(clock_sync.offset(), 1),
+            "clock_uncertainty": round(clock_sync.uncertainty(), 1),
+        }
 
     def on_webrtc_connected(self):
         logger.info("WebRTC connection established")
@@ -349,9 +372,9 @@ class BaseClient(ABC, metaclass=QABCMeta):
                     "target_speed": message.get('target_speed', None),
                     "direction": message.get('direction', None),
                     "quality": message.get('quality', None),
+                    **self.clock_sync_fields(remote_control_id),
                 }
                 self.latency_output_file.write(json.dumps(latency_log_entry) + "\n")
-                self.latency_output_file.flush()
             else:
                 logger.info(f"Received command: {message} (latency not available - clock not synchronized)")
 
@@ -392,20 +415,18 @@ class BaseClient(ABC, metaclass=QABCMeta):
             elif message['instruction'] == 'CHANGE_VIDEO_QUALITY':
                 video_quality = message.get('quality')
                 logger.info(f"Video quality is changing to {video_quality}")
-                if video_quality ==  "low":
-                    logger.info(f"Setting encoder bitrate to LOW_BITRATE: {LOW_BITRATE}")
-                    self.encoder.set_bitrate(LOW_BITRATE)
-                elif video_quality == "medium":
-                    logger.info(f"Setting encoder bitrate to MEDIUM_BITRATE: {MEDIUM_BITRATE}")
-                    self.encoder.set_bitrate(MEDIUM_BITRATE)
-                elif video_quality == "high":
-                    logger.info(f"Setting encoder bitrate to HIGH_BITRATE: {HIGH_BITRATE}")
-                    self.encoder.set_bitrate(HIGH_BITRATE)
-                else:
+                bitrate = {"low": LOW_BITRATE, "medium": MEDIUM_BITRATE, "high": HIGH_BITRATE}.get(video_quality)
+                if bitrate is None:
                     logger.warning(f"Unknown video quality: {video_quality}")
+                elif self.abr_controller is not None:
+                    # the preset is the upper limit, the controller picks the bitrate below it
+                    self.abr_controller.set_max_bitrate(bitrate)
+                else:
+                    logger.info(f"Setting encoder bitrate to {video_quality.upper()}_BITRATE: {bitrate}")
+                    self.encoder.set_bitrate(bitrate)
             elif message['instruction'] == 'SWITCH_PROTOCOL':
                 protocol = message.get('protocol', '').upper()
-                if protocol in ['WEBSOCKET', 'QUIC', 'WEBRTC']:
+                if protocol in ['WEBSOCKET', 'QUIC', 'WEBRTC', 'AUTO']:
                     self.switch_protocol(protocol)
                 else:
                     logger.warning(f"Unknown protocol: {protocol}")
@@ -420,11 +441,11 @@ class BaseClient(ABC, metaclass=QABCMeta):
         except Exception as e:
             logger.error(f"Unexpected error processing command: {e}. Payload: {payload}")
 
-    def on_new_frame(self, frame_id, frame, width, height, is_encoded):
-        if is_encoded:
-            self.on_encoded_frame(frame_id, int(datetime.datetime.now().timestamp() * 1000), frame)  # Placeholder for encoded bytes
-        else:
-            self.encoder.encode_frame(frame_id, frame, width, height, self.log_message)
+    def on_new_frame(self, captured: CapturedFrame):
+        # raw frames reach the encoder through the encode worker
+        frame_id, width, height = captured.frame_id, captured.width, captured.height
+        if captured.is_encoded:
+            self.on_encoded_frame(frame_id, captured.timestamp_ms, captured.data)
 
         # calculate continuous FPS
         self.last_few_frame_ids.append((frame_id, int(datetime.datetime.now().timestamp() * 1000)))
@@ -441,23 +462,34 @@ class BaseClient(ABC, metaclass=QABCMeta):
 
     def on_telemetry_data(self, data):
         if self.is_sending:
-            packet_data = json.dumps(data).encode('utf-8')
-            packet = struct.pack("B", PACKET_TYPE["telemetry"]) + packet_data
-            # Send telemetry on all active connections
-            # self.network_worker_quic.enqueue_stream_packet(packet)
-            # self.network_worker_ws.enqueue_packet(packet)
-            self.network_worker_mqtt.send_data(packet_data)
+            if self.telemetry_encoder is None:
+                packet_data = json.dumps(data).encode('utf-8')
+            else:
+                # None while a batch is filling up
+                packet_data = self.telemetry_encoder.encode(data)
+            if packet_data is not None:
+                # MQTT while the broker is reachable, else the QUIC or WebSocket connection
+                self.transport_manager.send_telemetry(packet_data)
 
     def on_imu_data(self, data):
         pass
 
+    def on_route_changed(self, traffic_class, transport):
+        if traffic_class == "telemetry" and self.telemetry_encoder is not None:
+            # the receivers behind the new transport have not seen the deltas so far
+            self.telemetry_encoder.request_snapshot()
+
+    def switch_protocol(self, protocol):
+        """Pin the video to a transport, AUTO lets the transport manager choose by health again."""
+        self.transport_manager.pin_video(None if protocol == "AUTO" else protocol)
+
     def on_encoded_frame(self, frame_id, timestamp, encoded_bytes):
         if self.write_to_file:
-            self.output_file.write(encoded_bytes)
-            self.output_file.flush()
+            # queued for the writer thread, after a drop the dump goes on at the next keyframe
+            self.output_file.write(encoded_bytes, boundary=is_keyframe(encoded_bytes))
         if self.is_sending:
-            # Send the encoded frame over the network
-            self.network_worker_quic.enqueue_frame(frame_id, timestamp, encoded_bytes)
+            # Send the encoded frame over the healthiest transport
+            self.transport_manager.send_frame(frame_id, timestamp, encoded_bytes)
             self.telemetry.notify_new_frame_processed()
 
     def toggle_capture(self):
@@ -475,10 +507,20 @@ class BaseClient(ABC, metaclass=QABCMeta):
 
     def toggle_sending(self):
         self.is_sending = not self.is_sending
+        if self.is_sending and self.telemetry_encoder is not None:
+            self.telemetry_encoder.request_snapshot()
+        if self.abr_controller is not None:
+            if self.is_sending:
+                self.abr_controller.start()
+            else:
+                self.abr_controller.stop()
         self.log_message(f"Sending {'enabled' if self.is_sending else 'disabled'}")
 
     def toggle_write_to_file(self):
         self.write_to_file = not self.write_to_file
+        if not self.write_to_file:
+            # frames are left out from here, the dump picks up again at a keyframe
+            self.output_file.gap()
         self.log_message(f"Write to file {'enabled' if self.write_to_file else 'disabled'}")
 
     def log_message(self, message):
@@ -499,11 +541,15 @@ class BaseClient(ABC, metaclass=QABCMeta):
     def close(self):
         self._running = False
         self.video_source.stop()
+        self.encode_worker.stop()
         self.encoder.close()
+        self.transport_manager.stop()
         self.network_worker_ws.stop()
         self.network_worker_quic.stop()
-        self.output_file.close()
-        self.hw_info_generator_timer.stop()
+        self.hw_sampler.stop()
+        self.pipeline_stats_timer.stop()
+        self.clock_sync_timer.stop()
+        self.dump_writer.stop()
         logger.info("BaseClient closed.")
 
     @abstractmethod
@@ -0,0 +1,69 @@
+import time
+from typing import Optional
+
+from PyQt5.QtCore import QThread
+from utils.app_logger import logger
+from utils.frame_mailbox import LatestFrameMailbox
+from utils.pipeline_stats import PipelineStats
+from encoder import Encoder
+from sensor.video_source import CapturedFrame
+from globals import VIDEO_RESOLUTION
+
+
+class EncodeWorker(QThread):
+    """Encodes raw frames on its own thread, away from capture and the Qt main thread.
+
+    Capture hands frames over through a single-slot mailbox: when encoding
+    falls behind, the frame waiting there is replaced and never encoded,
+    instead of queueing up latency. x264 releases the GIL while it encodes,
+    so capture and the network thread keep running meanwhile. Encoded frames
+    are emitted by the encoder's encode_ready signal from this thread.
+    """
+
+    def __init__(self, encoder: Encoder, pipeline_stats: Optional[PipelineStats] = None,
+                 select_backend: bool = True, parent=None):
+        super().__init__(parent)
+        self.encoder = encoder
+        self.select_backend = select_backend  # probe the encoder backends when the thread starts
+        self.pipeline_stats = pipeline_stats
+        self.mailbox = LatestFrameMailbox("encode")
+        self._running = False
+
+    def submit(self, captured: CapturedFrame):
+        """Slot for a video source's frame_ready, runs on the capture thread and never blocks."""
+        if captured.is_encoded:
+            # the camera encodes in hardware, BaseClient.on_new_frame passes those frames on
+            return
+        self.mailbox.put(captured)
+
+    def run(self):
+        self._running = True
+        logger.info("Encode worker started")
+        if self.select_backend:
+            try:
+                # frames arriving meanwhile replace each other in the mailbox
+                self.encoder.select_backend(*VIDEO_RESOLUTION)
+            except Exception as e:
+                logger.error(f"Encoder backend probe failed, keeping {self.encoder.backend.name}: {e}")
+        while self._running:
+            handoff = self.mailbox.get(timeout=0.5)
+            if handoff is None:
+                continue
+            captured, waited = handoff
+            start = time.monotonic()
+            try:
+                self.encoder.encode_frame(captured.frame_id, captured.data, captured.width, captured.height,
+                                          capture_time=captured.capture_time, pixel_format=captured.pixel_format)
+            except Exception as e:
+                logger.error(f"Encode worker failed on frame {captured.frame_id}: {e}")
+                continue
+            if self.pipeline_stats is not None:
+                self.pipeline_stats.record("handoff", waited * 1000)
+                self.pipeline_stats.record("encode", (time.monotonic() - start) * 1000)
+        logger.info(f"Encode worker stopped, {self.mailbox.delivered} frames encoded, "
+                    f"{self.mailbox.dropped} dropped before encode")
+
+    def stop(self):
+        self._running = False
+        self.mailbox.close()
+        self.wait(4000)
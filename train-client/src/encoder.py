@@ -1,12 +1,19 @@
 import av
+from av.video.frame import PictureType
+import cv2
 import datetime
-from fractions import Fraction
+import threading
+import numpy as np
 from PyQt5.QtCore import QObject, pyqtSignal
 from utils.app_logger import logger
+from sensor.video_source import monotonic_to_epoch_ms
+from encoder_backends import get_backend, probe_backends
 
 from globals import *
+
+
 class Encoder(QObject):
-    encode_ready = pyqtSignal(int, object, object)  # Emits frame_id, timestamp (as object to handle 64-bit), encoded_bytes
+    encode_ready = pyqtSignal(int, object, object)  # Emits frame_id, timestamp (as object to handle 64-bit), encoded_bytes (memoryview of the packet)
     def __init__(self, parent=None):
         super().__init__(parent)
         self.frame_rate = VIDEO_FPS
@@ -15,11 +22,82 @@ class Encoder(QObject):
         self.current_bitrate = VIDEO_BITRATE
         self.min_bitrate = LOW_BITRATE
         self.max_bitrate = HIGH_BITRATE
-        self.output_container = None
-        self.stream = None
+        self.gop_size = ENCODER_GOP_SIZE
+        # ENCODER_BACKEND, or the default until select_backend has probed the candidates
+        self.backend = get_backend(DEFAULT_ENCODER_BACKEND if ENCODER_BACKEND == "auto" else ENCODER_BACKEND)
+        self.fallback_backends = []  # tried in order when the backend cannot be opened
+        self.codec_context = None
         self.enc_width = None
         self.enc_height = None
-        self._pending_reinit = False  # Flag when bitrate change requires reinit
+        self.rate_ceiling = None  # VBV maxrate the running encoder was opened with
+        self.frame_index = 0  # frames fed to the running encoder, a keyframe is due at every multiple of gop_size
+        self.pts = 0  # presentation timestamp in 1/frame_rate, keeps counting across standby switches
+        self._pending_frames = {}  # pts -> (frame_id, capture_time) of frames the encoder has not output yet
+        # set_bitrate may be called from another thread than the one encoding,
+        # the codec context is only touched by encode_frame
+        self._bitrate_pending = False
+        self._keyframe_requested = False  # set by request_keyframe, possibly from the network thread
+        # I420 buffer the BGR frames are converted into, reused for every frame of the same size.
+        # libavcodec copies frames it does not own on encode, so it can be overwritten right after
+        self._yuv_buffer = None
+        # Encoder opened in the background for a bitrate the running one cannot switch to,
+        # (codec_context, rate_ceiling), swapped in at the next GOP boundary
+        self._standby = None
+        self._standby_thread = None
+        self._generation = 0  # bumped on every (re)init, a standby of an older generation is dropped
+        self.standby_switches = 0
+
+    def _open_encoder(self, width: int, height: int, rate_ceiling: int):
+        """Open a bare codec context for the given resolution, ready to encode the first frame.
+
+        There is no container, so no global header is set and the encoder
+        writes Annex-B packets with SPS/PPS in front of every IDR frame.
+        """
+        return self.backend.open(width, height, self.frame_rate, self.gop_size, rate_ceiling, self.pixel_format)
+
+    @property
+    def codec_name(self) -> str:
+        return self.backend.codec_name
+
+    @property
+    def live_rate_control(self) -> bool:
+        """True if the backend follows a new codec_context.bit_rate from the next frame on, else a standby encoder is used."""
+        return self.backend.live_rate_control
+
+    def select_backend(self, width: int, height: int):
+        """Probe the ENCODER_BACKEND_CANDIDATES when ENCODER_BACKEND is "auto".
+
+        Takes the fastest backend whose per-frame encode time stays within
+        ENCODER_LATENCY_BUDGET_MS at this resolution and keeps the others as
+        fallbacks. Takes a few seconds, call it before the first frame.
+        """
+        if ENCODER_BACKEND != "auto":
+            return
+        budget_ms = ENCODER_LATENCY_BUDGET_MS or 1000 / self.frame_rate
+        ranked = probe_backends(ENCODER_BACKEND_CANDIDATES, width, height, self.frame_rate, self.gop_size,
+                                self.current_bitrate, budget_ms)
+        if not ranked:
+            logger.warning(f"No encoder backend passed the probe, keeping {self.backend.name}")
+            return
+        self.backend, self.fallback_backends = ranked[0], ranked[1:]
+        logger.info(f"Encoder backend {self.backend.name} selected, "
+                    f"fallbacks: {', '.join(b.name for b in self.fallback_backends) or 'none'}")
+
+    def _fall_back(self, error: Exception) -> bool:
+        """Move on to the next fallback backend, False if there is none left."""
+        if not self.fallback_backends:
+            return False
+        failed = self.backend
+        self.backend = self.fallback_backends.pop(0)
+        logger.warning(f"Encoder backend {failed.name} failed ({error}), falling back to {self.backend.name}")
+        return True
+
+    def _rate_ceiling(self) -> int:
+        if self.live_rate_control:
+            # room to raise the bitrate live up to the maximum
+            return max(self.max_bitrate, self.current_bitrate)
+        # the bitrate is fixed once open
+        return self.current_bitrate
 
     def init_encoder(self, width: int, height: int):
         """(Re)initialize encoder for given resolution."""
@@ -27,85 +105,170 @@ class Encoder(QObject):
         self.close()
         self.enc_width = width
         self.enc_height = height
-        self.output_container = av.open('pipe:', mode='w', format='mp4')
-        fps_fraction = Fraction(self.frame_rate).limit_denominator(1000)
-        self.stream = self.output_container.add_stream('h264', rate=fps_fraction)
-        self.stream.pix_fmt = self.pixel_format
-        self.stream.width = width
-        self.stream.height = height
-        # Base options
-        self.stream.options = {
-            'g': '30',
-            'gop_size': '30',
-            'idr_interval': '30',
-            'keyint_min': '30',
-            'forced-idr': '1',
-            'preset': 'fast',
-            'level': '3.1',
-            'crf': '23',
-            'tune': 'zerolatency',
-            'sc_threshold': '0',
-            'x264-params': (
-                'keyint=30:min-keyint=30:scenecut=0:'
-                'force-idr=1:repeat_headers=1'
-            ),
-        }
+        while True:
+            self.rate_ceiling = self._rate_ceiling()
+            try:
+                self.codec_context = self._open_encoder(width, height, self.rate_ceiling)
+                break
+            except Exception as e:
+                if not self._fall_back(e):
+                    raise
+        self.frame_index = 0
         self.update_encoder_parameters()
-        logger.info(f"Encoder initialized ({width}x{height}) bitrate={self.current_bitrate}")
+        logger.info(f"Encoder initialized ({width}x{height}, {self.backend.name}) "
+                    f"bitrate={self.current_bitrate} maxrate={self.rate_ceiling}")
 
     def update_encoder_parameters(self):
-        if not self.stream:
+        """Apply current_bitrate to the running encoder, or prepare a standby encoder if it cannot follow."""
+        if not self.codec_context:
             return
-        # Merge bitrate-related options
-        self.stream.options = {
-            **self.stream.options,
-            'bitrate': str(self.current_bitrate),
-            'bufsize': str(self.current_bitrate * 2),
-            'maxrate': str(self.current_bitrate),
-            'minrate': str(self.current_bitrate // 2),
-        }
-        if hasattr(self.stream, 'codec_context') and self.stream.codec_context:
-            try:
-                self.stream.codec_context.bit_rate = self.current_bitrate
-            except Exception:
-                pass
+        if self.current_bitrate == self.codec_context.bit_rate:
+            return
+        if self.live_rate_control and self.current_bitrate <= self.rate_ceiling:
+            self.codec_context.bit_rate = self.current_bitrate
+            return
+        if self._standby_thread is not None and self._standby_thread.is_alive():
+            # applied again once that standby is running
+            return
+        rate_ceiling = self._rate_ceiling()
+        self._standby_thread = threading.Thread(
+            target=self._prepare_standby,
+            args=(self._generation, self.enc_width, self.enc_height, rate_ceiling),
+            name="EncoderStandby", daemon=True)
+        self._standby_thread.start()
+
+    def _prepare_standby(self, generation: int, width: int, height: int, rate_ceiling: int):
+        try:
+            codec_context = self._open_encoder(width, height, rate_ceiling)
+        except Exception as e:
+            logger.error(f"Could not open a standby encoder at {rate_ceiling} bps: {e}")
+            return
+        if generation != self._generation:
+            self._close_encoder(codec_context)
+            return
+        self._standby = (codec_context, rate_ceiling)
+        logger.debug(f"Standby encoder at {rate_ceiling} bps ready, switching at the next keyframe")
+
+    def _switch_to_standby(self):
+        codec_context, rate_ceiling = self._standby
+        self._standby = None
+        old = self.codec_context
+        self.codec_context = codec_context
+        self.rate_ceiling = rate_ceiling
+        self.frame_index = 0
+        self.standby_switches += 1
+        # draining the old encoder takes a moment, keep it off the capture path
+        threading.Thread(target=self._close_encoder, args=(old,), name="EncoderClose", daemon=True).start()
+        logger.info(f"Switched to the standby encoder (maxrate={rate_ceiling})")
+        self.update_encoder_parameters()
 
     def set_bitrate(self, new_bitrate: int, immediate: bool = True):
+        """Change the bitrate without restarting the encoder.
+
+        libx264 takes the new rate from the next frame on. Other backends, and
+        rates above the VBV maxrate the encoder was opened with, get a standby
+        encoder opened in the background and swapped in at the next keyframe,
+        so frames keep coming either way. The change is applied by the thread
+        encoding, from the next frame on, or with immediate=False from the
+        next keyframe on.
+        """
         # Clamp to allowed range
         old_bitrate = self.current_bitrate
         self.current_bitrate = max(self.min_bitrate, min(self.max_bitrate, new_bitrate))
         if old_bitrate != self.current_bitrate:
-            if immediate and self.enc_width and self.enc_height:
-                # Recreate encoder with same resolution
-                self.init_encoder(self.enc_width, self.enc_height)
-            else:
-                self._pending_reinit = True
+            if immediate:
+                self._bitrate_pending = True
             logger.info(f"Encoder bitrate set to {self.current_bitrate} bps (old={old_bitrate})")
         else:
             logger.info(f"Encoder bitrate unchanged at {self.current_bitrate} bps")
 
+    def _to_video_frame(self, frame, width: int, height: int, pixel_format=None) -> av.VideoFrame:
+        """Wrap a source frame for the encoder without allocating new planes.
+
+        Accepts an ndarray in the pixel format the source reports, or an
+        av.VideoFrame. Without a pixel format, a (height, width, 3) ndarray is
+        taken as bgr24 and a (height * 3 / 2, width) one as yuv420p. BGR frames
+        are converted into a buffer that is reused for every frame, YUV input
+        is passed on as it is.
+        """
+        if isinstance(frame, av.VideoFrame):
+            if frame.format.name != self.pixel_format:
+                return frame.reformat(format=self.pixel_format)
+            return frame
+        if pixel_format is None:
+            pixel_format = 'yuv420p' if frame.ndim == 2 else 'bgr24'
+        if pixel_format == 'yuv420p':
+            # the source already delivers I420
+            return av.VideoFrame.from_numpy_buffer(np.ascontiguousarray(frame), format='yuv420p')
+        if pixel_format != 'bgr24':
+            return av.VideoFrame.from_ndarray(frame, format=pixel_format)
+        if self._yuv_buffer is None or self._yuv_buffer.shape != (height * 3 // 2, width):
+            self._yuv_buffer = np.empty((height * 3 // 2, width), dtype=np.uint8)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420, dst=self._yuv_buffer)
+        return av.VideoFrame.from_numpy_buffer(self._yuv_buffer, format='yuv420p')
+
+    def request_keyframe(self):
+        """Make the next frame an IDR and start a new GOP there, e.g. after the network dropped frames."""
+        self._keyframe_requested = True
 
-    def encode_frame(self, frame_id, frame, width, height, log_callback=None):
-        # Lazy init or reinit if resolution changed or pending bitrate reinit
-        if (self.stream is None or
+    def encode_frame(self, frame_id, frame, width, height, log_callback=None, capture_time=None, pixel_format=None):
+        """Encode one frame and emit encode_ready for every packet.
+
+        capture_time is time.monotonic() when the source acquired the frame,
+        the packets carry it as their timestamp. Without it they get the time
+        they left the encoder.
+        """
+        # Lazy init or reinit if resolution changed
+        force_keyframe = False
+        if (self.codec_context is None or
             self.enc_width != width or
-            self.enc_height != height or
-            self._pending_reinit):
+            self.enc_height != height):
             self.init_encoder(width, height)
-            self._pending_reinit = False
-        av_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+            self._keyframe_requested = False  # a new encoder starts with one
+        else:
+            if self._keyframe_requested:
+                self._keyframe_requested = False
+                if self.frame_index % self.gop_size != 0:
+                    # the forced keyframe starts a new GOP, so a pending switch can happen right here
+                    self.frame_index = 0
+                    force_keyframe = True
+            if self.frame_index % self.gop_size == 0:
+                # GOP boundary, the next frame is a keyframe anyway
+                if self._standby is not None:
+                    self._switch_to_standby()
+                elif self.current_bitrate != self.codec_context.bit_rate:
+                    self.update_encoder_parameters()
+            elif self._bitrate_pending:
+                self._bitrate_pending = False
+                self.update_encoder_parameters()
+        self.frame_index += 1
+        av_frame = self._to_video_frame(frame, width, height, pixel_format)
+        av_frame.pts = self.pts
+        if force_keyframe:
+            av_frame.pict_type = PictureType.I
+        self._pending_frames[self.pts] = (frame_id, capture_time)
+        self.pts += 1
         try:
-            packets = self.stream.encode(av_frame)
+            packets = self.codec_context.encode(av_frame)
         except Exception as e:
             logger.error(f"Encoder error on frame {frame_id}: {e}. Attempting reinitialization.")
-            # Try one reinit and retry once
+            # Try one reinit and retry once, then the next backend
             self.init_encoder(width, height)
-            av_frame_retry = av.VideoFrame.from_ndarray(frame, format='bgr24')
-            packets = self.stream.encode(av_frame_retry)
+            try:
+                packets = self.codec_context.encode(av_frame)
+            except Exception as retry_error:
+                if not self._fall_back(retry_error):
+                    raise
+                self.init_encoder(width, height)
+                packets = self.codec_context.encode(av_frame)
         for packet in packets:
-            current_sps_pps = self.stream.codec_context.extradata
-            encoded_frame = bytes(packet)
-            timestamp = int(datetime.datetime.now().timestamp() * 1000)  # Current timestamp in milliseconds
+            # the packet buffer is handed on as it is, it stays valid as long as the view is referenced
+            encoded_frame = memoryview(packet)
+            packet_frame_id, packet_capture_time = self._take_pending_frame(packet.pts, frame_id, capture_time)
+            if packet_capture_time is not None:
+                timestamp = monotonic_to_epoch_ms(packet_capture_time)
+            else:
+                timestamp = int(datetime.datetime.now().timestamp() * 1000)  # Current timestamp in milliseconds
             if len(encoded_frame) > 0:
                 nal_type = encoded_frame[4] & 0x1F
                 # if log_callback:
@@ -121,28 +284,39 @@ class Encoder(QObject):
                 #     elif nal_type == 0:
                 #         log_callback(f"B-frame NAL unit detected for Frame ID: {frame_id}")
 
-                if nal_type == 5:  # IDR frame
-                    # Prepend SPS and PPS to the IDR frame
-                    encoded_frame = current_sps_pps + encoded_frame
-                self.encode_ready.emit(frame_id, timestamp, encoded_frame)
+                if nal_type == 5 and self.codec_context.extradata:
+                    # An encoder that keeps SPS and PPS out of band, prepend them to the IDR frame
+                    encoded_frame = self.codec_context.extradata + encoded_frame
+                self.encode_ready.emit(packet_frame_id, timestamp, encoded_frame)
+
+    def _take_pending_frame(self, pts, frame_id, capture_time):
+        """Frame ID and capture time of the input frame a packet belongs to, frames before it are forgotten."""
+        if pts not in self._pending_frames:
+            return frame_id, capture_time
+        while True:
+            pending_pts, entry = next(iter(self._pending_frames.items()))
+            del self._pending_frames[pending_pts]
+            if pending_pts == pts:
+                return entry
 
 
     def close(self):
+        self._generation += 1
+        self._pending_frames.clear()
+        if self._standby is not None:
+            self._close_encoder(self._standby[0])
+            self._standby = None
         try:
-            # Drain encoder if possible
-            if self.stream:
-                try:
-                    for _ in self.stream.encode():
-                        pass
-                except Exception:
-                    pass
-            if self.output_container:
-                try:
-                    self.output_container.close()
-                except Exception:
-                    pass
-        except Exception as e:
-            logger.warning(f"Error closing encoder container: {e}")
+            self._close_encoder(self.codec_context)
         finally:
-            self.output_container = None
-            self.stream = None
\ No newline at end of file
+            self.codec_context = None
+
+    @staticmethod
+    def _close_encoder(codec_context):
+        # Drain encoder if possible
+        if codec_context:
+            try:
+                for _ in codec_context.encode():
+                    pass
+            except Exception as e:
+                logger.warning(f"Error draining encoder: {e}")
@@ -0,0 +1,201 @@
+import time
+from fractions import Fraction
+from typing import Dict, List, Optional
+
+import av
+import numpy as np
+
+from utils.app_logger import logger
+from globals import ENCODER_VBV_BUFFER, ENCODER_PROBE_FRAMES
+
+
+class EncoderBackend:
+    """An FFmpeg H.264 encoder and the options the train opens it with.
+
+    open() returns a bare, opened av.CodecContext that takes yuv420p frames
+    and writes Annex-B packets with SPS/PPS in front of every IDR frame.
+    Backends with live_rate_control follow a new bit_rate from the next
+    frame on, the others are opened again through a standby encoder.
+    """
+
+    live_rate_control = False
+
+    def __init__(self, name: str, codec_name: str):
+        self.name = name
+        self.codec_name = codec_name
+
+    def is_available(self) -> bool:
+        """True if the FFmpeg build has the codec, opening it may still fail without the hardware."""
+        try:
+            av.Codec(self.codec_name, 'w')
+        except Exception:
+            return False
+        return True
+
+    def options(self, gop_size: int, rate_ceiling: int) -> Dict[str, str]:
+        return {}
+
+    def open(self, width: int, height: int, frame_rate: float, gop_size: int, rate_ceiling: int,
+             pixel_format: str = 'yuv420p'):
+        fps_fraction = Fraction(frame_rate).limit_denominator(1000)
+        codec_context = av.CodecContext.create(self.codec_name, 'w')
+        codec_context.pix_fmt = pixel_format
+        codec_context.width = width
+        codec_context.height = height
+        codec_context.framerate = fps_fraction
+        codec_context.time_base = 1 / fps_fraction
+        codec_context.gop_size = gop_size
+        codec_context.max_b_frames = 0
+        codec_context.options = self.options(gop_size, rate_ceiling)
+        codec_context.bit_rate = rate_ceiling
+        codec_context.open(strict=False)
+        return codec_context
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name})"
+
+
+class X264Backend(EncoderBackend):
+    live_rate_control = True
+
+    def __init__(self, preset: str):
+        super().__init__(f"x264-{preset}", "libx264")
+        self.preset = preset
+
+    def options(self, gop_size: int, rate_ceiling: int) -> Dict[str, str]:
+        # Rate control is ABR with a VBV cap instead of CRF, x264 ignores bit_rate under CRF.
+        # x264 only follows later bit_rate changes when it starts at the VBV maxrate,
+        # the Encoder sets the actual bitrate before the first frame
+        return {
+            'g': str(gop_size),
+            'idr_interval': str(gop_size),
+            'keyint_min': str(gop_size),
+            'forced-idr': '1',
+            'preset': self.preset,
+            'level': '3.1',
+            'tune': 'zerolatency',
+            'sc_threshold': '0',
+            'maxrate': str(rate_ceiling),
+            'bufsize': str(int(rate_ceiling * ENCODER_VBV_BUFFER)),
+            'x264-params': (
+                f'keyint={gop_size}:min-keyint={gop_size}:scenecut=0:'
+                'force-idr=1:repeat_headers=1'
+            ),
+        }
+
+
+class OpenH264Backend(EncoderBackend):
+    def __init__(self):
+        super().__init__("openh264", "libopenh264")
+
+    def options(self, gop_size: int, rate_ceiling: int) -> Dict[str, str]:
+        # frame skipping would leave gaps in the frame IDs the receivers count as loss
+        return {'allow_skip_frames': '0', 'rc_mode': 'bitrate', 'profile': 'constrained_baseline'}
+
+
+class V4L2M2MBackend(EncoderBackend):
+    """Stateful V4L2 memory-to-memory encoder, only opens where the kernel exposes one."""
+
+    def __init__(self):
+        super().__init__("v4l2m2m", "h264_v4l2m2m")
+
+    def options(self, gop_size: int, rate_ceiling: int) -> Dict[str, str]:
+        # few buffers keep the encoder latency at about one frame
+        return {'num_output_buffers': '4', 'num_capture_buffers': '4'}
+
+
+ENCODER_BACKENDS: Dict[str, EncoderBackend] = {
+    backend.name: backend for backend in (
+        V4L2M2MBackend(),
+        OpenH264Backend(),
+        X264Backend("fast"),
+        X264Backend("veryfast"),
+        X264Backend("superfast"),
+        X264Backend("ultrafast"),
+    )
+}
+
+
+def get_backend(name: str) -> EncoderBackend:
+    try:
+        return ENCODER_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown encoder backend {name!r}, known: {', '.join(ENCODER_BACKENDS)}") from None
+
+
+def synthetic_frames(width: int, height: int, count: int = 8) -> List[np.ndarray]:
+    """I420 frames of a moving, noisy gradient, so that P-frames cost about as much as camera frames."""
+    rng = np.random.default_rng(1)
+    luma = np.add.outer(np.arange(height), np.arange(width)).astype(np.uint8)
+    frames = []
+    for i in range(count):
+        frame = np.full((height * 3 // 2, width), 128, dtype=np.uint8)
+        frame[:height] = np.roll(luma, 8 * i, axis=1) + rng.integers(0, 24, size=luma.shape, dtype=np.uint8)
+        frames.append(frame)
+    return frames
+
+
+def measure_backend(backend: EncoderBackend, width: int, height: int, frame_rate: float, gop_size: int,
+                    bitrate: int, frames: int = ENCODER_PROBE_FRAMES) -> Optional[dict]:
+    """Encode synthetic frames with one backend, None if it cannot be opened or fails."""
+    if not backend.is_available():
+        return None
+    try:
+        codec_context = backend.open(width, height, frame_rate, gop_size, bitrate)
+    except Exception as e:
+        logger.debug(f"Encoder backend {backend.name} cannot be opened: {e}")
+        return None
+    samples = []
+    packets = 0
+    try:
+        for index, frame in enumerate(synthetic_frames(width, height) * (frames // 8 + 1)):
+            if index >= frames:
+                break
+            av_frame = av.VideoFrame.from_numpy_buffer(frame, format='yuv420p')
+            av_frame.pts = index
+            start = time.perf_counter()
+            packets += len(codec_context.encode(av_frame))
+            samples.append((time.perf_counter() - start) * 1000)
+        for _ in codec_context.encode():
+            pass
+    except Exception as e:
+        logger.debug(f"Encoder backend {backend.name} failed while encoding: {e}")
+        return None
+    if not packets or not samples:
+        return None
+    # the first frames include opening and the keyframe
+    steady = sorted(samples[min(2, len(samples) - 1):])
+    return {
+        "name": backend.name,
+        "mean_ms": sum(steady) / len(steady),
+        "p95_ms": steady[min(len(steady) - 1, int(len(steady) * 0.95))],
+    }
+
+
+def probe_backends(candidates: List[str], width: int, height: int, frame_rate: float, gop_size: int,
+                   bitrate: int, budget_ms: float, frames: int = ENCODER_PROBE_FRAMES) -> List[EncoderBackend]:
+    """Order the candidate backends for this machine, the one to use first.
+
+    Every candidate encodes `frames` synthetic frames. The candidates whose
+    p95 encode time meets `budget_ms` come first, in the order given, so a
+    hardware encoder or a slower x264 preset that compresses better wins
+    over a faster one as long as it keeps up. The others follow, fastest
+    first. Backends that cannot open or encode are left out, the rest of
+    the list is the fallback order.
+    """
+    within_budget = []
+    over_budget = []
+    for name in candidates:
+        backend = get_backend(name)
+        result = measure_backend(backend, width, height, frame_rate, gop_size, bitrate, frames)
+        if result is None:
+            logger.info(f"Encoder probe: {name} not usable here")
+            continue
+        logger.info(f"Encoder probe: {name} {width}x{height} mean={result['mean_ms']:.1f}ms "
+                    f"p95={result['p95_ms']:.1f}ms (budget {budget_ms:.1f}ms)")
+        if result["p95_ms"] <= budget_ms:
+            within_budget.append(backend)
+        else:
+            over_budget.append((result["mean_ms"], backend))
+    over_budget.sort(key=lambda result: result[0])
+    return within_budget + [backend for _, backend in over_budget]
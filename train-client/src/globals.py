@@ -44,8 +44,37 @@ PACKET_TYPE = {
     "map_disconnect": 31,
     "connect": 32,
     "connect_response": 33,
+    "admission": 34,
+    "pmtu_probe": 35,
+    "pmtu_ack": 36,
+    "video_fec": 37,
+    "receiver_report": 38,
+    "nack": 39,
+    "video_frame": 40,
 }
 
+# Control-plane lanes for stream messages, a lower value is always served first
+STREAM_LANE = {
+    "urgent": 0,
+    "control": 1,
+    "probe": 2,
+    "bulk": 3,
+}
+
+STREAM_LANE_BY_PACKET_TYPE = {
+    PACKET_TYPE["connect"]: STREAM_LANE["urgent"],
+    PACKET_TYPE["command"]: STREAM_LANE["urgent"],
+    PACKET_TYPE["map_connect"]: STREAM_LANE["control"],
+    PACKET_TYPE["map_disconnect"]: STREAM_LANE["control"],
+    PACKET_TYPE["rtt"]: STREAM_LANE["probe"],
+    PACKET_TYPE["rtt_train"]: STREAM_LANE["probe"],
+    PACKET_TYPE["keepalive"]: STREAM_LANE["bulk"],
+    PACKET_TYPE["telemetry"]: STREAM_LANE["bulk"],
+}
+
+STREAM_BULK_INTERVAL = 0.1  # seconds between two bulk messages, higher lanes are not paced
+CONTROL_PLANE_STATS_INTERVAL = 60  # seconds
+
 TRAIN_STATUS = {
     "POWER_ON": "running",
     "POWER_OFF": "stopped",
@@ -65,7 +94,98 @@ WS_PORT = 8000
 QUIC_PORT = 4437
 MQTT_PORT = 1883
 WEBSOCKET_URL = f"wss://{SERVER}:{WS_PORT}/ws"
-MAX_PACKET_SIZE = 1000
+MAX_PACKET_SIZE = 1000  # video payload per datagram until the QUIC path MTU is known
+
+# Reconnecting the QUIC connection, with a session ticket of the last connection the connect message is 0-RTT data
+QUIC_CONNECT_TIMEOUT = 1.0         # seconds for the first handshake attempt, doubled with every failed one
+QUIC_CONNECT_MAX_TIMEOUT = 4.0     # cap, has to stay well above the RTT of the worst uplink
+QUIC_RECONNECT_BASE_DELAY = 0.1    # seconds before the second attempt, doubled with every failed one
+QUIC_RECONNECT_MAX_DELAY = 10.0    # backoff cap, the actual delay is drawn from [0, backoff] (full jitter)
+QUIC_PING_INTERVAL = 0.5           # seconds without a packet from the server before a PING asks for one
+QUIC_LIVENESS_TIMEOUT = 2.0        # seconds without a packet from the server before the connection counts as dead
+
+# Video, telemetry and commands over the WebSocket, one message per frame, see "WebSocket video" in central-server/README.md
+WS_WRITE_HIGH_WATER = 32 * 1024    # bytes in the write buffer above which a send waits, the frame queue sheds meanwhile
+WS_WRITE_LOW_WATER = 8 * 1024      # a waiting send goes on once the write buffer has drained to this
+WS_NOTSENT_LOWAT = 16 * 1024       # unsent bytes the kernel takes at most (TCP_NOTSENT_LOWAT), the rest waits in the write buffer
+WS_CONNECT_TIMEOUT = 5.0           # seconds for the TCP, TLS and WebSocket handshakes
+WS_CLOSE_TIMEOUT = 1.0             # seconds to wait for the server's close frame, the path may be gone
+WS_PING_INTERVAL = 1.0             # seconds between WebSocket pings
+WS_PING_TIMEOUT = 5.0              # seconds without a pong before the connection counts as dead, pings queue behind video
+WS_RECONNECT_BASE_DELAY = 0.5      # seconds before the second attempt, doubled with every failed one
+WS_RECONNECT_MAX_DELAY = 10.0      # backoff cap, the actual delay is drawn from [0, backoff] (full jitter)
+WS_CLOSE_TRY_AGAIN_LATER = 1013    # close code of a server at capacity, counts as a failed attempt
+
+# Datagram path MTU discovery on the QUIC connection (sizes are UDP payload bytes)
+PMTU_BASE_SIZE = 1200           # QUIC minimum, every path has to carry it
+PMTU_MAX_SIZE = 1452            # 1500 byte Ethernet MTU minus IPv6 and UDP headers
+PMTU_SEARCH_GRANULARITY = 16    # stop the search when the interval is this narrow
+PMTU_PROBE_TIMEOUT = 1.0        # seconds to wait for a pmtu_ack
+PMTU_MAX_PROBES = 3             # lost probes before a size counts as too big
+PMTU_RAISE_INTERVAL = 600       # seconds until a finished search looks for a larger size again
+PMTU_CONFIRM_INTERVAL = 15      # seconds between probes that confirm the current size still works
+VIDEO_HEADER_SIZE = 53          # type, frame_id, number_of_packets, packet_id, train_id, timestamp
+
+# Forward error correction for video datagrams, see "Video Datagrams and FEC" in central-server/README.md
+VIDEO_FEC_ENABLED = True
+FEC_HEADER_SIZE = 6             # group_count and frame_size after the video header
+FEC_INITIAL_GROUP_SIZE = 8      # data packets per parity packet until the server reports the loss
+FEC_GROUP_SIZE_BY_LOSS = [      # (packet loss below, data packets per parity packet), 0 turns FEC off
+    (0.002, 0),
+    (0.01, 16),
+    (0.03, 8),
+    (0.08, 4),
+    (1.01, 2),
+]
+
+# Pacing of the video datagrams of a frame, so that keyframes do not hit the uplink as one burst
+VIDEO_PACING_ENABLED = True
+PACER_FRAME_WINDOW = 0.5        # share of the frame interval a P-frame is spread over at most
+PACER_KEYFRAME_WINDOW = 1.5     # frame intervals a keyframe is spread over at most
+PACER_GAIN = 1.25               # pacing rate over the bandwidth estimate for P-frames, room to find more
+PACER_KEYFRAME_GAIN = 1.0       # keyframes are not used to probe for more bandwidth
+PACER_BANDWIDTH_WINDOW = 10.0   # seconds the highest delivery rate counts as the bottleneck bandwidth
+PACER_MIN_SLEEP = 0.001         # shorter gaps are sent right away, the event loop cannot time them
+
+# Encoded frames waiting for the send loop, the encode thread is never blocked by a slow uplink
+FRAME_QUEUE_SIZE = 30           # frames queued at most, a P-frame that finds the queue full is dropped
+FRAME_QUEUE_MAX_AGE = 0.3       # seconds since capture after which a frame is dropped instead of sent
+
+# Bonding of several uplinks (e.g. one cellular modem each), every extra link is its own QUIC connection.
+# A link is a dict with any of "name", "source_address", "interface" (SO_BINDTODEVICE, needs CAP_NET_RAW),
+# "server_host" and "server_port", e.g. [{"name": "modem2", "interface": "wwan1"}]
+BONDING_LINKS = []
+BONDING_KEYFRAME_REDUNDANCY = 2    # links every keyframe is sent over, a lost keyframe freezes the video for a GOP
+BONDING_SPLIT_FRAMES = True        # spread the packets of a P-frame over the links, else the best link takes it
+BONDING_SPLIT_MAX_SKEW = 0.05      # seconds a link may be slower than the best one and still get a share of a frame
+BONDING_LOSS_WEIGHT = 10.0         # a link with 10% loss costs as much as one with twice the RTT
+BONDING_LOSS_SMOOTHING = 0.2       # weight of the newest loss sample
+BONDING_RECONNECT_INTERVAL = 5.0   # seconds between attempts to bring a link back
+BONDING_CONNECT_TIMEOUT = 5.0      # seconds for the QUIC handshake of a link
+BONDING_KEEPALIVE_INTERVAL = 5.0   # seconds between PINGs on a link that carries no video
+
+# Selective retransmission of keyframe packets the server reports missing (NACK)
+KEYFRAME_RETRANSMIT_BUFFER = 2      # keyframes kept for retransmission
+KEYFRAME_RETRANSMIT_DEADLINE = 0.5  # seconds after sending, later the frame is too old to be useful
+KEYFRAME_MAX_RETRANSMISSIONS = 2    # times the same packet is sent again
+
+# Telemetry encoding, see "Telemetry encoding" in central-server/README.md
+TELEMETRY_ENCODING = "compact"      # "compact": binary snapshots and deltas, "json": one JSON document per sample
+TELEMETRY_SCHEMA_ID = 1             # field layout, utils/telemetry_codec.TELEMETRY_SCHEMAS
+TELEMETRY_SNAPSHOT_INTERVAL = 5.0   # seconds between records with every field, a new receiver waits at most this long
+TELEMETRY_BATCH_SIZE = 1            # samples per message, 5 saves 80% of the publishes for up to 0.8 s of latency
+
+# Transport manager: each traffic class goes over the first healthy transport of its preference list
+TRANSPORT_PREFERENCE = {
+    "video": ["QUIC", "WEBSOCKET"],
+    "telemetry": ["MQTT", "QUIC", "WEBSOCKET"],
+}
+TRANSPORT_HEALTH_INTERVAL = 0.2    # seconds between health checks, a dead route is also noticed on the next frame
+TRANSPORT_SILENCE_TIMEOUT = 0.2    # seconds without a packet from the QUIC server, plus 2 RTT, before video leaves it
+TRANSPORT_MAX_COST = 0.5           # seconds of RTT plus backlog, weighted by loss, above which a transport is unhealthy
+TRANSPORT_LOSS_WEIGHT = 10.0       # 10% loss costs as much as twice the RTT, like BONDING_LOSS_WEIGHT
+TRANSPORT_REPORT_MAX_AGE = 2.0     # seconds a receiver report of the server counts for the loss
+TRANSPORT_RETURN_HOLD = 3.0        # seconds a preferred transport has to stay healthy before traffic returns to it
 
 # Protocol options for video transmission
 PROTOCOL_OPTIONS = {
@@ -116,6 +236,53 @@ STATION_LIST = [
 LOW_BITRATE = 1000000  # 1 Mbps
 MEDIUM_BITRATE = 3000000  # 3 Mbps
 HIGH_BITRATE = 5000000  # 5 Mbps
+ENCODER_GOP_SIZE = 30             # frames from one IDR to the next, a standby encoder is swapped in at this boundary
+ENCODER_VBV_BUFFER = 0.5          # seconds of video at the maximum bitrate the rate control may buffer
+# Encoder backend, a name from encoder_backends.ENCODER_BACKENDS or "auto" to probe the candidates at startup
+ENCODER_BACKEND = "auto"
+DEFAULT_ENCODER_BACKEND = "x264-fast"   # used until the probe has run, and when no candidate passes it
+ENCODER_BACKEND_CANDIDATES = ["v4l2m2m", "openh264", "x264-fast", "x264-veryfast", "x264-superfast", "x264-ultrafast"]
+ENCODER_LATENCY_BUDGET_MS = None  # p95 encode time per frame a backend must meet, None for one frame interval
+ENCODER_PROBE_FRAMES = 30         # synthetic frames every candidate encodes during the probe
+PIPELINE_STATS_INTERVAL = 10      # seconds between log lines with per-stage timing of the video pipeline
+
+# Hardware usage, sampled on the HWSampler thread and written to HW_USAGE_DUMP as JSON lines by the DumpWriter
+HW_SAMPLE_INTERVAL = 1.0          # seconds between samples of CPU, temperature, memory and disk
+HW_GPU_INTERVAL = 10.0            # seconds between vcgencmd queries, each one is a subprocess
+
+# Dumps (H.264, latency logs, hardware usage), written by the DumpWriter thread
+DUMP_FLUSH_INTERVAL = 1.0         # seconds data waits in memory at most, what a crash can lose
+DUMP_FLUSH_BYTES = 1024 * 1024    # queued bytes of one dump that are written right away
+DUMP_BUFFER_BYTES = 16 * 1024 * 1024  # queued bytes per dump before writes are dropped, 30 s of 4 Mbps video
+DUMP_FSYNC_INTERVAL = 10.0        # seconds between fsyncs of a dump, 0 after every write, None only on rotation and close
+DUMP_ROTATE_BYTES = 512 * 1024 * 1024  # a dump continues in a new file after this size, at a line or keyframe, 0 never
+DUMP_MAX_FILES = 0                # files kept per dump, the oldest are removed, 0 keeps all
+
+# Clock sync with the remote controls, for the latency of their commands and keepalives
+CLOCK_SYNC_PROBE_INTERVAL = 2.0   # seconds between rtt_train probes to each connected remote control
+CLOCK_SYNC_BURST = 5              # probes 200 ms apart after map_connect, for a first offset
+CLOCK_SYNC_BUCKET = 16.0          # seconds of probes of which only the one with the lowest RTT is kept
+CLOCK_SYNC_WINDOW = 300.0         # seconds of kept probes the offset and skew are fitted over
+CLOCK_SYNC_MIN_SPAN = 60.0        # seconds the kept probes must span before the skew is fitted
+CLOCK_SYNC_MAX_RTT = 2000         # ms, probes with a longer RTT are ignored
+CLOCK_SYNC_STEP = 20              # ms a clock may jump beyond the uncertainty before the estimate restarts
+CLOCK_SYNC_DRIFT_PPM = 50         # skew assumed while none is fitted, widens the uncertainty with the age of the probes
+CLOCK_SYNC_MAX_SKEW_PPM = 500     # fitted skews are limited to this, quartz clocks stay well within
+
+# Adaptive bitrate: steers the encoder between ABR_MIN_BITRATE and the quality preset of the operator
+ABR_ENABLED = True
+ABR_INTERVAL = 0.5                # seconds between decisions
+ABR_MIN_BITRATE = 300000          # 300 kbps, still a usable picture for driving slowly
+ABR_QUEUE_DELAY_HIGH = 0.2        # seconds of send backlog that count as overuse
+ABR_QUEUE_DELAY_LOW = 0.08        # below this (and low loss) the bitrate may grow
+ABR_LOSS_HIGH = 0.10              # receiver loss that forces a decrease, FEC covers less
+ABR_LOSS_LOW = 0.02
+ABR_DECREASE_FACTOR = 0.85        # of the measured send rate on overuse
+ABR_INCREASE_RATE = 0.08          # relative increase per second while the path is underused
+ABR_HOLD_AFTER_DECREASE = 2.0     # seconds without increases after a decrease
+ABR_MIN_CHANGE = 0.1              # relative change needed before the encoder is reconfigured
+ABR_MIN_INCREASE_INTERVAL = 1.0   # seconds between increases, the rate control needs a moment to settle
+ABR_CWND_UTILIZATION = 0.8        # share of congestion window / RTT the video may use
 
 #FPS
 LOW_FPS = 15
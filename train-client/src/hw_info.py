@@ -1,120 +1,234 @@
-import psutil
-import datetime
+import json
 import os
 import subprocess
-from globals import HW_USAGE_DUMP
-
-class HWInfo:
-    def __init__(self):
-        self._prev_disk_read = None
-        self._prev_disk_write = None
-        self._prev_time = None
-        self.hw_usage_output_file = None
-        self.create_dump_file_for_hw_usage()
-
-    def create_dump_file_for_hw_usage(self):
-        dump_dir = os.path.dirname(HW_USAGE_DUMP)
-        if dump_dir and not os.path.exists(dump_dir):
-            os.makedirs(dump_dir, exist_ok=True)
-
-        time_suffix = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"{HW_USAGE_DUMP}_{time_suffix}.log"
-
-        # create a new file only if it doesn't exist
-        if not os.path.exists(output_filename):
-            self.hw_usage_output_file = open(output_filename, 'w')
-        else:
-            self.hw_usage_output_file = open(output_filename, 'a')
+import threading
+import time
+from typing import Optional
+
+from PyQt5.QtCore import QThread, pyqtSignal
+from utils.app_logger import logger
+from utils.dump_writer import DumpWriter
+from globals import HW_USAGE_DUMP, HW_SAMPLE_INTERVAL, HW_GPU_INTERVAL
+
+MAX_GPU_FREQ_MHZ = 910  # RPi5 typical max core clock, the GPU usage is estimated from it
+SECTOR_BYTES = 512  # /proc/diskstats counts sectors of 512 bytes, whatever the device's sector size
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"  # cpu-thermal on the Raspberry Pi
+CPU_FREQ = "/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq"
+VIRTUAL_DISKS = ("loop", "ram", "zram", "dm-", "md")  # counted again on the disks below them, or not disks at all
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+class HWSampler(QThread):
+    """Samples the hardware usage of the train on its own thread, once per HW_SAMPLE_INTERVAL.
+
+    CPU, temperature, memory and disk come straight from /proc and /sys,
+    without a subprocess, psutil is only imported where there is no /proc. The
+    GPU needs vcgencmd, which takes tens of ms, so it is queried every
+    HW_GPU_INTERVAL and its last values go into the samples in between.
+
+    Every sample is emitted by sample_ready and kept for latest(), the
+    consumers share it and must not change it. The samples, and events
+    like a new remote control, go to the hw_usage dump as JSON lines, the
+    DumpWriter writes them in batches.
+    """
+
+    sample_ready = pyqtSignal(dict)
+
+    def __init__(self, dump_writer: DumpWriter, interval: float = HW_SAMPLE_INTERVAL, parent=None):
+        super().__init__(parent)
+        self.interval = interval
+        self.has_proc = os.path.exists("/proc/stat")
+        self._latest: Optional[dict] = None
+        self._stop_event = threading.Event()
+        self._prev_cpu = None  # (busy, total) jiffies
+        self._prev_disk = None  # (monotonic time, read bytes, written bytes)
+        self._disks = self._physical_disks() if self.has_proc else []
+        self._gpu = {"gpu_memory_mb": None, "gpu_frequency_mhz": None, "gpu_usage_percent": None}
+        self._gpu_memory_mb = None
+        self._gpu_available = True
+        self._gpu_sampled_at = None
+        self.dump = dump_writer.open(HW_USAGE_DUMP, "jsonl")
+
+    def latest(self) -> Optional[dict]:
+        """The last sample, None before the first one. Safe from any thread."""
+        return self._latest
 
     def notify_new_remote_control_connected(self, remote_control_id: str):
-        if self.hw_usage_output_file:
-            self.hw_usage_output_file.write(f"New remote control connected: {remote_control_id}\n")
-            self.hw_usage_output_file.flush()
+        self._log({"created_at": int(time.time() * 1000), "event": "remote_control_connected",
+                   "remote_control_id": remote_control_id})
+
+    def run(self):
+        logger.info(f"HW sampler started, every {self.interval:g} s, GPU every {HW_GPU_INTERVAL:g} s")
+        due = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                sample = self.sample()
+            except Exception as e:
+                logger.error(f"HW sampler failed: {e}")
+            else:
+                self._latest = sample
+                self._log(sample)
+                self.sample_ready.emit(sample)
+            # a fixed schedule, the time the sample took does not add up
+            due += self.interval
+            now = time.monotonic()
+            if due < now:
+                due = now
+            self._stop_event.wait(due - now)
+        self.dump.close()
+        logger.info("HW sampler stopped")
+
+    def stop(self):
+        self._stop_event.set()
+        self.wait(2000)
+
+    def sample(self) -> dict:
+        now = time.monotonic()
+        if self.has_proc:
+            cpu, ghz, temperature = self._cpu_percent(), self._cpu_ghz(), self._temperature()
+            memory = self._memory()
+            read_bytes, write_bytes = self._disk_bytes()
+            disk_percent = self._disk_percent("/")
+        else:
+            import psutil
+            cpu = psutil.cpu_percent(interval=None)
+            freq_info = psutil.cpu_freq()
+            ghz = freq_info.current / 1000.0 if freq_info else 0.0
+            temperature = None
+            mem = psutil.virtual_memory()
+            swap = psutil.swap_memory()
+            memory = (mem.used, mem.total, mem.percent, swap.used)
+            io = psutil.disk_io_counters()
+            read_bytes, write_bytes = (io.read_bytes, io.write_bytes) if io else (0, 0)
+            disk_percent = psutil.disk_usage("/").percent
+
+        read_mb_s = write_mb_s = 0.0
+        if self._prev_disk is not None:
+            dt = max(now - self._prev_disk[0], 1e-6)
+            read_mb_s = (read_bytes - self._prev_disk[1]) / dt / (1024 * 1024)
+            write_mb_s = (write_bytes - self._prev_disk[2]) / dt / (1024 * 1024)
+        self._prev_disk = (now, read_bytes, write_bytes)
+
+        if self._gpu_available and (self._gpu_sampled_at is None or now - self._gpu_sampled_at >= HW_GPU_INTERVAL):
+            self._gpu_sampled_at = now
+            self._gpu = self.get_rpi_gpu_info()
+
+        used, total, percent, swap_used = memory
+        return {
+            "created_at": int(time.time() * 1000),
+            "cpu_usage_percent": int(cpu),
+            "cpu_frequency_ghz": ghz,
+            "cpu_temperature_celsius": temperature,
+            "ram_used_mb": int(used / (1024 * 1024)),
+            "ram_total_gb": total / (1024 * 1024 * 1024),
+            "ram_usage_percent": int(percent),
+            "swap_used_mb": int(swap_used / (1024 * 1024)),
+            "disk_usage_percent": int(disk_percent),
+            "disk_read_mb_s": read_mb_s,
+            "disk_write_mb_s": write_mb_s,
+            **self._gpu,
+        }
+
+    def _cpu_percent(self) -> float:
+        # user nice system idle iowait irq softirq steal, guest time is already in user
+        jiffies = [int(value) for value in _read("/proc/stat").split("\n", 1)[0].split()[1:9]]
+        total = sum(jiffies)
+        busy = total - jiffies[3] - jiffies[4]
+        previous, self._prev_cpu = self._prev_cpu, (busy, total)
+        if previous is None or total == previous[1]:
+            return 0.0
+        return (busy - previous[0]) * 100 / (total - previous[1])
+
+    @staticmethod
+    def _cpu_ghz() -> float:
+        khz = _read(CPU_FREQ)
+        return int(khz) / 1e6 if khz else 0.0
+
+    @staticmethod
+    def _temperature() -> Optional[float]:
+        millidegrees = _read(THERMAL_ZONE)
+        return int(millidegrees) / 1000 if millidegrees else None
+
+    @staticmethod
+    def _memory():
+        info = {}
+        for line in _read("/proc/meminfo").splitlines():
+            key, value = line.split(":", 1)
+            info[key] = int(value.split()[0]) * 1024
+        total = info["MemTotal"]
+        available = info.get("MemAvailable", info["MemFree"])
+        # like psutil: used leaves out buffers and caches, the percent is of what is not available
+        used = total - info["MemFree"] - info.get("Buffers", 0) - info.get("Cached", 0) - info.get("SReclaimable", 0)
+        if used < 0:
+            used = total - info["MemFree"]
+        percent = (total - available) * 100 / total if total else 0.0
+        return used, total, percent, info.get("SwapTotal", 0) - info.get("SwapFree", 0)
+
+    @staticmethod
+    def _disk_percent(path: str) -> float:
+        # like psutil.disk_usage: the blocks reserved for root count as neither used nor free
+        disk = os.statvfs(path)
+        used = (disk.f_blocks - disk.f_bfree) * disk.f_frsize
+        total = used + disk.f_bavail * disk.f_frsize
+        return used * 100 / total if total else 0.0
+
+    @staticmethod
+    def _physical_disks() -> list:
+        try:
+            return [name for name in os.listdir("/sys/block") if not name.startswith(VIRTUAL_DISKS)]
+        except OSError:
+            return []
+
+    def _disk_bytes(self):
+        read_sectors = write_sectors = 0
+        for line in (_read("/proc/diskstats") or "").splitlines():
+            fields = line.split()
+            if len(fields) > 9 and fields[2] in self._disks:
+                read_sectors += int(fields[5])
+                write_sectors += int(fields[9])
+        return read_sectors * SECTOR_BYTES, write_sectors * SECTOR_BYTES
 
     def get_rpi_gpu_info(self):
         """Get Raspberry Pi GPU information using vcgencmd"""
         try:
-            # GPU memory allocation
-            gpu_mem = subprocess.check_output(['vcgencmd', 'get_mem', 'gpu'], timeout=1).decode().strip()
-            gpu_mem_mb = int(gpu_mem.split('=')[1].replace('M', '')) if 'gpu=' in gpu_mem else None
+            if self._gpu_memory_mb is None:
+                # the GPU memory split is fixed at boot
+                gpu_mem = subprocess.check_output(['vcgencmd', 'get_mem', 'gpu'], timeout=1).decode().strip()
+                self._gpu_memory_mb = int(gpu_mem.split('=')[1].replace('M', '')) if 'gpu=' in gpu_mem else None
 
             # GPU core clock frequency
             gpu_freq = subprocess.check_output(['vcgencmd', 'measure_clock', 'core'], timeout=1).decode().strip()
             gpu_freq_mhz = int(gpu_freq.split('=')[1]) / 1000000 if 'frequency' in gpu_freq else None
 
-            # Estimate GPU usage from frequency (RPi5 max core freq is ~910 MHz)
+            # Estimate GPU usage from frequency
             gpu_usage_percent = None
             if gpu_freq_mhz:
-                MAX_GPU_FREQ_MHZ = 910  # RPi5 typical max
                 gpu_usage_percent = min(100, int((gpu_freq_mhz / MAX_GPU_FREQ_MHZ) * 100))
 
             return {
-                "gpu_memory_mb": gpu_mem_mb,
+                "gpu_memory_mb": self._gpu_memory_mb,
                 "gpu_frequency_mhz": gpu_freq_mhz,
                 "gpu_usage_percent": gpu_usage_percent
             }
+        except FileNotFoundError:
+            # not a Raspberry Pi, no need to ask again
+            logger.info("HW sampler: no vcgencmd, the samples carry no GPU usage")
+            self._gpu_available = False
         except Exception as e:
-            return {
-                "gpu_memory_mb": None,
-                "gpu_frequency_mhz": None,
-                "gpu_usage_percent": None
-            }
-
-    def get_hw_info(self, write_to_file = False):
-        cpu = psutil.cpu_percent(interval=None)
-        freq_info = psutil.cpu_freq()
-        freq = int(freq_info.current) if freq_info else 0
-        temps = psutil.sensors_temperatures() if hasattr(psutil, "sensors_temperatures") else {}
-        temp_val = None
-        if temps:
-            for entries in temps.values():
-                if entries:
-                    cur = entries[0].current if hasattr(entries[0], "current") else None
-                    if cur is not None:
-                        temp_val = cur
-                        break
-        mem = psutil.virtual_memory()
-        swap = psutil.swap_memory()
-        disk = psutil.disk_usage('/')
-        io = psutil.disk_io_counters() if hasattr(psutil, "disk_io_counters") else None
-        now = int(datetime.datetime.now().timestamp() * 1000)
-        read_mb_s = 0.0
-        write_mb_s = 0.0
-        if io:
-            if self._prev_disk_read is not None and self._prev_disk_write is not None and self._prev_time is not None:
-                dt = max(now - self._prev_time, 1e-6)
-                read_mb_s = (io.read_bytes - self._prev_disk_read) / dt / (1024 * 1024)
-                write_mb_s = (io.write_bytes - self._prev_disk_write) / dt / (1024 * 1024)
-            self._prev_disk_read = io.read_bytes
-            self._prev_disk_write = io.write_bytes
-            self._prev_time = now
-        used_mb = int(mem.used / (1024 * 1024))
-        total_gb = mem.total / (1024 * 1024 * 1024)
-        swap_mb = int(swap.used / (1024 * 1024))
-        ghz = freq / 1000.0 if freq else 0.0
-
-        # Get GPU info
-        gpu_info = self.get_rpi_gpu_info()
-
-        hw_usage_log_entry = {
-            "created_at": now,
-            "cpu_usage_percent": int(cpu),
-            "cpu_frequency_ghz": ghz,
-            "cpu_temperature_celsius": temp_val,
-            "ram_used_mb": used_mb,
-            "ram_total_gb": total_gb,
-            "ram_usage_percent": int(mem.percent),
-            "swap_used_mb": swap_mb,
-            "disk_usage_percent": int(disk.percent),
-            "disk_read_mb_s": read_mb_s,
-            "disk_write_mb_s": write_mb_s,
-            "gpu_memory_mb": gpu_info["gpu_memory_mb"],
-            "gpu_frequency_mhz": gpu_info["gpu_frequency_mhz"],
-            "gpu_usage_percent": gpu_info["gpu_usage_percent"]
+            logger.warning(f"HW sampler: vcgencmd failed: {e}")
+        return {
+            "gpu_memory_mb": None,
+            "gpu_frequency_mhz": None,
+            "gpu_usage_percent": None
         }
 
-        if write_to_file and self.hw_usage_output_file:
-            self.hw_usage_output_file.write(f"{hw_usage_log_entry}\n")
-            self.hw_usage_output_file.flush()
-
-        return hw_usage_log_entry
+    def _log(self, record: dict):
+        # any thread, the writer thread puts it on disk
+        self.dump.write(json.dumps(record) + "\n")
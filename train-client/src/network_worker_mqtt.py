@@ -81,6 +81,12 @@ class NetworkWorkerMqtt:
         except Exception as e:
             logger.error(f"Error disconnecting MQTT client: {e}")
 
+    def health(self):
+        """For the transport manager, None while not connected. paho does not measure the RTT."""
+        if not self.is_connected:
+            return None
+        return {"rtt": 0.0, "loss": 0.0, "queue_age": 0.0}
+
     def is_mqtt_connected(self):
         """Check if MQTT client is connected"""
         return self.is_connected
\ No newline at end of file
@@ -1,17 +1,32 @@
 import asyncio
-import queue
+import dataclasses
+import random
+import socket
 import ssl
 import json
 import struct
+import time
 import datetime
 from typing import Optional
 
 
 from utils.app_logger import logger
+from utils.control_plane import ControlPlaneQueue
+from utils.datagram_mtu import DatagramPathMTU
+from utils.datagram_pacer import DatagramPacer
+from utils.video_fec import VideoFecEncoder
+from utils.video_frame_queue import VideoFrameQueue
+from utils.video_packetizer import VideoPacketizer
+from utils.pipeline_stats import PipelineStats
+from utils.link_scheduler import LinkScheduler, interleave
+from utils.h264 import is_keyframe
+from utils.video_retransmit import KeyframeRetransmitBuffer, parse_nack
+from utils.stream_reassembler import StreamReassembler
 from PyQt5.QtCore import QThread, pyqtSignal
-from aioquic.asyncio import connect
+from quic_link import QuicLink
 from aioquic.quic.configuration import QuicConfiguration
 from aioquic.quic.connection import QuicConnection
+from aioquic.tls import SessionTicket
 from aioquic.quic.events import QuicEvent, StreamDataReceived, DatagramFrameReceived, ConnectionTerminated, StreamReset
 from aioquic.asyncio.protocol import QuicStreamAdapter
 from aioquic.asyncio.protocol import QuicConnectionProtocol
@@ -37,6 +52,7 @@ class NetworkWorkerQUIC(QThread):
     connection_closed = pyqtSignal()
     process_command = pyqtSignal(object)
     data_received = pyqtSignal(bytes)  # Signal for received data
+    keyframe_requested = pyqtSignal()  # frames were dropped, the video only recovers with a keyframe
 
     def __init__(self, train_client_id: str, parent=None):
         super().__init__(parent)
@@ -54,9 +70,37 @@ class NetworkWorkerQUIC(QThread):
 
         self.server_host = SERVER
         self.server_port = QUIC_PORT
-        self.frame_queue = queue.Queue(maxsize=30)  # Use asyncio.Queue
-        self.stream_packet_queue = queue.Queue()  # Use asyncio.Queue
+        # encoded frames, put by the encode thread
+        self.frame_queue = VideoFrameQueue(f"{train_client_id}:frames", on_keyframe_request=self.keyframe_requested.emit)
+        self.control_plane = ControlPlaneQueue(train_client_id)  # prioritized stream packets
+        self.path_mtu = DatagramPathMTU(train_client_id)
+        self.max_packet_size = MAX_PACKET_SIZE  # video payload per datagram, follows the path MTU
+        self.packetizer = VideoPacketizer(self.train_client_id_bytes)
+        self.fec = VideoFecEncoder(self.train_client_id_bytes) if VIDEO_FEC_ENABLED else None
+        self.retransmit_buffer = KeyframeRetransmitBuffer()  # answers NACKs for lost keyframe packets
+        self.pacer = DatagramPacer(train_client_id, VIDEO_FPS) if VIDEO_PACING_ENABLED else None
+        self.sent_video_bytes = 0  # video and parity datagrams handed to QUIC, read by the ABR controller
+        self.primary_link = QuicLink(0, "primary")  # this connection, as one of the links of a bonded train
+        self.links = [QuicLink.from_config(index + 1, config) for index, config in enumerate(BONDING_LINKS)]
+        self.link_scheduler = LinkScheduler()
+        self._link_tasks = []
+        self._connection_tasks = []  # send loops and probes of the current connection
+        self.session_ticket: Optional[SessionTicket] = None  # from the server, resumes the next connection with 0-RTT
+        self.reconnects = 0
+        self.last_outage: Optional[float] = None  # seconds from losing the connection to the server accepting the next
+        self.last_resumed = False
+        self._disconnected_at: Optional[float] = None
+        self._attempt_started_at: Optional[float] = None
+        self._connect_timeout = QUIC_CONNECT_TIMEOUT
+        self.receiver_report: Optional[dict] = None  # latest receiver report of the server
+        self.receiver_report_count = 0
+        self.receiver_report_at = 0.0  # loop time of the latest receiver report
+        self.pipeline_stats: Optional[PipelineStats] = None  # per-stage timing of the video pipeline, set by BaseClient
+        self._pmtu_acked: Optional[asyncio.Event] = None
         self._running = False
+        self._stopping = False
+        self._accepted = False  # the server admitted the current connection
+        self._stopped: Optional[asyncio.Event] = None
         self._client: Optional[QuicConnection] = None
         self._stream_id: Optional[int] = None
         self._loop: Optional[asyncio.AbstractEventLoop] = None
@@ -65,12 +109,18 @@ class NetworkWorkerQUIC(QThread):
         logger.info(f"QUIC server URL: {self.server_host}:{self.server_port}")
 
     def run(self):
-        self._running = True
         try:
             # Create a new event loop for this thread
             self._loop = asyncio.new_event_loop()
             asyncio.set_event_loop(self._loop)
-            self._loop.run_until_complete(self.run_client())
+            self.control_plane.bind(self._loop)
+            self.frame_queue.bind(self._loop)
+            self._pmtu_acked = asyncio.Event()
+            self._stopped = asyncio.Event()
+            if self._stopping:
+                # stop() came before the loop existed
+                self._stopped.set()
+            self._loop.run_until_complete(self.supervise())
         except Exception as e:
             logger.error(f"QUIC client error: {e}")
             self.connection_failed.emit(str(e))
@@ -80,47 +130,191 @@ class NetworkWorkerQUIC(QThread):
             if self._loop:
                 self._loop.close()
             self._running = False
-            self.connection_closed.emit()
 
-    async def run_client(self):
-        try:
-            async with connect(
-                self.server_host,
-                self.server_port,
-                configuration=self.configuration,
-                create_protocol=lambda *args, **kwargs: QuicClientProtocol(
-                *args, network_worker=self, **kwargs
-            )
-            ) as client:
-                self._client = client
-                self.connection_established.emit()
-
-                # Get a new stream ID for communication
-                self._stream_id = client._quic.get_next_available_stream_id(is_unidirectional=False)
-
-                logger.debug(f"Sending QUIC handshake on stream {self._stream_id}")
-                # Send train identification
-                client._quic.send_stream_data(self._stream_id, self.prepareConnectMessage(), end_stream=False)
-                result = client.transmit()
-                if result is not None:
-                    await result
-                logger.info(f"QUIC handshake sent on stream {self._stream_id}")
-
-                asyncio.create_task(self.send_stream_reliable())  # Start sending stream packets
-                asyncio.create_task(self.send_keepalive())  # Start sending keepalive packets
+    async def supervise(self):
+        """Run the client until stop(), reconnecting with exponential backoff and full jitter.
+
+        The first attempt after a working connection is made right away, a
+        blip or a server restart costs the detection time and one handshake.
+        Every failed attempt doubles the backoff up to QUIC_RECONNECT_MAX_DELAY,
+        the delay is drawn from [0, backoff] so that the trains of a restarted
+        server do not all come back in the same instant.
+        """
+        failures = 0
+        while not self._stopping:
+            if failures:
+                backoff = min(QUIC_RECONNECT_MAX_DELAY, QUIC_RECONNECT_BASE_DELAY * 2 ** (failures - 1))
+                delay = random.uniform(0, backoff)
+                logger.info(f"QUIC: reconnecting in {delay:.2f} s (attempt {failures + 1})")
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), delay)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+            connected = await self.run_client(min(QUIC_CONNECT_MAX_TIMEOUT, QUIC_CONNECT_TIMEOUT * 2 ** failures))
+            if connected:
+                self.connection_closed.emit()
+            if self._stopping:
+                break
+            # a connection the server rejected is retried with backoff like a failed handshake
+            failures = 0 if self._accepted else failures + 1
 
-                # Main sending loop
-                await self.send_datagram_unreliable()
+    async def run_client(self, connect_timeout: float = QUIC_CONNECT_TIMEOUT) -> bool:
+        """One connection to the server, returns True if the handshake completed within `connect_timeout`.
 
+        With a session ticket of an earlier connection the connect message and
+        the first video go out as 0-RTT data in the first flight, the send
+        loops start without waiting for the handshake.
+        """
+        loop = asyncio.get_running_loop()
+        self._running = True
+        self._accepted = False
+        self._attempt_started_at = loop.time()
+        self._connect_timeout = connect_timeout
+        transport = client = handshake = None
+        try:
+            sock, address = await self.primary_link.open_socket(self.server_host, self.server_port)
+            configuration = dataclasses.replace(
+                self.configuration, server_name=self.configuration.server_name or self.server_host,
+                session_ticket=self.session_ticket if self.session_ticket and self.session_ticket.is_valid else None)
+            connection = QuicConnection(configuration=configuration, session_ticket_handler=self.on_session_ticket)
+            transport, client = await loop.create_datagram_endpoint(
+                lambda: QuicClientProtocol(connection, network_worker=self), sock=sock)
+
+            client.connect(address, transmit=False)
+            self._stream_id = connection.get_next_available_stream_id(is_unidirectional=False)
+            logger.debug(f"Sending QUIC handshake on stream {self._stream_id}")
+            connection.send_stream_data(self._stream_id, self.prepareConnectMessage(), end_stream=False)
+            client.transmit()
+            handshake = asyncio.ensure_future(asyncio.wait_for(client.wait_connected(), connect_timeout))
+            early_data = configuration.session_ticket is not None and configuration.session_ticket.max_early_data_size
+            if not early_data:
+                await handshake
+
+            self._client = client
+            self.primary_link.attach(client)
+            self.connection_established.emit()
+            self.path_mtu.reset()
+            self.retransmit_buffer.clear()
+            if self.pacer is not None:
+                self.pacer.reset()
+            self.max_packet_size = MAX_PACKET_SIZE
+            self.enable_path_mtu_probing()
+            # frames of the last connection are stale, and the server's reassembly starts over
+            self.frame_queue.reset()
+            self.frame_queue.reopen()
+            self.keyframe_requested.emit()
+
+            self._connection_tasks = [
+                asyncio.create_task(self.confirm_handshake(client, handshake)),
+                asyncio.create_task(self.send_stream_reliable()),  # Start sending stream packets
+                asyncio.create_task(self.send_keepalive()),  # Start sending keepalive packets
+                asyncio.create_task(self.watch_liveness(client)),
+            ]
+
+            # Main sending loop
+            await self.send_datagram_unreliable()
+
+        except asyncio.TimeoutError:
+            logger.error(f"QUIC connection error: no handshake with {self.server_host}:{self.server_port} "
+                         f"within {connect_timeout:g} s")
+            self.connection_failed.emit("handshake timeout")
         except Exception as e:
             logger.error(f"QUIC connection error: {e}")
             self.connection_failed.emit(str(e))
+        finally:
+            self._running = False
+            connected = handshake is not None and handshake.done() and not handshake.cancelled() \
+                and handshake.exception() is None
+            if handshake is not None and not handshake.done():
+                handshake.cancel()
+            if self._accepted and self._disconnected_at is None:
+                self._disconnected_at = loop.time()
+            self._client = None
+            self.primary_link.detach()
+            for task in self._connection_tasks + self._link_tasks:
+                task.cancel()
+            self._connection_tasks = []
+            self._link_tasks = []
+            if client is not None:
+                # sends CONNECTION_CLOSE without waiting for the peer, it may be gone
+                client.close()
+            if transport is not None:
+                transport.close()
+        return connected
+
+    async def confirm_handshake(self, client: "QuicClientProtocol", handshake: asyncio.Future):
+        try:
+            await handshake
+        except asyncio.TimeoutError:
+            self.on_connection_lost(f"no handshake within {self._connect_timeout:g} s")
+            return
+        except ConnectionError as e:
+            self.on_connection_lost(f"handshake failed: {e}")
+            return
+        tls = client._quic.tls
+        self.last_resumed = tls.session_resumed
+        logger.info(f"QUIC handshake completed in {(self._loop.time() - self._attempt_started_at) * 1000:.0f} ms "
+                    f"on stream {self._stream_id}"
+                    f"{', session resumed' if tls.session_resumed else ''}"
+                    f"{', 0-RTT accepted' if tls.early_data_accepted else ''}")
+
+    def on_session_ticket(self, ticket: SessionTicket):
+        self.session_ticket = ticket
+
+    def on_connect_accepted(self):
+        """The server admitted this connection, the video can flow again."""
+        now = self._loop.time()
+        self._accepted = True
+        if self._disconnected_at is not None:
+            self.reconnects += 1
+            self.last_outage = now - self._disconnected_at
+            logger.info(f"QUIC: reconnected after {self.last_outage * 1000:.0f} ms without a connection, "
+                        f"{(now - self._attempt_started_at) * 1000:.0f} ms of it for the last attempt"
+                        f"{' with a resumed session' if self._client._quic.tls.session_resumed else ''}")
+            self._disconnected_at = None
+        self.start_path_mtu_discovery()
+        self.start_links()
+
+    def on_connection_lost(self, reason: str):
+        """Stop the send loops of the current connection, the supervisor opens the next one."""
+        logger.warning(f"QUIC: connection lost: {reason}")
+        self._running = False
+        self.frame_queue.close()  # wakes the send loop
+
+    async def watch_liveness(self, client: "QuicClientProtocol"):
+        """Detect a dead path or a restarted server long before the idle timeout would.
+
+        A restarted server does not know the connection and drops its
+        packets silently. While the server sends nothing, a PING every
+        QUIC_PING_INTERVAL asks for an ACK, without any packet for
+        QUIC_LIVENESS_TIMEOUT the connection is given up.
+        """
+        while self._running and self._client is client:
+            silent = self._loop.time() - client.last_received
+            if silent >= QUIC_LIVENESS_TIMEOUT:
+                self.on_connection_lost(f"nothing received from the server for {silent:.1f} s")
+                return
+            if silent >= QUIC_PING_INTERVAL:
+                client._quic.send_ping(0)
+                client.transmit()
+            await asyncio.sleep(QUIC_PING_INTERVAL / 2)
+
+    def reconnect_stats(self) -> dict:
+        return {
+            "reconnects": self.reconnects,
+            "last_outage": self.last_outage,
+            "last_resumed": self.last_resumed,
+        }
 
-    def prepareConnectMessage(self):
+    def prepareConnectMessage(self, link_id: int = 0):
         connect_packet = {
             "type": "connect",
             "train_id": self.train_client_id,
         }
+        if link_id:
+            # an extra uplink of this train, not a client of its own
+            connect_packet["link_id"] = link_id
         packet_data = json.dumps(connect_packet).encode('utf-8')
 
         # Create packet with type byte + data
@@ -136,41 +330,92 @@ class NetworkWorkerQUIC(QThread):
         return bytes(length_prefixed_packet)
 
     async def send_stream_reliable(self):
+        last_stats_time = self._loop.time()
+        next_bulk_time = 0.0
         while self._running:
+            now = self._loop.time()
+            if now - last_stats_time >= CONTROL_PLANE_STATS_INTERVAL:
+                self.control_plane.log_stats()
+                self.frame_queue.log_stats()
+                if self.pacer is not None:
+                    self.pacer.log_stats()
+                if self.links:
+                    self.log_link_stats()
+                last_stats_time = now
+
+            lane = self.control_plane.peek_lane()
+            if lane is None:
+                # woken by the next put, or for the next stats line
+                await self.control_plane.wait(timeout=last_stats_time + CONTROL_PLANE_STATS_INTERVAL - now)
+                continue
+            if lane == STREAM_LANE["bulk"] and now < next_bulk_time:
+                # only bulk traffic is paced, a higher-priority packet wakes the loop immediately
+                await self.control_plane.wait(timeout=next_bulk_time - now)
+                continue
+
+            lane, packet = self.control_plane.pop()
+            if lane == STREAM_LANE["bulk"]:
+                next_bulk_time = now + STREAM_BULK_INTERVAL
             try:
-                packet = self.stream_packet_queue.get_nowait()
                 self._client._quic.send_stream_data(self._stream_id, packet, end_stream=False)
                 result = self._client.transmit()
                 if result is not None:
                     await result
-                await asyncio.sleep(0.1)  # 100ms delay
-            except queue.Empty:
-                await asyncio.sleep(0.1)
-                continue
+            except Exception as e:
+                logger.error(f"Error sending stream packet: {e}")
 
 
     async def send_datagram_unreliable(self):
         while self._running:
             try:
-                # Get frame from queue with timeout
-                try:
-                    frame_id, timestamp, frame = self.frame_queue.get_nowait()
-                except queue.Empty:
-                    await asyncio.sleep(0.01)
+                handoff = await self.frame_queue.get()
+                if handoff is None:
+                    # closed, the worker is stopping
                     continue
+                (frame_id, timestamp, frame), waited = handoff
+                enqueued_at = time.monotonic() - waited
 
                 # Split frame into packets and send
-                packet_list = self.create_packets(frame_id, timestamp, frame)
-                for packet in packet_list:
+                if self.fec is not None and self.fec.group_size:
+                    # parity packets carry the FEC header, keep them within the same datagram size
+                    max_packet_size = self.max_packet_size - FEC_HEADER_SIZE
+                    packet_list = self.create_packets(frame_id, timestamp, frame, max_packet_size)
+                    parity_packets = self.fec.create_parity_packets(frame_id, timestamp, frame, max_packet_size)
+                else:
+                    packet_list = self.create_packets(frame_id, timestamp, frame)
+                    parity_packets = []
+                keyframe = is_keyframe(frame)
+                if keyframe:
+                    self.retransmit_buffer.store(frame_id, packet_list)
+                packet_list = packet_list + parity_packets
+                routes = self.route_packets(packet_list, keyframe)
+                if self.pacer is not None:
+                    self.start_paced_frame(sum(len(packet) for _, packet in routes), keyframe)
+                for link, packet in routes:
                     if not self._running:
                         break
                     if self._client is None:
                         raise ConnectionError("Client not connected")
 
-                    self._client._quic.send_datagram_frame(packet)
-                    result = self._client.transmit()
+                    if self.pacer is not None:
+                        delay = self.pacer.delay(time.monotonic(), len(packet))
+                        if delay:
+                            await asyncio.sleep(delay)
+                    client = link.client
+                    if client is None:
+                        # an extra link went down in the middle of the frame
+                        continue
+                    link.send(packet)
+                    self.sent_video_bytes += len(packet)
+                    result = client.transmit()
                     if result is not None:
                         await result
+                if self.pacer is not None:
+                    self.pacer.end_frame(time.monotonic())
+                if self.pipeline_stats is not None:
+                    self.pipeline_stats.record("send", (time.monotonic() - enqueued_at) * 1000)
+                    # timestamp is the capture time of the frame
+                    self.pipeline_stats.record("total", datetime.datetime.now().timestamp() * 1000 - timestamp)
 
             except ConnectionError as e:
                 logger.error(f"Connection lost: {e}")
@@ -179,6 +424,47 @@ class NetworkWorkerQUIC(QThread):
                 logger.error(f"Error in send loop: {e}")
                 continue
 
+    def route_packets(self, packet_list: list, keyframe: bool) -> list:
+        """(link, datagram) pairs of one frame, all on this connection unless extra links are up."""
+        if self.links:
+            samples = []
+            for link in [self.primary_link] + self.links:
+                sample = link.sample()
+                if sample is not None:
+                    samples.append((link, sample))
+            if len(samples) > 1:
+                return interleave(self.link_scheduler.assign(samples, packet_list, keyframe))
+        return [(self.primary_link, packet) for packet in packet_list]
+
+    def start_links(self):
+        """Connect the extra links of a bonded train, once the server accepted this connection."""
+        if self._link_tasks:
+            return
+        for link in self.links:
+            self._link_tasks.append(asyncio.create_task(link.maintain(
+                self.server_host, self.server_port, self.configuration, self.prepareConnectMessage(link.link_id),
+                running=lambda: self._running and self._client is not None)))
+
+    def log_link_stats(self):
+        for link in [self.primary_link] + self.links:
+            stats = link.stats()
+            rtt = f"{stats['smoothed_rtt'] * 1000:.0f} ms" if stats["smoothed_rtt"] else "unknown"
+            rate = f"{stats['rate'] / 1e6:.2f} Mbps" if stats["rate"] else "unknown"
+            logger.info(f"Bonding: link {stats['name']} {'up' if stats['connected'] else 'down'}, rtt {rtt}, "
+                        f"cwnd rate {rate}, loss {stats['loss']:.1%}, {stats['sent_datagrams']} datagrams "
+                        f"({stats['sent_bytes'] / 1e6:.1f} MB) sent, {stats['connects']} connects")
+
+    def start_paced_frame(self, frame_bytes: int, keyframe: bool):
+        """Feed the pacer the current delivery state and size of the frame about to be sent."""
+        quic = self._client._quic
+        recovery = quic._loss
+        now = time.monotonic()
+        if recovery._rtt_initialized:
+            # bytes that left on the path and are no longer in flight, lost ones included
+            delivered = quic._network_paths[0].bytes_sent - recovery.bytes_in_flight if quic._network_paths else 0
+            self.pacer.on_transport_sample(now, delivered, recovery.congestion_window, recovery._rtt_smoothed)
+        self.pacer.start_frame(now, frame_bytes, keyframe)
+
     async def send_keepalive(self):
         while self._running:
             try:
@@ -212,32 +498,173 @@ class NetworkWorkerQUIC(QThread):
                 logger.error(f"Error sending keepalive: {e}")
                 await asyncio.sleep(10)
 
-    def create_packets(self, frame_id: int, timestamp: int, frame: bytes) -> list[bytes]:
-        packet_list = []
-        frame_size = len(frame)
-        number_of_packets = (frame_size // MAX_PACKET_SIZE) + 1
-        remaining_data = frame
-
-        for packet_id in range(1, number_of_packets + 1):
-            header = bytearray()
-            header.append(PACKET_TYPE["video"])
-            header.extend(frame_id.to_bytes(4, byteorder='big'))
-            header.extend(number_of_packets.to_bytes(2, byteorder='big'))
-            header.extend(packet_id.to_bytes(2, byteorder='big'))
-            header.extend(self.train_client_id_bytes)
-            header.extend(timestamp.to_bytes(8, byteorder='big'))
+    def enable_path_mtu_probing(self):
+        """Set the don't-fragment bit on the UDP socket so that too large probes are lost instead of fragmented."""
+        sock = self._client._transport.get_extra_info("socket")
+        if sock is None:
+            return
+        # Linux values, the socket module does not export all of them
+        options = [
+            (socket.IPPROTO_IP, getattr(socket, "IP_MTU_DISCOVER", 10), getattr(socket, "IP_PMTUDISC_PROBE", 3)),
+            (socket.IPPROTO_IPV6, getattr(socket, "IPV6_MTU_DISCOVER", 23), getattr(socket, "IPV6_PMTUDISC_PROBE", 3)),
+        ]
+        for level, option, value in options:
+            try:
+                sock.setsockopt(level, option, value)
+            except OSError as e:
+                logger.debug(f"PMTU: cannot set socket option {option} on level {level}: {e}")
+
+    def start_path_mtu_discovery(self):
+        # probes are only answered after the server accepted the connect message
+        self._connection_tasks.append(asyncio.create_task(self.discover_path_mtu()))
+
+    async def discover_path_mtu(self):
+        while self._running and self._client is not None:
+            probe = self.path_mtu.next_probe()
+            if probe is None:
+                await asyncio.sleep(1.0)
+                continue
 
-            chunk = remaining_data[:MAX_PACKET_SIZE]
-            remaining_data = remaining_data[MAX_PACKET_SIZE:]
-            packet_list.append(bytes(header + chunk))
+            self._pmtu_acked.clear()
+            sent = self.send_pmtu_probe(*probe)
+            if not sent and self.path_mtu.searching:
+                # congestion limited, a probe that never left says nothing about the path
+                await asyncio.sleep(PMTU_PROBE_TIMEOUT)
+                continue
+            try:
+                # while confirming, a window that stays closed is itself a sign of a black hole
+                await asyncio.wait_for(self._pmtu_acked.wait(), PMTU_PROBE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if self.path_mtu.on_timeout():
+                    self.update_packet_size()
+
+    def datagram_overhead(self) -> int:
+        # short header with the server's connection id and a 2 byte packet number,
+        # AEAD tag, DATAGRAM frame type and 2 byte length
+        return 1 + len(self._client._quic._peer_cid.cid) + 2 + 16 + 1 + 2
+
+    def send_pmtu_probe(self, probe_id: int, size: int) -> bool:
+        quic = self._client._quic
+        header = struct.pack(">BIH", PACKET_TYPE["pmtu_probe"], probe_id, size)
+        probe = header.ljust(size - self.datagram_overhead(), b"\x00")
+
+        # only the packets built by this transmit may use the probe size
+        quic._max_datagram_size = max(size, self.path_mtu.confirmed_size)
+        sent = False
+        try:
+            # ahead of queued video, the probe is what tells whether that video can still get through
+            quic._datagrams_pending.appendleft(probe)
+            self._client.transmit()
+        finally:
+            quic._max_datagram_size = self.path_mtu.confirmed_size
+            # a probe that did not fit into the congestion window must not block the video behind it
+            try:
+                quic._datagrams_pending.remove(probe)
+            except ValueError:
+                sent = True
+        return sent
+
+    def on_pmtu_ack(self, payload: bytes):
+        ack = json.loads(payload.decode('utf-8'))
+        if self.path_mtu.on_ack(ack["probe_id"], ack.get("relay_limit")):
+            self._pmtu_acked.set()
+        self.update_packet_size()
+
+    def on_nack(self, payload: bytes):
+        frame_id, packet_ids = parse_nack(payload)
+        packets = self.retransmit_buffer.packets_for_nack(frame_id, packet_ids)
+        if not packets or self._client is None:
+            return
+        logger.debug(f"NACK: resending {len(packets)} of {len(packet_ids)} missing packets of keyframe {frame_id}")
+        # ahead of queued video, the frames behind the keyframe cannot be decoded without it
+        self._client._quic._datagrams_pending.extendleft(reversed(packets))
+        self._client.transmit()
+
+    def on_receiver_report(self, payload: bytes):
+        report = json.loads(payload.decode('utf-8'))
+        self.receiver_report = report
+        self.receiver_report_count += 1
+        self.receiver_report_at = self._loop.time()
+        if self.fec is not None:
+            self.fec.on_receiver_report(report)
+
+    def transport_stats(self) -> Optional[dict]:
+        """Congestion state of the connection and the send backlog, None while not connected."""
+        client = self._client
+        if client is None or not self._running:
+            return None
+        quic = client._quic
+        recovery = quic._loss
+        # the frame timestamp is the capture time, the queue age starts when the frame was enqueued
+        frame_queue = self.frame_queue.stats()
+        stats = {
+            "congestion_window": recovery.congestion_window,
+            "bytes_in_flight": recovery.bytes_in_flight,
+            "smoothed_rtt": recovery._rtt_smoothed if recovery._rtt_initialized else None,
+            "min_rtt": recovery._rtt_min if recovery._rtt_initialized else None,
+            "pending_datagram_bytes": sum(len(datagram) for datagram in list(quic._datagrams_pending)),
+            "frame_queue_age": frame_queue["oldest_age"],
+            "frame_queue": frame_queue,
+            "sent_video_bytes": self.sent_video_bytes,
+            "fec_overhead": 1 / self.fec.group_size if self.fec is not None and self.fec.group_size else 0.0,
+            "pacer": self.pacer.stats() if self.pacer is not None else None,
+            "reconnect": self.reconnect_stats(),
+        }
+        if self.links:
+            # video goes out over all links, so the backlog and the capacity are those of all of them
+            samples = [sample for sample in (link.sample() for link in [self.primary_link] + self.links) if sample]
+            stats["pending_datagram_bytes"] = sum(sample["backlog_bytes"] for sample in samples)
+            stats["link_capacity"] = sum(sample["rate"] for sample in samples)
+            stats["links"] = [link.stats() for link in [self.primary_link] + self.links]
+        return stats
+
+    def health(self) -> Optional[dict]:
+        """RTT, loss, send backlog and silence of the connection for the transport manager, None while it cannot send."""
+        client = self._client
+        if client is None or not self._running or not self._accepted:
+            return None
+        recovery = client._quic._loss
+        now = self._loop.time()
+        loss = 0.0
+        if self.receiver_report is not None and now - self.receiver_report_at < TRANSPORT_REPORT_MAX_AGE:
+            # the server only reports while video arrives, an old report says nothing about the path
+            loss = float(self.receiver_report.get("loss", 0.0))
+        return {
+            "rtt": recovery._rtt_smoothed if recovery._rtt_initialized else 0.0,
+            "loss": loss,
+            "queue_age": self.frame_queue.oldest_age(),
+            "silent": now - client.last_received,
+        }
 
-        return packet_list
+    def update_packet_size(self):
+        if self._client is None:
+            return
+        self._client._quic._max_datagram_size = self.path_mtu.confirmed_size
+        if self.path_mtu.relay_limit is None:
+            # the server did not tell how large datagrams it can relay to the viewers
+            max_packet_size = MAX_PACKET_SIZE
+        else:
+            datagram_size = min(self.path_mtu.confirmed_size - self.datagram_overhead(), self.path_mtu.relay_limit)
+            max_packet_size = datagram_size - VIDEO_HEADER_SIZE
+        if self.links:
+            # the extra links do not probe their path MTU, their datagrams stay at the safe size
+            max_packet_size = min(max_packet_size, MAX_PACKET_SIZE)
+        if max_packet_size != self.max_packet_size:
+            logger.info(f"PMTU: video payload per datagram {self.max_packet_size} -> {max_packet_size} bytes "
+                        f"(path {self.path_mtu.confirmed_size}, relay limit {self.path_mtu.relay_limit})")
+            self.max_packet_size = max_packet_size
+
+    def create_packets(self, frame_id: int, timestamp: int, frame: bytes, max_packet_size: Optional[int] = None) -> list[bytes]:
+        if max_packet_size is None:
+            max_packet_size = self.max_packet_size
+        return self.packetizer.packetize(frame_id, timestamp, frame, max_packet_size)
 
     def enqueue_frame(self, frame_id: int, timestamp: int, frame: bytes):
         if not self._running or not self._loop:
             logger.warning("Cannot enqueue frame - client not running")
             return
         try:
+            # never blocks, a frame the uplink cannot take in time is dropped
             self.frame_queue.put((frame_id, timestamp, frame))
         except Exception as e:
             logger.error(f"Error enqueuing frame: {e}")
@@ -246,10 +673,18 @@ class NetworkWorkerQUIC(QThread):
         if not self._running or not self._loop:
             logger.warning("Cannot enqueue stream packet - client not running")
             return
-        self.stream_packet_queue.put(data)
+        self.control_plane.put(data)
 
     def stop(self):
+        self._stopping = True
         self._running = False
+        self.frame_queue.close()  # wakes the send loop
+        loop = self._loop
+        if loop is not None and not loop.is_closed() and self._stopped is not None:
+            try:
+                loop.call_soon_threadsafe(self._stopped.set)  # wakes the supervisor from its backoff
+            except RuntimeError:
+                pass
         self.quit()
         self.wait(4000)
 
@@ -257,48 +692,71 @@ class QuicClientProtocol(QuicConnectionProtocol):  # <-- inherit from QuicConnec
     def __init__(self, *args, network_worker: NetworkWorkerQUIC, **kwargs):
         super().__init__(*args, **kwargs)
         self.network_worker = network_worker
+        self.last_received = asyncio.get_event_loop().time()  # for the liveness check of the worker
+        self.stream_reassembler = StreamReassembler()
+
+    def datagram_received(self, data, addr):
+        self.last_received = self._loop.time()
+        super().datagram_received(data, addr)
 
     def quic_event_received(self, event: QuicEvent):
         if isinstance(event, ConnectionTerminated):
             logger.error(f"QUIC connection terminated! Error code: {event.error_code}, "
                         f"Reason: {event.reason_phrase}")
-            self.network_worker._running = False
-            self.network_worker.connection_closed.emit()
+            if self.network_worker._client is self:
+                self.network_worker.on_connection_lost("terminated")
             return
 
         if isinstance(event, StreamReset):
             logger.warning(f"Stream {event.stream_id} reset! Error code: {event.error_code}")
+            self.stream_reassembler.reset(event.stream_id)
             # Potentially reconnect or handle gracefully
             return
 
         if isinstance(event, StreamDataReceived):
-            try:
-                packet_type = event.data[0]
-                payload = event.data[1:]
-                if packet_type == PACKET_TYPE["command"]:
-                    self.network_worker.process_command.emit(payload)
-                elif packet_type == PACKET_TYPE["map_connect"] or packet_type == PACKET_TYPE["map_disconnect"] or packet_type == PACKET_TYPE["keepalive"]:
-                    self.network_worker.data_received.emit(event.data)
-                elif packet_type == PACKET_TYPE["rtt"]:
-                    # just modify event data with current timestamp
-                    rtt_data = json.loads(payload.decode('utf-8'))
-                    rtt_data["train_timestamp"] = int(datetime.datetime.now().timestamp() * 1000)  # Current timestamp in milliseconds
-                    rtt_packet = json.dumps(rtt_data).encode('utf-8')
-                    rtt_packet = struct.pack("B", PACKET_TYPE["rtt"]) + rtt_packet
-
-                    # Add 2-byte length prefix (big-endian)
-                    data_size = len(rtt_packet)
-                    length_prefixed_packet = bytearray(2 + len(rtt_packet))
-                    length_prefixed_packet[0] = (data_size >> 8) & 0xFF  # High byte
-                    length_prefixed_packet[1] = data_size & 0xFF         # Low byte
-                    length_prefixed_packet[2:] = rtt_packet
-
-                    self.network_worker.enqueue_stream_packet(length_prefixed_packet)
-                elif packet_type == PACKET_TYPE["rtt_train"]:
-                    self.network_worker.data_received.emit(event.data)
-                elif packet_type == PACKET_TYPE["connect_response"]:
-                    logger.info(f"Received connect response from server, data = {event.data}")
+            # messages can be split across or coalesced into the chunks of a stream
+            for message in self.stream_reassembler.feed(event.stream_id, event.data):
+                self.handle_stream_message(message)
+
+    def handle_stream_message(self, data: bytes):
+        try:
+            packet_type = data[0]
+            payload = data[1:]
+            if packet_type == PACKET_TYPE["command"]:
+                self.network_worker.process_command.emit(payload)
+            elif packet_type == PACKET_TYPE["map_connect"] or packet_type == PACKET_TYPE["map_disconnect"] or packet_type == PACKET_TYPE["keepalive"]:
+                self.network_worker.data_received.emit(data)
+            elif packet_type == PACKET_TYPE["rtt"]:
+                # just modify event data with current timestamp
+                rtt_data = json.loads(payload.decode('utf-8'))
+                rtt_data["train_timestamp"] = int(datetime.datetime.now().timestamp() * 1000)  # Current timestamp in milliseconds
+                rtt_packet = json.dumps(rtt_data).encode('utf-8')
+                rtt_packet = struct.pack("B", PACKET_TYPE["rtt"]) + rtt_packet
+
+                # Add 2-byte length prefix (big-endian)
+                data_size = len(rtt_packet)
+                length_prefixed_packet = bytearray(2 + len(rtt_packet))
+                length_prefixed_packet[0] = (data_size >> 8) & 0xFF  # High byte
+                length_prefixed_packet[1] = data_size & 0xFF         # Low byte
+                length_prefixed_packet[2:] = rtt_packet
+
+                self.network_worker.enqueue_stream_packet(length_prefixed_packet)
+            elif packet_type == PACKET_TYPE["rtt_train"]:
+                self.network_worker.data_received.emit(data)
+            elif packet_type == PACKET_TYPE["connect_response"]:
+                response = json.loads(payload.decode('utf-8'))
+                if response.get("status") == "rejected":
+                    logger.error(f"Server rejected the connection: {response.get('reason')}")
                 else:
-                    logger.warning(f"Invalid process command with packet type = {packet_type}, data: {event.data}")
-            except Exception as e:
-                logger.warning("There is no packet type in the received data")
+                    logger.info(f"Received connect response from server, data = {data}")
+                    self.network_worker.on_connect_accepted()
+            elif packet_type == PACKET_TYPE["pmtu_ack"]:
+                self.network_worker.on_pmtu_ack(payload)
+            elif packet_type == PACKET_TYPE["nack"]:
+                self.network_worker.on_nack(payload)
+            elif packet_type == PACKET_TYPE["receiver_report"]:
+                self.network_worker.on_receiver_report(payload)
+            else:
+                logger.warning(f"Invalid process command with packet type = {packet_type}, data: {data}")
+        except Exception as e:
+            logger.warning("There is no packet type in the received data")
@@ -1,145 +1,255 @@
 import asyncio
-import queue
 import json
+import random
+import socket
 import struct
 import ssl
+from typing import Optional
+
 from PyQt5.QtCore import QThread, pyqtSignal
 import websockets
+from websockets.protocol import State
 from utils.app_logger import logger
+from utils.loop_queue import LoopQueue
+from utils.video_frame_queue import VideoFrameQueue
+from utils.video_packetizer import VideoPacketizer
 
 from globals import *
 
 class NetworkWorkerWS(QThread):
+    """Video, telemetry and commands over one WebSocket, for networks that block UDP.
+
+    Every encoded frame is one binary message: the video_frame type byte and
+    the frame laid out as a video datagram with a single packet. The server
+    relays it to its WebSocket viewers unchanged, their assembler completes
+    it like any other frame.
+
+    TCP does not drop, so frames have to be dropped before they reach it.
+    The write buffer of the connection has a high-water mark, and the kernel
+    takes only WS_NOTSENT_LOWAT unsent bytes, so the backlog stays where it
+    can be seen. A frame that finds the buffer above the mark waits until it
+    has drained, meanwhile the frame queue sheds frames and asks the encoder
+    for a keyframe, like on QUIC. Telemetry and other messages have their own
+    queue and go out between two frames, behind at most one buffer of video.
+    """
+
     process_command = pyqtSignal(object)
+    data_received = pyqtSignal(bytes)  # map_connect, map_disconnect and the remote controls' keepalives
+    keyframe_requested = pyqtSignal()  # frames were dropped, the video only recovers with a keyframe
 
     def __init__(self, train_client_id, parent=None):
         super().__init__(parent)
-        self.packet_queue = queue.Queue()
+        self.packet_queue = LoopQueue(f"{train_client_id}:ws")  # telemetry and other messages
+        self.frame_queue = VideoFrameQueue(f"{train_client_id}:ws_frames", on_keyframe_request=self.keyframe_requested.emit)
         self.train_client_id = train_client_id
         self.train_client_id_bytes = train_client_id.encode('utf-8').ljust(36)[:36]  # Ensure 36 bytes
+        self.packetizer = VideoPacketizer(self.train_client_id_bytes, prefix=struct.pack("B", PACKET_TYPE["video_frame"]))
         self.running = False
         self.loop = None
         self.server_url = f"{WEBSOCKET_URL}/train/{train_client_id}"
+        self.sent_frames = 0
+        self.sent_video_bytes = 0
+        self.connections = 0
+        self._stopping = False
+        self._websocket = None
+        self._stopped: Optional[asyncio.Event] = None
 
     def run(self):
         self.running = True
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
+        self.packet_queue.bind(self.loop)
+        self.frame_queue.bind(self.loop)
+        self._stopped = asyncio.Event()
+        if self._stopping:
+            # stop() came before the loop existed
+            self._stopped.set()
         try:
-            self.loop.run_until_complete(self.websocket_handler())
+            self.loop.run_until_complete(self.supervise())
         finally:
             self.loop.close()
 
-    async def websocket_handler(self):
+    async def supervise(self):
+        """Keep the WebSocket up until stop(), reconnecting with exponential backoff and full jitter."""
+        failures = 0
+        while not self._stopping:
+            if failures:
+                backoff = min(WS_RECONNECT_MAX_DELAY, WS_RECONNECT_BASE_DELAY * 2 ** (failures - 1))
+                delay = random.uniform(0, backoff)
+                logger.info(f"WebSocket: reconnecting in {delay:.2f} s (attempt {failures + 1})")
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), delay)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+            accepted = await self.websocket_handler()
+            failures = 0 if accepted else failures + 1
+
+    async def websocket_handler(self) -> bool:
+        """One connection to the server, True if the server accepted it."""
         ssl_context = ssl._create_unverified_context()
         try:
-            async with websockets.connect(self.server_url, ssl=ssl_context) as websocket:
-                print(f"WebSocket: Connected to server at {self.server_url}")
-                # Create tasks
+            async with websockets.connect(self.server_url, ssl=ssl_context, open_timeout=WS_CONNECT_TIMEOUT,
+                                          close_timeout=WS_CLOSE_TIMEOUT, ping_interval=WS_PING_INTERVAL,
+                                          ping_timeout=WS_PING_TIMEOUT,
+                                          write_limit=(WS_WRITE_HIGH_WATER, WS_WRITE_LOW_WATER)) as websocket:
+                logger.info(f"WebSocket: Connected to server at {self.server_url}")
+                if self._stopping:
+                    return True
+                self.limit_unsent_bytes(websocket)
+                # frames of the last connection are stale, and the viewers' decoder needs a keyframe
+                self.frame_queue.reset()
+                self.frame_queue.reopen()
+                self._websocket = websocket
+                self.keyframe_requested.emit()
                 tasks = [
+                    asyncio.create_task(self.send_frames(websocket)),
                     asyncio.create_task(self.websocket_sender(websocket)),
                     asyncio.create_task(self.websocket_receiver(websocket)),
                     asyncio.create_task(self.keepalive(websocket))
                 ]
-                # Wait for the first task to complete (which will happen if any fails)
-                done, pending = await asyncio.wait(
-                    tasks,
-                    return_when=asyncio.FIRST_COMPLETED
-                )
-                # Cancel remaining tasks
-                for task in pending:
-                    task.cancel()
-                    try:
-                        await task
-                    except asyncio.CancelledError:
-                        pass
+                try:
+                    # Wait for the first task to complete (which will happen if any fails)
+                    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    self._websocket = None
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None:
+                        logger.warning(f"WebSocket: connection lost: {task.exception()!r}")
+        except websockets.ConnectionClosed as e:
+            logger.warning(f"WebSocket: connection closed: {e}")
         except Exception as e:
-            print(f"WebSocket: connection error: {e}")
+            logger.error(f"WebSocket: connection error: {e!r}")
+            return False
+        if websocket.close_code == WS_CLOSE_TRY_AGAIN_LATER:
+            logger.warning(f"WebSocket: rejected by server: {websocket.close_reason}")
+            return False
+        self.connections += 1
+        return True
+
+    @staticmethod
+    def limit_unsent_bytes(websocket):
+        # without the limit the kernel buffers megabytes and the write buffer never reaches its high-water mark
+        sock = websocket.transport.get_extra_info("socket")
+        if sock is None or not hasattr(socket, "TCP_NOTSENT_LOWAT"):
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NOTSENT_LOWAT, WS_NOTSENT_LOWAT)
+        except OSError as e:
+            logger.warning(f"WebSocket: cannot set TCP_NOTSENT_LOWAT: {e}")
+
+    async def send_frames(self, websocket):
+        while True:
+            handoff = await self.frame_queue.get()
+            if handoff is None:
+                # closed, the worker is stopping
+                return
+            (frame_id, timestamp, frame), _ = handoff
+            message = self.packetizer.packetize(frame_id, timestamp, frame, max(1, len(frame)))[0]
+            # returns once the write buffer is below its low-water mark, frames queue up and are shed meanwhile
+            await websocket.send(message)
+            self.sent_frames += 1
+            self.sent_video_bytes += len(message)
 
     async def websocket_sender(self, websocket):
-        print("WebSocket: Sender task started")
-        while self.running:
-            try:
-                packet = self.packet_queue.get_nowait()
-                if packet:
-                    await websocket.send(packet)
-            except queue.Empty:
-                await asyncio.sleep(0.1)  # Increased sleep to yield to other tasks
-            except Exception as e:
-                print(f"WebSocket: Sender error: {e}")
-                break
+        while True:
+            handoff = await self.packet_queue.get()
+            if handoff is None:
+                # closed, the worker is stopping
+                return
+            packet, _ = handoff
+            if packet:
+                await websocket.send(packet)
 
     async def websocket_receiver(self, websocket):
-        print("WebSocket: Receiver task started")
-        while self.running:
-            try:
-                packet = await asyncio.wait_for(websocket.recv(), timeout=1.0)
-                if packet:
-                    print(f"WebSocket: Received packet of size {len(packet)}")
-                    packet_type = packet[0]
-                    payload = packet[1:]
-                    if packet_type == PACKET_TYPE["keepalive"]:
-                        message = json.loads(payload.decode('utf-8'))
-                        print(f"WebSocket: Keepalive message: {message}")
-                    elif packet_type == PACKET_TYPE["command"]:
-                        self.process_command.emit(payload)
-                    else:
-                        print(f"WebSocket: Received packet type {packet_type}, not handled")
-            except asyncio.TimeoutError:
+        async for packet in websocket:
+            if not isinstance(packet, bytes) or not packet:
                 continue
-            except Exception as e:
-                print(f"WebSocket: Receiver error: {e}")
-                break
+            packet_type = packet[0]
+            payload = packet[1:]
+            # the server sends here what it cannot send over QUIC, the same messages as on the QUIC stream
+            if packet_type == PACKET_TYPE["keepalive"]:
+                message = json.loads(payload.decode('utf-8'))
+                if "remote_control_id" in message:
+                    # relayed from a remote control, not the server's own
+                    self.data_received.emit(packet)
+                else:
+                    logger.debug(f"WebSocket: Keepalive message: {message}")
+            elif packet_type == PACKET_TYPE["command"]:
+                self.process_command.emit(payload)
+            elif packet_type == PACKET_TYPE["map_connect"] or packet_type == PACKET_TYPE["map_disconnect"]:
+                self.data_received.emit(packet)
+            else:
+                logger.debug(f"WebSocket: Received packet type {packet_type}, not handled")
 
     async def keepalive(self, websocket):
-        print("WebSocket: Keepalive task started")
         self.keepalive_sequence = 0
-        while self.running:
-            try:
-                self.keepalive_sequence += 1
-                keepalive_packet = {
-                    "type": "keepalive",
-                    "timestamp": asyncio.get_event_loop().time(),
-                    "sequence": self.keepalive_sequence
-                }
-                packet_data = json.dumps(keepalive_packet).encode('utf-8')
-                packet = struct.pack("B", PACKET_TYPE["keepalive"]) + packet_data
-                await websocket.send(packet)
-                await asyncio.sleep(25)
-            except Exception as e:
-                print(f"WebSocket: Keepalive error: {e}")
-                break
+        while True:
+            self.keepalive_sequence += 1
+            keepalive_packet = {
+                "type": "keepalive",
+                "timestamp": asyncio.get_event_loop().time(),
+                "sequence": self.keepalive_sequence
+            }
+            packet_data = json.dumps(keepalive_packet).encode('utf-8')
+            packet = struct.pack("B", PACKET_TYPE["keepalive"]) + packet_data
+            await websocket.send(packet)
+            self.packet_queue.log_stats()
+            self.frame_queue.log_stats()
+            await asyncio.sleep(25)
+
+    def transport_stats(self) -> Optional[dict]:
+        """Send backlog of the connection, None while not connected."""
+        websocket = self._websocket
+        if websocket is None:
+            return None
+        frame_queue = self.frame_queue.stats()
+        return {
+            "write_buffer_bytes": websocket.transport.get_write_buffer_size(),
+            "frame_queue_age": frame_queue["oldest_age"],
+            "frame_queue": frame_queue,
+            "sent_frames": self.sent_frames,
+            "sent_video_bytes": self.sent_video_bytes,
+            "connections": self.connections,
+        }
+
+    def health(self) -> Optional[dict]:
+        """RTT and send backlog of the connection for the transport manager, None while it cannot send."""
+        websocket = self._websocket
+        if websocket is None or websocket.state is not State.OPEN:
+            return None
+        return {
+            # measured by the pings, 0 until the first pong
+            "rtt": websocket.latency,
+            "loss": 0.0,
+            "queue_age": max(self.frame_queue.oldest_age(), self.packet_queue.oldest_age()),
+        }
 
     def stop(self):
+        self._stopping = True
         self.running = False
+        self.packet_queue.close()
+        self.frame_queue.close()
+        loop = self.loop
+        if loop is not None and not loop.is_closed() and self._stopped is not None:
+            try:
+                loop.call_soon_threadsafe(self._stopped.set)  # wakes the supervisor from its backoff
+            except RuntimeError:
+                pass
+        self.quit()
+        self.wait(2000)
         logger.info("WebSocket connection closed")
 
-    def create_packets(self, frame_id: int, timestamp: int, frame: bytes) -> list[bytes]:
-        packet_list = []
-        frame_size = len(frame)
-        number_of_packets = (frame_size // MAX_PACKET_SIZE) + 1
-        remaining_data = frame
-
-        for packet_id in range(1, number_of_packets + 1):
-            header = bytearray()
-            header.append(PACKET_TYPE["video"])
-            header.extend(frame_id.to_bytes(4, byteorder='big'))
-            header.extend(number_of_packets.to_bytes(2, byteorder='big'))
-            header.extend(packet_id.to_bytes(2, byteorder='big'))
-            header.extend(self.train_client_id_bytes)
-            header.extend(timestamp.to_bytes(8, byteorder='big'))
-
-            chunk = remaining_data[:MAX_PACKET_SIZE]
-            remaining_data = remaining_data[MAX_PACKET_SIZE:]
-            packet_list.append(bytes(header + chunk))
-
-        return packet_list
-
     def enqueue_frame(self, frame_id: int, timestamp: int, frame: bytes):
-        packets = self.create_packets(frame_id, timestamp, frame)
-        for packet in packets:
-            packet_with_type = struct.pack("B", PACKET_TYPE["video"]) + packet
-            self.enqueue_packet(packet_with_type)
+        if self._websocket is None:
+            return
+        # never blocks, a frame the uplink cannot take in time is dropped
+        self.frame_queue.put((frame_id, timestamp, frame))
 
     def enqueue_packet(self, packet):
-        self.packet_queue.put(packet)
\ No newline at end of file
+        if self._websocket is None:
+            return
+        self.packet_queue.put(packet)
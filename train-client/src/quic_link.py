@@ -0,0 +1,216 @@
+import asyncio
+import dataclasses
+import json
+import socket
+from typing import Callable, Optional
+
+from utils.app_logger import logger
+from utils.stream_reassembler import StreamReassembler
+from aioquic.asyncio.protocol import QuicConnectionProtocol
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.connection import QuicConnection
+from aioquic.quic.events import QuicEvent, ConnectionTerminated, StreamDataReceived
+
+from globals import *
+
+
+class QuicLink:
+    """One uplink of the train: a QUIC connection and what is known about its path.
+
+    Link 0 is the connection of NetworkWorkerQUIC itself, it is attached once
+    connected. Every other link is opened by `maintain` on its own socket,
+    bound to a source address or network interface so that it leaves through
+    its own modem, and carries video datagrams only.
+
+    Loss is counted from aioquic's loss detection on the connection: QUIC
+    packets declared lost over QUIC packets sent, smoothed over the samples.
+    """
+
+    def __init__(self, link_id: int, name: str, source_address: Optional[str] = None,
+                 interface: Optional[str] = None, server_host: Optional[str] = None,
+                 server_port: Optional[int] = None):
+        self.link_id = link_id
+        self.name = name
+        self.source_address = source_address
+        self.interface = interface
+        self.server_host = server_host
+        self.server_port = server_port
+        self.client: Optional[QuicConnectionProtocol] = None
+        self.packets_sent = 0  # QUIC packets in flight when sent, counted by the recovery hook
+        self.packets_lost = 0
+        self.loss = 0.0
+        self.sent_datagrams = 0
+        self.sent_bytes = 0
+        self.connects = 0
+        self._last_sent = 0
+        self._last_lost = 0
+
+    @classmethod
+    def from_config(cls, link_id: int, config: dict) -> "QuicLink":
+        return cls(link_id, config.get("name", f"link{link_id}"), config.get("source_address"),
+                   config.get("interface"), config.get("server_host"), config.get("server_port"))
+
+    @property
+    def connected(self) -> bool:
+        return self.client is not None
+
+    def attach(self, client: QuicConnectionProtocol):
+        self.client = client
+        self.connects += 1
+        self.loss = 0.0
+        self._last_sent = self.packets_sent
+        self._last_lost = self.packets_lost
+        recovery = client._quic._loss
+        on_packet_sent = recovery.on_packet_sent
+        on_packets_lost = recovery._on_packets_lost
+
+        def count_sent(*, packet, space):
+            if packet.in_flight:
+                self.packets_sent += 1
+            on_packet_sent(packet=packet, space=space)
+
+        def count_lost(*, packets, congestion_event=True, **kwargs):
+            packets = list(packets)
+            if congestion_event:
+                # not when a PTO only reschedules data that may still arrive
+                self.packets_lost += sum(1 for packet in packets if packet.in_flight)
+            on_packets_lost(packets=packets, congestion_event=congestion_event, **kwargs)
+
+        recovery.on_packet_sent = count_sent
+        recovery._on_packets_lost = count_lost
+
+    def detach(self):
+        self.client = None
+
+    def sample(self) -> Optional[dict]:
+        """Path state for the LinkScheduler, None while the link is down or has no RTT yet."""
+        client = self.client
+        if client is None:
+            return None
+        quic = client._quic
+        recovery = quic._loss
+        if not recovery._rtt_initialized:
+            return None
+        sent = self.packets_sent - self._last_sent
+        if sent >= 50:
+            lost = self.packets_lost - self._last_lost
+            self.loss += BONDING_LOSS_SMOOTHING * (lost / sent - self.loss)
+            # aioquic can declare more packets lost in a window than were sent in it
+            self.loss = min(1.0, max(0.0, self.loss))
+            self._last_sent = self.packets_sent
+            self._last_lost = self.packets_lost
+        return {
+            "smoothed_rtt": recovery._rtt_smoothed,
+            "rate": recovery.congestion_window * 8 / recovery._rtt_smoothed,
+            "backlog_bytes": sum(len(datagram) for datagram in quic._datagrams_pending),
+            "loss": self.loss,
+        }
+
+    def send(self, packet: bytes):
+        self.client._quic.send_datagram_frame(packet)
+        self.sent_datagrams += 1
+        self.sent_bytes += len(packet)
+
+    def stats(self) -> dict:
+        sample = self.sample()
+        return {
+            "name": self.name,
+            "connected": self.connected,
+            "smoothed_rtt": sample["smoothed_rtt"] if sample else None,
+            "rate": sample["rate"] if sample else None,
+            "loss": self.loss,
+            "sent_datagrams": self.sent_datagrams,
+            "sent_bytes": self.sent_bytes,
+            "connects": self.connects,
+        }
+
+    async def open_socket(self, host: str, port: int) -> tuple:
+        """UDP socket leaving through this link, and the server address to connect it to."""
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+        if self.source_address is not None:
+            # the server address has to be of the family of the source address
+            source_family = socket.AF_INET6 if ":" in self.source_address else socket.AF_INET
+            infos = [info for info in infos if info[0] == source_family] or infos
+        family, _, _, _, address = infos[0]
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            if self.interface is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, self.interface.encode())
+            wildcard = "::" if family == socket.AF_INET6 else "0.0.0.0"
+            sock.bind((self.source_address or wildcard, 0))
+        except OSError:
+            sock.close()
+            raise
+        return sock, address
+
+    async def maintain(self, host: str, port: int, configuration: QuicConfiguration,
+                       connect_message: bytes, running: Callable[[], bool]):
+        """Keep the link connected while `running()` is true, reconnecting after a failure."""
+        host = self.server_host or host
+        port = self.server_port or port
+        while running():
+            try:
+                await self.connect(host, port, configuration, connect_message, running)
+            except Exception as e:
+                logger.warning(f"Bonding: link {self.name} failed: {e}")
+            if running():
+                await asyncio.sleep(BONDING_RECONNECT_INTERVAL)
+
+    async def connect(self, host: str, port: int, configuration: QuicConfiguration,
+                      connect_message: bytes, running: Callable[[], bool]):
+        loop = asyncio.get_running_loop()
+        sock, address = await self.open_socket(host, port)
+        configuration = dataclasses.replace(configuration, server_name=configuration.server_name or host)
+        connection = QuicConnection(configuration=configuration)
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: QuicLinkProtocol(connection, link=self), sock=sock)
+        attached = False
+        try:
+            protocol.connect(address)
+            await asyncio.wait_for(protocol.wait_connected(), BONDING_CONNECT_TIMEOUT)
+            stream_id = connection.get_next_available_stream_id(is_unidirectional=False)
+            connection.send_stream_data(stream_id, connect_message, end_stream=False)
+            protocol.transmit()
+            self.attach(protocol)
+            attached = True
+            logger.info(f"Bonding: link {self.name} connected to {host}:{port}"
+                        f"{f' from {self.source_address}' if self.source_address else ''}"
+                        f"{f' on {self.interface}' if self.interface else ''}")
+            while running():
+                sent_datagrams = self.sent_datagrams
+                try:
+                    await asyncio.wait_for(asyncio.shield(protocol.wait_closed()), BONDING_KEEPALIVE_INTERVAL)
+                    break
+                except asyncio.TimeoutError:
+                    if self.sent_datagrams == sent_datagrams:
+                        # no video over this link lately, keep the connection from idling out
+                        connection.send_ping(0)
+                        protocol.transmit()
+        finally:
+            self.detach()
+            protocol.close()
+            transport.close()
+            if attached:
+                logger.info(f"Bonding: link {self.name} disconnected")
+
+
+class QuicLinkProtocol(QuicConnectionProtocol):
+    def __init__(self, *args, link: QuicLink, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.link = link
+        self.stream_reassembler = StreamReassembler()
+
+    def quic_event_received(self, event: QuicEvent):
+        if isinstance(event, ConnectionTerminated):
+            logger.warning(f"Bonding: link {self.link.name} terminated, error code {event.error_code}, "
+                           f"reason: {event.reason_phrase}")
+            self.link.detach()
+        elif isinstance(event, StreamDataReceived):
+            for message in self.stream_reassembler.feed(event.stream_id, event.data):
+                if message and message[0] == PACKET_TYPE["connect_response"]:
+                    response = json.loads(message[1:].decode('utf-8'))
+                    if response.get("status") == "rejected":
+                        logger.error(f"Bonding: server rejected link {self.link.name}: {response.get('reason')}")
+                        self.link.detach()
+                        self.close()
@@ -168,8 +168,8 @@ class ReaktorClient(BaseClient, QMainWindow):
 
         self.central_widget.setLayout(layout)
 
-    def on_new_frame(self, frame_id, frame, width, height, is_encoded):
-        rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    def on_new_frame(self, captured):
+        rgb_image = cv2.cvtColor(captured.data, cv2.COLOR_BGR2RGB)
         h, w, ch = rgb_image.shape
         
         # Get the fixed size of the image label
@@ -206,7 +206,7 @@ class ReaktorClient(BaseClient, QMainWindow):
         pixmap = QPixmap.fromImage(qt_image)
         self.image_label.setPixmap(pixmap)
         
-        super().on_new_frame(frame_id, frame, width, height, is_encoded)
+        super().on_new_frame(captured)
 
     def toggle_capture(self):
         super().toggle_capture()
@@ -1,12 +1,14 @@
 import cv2
-from PyQt5.QtCore import QObject, QTimer, pyqtSignal, QThread
+import time
+from PyQt5.QtCore import QTimer, pyqtSignal, QThread, Qt
 from datetime import datetime
 from utils.app_logger import logger
+from sensor.video_source import VideoSource
 from globals import *
 
 class CameraWorker(QThread):
     """Worker thread for camera frame capture to avoid blocking UI thread."""
-    frame_captured = pyqtSignal(int, object, int, int)  # frame_count, frame, width, height
+    frame_captured = pyqtSignal(int, object, int, int, float)  # frame_count, frame, width, height, capture_time
 
     def __init__(self, index: int = 0):
         super().__init__()
@@ -121,6 +123,7 @@ class CameraWorker(QThread):
             ret, frame = self.cap.read()
             if not ret:
                 continue
+            capture_time = time.monotonic()
 
             self.frame_count += 1
             elapsed_time = (cv2.getTickCount() - self.start_time) / cv2.getTickFrequency()
@@ -156,7 +159,7 @@ class CameraWorker(QThread):
                 cv2.putText(frame, text, (x, y), font, font_scale, color, thickness, cv2.LINE_AA)
 
             try:
-                self.frame_captured.emit(self.frame_count, frame, self.width, self.height)
+                self.frame_captured.emit(self.frame_count, frame, self.width, self.height, capture_time)
             except Exception as e:
                 logger.error(f"Error emitting frame_captured signal: {e}")
 
@@ -179,16 +182,11 @@ class CameraWorker(QThread):
         self._running = False
 
 
-class Camera(QObject):
-    frame_ready = pyqtSignal(object, object, int, int, bool)
-
+class Camera(VideoSource):
     def __init__(self, parent=None, index: int = 0):
         super().__init__(parent)
         self.index = index
         self.worker = None
-        self.width = 0
-        self.height = 0
-        self.direction = 1  # forward/backward placeholder for API compatibility
 
 
     def init_capture(self):
@@ -198,16 +196,17 @@ class Camera(QObject):
             self.worker.wait()
 
         self.worker = CameraWorker(self.index)
-        self.worker.frame_captured.connect(self._on_frame_captured)
+        # frame_ready is emitted on the capture thread, receivers on the main thread get it queued
+        self.worker.frame_captured.connect(self._on_frame_captured, Qt.DirectConnection)
         self.worker.start()
         logger.info("Camera worker thread started")
 
-    def _on_frame_captured(self, frame_count, frame, width, height):
-        """Receive frame from worker thread and emit to main application."""
+    def _on_frame_captured(self, frame_count, frame, width, height, capture_time):
+        """Receive frame on the worker thread and emit it to the pipeline."""
         self.width = width
         self.height = height
         try:
-            self.frame_ready.emit(frame_count, frame, width, height, False)
+            self.emit_frame(frame_count, frame, width, height, "bgr24", capture_time)
         except Exception as e:
             logger.error(f"Error emitting frame_ready signal: {e}")
 
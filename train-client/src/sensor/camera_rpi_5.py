@@ -1,30 +1,41 @@
-from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5.QtCore import QTimer
 from picamera2 import Picamera2
 from picamera2.encoders import H264Encoder
-from picamera2.outputs import FileOutput
+from picamera2.outputs import Output
 from libcamera import controls, Transform
 import libcamera
 import cv2
 import numpy as np
 from utils.app_logger import logger
-import io
+from sensor.video_source import VideoSource, ENCODED_PIXEL_FORMAT
 import threading
 import time
 from globals import *
 
-class StreamingOutput(io.BufferedIOBase):
+class StreamingOutput(Output):
+    """Keeps the latest frame of the hardware encoder together with its capture time."""
+
     def __init__(self):
+        super().__init__()
         self.frame = None
+        self.capture_time = None
         self.condition = threading.Condition()
 
-    def write(self, buf):
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        now = time.monotonic()
+        capture_time = now
+        if timestamp is not None:
+            # sensor timestamp in microseconds, libcamera takes it from CLOCK_MONOTONIC like time.monotonic().
+            # Anything implausible falls back to the time the encoder delivered the frame
+            sensor_time = timestamp / 1e6
+            if 0 <= now - sensor_time < 1.0:
+                capture_time = sensor_time
         with self.condition:
-            self.frame = buf
+            self.frame = frame
+            self.capture_time = capture_time
             self.condition.notify_all()
 
-class CameraRPi5(QObject):
-    frame_ready = pyqtSignal(object, object, int, int, bool)  # Emits frame_count, encoded_data, width, height
-
+class CameraRPi5(VideoSource):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.picam2 = None
@@ -57,7 +68,7 @@ class CameraRPi5(QObject):
             self.encoder = H264Encoder(bitrate=VIDEO_BITRATE)
             self.output = StreamingOutput()
 
-            self.picam2.start_recording(self.encoder, FileOutput(self.output))
+            self.picam2.start_recording(self.encoder, self.output)
 
             # Get camera properties
             main_stream = self.picam2.stream_configuration("main")
@@ -91,11 +102,13 @@ class CameraRPi5(QObject):
                 with self.output.condition:
                     self.output.condition.wait()
                     encoded_data = self.output.frame
+                    capture_time = self.output.capture_time
 
                 self.frame_count += 1
 
                 # Emit encoded H.264 data directly
-                self.frame_ready.emit(self.frame_count, encoded_data, self.width, self.height, True)
+                self.emit_frame(self.frame_count, encoded_data, self.width, self.height,
+                                ENCODED_PIXEL_FORMAT, capture_time)
 
             except Exception as e:
                 logger.error(f"Error capturing frame: {str(e)}")
@@ -1,14 +1,41 @@
 import cv2
-from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+import time
+from PyQt5.QtCore import QThread
 from datetime import datetime
 import random
 import os
 from utils.app_logger import logger
+from sensor.video_source import VideoSource
 from globals import ASSET_DIR, MAX_SPEED
 
-class FileProcessor(QObject):
-    frame_ready = pyqtSignal(object, object, int, int, bool)  # Emits (frame_count, frame)
 
+class FileProcessorWorker(QThread):
+    """Paces FileProcessor.capture_frame on its own thread, so reading and overlay stay off the UI thread."""
+
+    def __init__(self, processor):
+        super().__init__()
+        self.processor = processor
+        self._running = False
+
+    def run(self):
+        self._running = True
+        next_due = time.monotonic()
+        while self._running:
+            self.processor.capture_frame()
+            # speed changes take effect with the next frame
+            next_due += 1.0 / self.processor.current_fps
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                self.msleep(int(delay * 1000))
+            else:
+                # behind schedule, do not try to catch up
+                next_due = time.monotonic()
+
+    def stop_capture(self):
+        self._running = False
+
+
+class FileProcessor(VideoSource):
     def __init__(self, parent=None):
         super().__init__(parent)
 
@@ -22,19 +49,15 @@ class FileProcessor(QObject):
         print(f"Selected video: {self.video_path}")
 
         self.cap = None
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.capture_frame)
+        self.worker = None
         self.frame_count = 0
         self.start_time = None
-        self.width = 0
-        self.height = 0
         self.original_fps = 60
         self.current_fps = 60
         self.set_speed(MAX_SPEED)
 
-        self.direction = 1  # 1 for forward, -1 for backward
-
     def init_capture(self, speed_kmh=MAX_SPEED):
+        self.stop()
         self.cap = cv2.VideoCapture(self.video_path)
         if not self.cap.isOpened():
             raise RuntimeError("Could not open video file")
@@ -45,24 +68,21 @@ class FileProcessor(QObject):
         self.set_speed(speed_kmh)
         self.frame_count = 0
         self.start_time = cv2.getTickCount()
-        self.timer.start(int(1000 / self.current_fps))
+        self.worker = FileProcessorWorker(self)
+        self.worker.start()
 
     def set_speed(self, speed_kmh):
         # FPS is directly equal to speed (max 60)
         # if speed is 13 then fps is 60
         self.current_fps = min(self.original_fps, max(1, int((speed_kmh / MAX_SPEED) * self.original_fps)))
-        if self.timer.isActive():
-            self.timer.stop()
-            self.timer.start(int(1000 / self.current_fps))
-
-    def set_direction(self, direction):
-        """Set direction: 1 for forward, -1 for backward."""
-        if direction not in (1, -1):
-            raise ValueError("Direction must be 1 (forward) or -1 (backward)")
-        self.direction = direction
 
     def stop(self):
-        self.timer.stop()
+        if self.worker:
+            self.worker.stop_capture()
+            # capture_frame stops the processor itself when the file cannot be read
+            if QThread.currentThread() is not self.worker:
+                self.worker.wait()
+            self.worker = None
         if self.cap:
             self.cap.release()
             self.cap = None
@@ -95,6 +115,7 @@ class FileProcessor(QObject):
                     if not ret:
                         self.stop()
                         return
+            capture_time = time.monotonic()
 
             self.frame_count += 1
             elapsed_time = (cv2.getTickCount() - self.start_time) / cv2.getTickFrequency()
@@ -144,6 +165,6 @@ class FileProcessor(QObject):
                 )
             # add a try catch here
             try:
-                self.frame_ready.emit(self.frame_count, frame, self.width, self.height, False)
+                self.emit_frame(self.frame_count, frame, self.width, self.height, "bgr24", capture_time)
             except Exception as e:
                 logger.error(f"Error emitting frame_ready signal, call back is not connected: {e}")
\ No newline at end of file
@@ -0,0 +1,84 @@
+import time
+from typing import Optional
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+ENCODED_PIXEL_FORMAT = "h264"  # pixel_format of frames a source delivers already encoded
+
+# Wall clock at time.monotonic() == 0. Capture times are monotonic and only
+# converted when they leave the train, so they never jump with the system clock
+_MONOTONIC_EPOCH = time.time() - time.monotonic()
+
+
+def monotonic_to_epoch_ms(monotonic_time: float) -> int:
+    """Convert a time.monotonic() value to milliseconds since the epoch, as used in the packet headers."""
+    return int((monotonic_time + _MONOTONIC_EPOCH) * 1000)
+
+
+class CapturedFrame:
+    """One frame as a video source acquired it.
+
+    `data` is an ndarray in `pixel_format` (FFmpeg names such as bgr24 or
+    yuv420p) with `stride` bytes per row of the first plane, or the encoded
+    bytes when pixel_format is ENCODED_PIXEL_FORMAT. `capture_time` is
+    time.monotonic() when the frame was acquired, before any overlay.
+    """
+    __slots__ = ("frame_id", "data", "width", "height", "pixel_format", "stride", "capture_time")
+
+    def __init__(self, frame_id: int, data, width: int, height: int, pixel_format: str,
+                 stride: int, capture_time: float):
+        self.frame_id = frame_id
+        self.data = data
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.stride = stride
+        self.capture_time = capture_time
+
+    @property
+    def is_encoded(self) -> bool:
+        return self.pixel_format == ENCODED_PIXEL_FORMAT
+
+    @property
+    def timestamp_ms(self) -> int:
+        return monotonic_to_epoch_ms(self.capture_time)
+
+
+class VideoSource(QObject):
+    """Common interface of the train video sources.
+
+    frame_ready is emitted with a CapturedFrame on the thread that captured
+    it. Receivers living on the Qt main thread get it queued, the encode
+    worker takes it directly.
+    """
+    frame_ready = pyqtSignal(object)  # CapturedFrame
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.width = 0
+        self.height = 0
+        self.direction = 1  # 1 for forward, -1 for backward
+        self.pipeline_stats = None  # records the capture stage, set by BaseClient
+
+    def init_capture(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def set_speed(self, speed_kmh: int):
+        pass
+
+    def set_direction(self, direction: int):
+        if direction not in (1, -1):
+            raise ValueError("Direction must be 1 (forward) or -1 (backward)")
+        self.direction = direction
+
+    def emit_frame(self, frame_id: int, data, width: int, height: int, pixel_format: str,
+                   capture_time: float, stride: Optional[int] = None):
+        if stride is None:
+            stride = 0 if pixel_format == ENCODED_PIXEL_FORMAT else data.strides[0]
+        if self.pipeline_stats is not None:
+            # from acquisition to handing the frame on, includes the overlay
+            self.pipeline_stats.record("capture", (time.monotonic() - capture_time) * 1000)
+        self.frame_ready.emit(CapturedFrame(frame_id, data, width, height, pixel_format, stride, capture_time))
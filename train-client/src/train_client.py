@@ -1,7 +1,7 @@
 import os
 from PyQt5.QtWidgets import QMainWindow, QLabel, QGridLayout, QVBoxLayout, QWidget, QTextEdit, QPushButton, QGraphicsDropShadowEffect
 from PyQt5.QtGui import QImage, QPixmap, QIcon, QTextCursor, QColor
-from PyQt5.QtCore import Qt, QSize, QDateTime, QTimer, QUrl, QMutex
+from PyQt5.QtCore import Qt, QSize, QDateTime, QUrl, QMutex
 from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent, QMediaPlaylist
 import qtawesome as qta
 import cv2
@@ -184,11 +184,9 @@ class TrainClient(BaseClient, QMainWindow):
 
         self.central_widget.setLayout(layout)
 
-        self.hw_timer = QTimer(self)
-        self.hw_timer.timeout.connect(self.update_hw_info)
-        self.hw_timer.start(1000)
-    def update_hw_info(self):
-        info = self.hw_info.get_hw_info()
+        self.hw_sampler.sample_ready.connect(self.update_hw_info)
+
+    def update_hw_info(self, info):
         hw_text = (
             f"CPU: {info['cpu_usage_percent']}% | {info['cpu_temperature_celsius']} °C\n"
             f"RAM: {info['ram_usage_percent']}%\n"
@@ -196,8 +194,8 @@ class TrainClient(BaseClient, QMainWindow):
         )
         self.hw_info_label.setText(hw_text)
 
-    def on_new_frame(self, frame_id, frame, width, height, is_encoded):
-        rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    def on_new_frame(self, captured):
+        rgb_image = cv2.cvtColor(captured.data, cv2.COLOR_BGR2RGB)
         h, w, ch = rgb_image.shape
 
         # Get the fixed size of the image label
@@ -234,7 +232,7 @@ class TrainClient(BaseClient, QMainWindow):
         pixmap = QPixmap.fromImage(qt_image)
         self.image_label.setPixmap(pixmap)
 
-        super().on_new_frame(frame_id, frame, width, height, is_encoded)
+        super().on_new_frame(captured)
 
     def toggle_capture(self):
         super().toggle_capture()
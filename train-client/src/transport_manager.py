@@ -0,0 +1,202 @@
+import struct
+import threading
+import time
+from typing import Optional
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from utils.app_logger import logger
+from globals import *
+
+
+class TransportManager(QObject):
+    """Routes each traffic class of the train over the best transport it has right now.
+
+    The workers (QUIC, WebSocket, MQTT) stay connected side by side, each
+    reports its health: RTT, loss and send backlog, None while it cannot
+    send. A transport's cost is its RTT plus backlog, inflated by the loss,
+    like a link of the LinkScheduler. A traffic class goes over the first
+    transport of its TRANSPORT_PREFERENCE list that is healthy: it can send,
+    costs less than TRANSPORT_MAX_COST and, for QUIC, the server answered
+    within TRANSPORT_SILENCE_TIMEOUT plus two RTT of the last frame.
+
+    The health is checked every TRANSPORT_HEALTH_INTERVAL, and the current
+    route of a class again on every frame or message, so the first frame
+    after a transport died already goes over the next one. Traffic only
+    returns to a more preferred transport once it has stayed healthy for
+    TRANSPORT_RETURN_HOLD, so a flaky path does not make it flap.
+
+    All transports share the one encoder: the frames still queued for the
+    old transport move to the new one, the video goes on without a new
+    encoder or a new stream. Only when the old transport died, and took the
+    frames in flight with it, a keyframe is requested.
+
+    The downlink is routed by the server, which sends commands over the
+    WebSocket while QUIC is silent. Both workers hand them to the BaseClient.
+    """
+
+    route_changed = pyqtSignal(str, str)  # traffic class, transport ("" if none can send)
+    keyframe_requested = pyqtSignal()  # frames were lost with a dead transport
+
+    def __init__(self, workers: dict, preference: dict = TRANSPORT_PREFERENCE, parent=None):
+        super().__init__(parent)
+        self.workers = workers  # transport name -> worker with a health() method
+        self.preference = {traffic_class: [name for name in order if name in workers]
+                           for traffic_class, order in preference.items()}
+        self.routes = {traffic_class: None for traffic_class in self.preference}
+        self.pinned_video: Optional[str] = None  # chosen by the operator (SWITCH_PROTOCOL)
+        self.samples = {}  # transport name -> latest health, None if it cannot send
+        self.healthy = {}  # transport name -> healthy at the latest check
+        self.healthy_since = {}  # transport name -> monotonic time since it has been healthy
+        self.last_sent = {}  # transport name -> monotonic time of the last frame or message
+        self.switches = {traffic_class: 0 for traffic_class in self.preference}
+        self.failovers = {traffic_class: 0 for traffic_class in self.preference}  # away from an unhealthy transport
+        self._lock = threading.Lock()  # frames come from the encode thread, the rest from the main thread
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update)
+
+    def start(self):
+        self.timer.start(int(TRANSPORT_HEALTH_INTERVAL * 1000))
+
+    def stop(self):
+        self.timer.stop()
+
+    def update(self):
+        with self._lock:
+            self._refresh(time.monotonic())
+
+    @staticmethod
+    def cost(sample: dict) -> float:
+        return (sample["rtt"] + sample["queue_age"]) * (1 + TRANSPORT_LOSS_WEIGHT * sample["loss"])
+
+    def pin_video(self, name: Optional[str]) -> bool:
+        """Keep the video on one transport while it is healthy, None lets the manager choose again."""
+        if name is not None and name not in self.preference["video"]:
+            logger.warning(f"Transport: {PROTOCOL_OPTIONS.get(name, name)} cannot carry the video, "
+                           f"it stays on {self.routes['video']}")
+            return False
+        with self._lock:
+            self.pinned_video = name
+            logger.info(f"Transport: video {'pinned to ' + name if name else 'follows the health of the transports'}")
+            self._refresh(time.monotonic())
+        return True
+
+    def send_frame(self, frame_id: int, timestamp: int, frame: bytes) -> bool:
+        """Hand an encoded frame to the transport of the video, False if none can send."""
+        with self._lock:
+            name = self._route("video")
+            if name is None:
+                return False
+            self.last_sent[name] = time.monotonic()
+        self.workers[name].enqueue_frame(frame_id, timestamp, frame)
+        return True
+
+    def send_telemetry(self, payload: bytes) -> bool:
+        """Send an encoded telemetry message (JSON or compact), False if no transport can send."""
+        with self._lock:
+            name = self._route("telemetry")
+            if name is None:
+                return False
+            self.last_sent[name] = time.monotonic()
+        worker = self.workers[name]
+        if name == "MQTT":
+            return worker.send_data(payload)
+        packet = struct.pack("B", PACKET_TYPE["telemetry"]) + payload
+        if name == "QUIC":
+            # stream packets carry a 2-byte length prefix
+            worker.enqueue_stream_packet(struct.pack(">H", len(packet)) + packet)
+        else:
+            worker.enqueue_packet(packet)
+        return True
+
+    def _route(self, traffic_class: str) -> Optional[str]:
+        # called with the lock held, the current route is checked on every send and only replaced when it is down
+        now = time.monotonic()
+        name = self.routes[traffic_class]
+        if name is None or not self._is_healthy(name, self.workers[name].health(), now):
+            self._refresh(now)
+        return self.routes[traffic_class]
+
+    def _is_healthy(self, name: str, sample: Optional[dict], now: float) -> bool:
+        if sample is None:
+            return False
+        silent = sample.get("silent")
+        if silent is not None:
+            limit = TRANSPORT_SILENCE_TIMEOUT + 2 * sample["rtt"]
+            if self.last_sent.get(name, 0.0) < now - silent:
+                # nothing sent since the server's last packet, only the PINGs of the worker ask for an answer
+                limit += 1.5 * QUIC_PING_INTERVAL
+            if silent > limit:
+                return False
+        return self.cost(sample) <= TRANSPORT_MAX_COST
+
+    def _refresh(self, now: float):
+        # called with the lock held
+        for name, worker in self.workers.items():
+            sample = worker.health()
+            healthy = self._is_healthy(name, sample, now)
+            self.samples[name] = sample
+            self.healthy[name] = healthy
+            if not healthy:
+                self.healthy_since.pop(name, None)
+            elif name not in self.healthy_since:
+                self.healthy_since[name] = now
+        for traffic_class in self.routes:
+            name = self._choose(traffic_class, now)
+            if name != self.routes[traffic_class]:
+                self._switch(traffic_class, name)
+
+    def _choose(self, traffic_class: str, now: float) -> Optional[str]:
+        order = self.preference[traffic_class]
+        if traffic_class == "video" and self.pinned_video is not None:
+            order = [self.pinned_video] + [name for name in order if name != self.pinned_video]
+        current = self.routes[traffic_class]
+        if order and order[0] == self.pinned_video and self.healthy.get(self.pinned_video, False):
+            # the operator's choice needs no hold time
+            return self.pinned_video
+        current_healthy = current is not None and self.healthy.get(current, False)
+        for name in order:
+            if name == current and current_healthy:
+                return current
+            if not self.healthy.get(name, False):
+                continue
+            if current_healthy and now - self.healthy_since[name] < TRANSPORT_RETURN_HOLD:
+                # the current route works, a preferred transport has to prove itself first
+                continue
+            return name
+        # nothing is healthy, any transport that can send is better than none
+        if current is not None and self.samples.get(current) is not None:
+            return current
+        return next((name for name in order if self.samples.get(name) is not None), None)
+
+    def _switch(self, traffic_class: str, name: Optional[str]):
+        # called with the lock held
+        old = self.routes[traffic_class]
+        self.routes[traffic_class] = name
+        self.switches[traffic_class] += 1
+        failed = old is not None and not self.healthy.get(old, False)
+        if failed:
+            self.failovers[traffic_class] += 1
+        sample = self.samples.get(name) if name is not None else None
+        measurements = f"RTT {sample['rtt'] * 1000:.0f} ms, cost {self.cost(sample) * 1000:.0f} ms" if sample else "not sending"
+        logger.info(f"Transport: {traffic_class} {old} -> {name} "
+                    f"({'failover, ' if failed else ''}{measurements})")
+        if traffic_class == "video" and old is not None and name is not None:
+            # the queued frames go on over the new transport, the encoder and its stream stay as they are
+            new_worker = self.workers[name]
+            frames = self.workers[old].frame_queue.take_pending()
+            new_worker.frame_queue.reset()
+            for frame in frames:
+                new_worker.enqueue_frame(*frame)
+            if failed:
+                self.keyframe_requested.emit()
+        self.route_changed.emit(traffic_class, name or "")
+
+    def stats(self) -> dict:
+        return {
+            "routes": dict(self.routes),
+            "pinned_video": self.pinned_video,
+            "healthy": dict(self.healthy),
+            "switches": dict(self.switches),
+            "failovers": dict(self.failovers),
+        }
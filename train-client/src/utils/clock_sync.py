@@ -0,0 +1,159 @@
+import math
+import time
+from typing import List, Optional, Tuple
+
+from utils.app_logger import logger
+from globals import (CLOCK_SYNC_BUCKET, CLOCK_SYNC_WINDOW, CLOCK_SYNC_MIN_SPAN, CLOCK_SYNC_MAX_RTT, CLOCK_SYNC_STEP,
+                     CLOCK_SYNC_DRIFT_PPM, CLOCK_SYNC_MAX_SKEW_PPM)
+
+
+def _wall_minus_monotonic() -> float:
+    return (time.time() - time.monotonic()) * 1000
+
+
+class ClockSync:
+    """Offset and skew of a remote control's clock against the train's, from NTP-style probes.
+
+    A probe carries the train's send time, the remote control adds its own
+    time and echoes it back. The remote time lies between send and receive,
+    so the offset (remote - train) is known within half the RTT. Of the
+    probes of every CLOCK_SYNC_BUCKET seconds only the one with the lowest
+    RTT is kept, the others waited in some queue. A line fitted through the
+    kept probes of the last CLOCK_SYNC_WINDOW seconds gives the offset at
+    any time and the skew, the rate at which the clocks drift apart.
+
+    uncertainty() bounds the error of the offset: half the RTT of the kept
+    probes, which an asymmetric path can hide, plus twice the standard
+    error of the fit at that time, or, before the probes span
+    CLOCK_SYNC_MIN_SPAN, an assumed CLOCK_SYNC_DRIFT_PPM since the probe.
+    A step of either clock (NTP on the train, a browser adjusting its time)
+    restarts the estimate.
+
+    All times are epoch milliseconds.
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.points: List[Tuple[float, float, float]] = []  # kept probes (local time, offset, RTT), oldest first
+        self._bucket: Optional[Tuple[float, float, float]] = None  # lowest RTT probe of the current bucket
+        self._bucket_start = 0.0
+        self._wall_minus_monotonic = _wall_minus_monotonic()
+        self._fit = None  # (mean time, offset at mean, skew, residual deviation, Sxx, mean half RTT, last time)
+        self.samples = 0
+        self.rejected = 0
+        self.resets = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._fit is not None
+
+    def add_sample(self, sent_ms: float, remote_ms: float, received_ms: float) -> bool:
+        """A probe sent at `sent_ms`, stamped `remote_ms` by the remote control and back at `received_ms`."""
+        rtt = received_ms - sent_ms
+        if rtt < 0 or rtt > CLOCK_SYNC_MAX_RTT:
+            self.rejected += 1
+            return False
+        wall_minus_monotonic = _wall_minus_monotonic()
+        if abs(wall_minus_monotonic - self._wall_minus_monotonic) > CLOCK_SYNC_STEP:
+            # the train's clock was set, probes before it are on another time scale
+            self._wall_minus_monotonic = wall_minus_monotonic
+            self._reset("the train's clock stepped")
+        self.samples += 1
+        at = (sent_ms + received_ms) / 2
+        offset = remote_ms - at
+        if self._bucket is not None and at - self._bucket_start >= CLOCK_SYNC_BUCKET * 1000:
+            self._close_bucket()
+        if self._bucket is None:
+            self._bucket_start = at
+        if self._bucket is None or rtt < self._bucket[2]:
+            self._bucket = (at, offset, rtt)
+        self._update()
+        return True
+
+    def offset(self, local_ms: Optional[float] = None) -> Optional[float]:
+        """Remote minus train clock at `local_ms` (now by default), None before the first probe."""
+        if self._fit is None:
+            return None
+        if local_ms is None:
+            local_ms = time.time() * 1000
+        mean_time, mean_offset, skew = self._fit[:3]
+        return mean_offset + skew * (local_ms - mean_time)
+
+    def to_local(self, remote_ms: float) -> Optional[float]:
+        """A time of the remote control's clock on the train's clock."""
+        offset = self.offset()
+        if offset is None:
+            return None
+        # the offset barely moves in the meantime, once more at the time itself
+        return remote_ms - self.offset(remote_ms - offset)
+
+    def uncertainty(self, local_ms: Optional[float] = None) -> Optional[float]:
+        """Bound of the error of offset(local_ms) in ms, None before the first probe."""
+        if self._fit is None:
+            return None
+        if local_ms is None:
+            local_ms = time.time() * 1000
+        mean_time, _, _, deviation, sxx, half_rtt, last_time = self._fit
+        if sxx is None:
+            # no skew fitted, the clocks may drift apart since the last probe
+            return half_rtt + CLOCK_SYNC_DRIFT_PPM * 1e-6 * abs(local_ms - last_time)
+        n = len(self._fit_points())
+        return half_rtt + 2 * deviation * math.sqrt(1 / n + (local_ms - mean_time) ** 2 / sxx)
+
+    def stats(self) -> dict:
+        now = time.time() * 1000
+        return {
+            "offset": self.offset(now),
+            "skew_ppm": self._fit[2] * 1e6 if self._fit is not None else None,
+            "uncertainty": self.uncertainty(now),
+            "min_rtt": min((rtt for _, _, rtt in self._fit_points()), default=None),
+            "points": len(self._fit_points()),
+            "samples": self.samples,
+            "rejected": self.rejected,
+            "resets": self.resets,
+        }
+
+    def _fit_points(self) -> list:
+        return self.points + ([self._bucket] if self._bucket is not None else [])
+
+    def _close_bucket(self):
+        point, self._bucket = self._bucket, None
+        if self.points:
+            # a jump of the remote clock shows as a probe far off the line through the earlier ones,
+            # even though its RTT is low
+            self._update()
+            error = abs(point[1] - self.offset(point[0]))
+            if error > point[2] / 2 + self.uncertainty(point[0]) + CLOCK_SYNC_STEP:
+                self._reset(f"the remote clock stepped by {error:.0f} ms")
+        self.points.append(point)
+        while self.points and self.points[0][0] < point[0] - CLOCK_SYNC_WINDOW * 1000:
+            self.points.pop(0)
+
+    def _reset(self, reason: str):
+        if self.points or self._bucket is not None:
+            self.resets += 1
+            logger.info(f"Clock sync {self.name}: {reason}, estimating the offset anew")
+        self.points = []
+        self._bucket = None
+        self._fit = None
+
+    def _update(self):
+        points = self._fit_points()
+        half_rtt = sum(rtt for _, _, rtt in points) / len(points) / 2
+        last_time = points[-1][0]
+        span = points[-1][0] - points[0][0]
+        if len(points) < 3 or span < CLOCK_SYNC_MIN_SPAN * 1000:
+            # too short to see a skew, the probe with the lowest RTT is the best offset
+            best = min(points, key=lambda point: point[2])
+            self._fit = (best[0], best[1], 0.0, 0.0, None, best[2] / 2, last_time)
+            return
+        n = len(points)
+        mean_time = sum(at for at, _, _ in points) / n
+        mean_offset = sum(offset for _, offset, _ in points) / n
+        sxx = sum((at - mean_time) ** 2 for at, _, _ in points)
+        sxy = sum((at - mean_time) * (offset - mean_offset) for at, offset, _ in points)
+        max_skew = CLOCK_SYNC_MAX_SKEW_PPM * 1e-6
+        skew = max(-max_skew, min(max_skew, sxy / sxx))
+        residuals = sum((offset - mean_offset - skew * (at - mean_time)) ** 2 for at, offset, _ in points)
+        deviation = math.sqrt(residuals / (n - 2)) if n > 2 else 0.0
+        self._fit = (mean_time, mean_offset, skew, deviation, sxx, half_rtt, last_time)
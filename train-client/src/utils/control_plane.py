@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Optional, Tuple
+
+from utils.app_logger import logger
+from utils.latency_histogram import LatencyHistogram
+from globals import STREAM_LANE, STREAM_LANE_BY_PACKET_TYPE
+
+
+def classify_stream_packet(packet: bytes) -> int:
+    """Map a length-prefixed stream packet to its control-plane lane."""
+    if len(packet) < 3:
+        return STREAM_LANE["bulk"]
+    return STREAM_LANE_BY_PACKET_TYPE.get(packet[2], STREAM_LANE["bulk"])
+
+
+class ControlPlaneQueue:
+    """Priority queue for the reliable QUIC stream.
+
+    Packets are put from the Qt thread (or the network thread itself) and
+    consumed by the asyncio send loop. Lanes are served strictly by priority,
+    and the time each packet waits is recorded in a histogram per lane.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lanes = {lane: deque() for lane in STREAM_LANE.values()}
+        self.histograms = {
+            lane: LatencyHistogram(f"{name}:{lane_name}") for lane_name, lane in STREAM_LANE.items()
+        }
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        # must be called from the thread running the loop
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def put(self, packet: bytes, lane: Optional[int] = None):
+        if lane is None:
+            lane = classify_stream_packet(packet)
+        with self._lock:
+            self.lanes[lane].append((time.monotonic(), packet))
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def peek_lane(self) -> Optional[int]:
+        with self._lock:
+            for lane in sorted(self.lanes):
+                if self.lanes[lane]:
+                    return lane
+        return None
+
+    def pop(self) -> Optional[Tuple[int, bytes]]:
+        with self._lock:
+            for lane in sorted(self.lanes):
+                if self.lanes[lane]:
+                    enqueued_at, packet = self.lanes[lane].popleft()
+                    break
+            else:
+                return None
+        self.histograms[lane].record((time.monotonic() - enqueued_at) * 1000)
+        return lane, packet
+
+    async def wait(self, timeout: float):
+        """Sleep for up to `timeout` seconds, returning early when a packet is put."""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def log_stats(self):
+        for lane_name, lane in STREAM_LANE.items():
+            snapshot = self.histograms[lane].snapshot()
+            if snapshot["count"]:
+                logger.info(f"Control plane {self.name} [{lane_name}] queue wait: count={snapshot['count']}, "
+                            f"p50={snapshot['p50_ms']}ms, p95={snapshot['p95_ms']}ms, max={snapshot['max_ms']}ms, "
+                            f"pending={len(self.lanes[lane])}")
@@ -0,0 +1,109 @@
+import time
+from typing import Optional, Tuple
+
+from utils.app_logger import logger
+from globals import (
+    PMTU_BASE_SIZE, PMTU_MAX_SIZE, PMTU_SEARCH_GRANULARITY, PMTU_MAX_PROBES,
+    PMTU_RAISE_INTERVAL, PMTU_CONFIRM_INTERVAL,
+)
+
+
+class DatagramPathMTU:
+    """Packetization-layer path MTU search for QUIC datagrams (after RFC 8899).
+
+    Sizes are UDP payload bytes. The search starts from the QUIC minimum,
+    which every path carries, and bisects towards `max_size` with padded probe
+    datagrams that the server acknowledges. A finished search is repeated
+    after PMTU_RAISE_INTERVAL to pick up a better path, and the current size
+    is re-confirmed every PMTU_CONFIRM_INTERVAL so that a path change to a
+    smaller MTU (e.g. a tunnel on the cellular link) falls back to the base
+    size instead of silently dropping every full-size datagram.
+    """
+
+    def __init__(self, name: str, base_size: int = PMTU_BASE_SIZE, max_size: int = PMTU_MAX_SIZE):
+        self.name = name
+        self.base_size = base_size
+        self.max_size = max_size
+        self.confirmed_size = base_size
+        self.search_high = max_size
+        self.searching = True
+        self.next_probe_id = 1
+        self.probe: Optional[Tuple[int, int]] = None  # (probe_id, size) in flight
+        self.lost_probes = 0
+        self.search_done_at = 0.0
+        self.last_confirmed_at = time.monotonic()
+        self.relay_limit: Optional[int] = None  # largest datagram the server can relay to viewers
+
+    def reset(self):
+        """Forget everything learned about the path, e.g. after a reconnect."""
+        self.__init__(self.name, self.base_size, self.max_size)
+
+    def next_probe(self) -> Optional[Tuple[int, int]]:
+        """Return (probe_id, size) of the probe to send now, or None if nothing is due."""
+        if self.probe is not None:
+            # retransmission of a lost probe keeps its size but gets a new id
+            size = self.probe[1]
+        else:
+            now = time.monotonic()
+            if not self.searching and now - self.search_done_at >= PMTU_RAISE_INTERVAL:
+                self.searching = True
+                self.search_high = self.max_size
+            if self.searching:
+                if self.search_high - self.confirmed_size < PMTU_SEARCH_GRANULARITY:
+                    self._finish_search()
+                    return None
+                size = (self.confirmed_size + self.search_high + 1) // 2
+            elif now - self.last_confirmed_at >= PMTU_CONFIRM_INTERVAL and self.confirmed_size > self.base_size:
+                size = self.confirmed_size
+            else:
+                return None
+
+        self.probe = (self.next_probe_id, size)
+        self.next_probe_id += 1
+        return self.probe
+
+    def on_ack(self, probe_id: int, relay_limit: Optional[int] = None) -> bool:
+        """Handle a pmtu_ack. Returns True if it acknowledged the probe in flight."""
+        if relay_limit is not None:
+            self.relay_limit = relay_limit
+        if self.probe is None or self.probe[0] != probe_id:
+            # late ack of a retransmitted probe, the newer one will be acknowledged as well
+            return False
+        size = self.probe[1]
+        self.probe = None
+        self.lost_probes = 0
+        self.last_confirmed_at = time.monotonic()
+        if size > self.confirmed_size:
+            self.confirmed_size = size
+            logger.debug(f"PMTU {self.name}: {size} bytes confirmed, searching up to {self.search_high}")
+        return True
+
+    def on_timeout(self) -> bool:
+        """Handle a probe that was not acknowledged in time. Returns True if the confirmed size dropped."""
+        if self.probe is None:
+            return False
+        self.lost_probes += 1
+        if self.lost_probes < PMTU_MAX_PROBES:
+            return False
+
+        size = self.probe[1]
+        self.probe = None
+        self.lost_probes = 0
+        if size > self.confirmed_size:
+            # too big for the path, continue below it
+            self.search_high = size - 1
+            return False
+
+        # the confirmed size stopped working, the path changed
+        logger.warning(f"PMTU {self.name}: {size} bytes no longer reach the server, falling back to {self.base_size}")
+        self.confirmed_size = self.base_size
+        self.search_high = self.max_size
+        self.searching = True
+        return True
+
+    def _finish_search(self):
+        self.searching = False
+        self.search_done_at = time.monotonic()
+        self.last_confirmed_at = self.search_done_at
+        logger.info(f"PMTU {self.name}: path carries {self.confirmed_size} byte datagrams"
+                    + (f", server relays up to {self.relay_limit}" if self.relay_limit else ""))
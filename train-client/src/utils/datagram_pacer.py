@@ -0,0 +1,131 @@
+from collections import deque
+from typing import Optional
+
+from utils.app_logger import logger
+from utils.latency_histogram import LatencyHistogram
+from globals import (
+    PACER_FRAME_WINDOW, PACER_KEYFRAME_WINDOW, PACER_GAIN, PACER_KEYFRAME_GAIN,
+    PACER_BANDWIDTH_WINDOW, PACER_MIN_SLEEP,
+)
+
+
+class DatagramPacer:
+    """Spreads the datagrams of a video frame instead of sending them back to back.
+
+    The bottleneck bandwidth is estimated like BBR does: the highest delivery
+    rate (bytes sent on the path minus bytes in flight, per interval of at
+    least one RTT and two frames) seen in the last PACER_BANDWIDTH_WINDOW seconds, capped by
+    the congestion window over the RTT. A frame is paced at PACER_GAIN times
+    that estimate, but never spread over more than PACER_FRAME_WINDOW of the
+    frame interval, so pacing adds a bounded delay. Keyframes may take
+    PACER_KEYFRAME_WINDOW frame intervals and are paced at the estimate
+    itself: they are the largest bursts and the frames that can least afford
+    to lose packets.
+
+    aioquic paces too, but at the congestion window over the RTT and with a
+    burst allowance of up to 16 datagrams, which is what overflows the small
+    buffers of a cellular modem.
+    """
+
+    def __init__(self, name: str, frame_rate: float):
+        self.name = name
+        self.frame_rate = frame_rate
+        self.bandwidth: Optional[float] = None  # bottleneck estimate in bit/s
+        self.cwnd_rate: Optional[float] = None  # congestion window over smoothed RTT in bit/s
+        self.rate: Optional[float] = None  # pacing rate of the current frame in bit/s
+        self._delivery_samples = deque()  # (time, bit/s)
+        self._last_delivered: Optional[tuple] = None  # (time, delivered bytes)
+        self._next_send = 0.0
+        self._frame_start = 0.0
+        self._frame_deadline = 0.0
+        self.frames = 0
+        self.keyframes = 0
+        self.packets = 0
+        self.late_frames = 0  # frames that took longer than their window, the event loop was busy
+        self.frame_spread = LatencyHistogram(f"{name}:frame_spread")  # first to last datagram of a frame
+        self.packet_delay = LatencyHistogram(f"{name}:packet_delay")  # time a datagram was held back
+
+    def reset(self):
+        """Forget the bandwidth estimate, e.g. after a reconnect."""
+        self.bandwidth = None
+        self.cwnd_rate = None
+        self._delivery_samples.clear()
+        self._last_delivered = None
+
+    def on_transport_sample(self, now: float, delivered_bytes: int, congestion_window: int,
+                            smoothed_rtt: Optional[float]):
+        if not smoothed_rtt:
+            return
+        self.cwnd_rate = congestion_window * 8 / smoothed_rtt
+        if self._last_delivered is None or delivered_bytes < self._last_delivered[1]:
+            self._last_delivered = (now, delivered_bytes)
+        else:
+            last_time, last_delivered = self._last_delivered
+            # shorter intervals measure bursts of ACKs rather than the bottleneck
+            if now - last_time >= max(smoothed_rtt, 2 / self.frame_rate):
+                self._delivery_samples.append((now, (delivered_bytes - last_delivered) * 8 / (now - last_time)))
+                self._last_delivered = (now, delivered_bytes)
+        while self._delivery_samples and now - self._delivery_samples[0][0] > PACER_BANDWIDTH_WINDOW:
+            self._delivery_samples.popleft()
+        if self._delivery_samples:
+            self.bandwidth = min(max(rate for _, rate in self._delivery_samples), self.cwnd_rate)
+        else:
+            self.bandwidth = self.cwnd_rate
+
+    def start_frame(self, now: float, frame_bytes: int, keyframe: bool):
+        """Set the pacing rate for the datagrams of the next frame, `frame_bytes` in total."""
+        frame_interval = 1.0 / self.frame_rate
+        window = frame_interval * (PACER_KEYFRAME_WINDOW if keyframe else PACER_FRAME_WINDOW)
+        # the slowest rate that still gets the frame out within its window
+        rate = frame_bytes * 8 / window
+        if self.bandwidth:
+            rate = max(rate, self.bandwidth * (PACER_KEYFRAME_GAIN if keyframe else PACER_GAIN))
+        self.rate = rate
+        # a gap left over from the previous frame is kept, an idle link is not saved up as a burst
+        self._next_send = max(self._next_send, now)
+        self._frame_start = now
+        self._frame_deadline = self._next_send + window
+        self.frames += 1
+        if keyframe:
+            self.keyframes += 1
+
+    def delay(self, now: float, size: int) -> float:
+        """Seconds to wait before sending the next datagram of `size` bytes, 0 to send it now."""
+        delay = self._next_send - now
+        self._next_send = max(self._next_send, now) + size * 8 / self.rate
+        self.packets += 1
+        if delay < PACER_MIN_SLEEP:
+            return 0.0
+        self.packet_delay.record(delay * 1000)
+        return delay
+
+    def end_frame(self, now: float):
+        self.frame_spread.record((now - self._frame_start) * 1000)
+        if now > self._frame_deadline:
+            self.late_frames += 1
+
+    def stats(self) -> dict:
+        return {
+            "bandwidth": self.bandwidth,
+            "cwnd_rate": self.cwnd_rate,
+            "rate": self.rate,
+            "frames": self.frames,
+            "keyframes": self.keyframes,
+            "packets": self.packets,
+            "late_frames": self.late_frames,
+            "frame_spread_p95_ms": self.frame_spread.percentile(95),
+            "frame_spread_max_ms": self.frame_spread.max_ms,
+        }
+
+    def log_stats(self):
+        spread = self.frame_spread.snapshot()
+        if not spread["count"]:
+            return
+        delay = self.packet_delay.snapshot()
+        bandwidth = f"{self.bandwidth / 1e6:.2f} Mbps" if self.bandwidth else "unknown"
+        logger.info(f"Pacer {self.name}: bandwidth {bandwidth}, {spread['count']} frames "
+                    f"({self.keyframes} keyframes, {self.late_frames} late), spread p50={spread['p50_ms']}ms "
+                    f"p95={spread['p95_ms']}ms max={spread['max_ms']}ms, {delay['count']} of {self.packets} "
+                    f"datagrams held back p95={delay['p95_ms']}ms")
+        self.frame_spread.reset()
+        self.packet_delay.reset()
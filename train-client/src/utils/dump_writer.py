@@ -0,0 +1,279 @@
+import datetime
+import os
+import threading
+import time
+from typing import List, Optional
+
+from utils.app_logger import logger
+from globals import (DUMP_BUFFER_BYTES, DUMP_FLUSH_BYTES, DUMP_FLUSH_INTERVAL, DUMP_FSYNC_INTERVAL,
+                     DUMP_ROTATE_BYTES, DUMP_MAX_FILES)
+
+
+class DumpFile:
+    """One dump of a DumpWriter, e.g. the H.264 stream or a latency log.
+
+    write() only queues the data, the writer thread puts it on disk. A
+    write that would grow the queue beyond `buffer_bytes` is dropped and
+    counted, and so is everything after it up to the next boundary, the
+    next point where a reader can pick up again: every line of a log, the
+    next keyframe of a video.
+    """
+
+    def __init__(self, writer: "DumpWriter", prefix: str, extension: str, buffer_bytes: int):
+        self.writer = writer
+        self.prefix = prefix
+        self.extension = extension
+        self.buffer_bytes = buffer_bytes
+        self.base = f"{prefix}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.name = os.path.basename(prefix)
+        self.path: Optional[str] = None
+        self.paths: List[str] = []  # files of this dump so far, the oldest first
+        # shared with the producers, under the writer's lock
+        self._pending = []  # (data, boundary)
+        self._pending_bytes = 0
+        self._pending_since = 0.0
+        self._resync = False  # something was dropped, wait for the next boundary
+        self._closed = False
+        self._dropping = False
+        self._episode_writes = 0
+        self._episode_bytes = 0
+        # the writer thread's own
+        self._file = None
+        self._size = 0
+        self._synced_at = time.monotonic()
+        self._unsynced = False
+        self.written_bytes = 0
+        self.dropped_writes = 0
+        self.dropped_bytes = 0
+        self.rotations = 0
+
+    def write(self, data, boundary: bool = True) -> bool:
+        """Queue bytes or text, returns False if they were dropped. Never blocks on the disk."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return self.writer._submit(self, data, boundary)
+
+    def gap(self):
+        """Data was left out on purpose, the dump goes on at the next boundary."""
+        with self.writer._condition:
+            self._resync = True
+
+    def close(self):
+        """The queued data is still written, then the file is closed by the writer thread."""
+        with self.writer._condition:
+            self._closed = True
+            self.writer._condition.notify()
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "written_bytes": self.written_bytes,
+            "dropped_writes": self.dropped_writes,
+            "dropped_bytes": self.dropped_bytes,
+            "rotations": self.rotations,
+        }
+
+
+class DumpWriter:
+    """Writes all dumps of the train on one background thread.
+
+    The encode thread, the Qt main thread and the HW sampler only append to
+    the in-memory queue of a DumpFile, so a slow SD card cannot stall them.
+    A dump is written when DUMP_FLUSH_BYTES are queued or its oldest data
+    has waited DUMP_FLUSH_INTERVAL, in one write() call. At the first flush
+    after DUMP_FSYNC_INTERVAL it is also fsynced, and at a boundary after
+    DUMP_ROTATE_BYTES it continues in a new file, of which DUMP_MAX_FILES
+    are kept.
+    """
+
+    def __init__(self, flush_interval: float = DUMP_FLUSH_INTERVAL, flush_bytes: int = DUMP_FLUSH_BYTES,
+                 fsync_interval: Optional[float] = DUMP_FSYNC_INTERVAL, rotate_bytes: int = DUMP_ROTATE_BYTES,
+                 max_files: int = DUMP_MAX_FILES):
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync_interval = fsync_interval  # 0 syncs every flush, None only on rotation and close
+        self.rotate_bytes = rotate_bytes  # 0 never rotates
+        self.max_files = max_files  # 0 keeps every file
+        self._condition = threading.Condition()
+        self._dumps: List[DumpFile] = []
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="DumpWriter", daemon=True)
+
+    def open(self, prefix: str, extension: str, buffer_bytes: int = DUMP_BUFFER_BYTES) -> DumpFile:
+        """A new dump at {prefix}_{date}_{time}.{extension}, the file is created right away."""
+        dump = DumpFile(self, prefix, extension, buffer_bytes)
+        dump_dir = os.path.dirname(prefix)
+        if dump_dir:
+            os.makedirs(dump_dir, exist_ok=True)
+        self._open_file(dump)
+        with self._condition:
+            self._dumps.append(dump)
+        return dump
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Write what is queued, close every dump and end the thread."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def stats(self) -> List[dict]:
+        with self._condition:
+            return [dump.stats() for dump in self._dumps]
+
+    def _submit(self, dump: DumpFile, data, boundary: bool) -> bool:
+        with self._condition:
+            if dump._closed or self._stopping:
+                return False
+            if dump._resync and not boundary:
+                if dump._dropping:
+                    self._drop(dump, data)
+                # else a gap() on purpose, nothing was lost
+                return False
+            if dump._pending_bytes + len(data) > dump.buffer_bytes:
+                dump._resync = True
+                self._drop(dump, data)
+                return False
+            dump._resync = False
+            if dump._dropping:
+                dump._dropping = False
+                logger.warning(f"Dump {dump.name}: writing again, {dump._episode_writes} writes "
+                               f"({dump._episode_bytes / 1024:.0f} KiB) were dropped")
+            if not dump._pending:
+                dump._pending_since = time.monotonic()
+            dump._pending.append((data, boundary))
+            dump._pending_bytes += len(data)
+            if dump._pending_bytes >= self.flush_bytes:
+                self._condition.notify()
+            return True
+
+    @staticmethod
+    def _drop(dump: DumpFile, data):
+        # called with the lock held
+        dump.dropped_writes += 1
+        dump.dropped_bytes += len(data)
+        if not dump._dropping:
+            dump._dropping = True
+            dump._episode_writes = dump._episode_bytes = 0
+            logger.warning(f"Dump {dump.name}: the disk falls behind with {dump._pending_bytes / 1024:.0f} KiB "
+                           f"queued, dropping until the next boundary that fits")
+        dump._episode_writes += 1
+        dump._episode_bytes += len(data)
+
+    def _due(self, dump: DumpFile, now: float) -> float:
+        if dump._closed or self._stopping or dump._pending_bytes >= self.flush_bytes:
+            return now
+        if not dump._pending:
+            return float("inf")
+        return dump._pending_since + self.flush_interval
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    next_due = min((self._due(dump, now) for dump in self._dumps), default=float("inf"))
+                    if next_due <= now or self._stopping:
+                        break
+                    self._condition.wait(None if next_due == float("inf") else next_due - now)
+                stopping = self._stopping
+                batches = []
+                for dump in self._dumps:
+                    if self._due(dump, now) <= now:
+                        batches.append((dump, dump._pending, dump._closed))
+                        dump._pending = []
+                        dump._pending_bytes = 0
+                self._dumps = [dump for dump in self._dumps if not dump._closed]
+            # the disk is only touched here, without the lock
+            for dump, entries, closed in batches:
+                self._write(dump, entries)
+                if closed or stopping:
+                    self._close_file(dump)
+            if stopping:
+                with self._condition:
+                    for dump in self._dumps:
+                        dump._closed = True
+                    self._dumps = []
+                return
+
+    def _write(self, dump: DumpFile, entries: list):
+        if dump._file is None:
+            # the file could not be opened
+            with self._condition:
+                dump.dropped_writes += len(entries)
+                dump.dropped_bytes += sum(len(data) for data, _ in entries)
+            return
+        chunk = []
+        for data, boundary in entries:
+            if boundary and self.rotate_bytes and dump._size >= self.rotate_bytes:
+                self._write_chunk(dump, chunk)
+                chunk = []
+                self._rotate(dump)
+            chunk.append(data)
+            dump._size += len(data)
+        self._write_chunk(dump, chunk)
+        now = time.monotonic()
+        if dump._unsynced and self.fsync_interval is not None and now - dump._synced_at >= self.fsync_interval:
+            self._fsync(dump, now)
+
+    def _write_chunk(self, dump: DumpFile, chunk: list):
+        if not chunk:
+            return
+        data = b"".join(chunk)
+        try:
+            dump._file.write(data)
+            dump._file.flush()
+            dump.written_bytes += len(data)
+            dump._unsynced = True
+        except (OSError, ValueError) as e:
+            logger.error(f"Dump {dump.name}: writing {len(data)} bytes to {dump.path} failed: {e}")
+            with self._condition:
+                for lost in chunk:
+                    self._drop(dump, lost)
+                dump._resync = True
+
+    def _fsync(self, dump: DumpFile, now: float):
+        try:
+            os.fsync(dump._file.fileno())
+        except (OSError, ValueError) as e:
+            logger.error(f"Dump {dump.name}: fsync of {dump.path} failed: {e}")
+        dump._synced_at = now
+        dump._unsynced = False
+
+    def _open_file(self, dump: DumpFile):
+        index = dump.rotations
+        dump.path = f"{dump.base}.{dump.extension}" if index == 0 else f"{dump.base}_{index}.{dump.extension}"
+        try:
+            dump._file = open(dump.path, "ab")
+        except OSError as e:
+            logger.error(f"Dump {dump.name}: cannot open {dump.path}: {e}")
+            dump._file = None
+        dump._size = 0
+        dump.paths.append(dump.path)
+
+    def _close_file(self, dump: DumpFile, final: bool = True):
+        if dump._file is None:
+            return
+        if dump._unsynced:
+            self._fsync(dump, time.monotonic())
+        dump._file.close()
+        dump._file = None
+        if final and dump.dropped_writes:
+            logger.warning(f"Dump {dump.name} closed, {dump.written_bytes / 1e6:.1f} MB written, "
+                           f"{dump.dropped_writes} writes ({dump.dropped_bytes / 1e6:.1f} MB) dropped")
+
+    def _rotate(self, dump: DumpFile):
+        self._close_file(dump, final=False)
+        dump.rotations += 1
+        self._open_file(dump)
+        while self.max_files and len(dump.paths) > self.max_files:
+            old = dump.paths.pop(0)
+            try:
+                os.remove(old)
+            except OSError as e:
+                logger.warning(f"Dump {dump.name}: cannot remove {old}: {e}")
+        logger.info(f"Dump {dump.name}: continuing in {dump.path}")
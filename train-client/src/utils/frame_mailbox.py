@@ -0,0 +1,49 @@
+import threading
+import time
+from typing import Any, Optional
+
+
+class LatestFrameMailbox:
+    """Single-slot handoff between two pipeline stages.
+
+    The producer never blocks: a frame that the consumer has not taken yet is
+    replaced by the newer one and counted as dropped, so a slow consumer works
+    on the freshest frame instead of a growing backlog.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._condition = threading.Condition()
+        self._item: Optional[Any] = None
+        self._put_at = 0.0
+        self._closed = False
+        self.delivered = 0
+        self.dropped = 0
+
+    def put(self, item: Any) -> bool:
+        """Offer a frame, returns True if it replaced one that was never taken."""
+        with self._condition:
+            replaced = self._item is not None
+            if replaced:
+                self.dropped += 1
+            self._item = item
+            self._put_at = time.monotonic()
+            self._condition.notify()
+        return replaced
+
+    def get(self, timeout: Optional[float] = None):
+        """Take the latest frame as (item, seconds it waited), or None on timeout or close."""
+        with self._condition:
+            if self._item is None and not self._closed:
+                self._condition.wait(timeout)
+            if self._item is None:
+                return None
+            item, self._item = self._item, None
+            self.delivered += 1
+            return item, time.monotonic() - self._put_at
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._item = None
+            self._condition.notify_all()
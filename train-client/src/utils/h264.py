@@ -0,0 +1,22 @@
+START_CODE = b"\x00\x00\x01"
+NAL_IDR = 5
+NAL_SPS = 7
+
+
+def is_keyframe(frame, scan_bytes: int = 1024) -> bool:
+    """True if an Annex B access unit starts with parameter sets or an IDR slice, a decoder can start there.
+
+    Only the NAL units in front of the first slice are looked at, within the
+    first `scan_bytes`, so a P frame is told apart by its first NAL unit.
+    """
+    head = bytes(frame[:scan_bytes])
+    start = head.find(START_CODE)
+    while start != -1 and start + 3 < len(head):
+        nal_type = head[start + 3] & 0x1F
+        if nal_type in (NAL_IDR, NAL_SPS):
+            return True
+        if 1 <= nal_type < NAL_IDR:
+            # a non-IDR slice
+            return False
+        start = head.find(START_CODE, start + 3)
+    return False
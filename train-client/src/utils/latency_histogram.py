@@ -0,0 +1,70 @@
+import bisect
+import threading
+
+# Bucket upper bounds in milliseconds, the last bucket collects everything above
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram for queue-wait and stage latencies (milliseconds).
+
+    Recording is cheap (one bisect + increment) and safe to call from
+    multiple threads, so it can sit on hot paths such as the QUIC send loop.
+    """
+
+    def __init__(self, name: str, buckets_ms=DEFAULT_BUCKETS_MS):
+        self.name = name
+        self.buckets_ms = tuple(buckets_ms)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets_ms) + 1)
+            self.count = 0
+            self.total_ms = 0.0
+            self.max_ms = 0.0
+
+    def record(self, value_ms: float):
+        index = bisect.bisect_left(self.buckets_ms, value_ms)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ms += value_ms
+            if value_ms > self.max_ms:
+                self.max_ms = value_ms
+
+    def percentile(self, p: float) -> float:
+        """Return the upper bound of the bucket holding the p-th percentile, capped at the maximum."""
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            target = self.count * p / 100.0
+            seen = 0
+            for index, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= target:
+                    if index < len(self.buckets_ms):
+                        return min(float(self.buckets_ms[index]), self.max_ms)
+                    return self.max_ms
+            return self.max_ms
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            count = self.count
+            mean = self.total_ms / count if count else 0.0
+            buckets = {
+                f"le_{bound}": self.counts[i] for i, bound in enumerate(self.buckets_ms)
+            }
+            buckets["inf"] = self.counts[-1]
+            max_ms = self.max_ms
+        return {
+            "name": self.name,
+            "count": count,
+            "mean_ms": round(mean, 3),
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(max_ms, 3),
+            "buckets": buckets,
+        }
@@ -0,0 +1,77 @@
+from typing import List, Sequence, Tuple
+
+from globals import (
+    BONDING_KEYFRAME_REDUNDANCY, BONDING_SPLIT_FRAMES, BONDING_SPLIT_MAX_SKEW, BONDING_LOSS_WEIGHT,
+)
+
+
+class LinkScheduler:
+    """Decides which uplink of a bonded train carries which datagram of a frame.
+
+    Works on the links' samples (smoothed RTT, loss, send rate and the
+    datagrams still waiting in their QUIC connections), see QuicLink.sample.
+    A link's cost is the time a datagram sent now needs to arrive: RTT plus
+    its backlog at the link's rate, inflated by the loss on the link.
+
+    Keyframes go out in full over the `keyframe_redundancy` cheapest links,
+    the receiver keeps the first copy of every packet. P-frames are split
+    over all links within BONDING_SPLIT_MAX_SKEW of the cheapest one, in
+    proportion to the rate each delivers, so a frame is never held up by a
+    link much slower than the best. Without `split_frames` the cheapest link
+    takes the whole frame.
+    """
+
+    def __init__(self, keyframe_redundancy: int = BONDING_KEYFRAME_REDUNDANCY,
+                 split_frames: bool = BONDING_SPLIT_FRAMES):
+        self.keyframe_redundancy = keyframe_redundancy
+        self.split_frames = split_frames
+
+    @staticmethod
+    def cost(sample: dict) -> float:
+        backlog_delay = sample["backlog_bytes"] * 8 / sample["rate"] if sample["rate"] else 0.0
+        return (sample["smoothed_rtt"] + backlog_delay) * (1 + BONDING_LOSS_WEIGHT * sample["loss"])
+
+    def rank(self, samples: Sequence[Tuple[object, dict]]) -> List[Tuple[object, dict, float]]:
+        """(link, sample, cost) of the links that can send, cheapest first."""
+        return sorted(((link, sample, self.cost(sample)) for link, sample in samples), key=lambda ranked: ranked[2])
+
+    def assign(self, samples: Sequence[Tuple[object, dict]], packets: list, keyframe: bool) -> List[Tuple[object, list]]:
+        """Split the datagrams of one frame into (link, datagrams), empty if no link can send."""
+        ranked = self.rank(samples)
+        if not ranked:
+            return []
+        if keyframe and self.keyframe_redundancy > 1:
+            return [(link, packets) for link, _, _ in ranked[:self.keyframe_redundancy]]
+        best_cost = ranked[0][2]
+        shares = [(link, sample["rate"] * (1 - sample["loss"])) for link, sample, cost in ranked
+                  if cost <= best_cost + BONDING_SPLIT_MAX_SKEW and sample["rate"]]
+        if not self.split_frames or len(shares) < 2 or len(packets) < 2:
+            return [(ranked[0][0], packets)]
+
+        # largest remainder, so the counts add up to the number of packets
+        total = sum(weight for _, weight in shares)
+        if total <= 0:
+            # every link in reach reports total loss, nothing to weigh them by
+            return [(ranked[0][0], packets)]
+        exact = [len(packets) * weight / total for _, weight in shares]
+        counts = [int(value) for value in exact]
+        for index in sorted(range(len(exact)), key=lambda i: exact[i] - counts[i], reverse=True)[:len(packets) - sum(counts)]:
+            counts[index] += 1
+        assignments = []
+        start = 0
+        for (link, _), count in zip(shares, counts):
+            if count:
+                assignments.append((link, packets[start:start + count]))
+                start += count
+        return assignments
+
+
+def interleave(assignments: List[Tuple[object, list]]) -> List[Tuple[object, object]]:
+    """(link, datagram) pairs taking turns between the links, so that they all send at once."""
+    pairs = []
+    longest = max((len(packets) for _, packets in assignments), default=0)
+    for index in range(longest):
+        for link, packets in assignments:
+            if index < len(packets):
+                pairs.append((link, packets[index]))
+    return pairs
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Optional
+
+from utils.app_logger import logger
+from utils.latency_histogram import LatencyHistogram
+
+
+class LoopQueue:
+    """FIFO from any thread into the asyncio loop of a network worker.
+
+    put() is called from the Qt or encode thread, get() is awaited by the
+    worker's send loop. An idle consumer is woken with call_soon_threadsafe
+    the moment something is put, there is no polling, and only a waiting
+    consumer costs a wakeup. The time every item spent in the queue is
+    recorded in a histogram.
+
+    With maxsize, put() blocks while the queue is full, like queue.Queue.
+    close() wakes both sides, get() returns None from then on and put()
+    drops the item, until reopen().
+    """
+
+    def __init__(self, name: str, maxsize: int = 0):
+        self.name = name
+        self.maxsize = maxsize
+        self.histogram = LatencyHistogram(f"{name}:queue_wait")
+        self._items = deque()  # (enqueued_at, item)
+        self._not_full = threading.Condition()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._consumer_waiting = False
+        self._closed = False
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        # must be called from the thread running the loop
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def put(self, item: Any, timeout: Optional[float] = None) -> bool:
+        """Append an item, blocking while the queue is full. False if it was dropped on timeout or close."""
+        with self._not_full:
+            if self.maxsize:
+                self._not_full.wait_for(lambda: self._closed or len(self._items) < self.maxsize, timeout)
+                if len(self._items) >= self.maxsize:
+                    return False
+            if self._closed:
+                return False
+            self._items.append((time.monotonic(), item))
+            wake = self._consumer_waiting
+            self._consumer_waiting = False
+        if wake:
+            self._wake_consumer()
+        return True
+
+    async def get(self, timeout: Optional[float] = None):
+        """Take the oldest item as (item, seconds it waited), or None on timeout or close."""
+        deadline = None if timeout is None else self._loop.time() + timeout
+        while True:
+            # cleared before looking, so a put after the look still wakes us
+            self._wakeup.clear()
+            with self._not_full:
+                if self._items:
+                    enqueued_at, item = self._items.popleft()
+                    self._not_full.notify()
+                    break
+                if self._closed:
+                    return None
+                self._consumer_waiting = True
+            remaining = None if deadline is None else deadline - self._loop.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        waited = time.monotonic() - enqueued_at
+        self.histogram.record(waited * 1000)
+        return item, waited
+
+    def oldest_age(self) -> float:
+        """Seconds the item at the head of the queue has been waiting, 0 if it is empty."""
+        with self._not_full:
+            if not self._items:
+                return 0.0
+            return max(0.0, time.monotonic() - self._items[0][0])
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def close(self):
+        with self._not_full:
+            self._closed = True
+            self._not_full.notify_all()
+        self._wake_consumer()
+
+    def reopen(self):
+        """Accept items again after close(), e.g. for a new connection."""
+        with self._not_full:
+            self._closed = False
+
+    def _wake_consumer(self):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # the loop closed in the meantime
+                pass
+
+    def log_stats(self):
+        snapshot = self.histogram.snapshot()
+        if snapshot["count"]:
+            logger.info(f"Queue {self.name} wait: count={snapshot['count']}, p50={snapshot['p50_ms']}ms, "
+                        f"p95={snapshot['p95_ms']}ms, max={snapshot['max_ms']}ms, pending={self.qsize()}")
+        self.histogram.reset()
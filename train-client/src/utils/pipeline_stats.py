@@ -0,0 +1,40 @@
+import time
+
+from utils.app_logger import logger
+from utils.latency_histogram import LatencyHistogram
+
+# capture: from acquisition to frame_ready, includes the overlay
+# handoff: time a raw frame waited in the encode mailbox
+# encode: Encoder.encode_frame in the encode thread
+# send: from the encoded frame entering the network queue to its datagrams handed to QUIC
+# total: from acquisition to the datagrams handed to QUIC, the packet header carries the capture time
+PIPELINE_STAGES = ("capture", "handoff", "encode", "send", "total")
+
+
+class PipelineStats:
+    """Per-stage timing and frame rate of the train video pipeline.
+
+    Each stage records from its own thread, log_stats reports the frames per
+    second every stage achieved since the previous call and starts over.
+    """
+
+    def __init__(self):
+        self.histograms = {stage: LatencyHistogram(f"pipeline:{stage}") for stage in PIPELINE_STAGES}
+        self._last_log = time.monotonic()
+
+    def record(self, stage: str, value_ms: float):
+        self.histograms[stage].record(value_ms)
+
+    def log_stats(self, dropped: int = 0):
+        now = time.monotonic()
+        elapsed = max(now - self._last_log, 1e-6)
+        self._last_log = now
+        parts = []
+        for stage in PIPELINE_STAGES:
+            snapshot = self.histograms[stage].snapshot()
+            self.histograms[stage].reset()
+            if snapshot["count"]:
+                parts.append(f"{stage} {snapshot['count'] / elapsed:.1f}fps p50={snapshot['p50_ms']:.1f}ms "
+                             f"p95={snapshot['p95_ms']:.1f}ms max={snapshot['max_ms']:.1f}ms")
+        if parts:
+            logger.info(f"Video pipeline: {', '.join(parts)}, dropped before encode={dropped}")
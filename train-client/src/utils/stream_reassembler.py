@@ -0,0 +1,44 @@
+import struct
+from typing import Dict, List
+
+from utils.app_logger import logger
+
+LENGTH_PREFIX = struct.Struct(">H")
+
+
+class StreamReassembler:
+    """Splits the QUIC streams from the server back into messages.
+
+    Every message on a stream carries a 2-byte big-endian length prefix,
+    the same framing the train uses towards the server. QUIC hands over
+    stream data in chunks that can hold part of a message or several
+    messages, so what is left over is kept per stream until the rest arrives.
+    """
+
+    def __init__(self):
+        self._buffers: Dict[int, bytearray] = {}
+
+    def feed(self, stream_id: int, data: bytes) -> List[bytes]:
+        """The messages completed by `data`, in order, without their prefix."""
+        buffer = self._buffers.setdefault(stream_id, bytearray())
+        buffer += data
+        messages = []
+        offset = 0
+        while len(buffer) - offset >= LENGTH_PREFIX.size:
+            (size,) = LENGTH_PREFIX.unpack_from(buffer, offset)
+            end = offset + LENGTH_PREFIX.size + size
+            if end > len(buffer):
+                break
+            messages.append(bytes(buffer[offset + LENGTH_PREFIX.size:end]))
+            offset = end
+        del buffer[:offset]
+        return messages
+
+    def reset(self, stream_id: int):
+        """The stream was reset, a message cut off on it never completes."""
+        dropped = self._buffers.pop(stream_id, None)
+        if dropped:
+            logger.warning(f"Stream {stream_id} reset with {len(dropped)} bytes of an incomplete message")
+
+    def clear(self):
+        self._buffers.clear()
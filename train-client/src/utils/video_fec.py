@@ -0,0 +1,75 @@
+import math
+import struct
+from typing import List, Optional
+
+import numpy as np
+
+from utils.app_logger import logger
+from utils.video_packetizer import packet_count
+from globals import PACKET_TYPE, FEC_GROUP_SIZE_BY_LOSS, FEC_INITIAL_GROUP_SIZE
+
+
+def group_size_for_loss(loss: float) -> int:
+    for max_loss, group_size in FEC_GROUP_SIZE_BY_LOSS:
+        if loss < max_loss:
+            return group_size
+    return FEC_GROUP_SIZE_BY_LOSS[-1][1]
+
+
+class VideoFecEncoder:
+    """XOR parity packets for the video datagrams of one frame.
+
+    Data packet i (0-based) belongs to group i % group_count, so consecutive
+    packets land in different groups and a burst of up to group_count lost
+    packets is still recoverable (one loss per group). The group size follows
+    the packet loss the server measures and sends back in receiver reports.
+    """
+
+    def __init__(self, train_client_id_bytes: bytes):
+        self.train_client_id_bytes = train_client_id_bytes
+        self.group_size = FEC_INITIAL_GROUP_SIZE
+        self.loss = None  # smoothed packet loss reported by the server
+
+    def on_receiver_report(self, report: dict):
+        loss = float(report.get("loss", 0.0))
+        # react fast to more loss, slowly to less
+        if self.loss is None or loss > self.loss:
+            self.loss = loss
+        else:
+            self.loss = 0.8 * self.loss + 0.2 * loss
+
+        group_size = group_size_for_loss(self.loss)
+        if group_size != self.group_size:
+            logger.info(f"FEC: packet loss {self.loss:.2%}, "
+                        + (f"one parity packet per {group_size} data packets" if group_size else "parity disabled")
+                        + f" (recovered frames: {report.get('recovered_frames')}, "
+                        f"unrecoverable: {report.get('unrecoverable_frames')})")
+            self.group_size = group_size
+
+    def group_count(self, number_of_packets: int) -> int:
+        if not self.group_size:
+            return 0
+        return math.ceil(number_of_packets / self.group_size)
+
+    def create_parity_packets(self, frame_id: int, timestamp: int, frame: bytes, max_packet_size: int,
+                              group_count: Optional[int] = None) -> List[bytes]:
+        """Parity packets for a frame that was split into packets of `max_packet_size` payload bytes."""
+        frame_size = len(frame)
+        number_of_packets = packet_count(frame_size, max_packet_size)
+        if group_count is None:
+            group_count = self.group_count(number_of_packets)
+        if not group_count:
+            return []
+
+        # one row per data packet, padded with zeros to the full payload size and to whole groups
+        rows = math.ceil(number_of_packets / group_count) * group_count
+        data = np.zeros(rows * max_packet_size, dtype=np.uint8)
+        data[:frame_size] = np.frombuffer(frame, dtype=np.uint8)
+        parity = np.bitwise_xor.reduce(data.reshape(-1, group_count, max_packet_size), axis=0)
+
+        packets = []
+        for group_index in range(group_count):
+            header = struct.pack(">BIHH36sQHI", PACKET_TYPE["video_fec"], frame_id, number_of_packets,
+                                 group_index + 1, self.train_client_id_bytes, timestamp, group_count, frame_size)
+            packets.append(header + parity[group_index].tobytes())
+        return packets
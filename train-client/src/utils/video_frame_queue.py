@@ -0,0 +1,141 @@
+import time
+from typing import Any, Callable, Optional
+
+from utils.app_logger import logger
+from utils.loop_queue import LoopQueue
+from utils.h264 import is_keyframe
+from sensor.video_source import monotonic_to_epoch_ms
+from globals import FRAME_QUEUE_SIZE, FRAME_QUEUE_MAX_AGE
+
+
+class VideoFrameQueue(LoopQueue):
+    """Queue of encoded frames in front of the video send loop that sheds instead of blocking.
+
+    Items are (frame_id, timestamp, frame) with the capture time as the
+    timestamp. put() never blocks the encode thread: a P-frame that finds
+    the queue full is dropped, a keyframe replaces everything queued, it is
+    decodable on its own. get() drops frames that are more than max_age
+    seconds past their capture, they would only add to the latency.
+
+    A dropped P-frame breaks the reference chain of the frames after it, so
+    after every drop the queue sheds the queued P-frames up to the next
+    keyframe and drops new P-frames until a keyframe arrives. The first drop
+    of such a run calls on_keyframe_request, so the encoder does not leave
+    the video frozen until the end of its GOP.
+    """
+
+    def __init__(self, name: str, maxsize: int = FRAME_QUEUE_SIZE, max_age: float = FRAME_QUEUE_MAX_AGE,
+                 on_keyframe_request: Optional[Callable[[], None]] = None):
+        super().__init__(name, maxsize)
+        self.max_age = max_age
+        self.on_keyframe_request = on_keyframe_request
+        self.waiting_for_keyframe = False
+        self.dropped_full = 0  # P-frames that found the queue full, or were flushed by a keyframe
+        self.dropped_expired = 0  # frames older than max_age when the send loop got to them
+        self.dropped_until_keyframe = 0  # P-frames without their reference frame
+        self.keyframe_requests = 0
+
+    def put(self, item: Any, timeout: Optional[float] = None) -> bool:
+        """Append a frame without blocking. False if it was dropped."""
+        keyframe = is_keyframe(item[2])
+        with self._not_full:
+            if self._closed:
+                return False
+            full = self.maxsize and len(self._items) >= self.maxsize
+            if keyframe:
+                self.waiting_for_keyframe = False
+                if full:
+                    # everything queued is older than a frame that decodes on its own
+                    self.dropped_full += len(self._items)
+                    self._items.clear()
+            elif self.waiting_for_keyframe:
+                self.dropped_until_keyframe += 1
+                return False
+            elif full:
+                # the queued frames still decode, the ones after them need a new keyframe
+                self.dropped_full += 1
+                self._start_waiting()
+            accepted = keyframe or not full
+            if accepted:
+                self._items.append((time.monotonic(), item))
+                wake = self._consumer_waiting
+                self._consumer_waiting = False
+        if not accepted:
+            self._request_keyframe()
+            return False
+        if wake:
+            self._wake_consumer()
+        return True
+
+    async def get(self, timeout: Optional[float] = None):
+        """Take the oldest frame that is not too old, as (item, seconds it waited), or None on timeout or close."""
+        while True:
+            handoff = await super().get(timeout)
+            if handoff is None:
+                return None
+            item, waited = handoff
+            age = (monotonic_to_epoch_ms(time.monotonic()) - item[1]) / 1000
+            if age <= self.max_age:
+                return handoff
+            with self._not_full:
+                self.dropped_expired += 1
+                request = self._shed_until_keyframe()
+            if request:
+                self._request_keyframe()
+
+    def _shed_until_keyframe(self) -> bool:
+        # called with the lock held, True if a keyframe has to be requested
+        while self._items and not is_keyframe(self._items[0][1][2]):
+            self._items.popleft()
+            self.dropped_until_keyframe += 1
+        self._not_full.notify_all()
+        if self._items:
+            return False
+        return self._start_waiting()
+
+    def _start_waiting(self) -> bool:
+        # called with the lock held, only the first drop of a run requests a keyframe
+        if self.waiting_for_keyframe:
+            return False
+        self.waiting_for_keyframe = True
+        self.keyframe_requests += 1
+        return True
+
+    def _request_keyframe(self):
+        if self.on_keyframe_request is not None:
+            self.on_keyframe_request()
+
+    def reset(self):
+        """Forget queued frames and the drop state, e.g. for a new connection."""
+        with self._not_full:
+            self._items.clear()
+            self.waiting_for_keyframe = False
+
+    def take_pending(self) -> list:
+        """Remove and return the queued frames, oldest first, e.g. to hand them to another transport."""
+        with self._not_full:
+            items = [item for _, item in self._items]
+            self._items.clear()
+            self.waiting_for_keyframe = False
+            self._not_full.notify_all()
+        return items
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.qsize(),
+            "oldest_age": self.oldest_age(),
+            "dropped_full": self.dropped_full,
+            "dropped_expired": self.dropped_expired,
+            "dropped_until_keyframe": self.dropped_until_keyframe,
+            "dropped": self.dropped_full + self.dropped_expired + self.dropped_until_keyframe,
+            "keyframe_requests": self.keyframe_requests,
+        }
+
+    def log_stats(self):
+        super().log_stats()
+        stats = self.stats()
+        if stats["dropped"]:
+            logger.info(f"Queue {self.name} dropped {stats['dropped']} frames so far: {stats['dropped_full']} on a "
+                        f"full queue, {stats['dropped_expired']} older than {self.max_age * 1000:.0f} ms, "
+                        f"{stats['dropped_until_keyframe']} waiting for a keyframe, "
+                        f"{stats['keyframe_requests']} keyframes requested")
@@ -0,0 +1,51 @@
+import struct
+from typing import List
+
+from globals import PACKET_TYPE
+
+# type, frame_id, number_of_packets, packet_id, train_id, timestamp
+VIDEO_HEADER = struct.Struct(">BIHH36sQ")
+_FRAME_FIELDS = struct.Struct(">IH")  # frame_id, number_of_packets at offset 1
+_PACKET_ID = struct.Struct(">H")  # at offset 7
+_TIMESTAMP = struct.Struct(">Q")  # at offset 45
+
+
+def packet_count(frame_size: int, max_packet_size: int) -> int:
+    """Number of datagrams a frame is split into, an empty frame still gets one."""
+    return max(1, -(-frame_size // max_packet_size))
+
+
+class VideoPacketizer:
+    """Splits an encoded frame into video datagrams.
+
+    The header is a template with the train ID filled in once. Per frame only
+    frame_id, number_of_packets and timestamp are patched in, per packet
+    only packet_id. The frame is sliced through a memoryview, and each
+    datagram is joined from the header and its slice. That is one allocation
+    and one copy of the payload per datagram. aioquic only sends immutable
+    bytes and keeps them until they leave, so a datagram cannot be a view
+    into a reused buffer.
+
+    `prefix` goes in front of every header, e.g. the video_frame type byte
+    of the WebSocket transport.
+    """
+
+    def __init__(self, train_client_id_bytes: bytes, prefix: bytes = b""):
+        self.offset = len(prefix)
+        self.header = bytearray(prefix + VIDEO_HEADER.pack(PACKET_TYPE["video"], 0, 0, 0, train_client_id_bytes, 0))
+
+    def packetize(self, frame_id: int, timestamp: int, frame, max_packet_size: int) -> List[bytes]:
+        view = memoryview(frame)
+        frame_size = len(view)
+        number_of_packets = packet_count(frame_size, max_packet_size)
+        header = self.header
+        offset = self.offset
+        _FRAME_FIELDS.pack_into(header, offset + 1, frame_id, number_of_packets)
+        _TIMESTAMP.pack_into(header, offset + 45, timestamp)
+        join = b"".join
+        packets = []
+        for packet_id in range(1, number_of_packets + 1):
+            _PACKET_ID.pack_into(header, offset + 7, packet_id)
+            start = (packet_id - 1) * max_packet_size
+            packets.append(join((header, view[start:start + max_packet_size])))
+        return packets
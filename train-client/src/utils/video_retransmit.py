@@ -0,0 +1,58 @@
+import struct
+import time
+from collections import OrderedDict
+from typing import List, Tuple
+
+from utils.app_logger import logger
+from globals import KEYFRAME_RETRANSMIT_BUFFER, KEYFRAME_RETRANSMIT_DEADLINE, KEYFRAME_MAX_RETRANSMISSIONS
+
+NACK_HEADER = struct.Struct(">IH")  # frame_id, number of packet IDs, followed by the u16 packet IDs
+
+
+def parse_nack(payload: bytes) -> Tuple[int, List[int]]:
+    frame_id, count = NACK_HEADER.unpack_from(payload)
+    packet_ids = list(struct.unpack_from(f">{count}H", payload, NACK_HEADER.size))
+    return frame_id, packet_ids
+
+
+class KeyframeRetransmitBuffer:
+    """Video datagrams of the last keyframes, kept to answer NACKs from the server.
+
+    A lost keyframe packet freezes the video until the next keyframe, so these
+    are worth sending twice. P-frames are not buffered, a late P-frame is
+    useless and their loss is covered by FEC.
+    """
+
+    def __init__(self):
+        self.frames: "OrderedDict[int, Tuple[float, List[bytes], List[int]]]" = OrderedDict()
+        self.retransmitted_packets = 0
+        self.expired_nacks = 0
+
+    def store(self, frame_id: int, packets: List[bytes]):
+        self.frames[frame_id] = (time.monotonic(), packets, [0] * len(packets))
+        while len(self.frames) > KEYFRAME_RETRANSMIT_BUFFER:
+            self.frames.popitem(last=False)
+
+    def clear(self):
+        self.frames.clear()
+
+    def packets_for_nack(self, frame_id: int, packet_ids: List[int]) -> List[bytes]:
+        """The buffered datagrams for a NACK, empty if the frame is unknown or past its deadline."""
+        entry = self.frames.get(frame_id)
+        if entry is None:
+            # a P-frame or a keyframe that was already replaced
+            return []
+        sent_at, packets, retransmissions = entry
+        if time.monotonic() - sent_at > KEYFRAME_RETRANSMIT_DEADLINE:
+            self.expired_nacks += 1
+            logger.debug(f"NACK for keyframe {frame_id} arrived after the retransmit deadline")
+            return []
+
+        resend = []
+        for packet_id in packet_ids:
+            index = packet_id - 1
+            if 0 <= index < len(packets) and retransmissions[index] < KEYFRAME_MAX_RETRANSMISSIONS:
+                retransmissions[index] += 1
+                resend.append(packets[index])
+        self.retransmitted_packets += len(resend)
+        return resend
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from utils.video_packetizer import VIDEO_HEADER, VideoPacketizer, packet_count
+from globals import PACKET_TYPE, VIDEO_HEADER_SIZE
+
+MAX_PACKET_SIZE = 1000
+TRAIN_ID = b"2f0c3f4e-6b1a-4c8e-9d2b-5a7e1f3c9b10"
+FRAME_ID = 0x01020304
+TIMESTAMP = 1_700_000_000_123
+
+
+def frame_of(size: int) -> bytes:
+    return bytes(index % 251 for index in range(size))
+
+
+@pytest.mark.parametrize("size, expected_packets", [
+    (0, 1),
+    (1, 1),
+    (MAX_PACKET_SIZE - 1, 1),
+    (MAX_PACKET_SIZE, 1),
+    (MAX_PACKET_SIZE + 1, 2),
+    (2 * MAX_PACKET_SIZE, 2),
+])
+def test_packetize(size, expected_packets):
+    frame = frame_of(size)
+    packets = VideoPacketizer(TRAIN_ID).packetize(FRAME_ID, TIMESTAMP, frame, MAX_PACKET_SIZE)
+
+    assert len(packets) == expected_packets == packet_count(size, MAX_PACKET_SIZE)
+    assert VIDEO_HEADER.size == VIDEO_HEADER_SIZE
+    payload = b""
+    for packet_id, packet in enumerate(packets, start=1):
+        assert isinstance(packet, bytes)
+        assert VIDEO_HEADER.unpack_from(packet) == (PACKET_TYPE["video"], FRAME_ID, expected_packets, packet_id,
+                                                    TRAIN_ID, TIMESTAMP)
+        assert len(packet) - VIDEO_HEADER_SIZE <= MAX_PACKET_SIZE
+        payload += packet[VIDEO_HEADER_SIZE:]
+    assert payload == frame
+
+
+def test_prefix_and_reuse():
+    # the header template is patched per frame, a second frame must not keep fields of the first
+    packetizer = VideoPacketizer(TRAIN_ID, prefix=b"\x7f")
+    packetizer.packetize(FRAME_ID, TIMESTAMP, frame_of(3 * MAX_PACKET_SIZE), MAX_PACKET_SIZE)
+    frame = frame_of(MAX_PACKET_SIZE + 1)
+    packets = packetizer.packetize(FRAME_ID + 1, TIMESTAMP + 33, frame, MAX_PACKET_SIZE)
+
+    assert len(packets) == 2
+    for packet_id, packet in enumerate(packets, start=1):
+        assert packet[0] == 0x7f
+        assert VIDEO_HEADER.unpack_from(packet, 1) == (PACKET_TYPE["video"], FRAME_ID + 1, 2, packet_id,
+                                                       TRAIN_ID, TIMESTAMP + 33)
+    assert b"".join(packet[1 + VIDEO_HEADER_SIZE:] for packet in packets) == frame
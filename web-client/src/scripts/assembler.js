@@ -7,8 +7,14 @@
  * - Out-of-order packet handling
  * - Automatic frame eviction when complete or when buffer is full
  * - Efficient memory management
+ * - Recovery of single lost packets per group from FEC parity packets
+ *   (format in central-server/README.md, "Video Datagrams and FEC")
  */
 
+const PACKET_TYPE_VIDEO_FEC = 37
+const VIDEO_HEADER_SIZE = 53
+const FEC_HEADER_SIZE = 6
+
 export class useAssembler {
   /**
    * @param {Object} options Configuration options
@@ -20,6 +26,14 @@ export class useAssembler {
     this.onFrameComplete = onFrameComplete
     this.frameBuffer = new Map()
     this.frameOrderQueue = []
+    // completed frames, later packets of them (stragglers, parity) are ignored
+    this.completedFrames = new Set()
+    this.completedOrderQueue = []
+
+    // FEC statistics
+    this.recoveredPackets = 0
+    this.recoveredFrames = 0
+    this.unrecoverableFrames = 0
     
     // Pre-create reusable objects for performance
     this.textDecoder = new TextDecoder()
@@ -34,27 +48,84 @@ export class useAssembler {
   processPacket(data) {
     try {
       const { frameId, numberOfPackets, packetId, payload, timestamp } = this._parsePacket(data)
+      if (this.completedFrames.has(frameId)) {
+        return
+      }
       // Get or create frame state
       let frameState = this.frameBuffer.get(frameId)
       if (!frameState) {
         frameState = this._createFrameState(frameId, numberOfPackets, timestamp)
       }
 
-      // Store payload if not already received
-      if (!frameState.packetBuffer[packetId - 1]) {
+      if (data[0] === PACKET_TYPE_VIDEO_FEC) {
+        const groupIndex = packetId - 1
+        if (frameState.parity[groupIndex]) {
+          return
+        }
+        frameState.groupCount = (data[VIDEO_HEADER_SIZE] << 8) | data[VIDEO_HEADER_SIZE + 1]
+        frameState.frameSize = ((data[VIDEO_HEADER_SIZE + 2] << 24) | (data[VIDEO_HEADER_SIZE + 3] << 16) |
+          (data[VIDEO_HEADER_SIZE + 4] << 8) | data[VIDEO_HEADER_SIZE + 5]) >>> 0
+        frameState.parity[groupIndex] = data.subarray(VIDEO_HEADER_SIZE + FEC_HEADER_SIZE)
+        this._tryRecover(frameState, groupIndex)
+      } else if (!frameState.packetBuffer[packetId - 1]) {
+        // Store payload if not already received
         frameState.packetBuffer[packetId - 1] = payload
         frameState.receivedPackets++
-
-        // Check for frame completion
-        if (frameState.receivedPackets === frameState.expectedPackets) {
-          this._handleCompleteFrame(frameState)
+        if (frameState.groupCount) {
+          this._tryRecover(frameState, (packetId - 1) % frameState.groupCount)
         }
       }
+
+      // Check for frame completion
+      if (frameState.receivedPackets === frameState.expectedPackets) {
+        this._handleCompleteFrame(frameState)
+      }
     } catch (e) {
       console.error('Packet processing error:', e)
     }
   }
 
+  /**
+   * Rebuild the only missing data packet of a group from its parity packet
+   * @private
+   */
+  _tryRecover(frameState, groupIndex) {
+    const parity = frameState.parity[groupIndex]
+    if (!parity) {
+      return
+    }
+    let missing = -1
+    for (let i = groupIndex; i < frameState.expectedPackets; i += frameState.groupCount) {
+      if (!frameState.packetBuffer[i]) {
+        if (missing !== -1) {
+          return
+        }
+        missing = i
+      }
+    }
+    if (missing === -1) {
+      return
+    }
+
+    const recovered = parity.slice()
+    for (let i = groupIndex; i < frameState.expectedPackets; i += frameState.groupCount) {
+      const packet = frameState.packetBuffer[i]
+      if (i !== missing) {
+        for (let j = 0; j < packet.length; j++) {
+          recovered[j] ^= packet[j]
+        }
+      }
+    }
+    const length = missing === frameState.expectedPackets - 1
+      ? frameState.frameSize - missing * parity.length
+      : parity.length
+
+    frameState.packetBuffer[missing] = recovered.subarray(0, length)
+    frameState.receivedPackets++
+    frameState.recoveredPackets++
+    this.recoveredPackets++
+  }
+
   /**
    * Parse packet header and extract metadata (optimized version)
    * @private
@@ -124,6 +195,7 @@ export class useAssembler {
     if (this.frameBuffer.size >= this.maxFrames) {
       const oldestFrameId = this.frameOrderQueue.shift()
       this.frameBuffer.delete(oldestFrameId)
+      this.unrecoverableFrames++
     }
 
     const frameState = {
@@ -131,7 +203,11 @@ export class useAssembler {
       expectedPackets: numberOfPackets,
       receivedPackets: 0,
       packetBuffer: new Array(numberOfPackets),
-      createdAt: timestamp
+      createdAt: timestamp,
+      parity: [],
+      groupCount: 0,
+      frameSize: 0,
+      recoveredPackets: 0
     }
 
     this.frameBuffer.set(frameId, frameState)
@@ -173,6 +249,14 @@ export class useAssembler {
     // Remove from buffer and queue
     this.frameBuffer.delete(frameState.frameId)
     this.frameOrderQueue = this.frameOrderQueue.filter(id => id !== frameState.frameId)
+    this.completedFrames.add(frameState.frameId)
+    this.completedOrderQueue.push(frameState.frameId)
+    if (this.completedOrderQueue.length > this.maxFrames) {
+      this.completedFrames.delete(this.completedOrderQueue.shift())
+    }
+    if (frameState.recoveredPackets) {
+      this.recoveredFrames++
+    }
 
     // Notify completion
     if (this.onFrameComplete) {
@@ -196,4 +280,15 @@ export class useAssembler {
       age: Date.now() - state.createdAt
     }))
   }
+
+  /**
+   * FEC counters since the assembler was created
+   */
+  getFecStats() {
+    return {
+      recoveredPackets: this.recoveredPackets,
+      recoveredFrames: this.recoveredFrames,
+      unrecoverableFrames: this.unrecoverableFrames
+    }
+  }
 }
\ No newline at end of file
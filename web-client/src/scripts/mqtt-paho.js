@@ -1,6 +1,7 @@
 import { ref } from 'vue'
 import { Client, Message } from 'paho-mqtt'
 import { MQTT_BROKER_URL } from '@/scripts/config'
+import { TelemetryDecoder, isCompactTelemetry } from '@/scripts/telemetryCodec'
 
 /**
  * MQTT Client for Web Browser using Paho MQTT JavaScript library
@@ -9,6 +10,8 @@ export function useMqttClient(remoteControlId, messageHandler) {
   const isMqttConnected = ref(false)
   const mqttClient = ref(null)
   const subscriptions = ref(new Set())
+  // compact telemetry is made of deltas, decoded against the last sample of each topic
+  const telemetryDecoders = new Map()
 
   // Parse MQTT broker URL to extract host, port, and path
   const brokerConfig = parseBrokerUrl(MQTT_BROKER_URL)
@@ -131,10 +134,21 @@ export function useMqttClient(remoteControlId, messageHandler) {
   function onMessageArrived(message) {
     try {
       const topic = message.destinationName
-      const payload = message.payloadString
+      const bytes = message.payloadBytes
+
+      if (isCompactTelemetry(bytes)) {
+        let decoder = telemetryDecoders.get(topic)
+        if (!decoder) {
+          decoder = new TelemetryDecoder(topic.split('/')[1])
+          telemetryDecoders.set(topic, decoder)
+        }
+        // a batch holds several samples, each is handled like a JSON message
+        decoder.decode(bytes).forEach(sample => handleMqttMessage(topic, sample))
+        return
+      }
 
       // Parse topic to extract train_id and message type
-      handleMqttMessage(topic, payload)
+      handleMqttMessage(topic, message.payloadString)
 
     } catch (error) {
       console.error('Error processing MQTT message:', error)
@@ -0,0 +1,141 @@
+/**
+ * Decoder of the compact telemetry encoding of the train (format in
+ * central-server/README.md, "Telemetry encoding").
+ *
+ * A message holds one or more records: a snapshot with every field, or a
+ * delta with the fields that changed since the record before. The decoder
+ * keeps the last sample of its train and returns full samples, shaped like
+ * the JSON telemetry.
+ *
+ * Keep the schema in sync with train-client/src/utils/telemetry_codec.py
+ */
+
+// [key, type, scale] by schema id, the index of a field is its bit in the change mask
+const TELEMETRY_SCHEMAS = {
+  1: [
+    ['direction', 'b', 1],
+    ['speed', 'H', 100],
+    ['max_speed', 'H', 100],
+    ['passenger_count', 'H', 1],
+    ['temperature', 'h', 10],
+    ['battery_level', 'H', 100],
+    ['gps.latitude', 'i', 10000000],
+    ['gps.longitude', 'i', 10000000],
+    ['engine_temperature', 'h', 10],
+    ['fuel_level', 'H', 100],
+    ['network_signal_strength', 'B', 1],
+    ['download_speed', 'I', 1000],
+    ['upload_speed', 'I', 1000],
+    ['jitter', 'I', 100],
+    ['ping', 'I', 100],
+    ['name', 's'],
+    ['status', 's'],
+    ['brake_status', 's'],
+    ['location', 's'],
+    ['next_station', 's'],
+    ['reaktor_motor_mode', 's'],
+  ],
+}
+
+const RECORD_SNAPSHOT = 1
+const MESSAGE_HEADER_SIZE = 2 // schema id, number of records
+const RECORD_HEADER_SIZE = 13 // kind, sequence number (u32), timestamp in ms (u64)
+const READERS = {
+  b: (view, offset) => [view.getInt8(offset), 1],
+  B: (view, offset) => [view.getUint8(offset), 1],
+  h: (view, offset) => [view.getInt16(offset), 2],
+  H: (view, offset) => [view.getUint16(offset), 2],
+  i: (view, offset) => [view.getInt32(offset), 4],
+  I: (view, offset) => [view.getUint32(offset), 4],
+}
+
+/**
+ * True for the compact encoding, JSON telemetry starts with "{"
+ * @param {Uint8Array} data
+ */
+export function isCompactTelemetry(data) {
+  return data.length > 0 && data[0] in TELEMETRY_SCHEMAS
+}
+
+export class TelemetryDecoder {
+  constructor(trainId) {
+    this.trainId = trainId
+    this.values = null
+    this.sequence = null
+    this.schemaId = null
+    this.textDecoder = new TextDecoder()
+  }
+
+  /**
+   * @param {Uint8Array} data A whole message
+   * @returns {Object[]} The samples, deltas before the first snapshot and duplicates are left out
+   */
+  decode(data) {
+    const view = new DataView(data.buffer, data.byteOffset, data.byteLength)
+    const schemaId = view.getUint8(0)
+    const count = view.getUint8(1)
+    const fields = TELEMETRY_SCHEMAS[schemaId]
+    if (!fields) {
+      throw new Error(`Unknown telemetry schema ${schemaId}`)
+    }
+    if (schemaId !== this.schemaId) {
+      this.schemaId = schemaId
+      this.values = null
+    }
+    const samples = []
+    let offset = MESSAGE_HEADER_SIZE
+    for (let record = 0; record < count; record++) {
+      const kind = view.getUint8(offset)
+      const sequence = view.getUint32(offset + 1)
+      const timestamp = Number(view.getBigUint64(offset + 5))
+      offset += RECORD_HEADER_SIZE
+      // the mask of a snapshot has every bit set
+      let mask = 2 ** fields.length - 1
+      if (kind !== RECORD_SNAPSHOT) {
+        mask = view.getUint32(offset)
+        offset += 4
+      }
+      const values = kind === RECORD_SNAPSHOT || !this.values ? new Array(fields.length) : [...this.values]
+      // numbers first, then strings, like the encoder writes them
+      for (const strings of [false, true]) {
+        fields.forEach(([, type, scale], index) => {
+          if ((type === 's') !== strings || !(Math.floor(mask / 2 ** index) % 2)) {
+            return
+          }
+          if (type === 's') {
+            const length = view.getUint8(offset)
+            values[index] = this.textDecoder.decode(data.subarray(offset + 1, offset + 1 + length))
+            offset += 1 + length
+          } else {
+            const [value, size] = READERS[type](view, offset)
+            values[index] = scale === 1 ? value : value / scale
+            offset += size
+          }
+        })
+      }
+      if (kind !== RECORD_SNAPSHOT && (!this.values || (this.sequence !== null && sequence <= this.sequence))) {
+        // no base yet, or already decoded (MQTT QoS 1 delivers at least once)
+        continue
+      }
+      this.values = values
+      this.sequence = sequence
+      samples.push(this._sample(fields, values, sequence, timestamp))
+    }
+    return samples
+  }
+
+  _sample(fields, values, sequence, timestamp) {
+    const sample = { train_id: this.trainId, video_stream_url: `/stream/${this.trainId}` }
+    fields.forEach(([key], index) => {
+      const path = key.split('.')
+      let target = sample
+      for (const part of path.slice(0, -1)) {
+        target = target[part] ??= {}
+      }
+      target[path[path.length - 1]] = values[index]
+    })
+    sample.timestamp = timestamp
+    sample.sequence_number = sequence
+    return sample
+  }
+}
@@ -32,9 +32,14 @@ export function useWebSocket(remoteControlId, messageHandler) {
       }
     }
 
-    webSocket.value.onclose = () => {
+    webSocket.value.onclose = (event) => {
       isWSConnected.value = false
-      console.log('❌ WebSocket disconnected')
+      if (event.code === 1013) {
+        // server is over capacity, the reason is also sent as an admission packet before closing
+        console.error('❌ WebSocket rejected by server:', event.reason)
+      } else {
+        console.log('❌ WebSocket disconnected')
+      }
     }
 
     webSocket.value.onerror = (error) => {
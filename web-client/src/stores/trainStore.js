@@ -8,6 +8,7 @@ import { useAssembler } from '@/scripts/assembler'
 import { useNetworkSpeed } from '@/scripts/networkspeed'
 import { useMqttClient } from '@/scripts/mqtt-paho'
 import { useDataStorage } from '@/scripts/dataStorage'
+import { TelemetryDecoder, isCompactTelemetry } from '@/scripts/telemetryCodec'
 import { SERVER_URL } from '@/scripts/config'
 
 
@@ -37,6 +38,13 @@ export const PACKET_TYPE = {
   map_disconnect: 31,
   connect: 32,
   connect_response: 33,
+  admission: 34,
+  pmtu_probe: 35,
+  pmtu_ack: 36,
+  video_fec: 37,
+  receiver_report: 38,
+  nack: 39,
+  video_frame: 40,
 }
 
 
@@ -66,6 +74,9 @@ export const useTrainStore = defineStore('train', () => {
   const rttCalibrationIndex = ref(0)
   const averageClockOffset = ref(0)
 
+  // Latest admission decision of the server (admitted, degraded or rejected) with its reason
+  const admissionStatus = ref(null)
+
   const indexedDBStorageEnabled = ref(false)
   const commandCounter = ref(0)
 
@@ -228,11 +239,14 @@ export const useTrainStore = defineStore('train', () => {
           }
         })
 
-        if (!response.ok) {
-          console.error('❌ Failed to assign train. Server responded with:', response.status)
+        const data = await response.json()
+        if (data.admission) {
+          handleAdmission(data.admission)
         }
 
-        await response.json()
+        if (!response.ok) {
+          console.error('❌ Failed to assign train. Server responded with:', response.status, data.message)
+        }
       } catch (error) {
         console.error('❌ Error assigning train to remote control:', error)
       }
@@ -407,23 +421,50 @@ export const useTrainStore = defineStore('train', () => {
     }
   }
 
+  function handleAdmission(decision) {
+    admissionStatus.value = decision
+    if (decision.status === 'rejected') {
+      console.error('❌ Server rejected the session:', decision.reason)
+    } else if (decision.status === 'degraded') {
+      console.warn('⚠️ Server admitted the session with reduced quality:', decision.reason)
+    }
+  }
+
+  // compact telemetry is made of deltas, each path decodes against its own last sample
+  const telemetryDecoders = { ws: null, wt: null }
+
+  function decodeTelemetry(protocol, payload) {
+    if (!isCompactTelemetry(payload)) {
+      return [JSON.parse(new TextDecoder().decode(payload))]
+    }
+    let decoder = telemetryDecoders[protocol]
+    if (!decoder || decoder.trainId !== selectedTrainId.value) {
+      decoder = telemetryDecoders[protocol] = new TelemetryDecoder(selectedTrainId.value)
+    }
+    return decoder.decode(payload)
+  }
+
   async function handleWsMessage(packetType, payload) {
     switch (packetType) {
+      case PACKET_TYPE.admission: {
+        handleAdmission(JSON.parse(new TextDecoder().decode(payload)))
+        break
+      }
       case PACKET_TYPE.telemetry: {
-        const jsonData =  JSON.parse(new TextDecoder().decode(payload))
-
-        // get system timestamp
-        const timestamp = Date.now()
-        const latency = timestamp - jsonData.timestamp + averageClockOffset.value
+        for (const jsonData of decodeTelemetry('ws', payload)) {
+          // get system timestamp
+          const timestamp = Date.now()
+          const latency = timestamp - jsonData.timestamp + averageClockOffset.value
 
-        if (indexedDBStorageEnabled.value) {
-          // Also store it to indexDB
-          dataStorage.storeTelemetry({
-            trainId: jsonData.train_id,
-            data: jsonData,
-            latency: latency,
-          protocol: 'ws'
-          })
+          if (indexedDBStorageEnabled.value) {
+            // Also store it to indexDB
+            dataStorage.storeTelemetry({
+              trainId: jsonData.train_id,
+              data: jsonData,
+              latency: latency,
+            protocol: 'ws'
+            })
+          }
         }
 
         break
@@ -437,7 +478,10 @@ export const useTrainStore = defineStore('train', () => {
         fetchAvailableTrains()
         break
       }
-      case PACKET_TYPE.video: {
+      case PACKET_TYPE.video:
+      case PACKET_TYPE.video_fec:
+      // a whole frame from a WebSocket train, laid out as a video datagram with a single packet
+      case PACKET_TYPE.video_frame: {
         videoDatagramAssembler.value.processPacket(payload)
         break
       }
@@ -450,34 +494,34 @@ export const useTrainStore = defineStore('train', () => {
     switch (packetType) {
       case PACKET_TYPE.telemetry: {
         try {
-          jsonString = new TextDecoder().decode(payload)
-          jsonData = JSON.parse(jsonString)
-
-          // get system timestamp
-          const timestamp = Date.now()
-          const latency = timestamp - jsonData.timestamp + averageClockOffset.value
-
-          if (indexedDBStorageEnabled.value) {
-            // Also store it to indexDB
-            dataStorage.storeTelemetry({
-              trainId: jsonData.train_id,
-              data: jsonData,
-              latency: latency,
-              protocol: 'wt'
-            })
-          }
-
-          // also update isPoweredOn and direction
-          if (jsonData.status === 'running'){
-            isPoweredOn.value = true
-          } else {
-            isPoweredOn.value = false
-          }
-
-          if (jsonData.direction === 1) {
-            direction.value = 'FORWARD'
-          } else {
-            direction.value = 'BACKWARD'
+          // a compact message may hold a batch of samples
+          for (jsonData of decodeTelemetry('wt', payload)) {
+            // get system timestamp
+            const timestamp = Date.now()
+            const latency = timestamp - jsonData.timestamp + averageClockOffset.value
+
+            if (indexedDBStorageEnabled.value) {
+              // Also store it to indexDB
+              dataStorage.storeTelemetry({
+                trainId: jsonData.train_id,
+                data: jsonData,
+                latency: latency,
+                protocol: 'wt'
+              })
+            }
+
+            // also update isPoweredOn and direction
+            if (jsonData.status === 'running'){
+              isPoweredOn.value = true
+            } else {
+              isPoweredOn.value = false
+            }
+
+            if (jsonData.direction === 1) {
+              direction.value = 'FORWARD'
+            } else {
+              direction.value = 'BACKWARD'
+            }
           }
 
         } catch (error) {
@@ -486,6 +530,7 @@ export const useTrainStore = defineStore('train', () => {
         break;
       }
       case PACKET_TYPE.video:
+      case PACKET_TYPE.video_fec:
         videoDatagramAssembler.value.processPacket(payload)
         break
       case PACKET_TYPE.download_start: {
@@ -507,6 +552,14 @@ export const useTrainStore = defineStore('train', () => {
       }
       case PACKET_TYPE.connect_response: {
         console.log('✅ Received connect response from server via WebTransport, data = ', new TextDecoder().decode(payload))
+        jsonData = JSON.parse(new TextDecoder().decode(payload))
+        if (jsonData.status === 'rejected') {
+          handleAdmission(jsonData)
+        }
+        break
+      }
+      case PACKET_TYPE.admission: {
+        handleAdmission(JSON.parse(new TextDecoder().decode(payload)))
         break
       }
       case PACKET_TYPE.rtt: {
@@ -682,6 +735,7 @@ export const useTrainStore = defineStore('train', () => {
     last30_framesAverageLatency,
     last1s_framesFPS,
     last1s_bandwidthMbps,
+    admissionStatus,
     initializeRemoteControlId,
     fetchAvailableTrains,
     connectToServer,